@@ -0,0 +1,57 @@
+'''
+Stand-in function executor returning canned responses, plugged into api_router.ApiRouter (via
+its executor argument) in place of Docker so that gateway overhead can be measured on its own.
+'''
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from lambda_utils import build_response
+
+DEFAULT_RESPONSE = {
+  'statusCode': 200,
+  'headers': {'content-type': 'application/json'},
+  'body': json.dumps({'message': 'Hello from the fake executor'})
+}
+
+class FakeExecutor:
+  '''
+  Executor answering every invocation with response (a Lambda function return value), or with
+  responses[function name] if there's one, after sleeping latency seconds plus up to jitter
+  seconds more. If echo is set the response body is the received event instead.
+  '''
+  def __init__(self, response=None, responses=None, latency=0, jitter=0, echo=False):
+    self.latency = latency
+    self.jitter = jitter
+    self.echo = echo
+    self.invocations = 0
+
+    # responses are serialized once, like a function's output would be
+    self.__default = json.dumps(response if response is not None else DEFAULT_RESPONSE)
+    self.__responses = {name: json.dumps(value) for name, value in (responses or {}).items()}
+    self.__lock = threading.Lock()
+
+  def __call__(self, config, payload):
+    with self.__lock:
+      self.invocations += 1
+
+    delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+    if delay > 0:
+      time.sleep(delay)
+
+    if self.echo:
+      output = json.dumps({
+        'statusCode': 200,
+        'headers': {'content-type': 'application/json'},
+        'body': json.dumps(payload)
+      })
+    else:
+      output = self.__responses.get(config['function'], self.__default)
+
+    return build_response(output, 0, '')
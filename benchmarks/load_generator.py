@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+'''
+Open-loop HTTP load generator.
+
+Requests are scheduled at a fixed arrival rate regardless of how fast earlier ones complete, and
+their latency is measured from the time they were scheduled to be sent rather than the time a
+worker got around to sending them. A gateway that falls behind therefore shows up as growing
+latency instead of silently lowering the offered load (coordinated omission).
+
+Usage: load_generator.py <url> [rate] [duration] [connections]
+'''
+
+import http.client
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+def percentile(sorted_values, p):
+  '''
+  Returns the p-th percentile (0-100) of sorted_values, using the nearest-rank method.
+  '''
+  if not sorted_values:
+    return None
+  rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+  return sorted_values[rank - 1]
+
+def summarize(latencies, errors, elapsed, offered_rate=None):
+  '''
+  Summarizes a load run: throughput, error count and latency percentiles (in milliseconds).
+  '''
+  latencies = sorted(latencies)
+  summary = {
+    'requests': len(latencies) + errors,
+    'errors': errors,
+    'duration': round(elapsed, 3),
+    'rps': round(len(latencies) / elapsed, 1) if elapsed else 0
+  }
+  if offered_rate is not None:
+    summary['offered_rps'] = offered_rate
+  for name, p in (('p50', 50), ('p95', 95), ('p99', 99)):
+    value = percentile(latencies, p)
+    summary[name + '_ms'] = round(value * 1000, 3) if value is not None else None
+  summary['max_ms'] = round(latencies[-1] * 1000, 3) if latencies else None
+  return summary
+
+class LoadGenerator:
+  '''
+  Sends requests to url at rate requests per second for duration seconds, over a pool of
+  connections persistent connections. method, body and headers describe the request sent.
+  '''
+  def __init__(self, url, rate=100, duration=10, connections=16, method='GET', body=None, headers=None):
+    self.url = urlsplit(url)
+    self.rate = rate
+    self.duration = duration
+    self.connections = connections
+    self.method = method
+    self.body = body
+    self.headers = headers or {}
+
+    self.__path = self.url.path or '/'
+    if self.url.query:
+      self.__path += '?' + self.url.query
+
+    self.__schedule = queue.Queue()
+    self.__lock = threading.Lock()
+    self.__latencies = []
+    self.__errors = 0
+
+  def run(self):
+    '''
+    Runs the load and returns its summary (see summarize).
+    '''
+    workers = [threading.Thread(target=self.__work, daemon=True) for _ in range(self.connections)]
+    for worker in workers:
+      worker.start()
+
+    total = int(self.rate * self.duration)
+    interval = 1 / self.rate
+    start = time.perf_counter()
+    for i in range(total):
+      scheduled = start + i * interval
+      delay = scheduled - time.perf_counter()
+      if delay > 0:
+        time.sleep(delay)
+      self.__schedule.put(scheduled)
+
+    for _ in workers:
+      self.__schedule.put(None)
+    for worker in workers:
+      worker.join()
+
+    return summarize(self.__latencies, self.__errors, time.perf_counter() - start, self.rate)
+
+  def __connect(self):
+    return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=30)
+
+  def __work(self):
+    connection = self.__connect()
+    latencies = []
+    errors = 0
+
+    while True:
+      scheduled = self.__schedule.get()
+      if scheduled is None:
+        break
+      try:
+        connection.request(self.method, self.__path, body=self.body, headers=self.headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status >= 500:
+          errors += 1
+        else:
+          latencies.append(time.perf_counter() - scheduled)
+      except (OSError, http.client.HTTPException):
+        errors += 1
+        connection.close()
+        connection = self.__connect()
+
+    connection.close()
+    with self.__lock:
+      self.__latencies.extend(latencies)
+      self.__errors += errors
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    print(__doc__.strip().splitlines()[-1].replace('load_generator.py', os.path.basename(sys.argv[0])))
+    sys.exit(1)
+
+  generator = LoadGenerator(
+    sys.argv[1],
+    rate=float(sys.argv[2]) if len(sys.argv) > 2 else 100,
+    duration=float(sys.argv[3]) if len(sys.argv) > 3 else 10,
+    connections=int(sys.argv[4]) if len(sys.argv) > 4 else 16
+  )
+  for name, value in generator.run().items():
+    print('{:>12}  {}'.format(name, value))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+'''
+Microbenchmarks of the gateway's per-request hot paths: payload building, JWT payload parsing
+and route matching.
+
+Usage: microbenchmarks.py [iterations]
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from payload import build_jwt, build_payload, parse_jwt_payload
+from route_index import RouteIndex
+
+DEFAULT_ITERATIONS = 20000
+
+JWT = build_jwt('user-42', name='Jane Doe', email='jane@example.com')
+
+PAYLOAD_REQUEST = {
+  'route': '/users/42',
+  'method': 'GET',
+  'user_agent': 'Mozilla/5.0 (X11; Linux x86_64)',
+  'source_ip': '127.0.0.1',
+  'headers': {
+    'host': 'localhost:3000',
+    'accept': 'application/json',
+    'authorization': JWT
+  },
+  'params': {'page': '2', 'sort': 'name'},
+  'route_key': 'GET /users/{id}',
+  'path_parameters': {'id': '42'}
+}
+
+def build_route_table(count):
+  '''
+  Returns count routes mixing static segments, path parameters and greedy path variables,
+  resembling a mid-sized API.
+  '''
+  routes = {}
+  for i in range(count):
+    resource = 'resource{}'.format(i)
+    routes['GET /{}'.format(resource)] = i
+    routes['POST /{}'.format(resource)] = i
+    routes['GET /{}/{{id}}'.format(resource)] = i
+    routes['ANY /{}/{{id}}/files/{{proxy+}}'.format(resource)] = i
+  return routes
+
+def time_call(function, iterations):
+  '''
+  Returns the mean duration of a call to function, in microseconds.
+  '''
+  return timeit.timeit(function, number=iterations) / iterations * 1e6
+
+def run(iterations=DEFAULT_ITERATIONS):
+  '''
+  Runs every microbenchmark, returning the mean time per call (in microseconds) of each.
+  '''
+  index = RouteIndex(build_route_table(50))
+  paths = [
+    ('GET', '/resource49'),
+    ('GET', '/resource25/42'),
+    ('PUT', '/resource10/42/files/a/b/c.txt'),
+    ('GET', '/missing/route')
+  ]
+
+  results = {
+    'build_payload': time_call(lambda: build_payload(**PAYLOAD_REQUEST), iterations),
+    'parse_jwt_payload': time_call(lambda: parse_jwt_payload(JWT), iterations)
+  }
+  for method, path in paths:
+    results['route_match {} {}'.format(method, path)] = time_call(lambda: index.match(method, path), iterations)
+
+  return {name: round(value, 3) for name, value in results.items()}
+
+if __name__ == '__main__':
+  iterations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ITERATIONS
+  for name, value in run(iterations).items():
+    print('{:<50}  {:>10.3f} us/call'.format(name, value))
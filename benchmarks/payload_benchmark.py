@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+'''
+Payload building microbenchmark.
+
+Compares payload.PayloadBuilder, which fills a per-route skeleton, against the original builder
+which rendered a json template with str.format and parsed it back with json.loads for every
+request.
+
+Usage: payload_benchmark.py [iterations]
+'''
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from payload import AUTH_HEADER, CONTENT_LENGTH, CONTENT_TYPE, PayloadBuilder, build_jwt, parse_jwt_payload
+
+legacy_payload_template = '''\
+{{
+  "version": "2.0",
+  "routeKey": "{METHOD} {ROUTE}",
+  "rawPath": "{ROUTE}",
+  "rawQueryString": "",
+  "headers": {{
+  }},
+  "requestContext": {{
+    "accountId": "",
+    "apiId": "",
+    "domainName": "{SERVER_HOST}",
+    "domainPrefix": "",
+    "http": {{
+      "method": "{METHOD}",
+      "path": "{ROUTE}",
+      "protocol": "HTTP/1.1",
+      "sourceIp": "{SOURCE_IP}",
+      "userAgent": "{USER_AGENT}"
+    }},
+    "requestId": "",
+    "routeKey": "{METHOD} {ROUTE}",
+    "stage": "$default",
+    "time": "",
+    "timeEpoch": 0
+  }},
+  "isBase64Encoded": false
+}}
+'''
+
+def legacy_build_payload(
+    route='/',
+    method='GET',
+    user_agent=None,
+    source_ip=None,
+    server_hostname=None,
+    headers=None,
+    params=None,
+    body=None,
+    route_key=None,
+    path_parameters=None
+  ):
+  '''
+  The original template-based payload builder.
+  '''
+  payload = json.loads(legacy_payload_template.format(
+    ROUTE=route.strip(),
+    METHOD=method.strip(),
+    USER_AGENT=user_agent if user_agent else '',
+    SOURCE_IP=source_ip if source_ip else '0.0.0.0',
+    SERVER_HOST=server_hostname if server_hostname else 'localhost'
+  ))
+
+  if route_key:
+    payload['routeKey'] = route_key
+    payload['requestContext']['routeKey'] = route_key
+
+  if path_parameters:
+    payload['pathParameters'] = path_parameters
+
+  _headers = {}
+  if headers:
+    for header in headers:
+      _headers[header.lower()] = headers[header]
+
+  if CONTENT_LENGTH not in _headers:
+    _headers[CONTENT_LENGTH] = len(body) if body else 0
+
+  if CONTENT_TYPE not in _headers:
+    _headers[CONTENT_TYPE] = 'application/json'
+
+  for header in _headers:
+    payload['headers'][header] = _headers[header]
+
+  if body:
+    payload['body'] = body
+
+  if AUTH_HEADER in _headers:
+    jwt = _headers[AUTH_HEADER]
+    payload['headers'][AUTH_HEADER] = jwt
+    payload['requestContext']['authorizer'] = {
+      'jwt': {
+        'claims': parse_jwt_payload(jwt)
+      },
+      'scopes': None
+    }
+
+  if params:
+    rawQueryString = ''
+    payload['queryStringParameters'] = {}
+    for param in params:
+      payload['queryStringParameters'][param] = params[param]
+      rawQueryString += '{}={}&'.format(param.strip(), str(params[param]).strip())
+    if rawQueryString:
+      rawQueryString = rawQueryString[:-1]
+    payload['rawQueryString'] = rawQueryString
+
+  return payload
+
+ROUTE_KEY = 'GET /users/{id}'
+
+REQUESTS = {
+  'minimal': {
+    'route': '/users/42',
+    'method': 'GET',
+    'path_parameters': {'id': '42'}
+  },
+  'typical': {
+    'route': '/users/42',
+    'method': 'GET',
+    'user_agent': 'Mozilla/5.0 (X11; Linux x86_64)',
+    'source_ip': '127.0.0.1',
+    'headers': {
+      'Host': 'localhost:3000',
+      'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64)',
+      'Accept': 'application/json',
+      'Accept-Encoding': 'gzip, deflate'
+    },
+    'params': {'page': '2', 'sort': 'name'},
+    'path_parameters': {'id': '42'}
+  },
+  'authenticated': {
+    'route': '/users/42',
+    'method': 'GET',
+    'headers': {'Authorization': build_jwt('user-42', name='Jane Doe')},
+    'body': json.dumps({'name': 'Jane Doe', 'tags': ['a', 'b', 'c']}),
+    'path_parameters': {'id': '42'}
+  }
+}
+
+if __name__ == '__main__':
+  iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  builder = PayloadBuilder(ROUTE_KEY)
+
+  print('{:>14}  {:>16}  {:>16}  {:>8}'.format('request', 'legacy (us/call)', 'builder (us/call)', 'speedup'))
+
+  for name, kwargs in REQUESTS.items():
+    # sanity check: both builders must agree on every field but the per-request ones
+    legacy = legacy_build_payload(route_key=ROUTE_KEY, **kwargs)
+    current = builder.build(**kwargs)
+    for field in ('requestId', 'time', 'timeEpoch'):
+      del legacy['requestContext'][field]
+      del current['requestContext'][field]
+    assert legacy == current, name
+
+    legacy_time = timeit.timeit(lambda: legacy_build_payload(route_key=ROUTE_KEY, **kwargs), number=iterations)
+    builder_time = timeit.timeit(lambda: builder.build(**kwargs), number=iterations)
+
+    print('{:>14}  {:>16.2f}  {:>16.2f}  {:>7.1f}x'.format(
+      name,
+      legacy_time / iterations * 1e6,
+      builder_time / iterations * 1e6,
+      legacy_time / builder_time
+    ))
+
+  # values the legacy template couldn't embed without producing invalid json
+  payload = PayloadBuilder().build(route='/say/"hi"', user_agent='curl "quoted" \\ agent')
+  assert payload['rawPath'] == '/say/"hi"'
+  assert payload['requestContext']['http']['userAgent'] == 'curl "quoted" \\ agent'
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+'''
+Traffic replay.
+
+Replays a traffic log captured by the gateway (see its --capture option) against a gateway. By
+default requests are sent open-loop (see load_generator.py) with their recorded inter-arrival
+times divided by a speed factor, their latency being measured from the time they were due. With
+a concurrency, requests are instead sent back to back over that many connections, ignoring their
+timing. The run ends with a latency and throughput report, next to the recorded one, and a diff
+of the responses against the recorded ones: status codes, content types and (decoded) bodies,
+JSON bodies being compared as objects.
+
+Usage: replay.py <log file> <gateway url> [options]
+'''
+
+import base64
+import getopt
+import http.client
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+from load_generator import percentile, summarize
+
+from traffic_log import TrafficLog
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+DEFAULT_CONNECTIONS = 16
+DEFAULT_MAX_DIFFS = 10
+# headers describing the recorded connection rather than the request
+HOP_BY_HOP_HEADERS = {
+  'connection',
+  'content-length',
+  'expect',
+  'host',
+  'keep-alive',
+  'te',
+  'transfer-encoding',
+  'upgrade'
+}
+
+def usage(message=None):
+  if message:
+    print(message + '\n')
+
+  print('''Usage: {CMD} <log file> <gateway url> [options]
+
+Options:
+-s | --speed <factor>:          Speed the recorded traffic is replayed at (e.g. 2 for twice as fast). Default: 1.
+-c | --concurrency <count>:     Send requests back to back over count connections, ignoring the recorded timing.
+--connections <count>:          Connections requests are sent over when replaying the recorded timing. Default: {CONNECTIONS}.
+--max-diffs <count>:            Response differences printed. Default: {MAX_DIFFS}.
+-o | --output <file path>:      Save the report as JSON.
+-h | --help:                    Print this help message.
+'''.format(
+  CMD=os.path.basename(sys.argv[0]),
+  CONNECTIONS=DEFAULT_CONNECTIONS,
+  MAX_DIFFS=DEFAULT_MAX_DIFFS
+))
+
+  sys.exit(1 if message else 0)
+
+def get_header(headers, name):
+  '''
+  Returns the value of the named header in a list of [name, value] pairs, or None.
+  '''
+  name = name.lower()
+  for header, value in headers:
+    if header.lower() == name:
+      return value
+  return None
+
+def get_request_body(record):
+  '''
+  Returns the raw body of a recorded request. Bodies that weren't recorded (larger than the
+  log's maximum body size) are rebuilt from the request's event, if it was passed to a function.
+  '''
+  body = record['request'].get('body')
+  if body is not None:
+    return body or None
+
+  event = record['event']
+  if not event or not event.get('body'):
+    return None
+  if event.get('isBase64Encoded'):
+    return base64.b64decode(event['body'])
+  return event['body'].encode('utf-8')
+
+def decode_body(body, content_encoding):
+  '''
+  Decodes a response body sent with content_encoding, returning None if it can't be decoded.
+  '''
+  encoding = (content_encoding or '').strip().lower()
+  try:
+    if not encoding or encoding == 'identity':
+      return body
+    if encoding == 'gzip':
+      return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if encoding == 'br' and brotli:
+      return brotli.decompress(body)
+  except Exception:
+    pass
+  return None
+
+def bodies_match(recorded, replayed):
+  if recorded == replayed:
+    return True
+  try:
+    return json.loads(recorded) == json.loads(replayed)
+  except ValueError:
+    return False
+
+def compare_responses(method, recorded, status, headers, body):
+  '''
+  Returns the differences (as strings) between a recorded response and a replayed one.
+  '''
+  differences = []
+  if recorded['status'] != status:
+    differences.append('status {} -> {}'.format(recorded['status'], status))
+
+  recorded_type = get_header(recorded['headers'], 'Content-Type')
+  content_type = get_header(headers, 'Content-Type')
+  if recorded_type != content_type:
+    differences.append('content type {} -> {}'.format(recorded_type, content_type))
+
+  # bodies aren't compared for HEAD requests nor if they weren't recorded
+  if differences or method == 'HEAD' or recorded['body'] is None:
+    return differences
+
+  recorded_body = decode_body(recorded['body'], get_header(recorded['headers'], 'Content-Encoding'))
+  replayed_body = decode_body(body, get_header(headers, 'Content-Encoding'))
+  if recorded_body is None or replayed_body is None:
+    # compare the bodies as sent if they can't be decoded
+    recorded_body, replayed_body = recorded['body'], body
+  if not bodies_match(recorded_body, replayed_body):
+    differences.append('body ({} bytes) -> ({} bytes)'.format(len(recorded_body), len(replayed_body)))
+  return differences
+
+class Replayer:
+  '''
+  Replays the records of a traffic_log.TrafficLog against the gateway at url, either with their
+  recorded timing divided by speed over connections connections or, if concurrency is
+  specified, back to back over concurrency connections.
+  '''
+  def __init__(self, log, url, speed=1, concurrency=None, connections=DEFAULT_CONNECTIONS):
+    self.log = log
+    self.url = urlsplit(url)
+    self.speed = speed
+    self.concurrency = concurrency
+    self.connections = concurrency or connections
+
+    self.__schedule = queue.Queue()
+    self.__lock = threading.Lock()
+    self.__latencies = []
+    self.__errors = 0
+    self.__diffs = []
+    self.__compared = 0
+
+  def run(self):
+    '''
+    Replays the log and returns the report: the replay's summary (see
+    load_generator.summarize), the recorded traffic's and the diff of the responses.
+    '''
+    entries = self.log.entries
+    workers = [threading.Thread(target=self.__work, daemon=True) for _ in range(self.connections)]
+    for worker in workers:
+      worker.start()
+
+    span = entries[-1][0] - entries[0][0] if entries else 0
+    offered_rate = None
+    start = time.perf_counter()
+    if self.concurrency:
+      # every request is due when a connection is free to send it
+      for index in range(len(entries)):
+        self.__schedule.put((None, index))
+    else:
+      if span:
+        offered_rate = round(len(entries) / span * self.speed, 1)
+      for index, (arrival_time, _, _) in enumerate(entries):
+        scheduled = start + (arrival_time - entries[0][0]) / self.speed
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+          time.sleep(delay)
+        self.__schedule.put((scheduled, index))
+
+    for _ in workers:
+      self.__schedule.put(None)
+    for worker in workers:
+      worker.join()
+
+    return {
+      'replay': summarize(self.__latencies, self.__errors, time.perf_counter() - start, offered_rate),
+      'recorded': self.__summarize_recording(span),
+      'diff': {
+        'compared': self.__compared,
+        'different': len(self.__diffs),
+        'responses': sorted(self.__diffs, key=lambda diff: diff['index'])
+      }
+    }
+
+  def __summarize_recording(self, span):
+    durations = sorted(record['duration'] for record in self.log)
+
+    summary = {
+      'requests': len(durations),
+      'duration': round(span, 3),
+      'rps': round(len(durations) / span, 1) if span else 0
+    }
+    for name, p in (('p50', 50), ('p95', 95), ('p99', 99)):
+      value = percentile(durations, p)
+      summary[name + '_ms'] = round(value * 1000, 3) if value is not None else None
+    summary['max_ms'] = round(durations[-1] * 1000, 3) if durations else None
+    return summary
+
+  def __connect(self):
+    return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=30)
+
+  def __work(self):
+    connection = self.__connect()
+    latencies = []
+    errors = 0
+    diffs = []
+    compared = 0
+
+    while True:
+      item = self.__schedule.get()
+      if item is None:
+        break
+      scheduled, index = item
+
+      record = self.log.read(index)
+      request = record['request']
+      headers = {name: value for name, value in request['headers'] if name.lower() not in HOP_BY_HOP_HEADERS}
+      body = get_request_body(record)
+      if scheduled is None:
+        scheduled = time.perf_counter()
+
+      try:
+        connection.request(request['method'], request['path'], body=body, headers=headers)
+        response = connection.getresponse()
+        response_body = response.read()
+        latencies.append(time.perf_counter() - scheduled)
+      except (OSError, http.client.HTTPException):
+        errors += 1
+        connection.close()
+        connection = self.__connect()
+        continue
+
+      compared += 1
+      differences = compare_responses(
+        request['method'],
+        record['response'],
+        response.status,
+        response.getheaders(),
+        response_body
+      )
+      if differences:
+        diffs.append({
+          'index': index,
+          'request': '{} {}'.format(request['method'], request['path']),
+          'differences': differences
+        })
+
+    connection.close()
+    with self.__lock:
+      self.__latencies.extend(latencies)
+      self.__errors += errors
+      self.__diffs.extend(diffs)
+      self.__compared += compared
+
+if __name__ == '__main__':
+  try:
+    # options may follow the log file and url
+    opts, args = getopt.gnu_getopt(
+      sys.argv[1:],
+      's:c:o:h',
+      [
+        'speed=',
+        'concurrency=',
+        'connections=',
+        'max-diffs=',
+        'output=',
+        'help'
+      ]
+    )
+  except getopt.GetoptError as error:
+    usage('Invalid arguments: {}'.format(error))
+
+  SPEED = 1
+  CONCURRENCY = None
+  CONNECTIONS = DEFAULT_CONNECTIONS
+  MAX_DIFFS = DEFAULT_MAX_DIFFS
+  OUTPUT_FILE_PATH = None
+
+  for opt, arg in opts:
+    if opt in ('-s', '--speed'):
+      SPEED = float(arg)
+    elif opt in ('-c', '--concurrency'):
+      CONCURRENCY = int(arg)
+    elif opt == '--connections':
+      CONNECTIONS = int(arg)
+    elif opt == '--max-diffs':
+      MAX_DIFFS = int(arg)
+    elif opt in ('-o', '--output'):
+      OUTPUT_FILE_PATH = arg
+    elif opt in ('-h', '--help'):
+      usage()
+    else:
+      usage('Invalid option \'{}\''.format(opt))
+
+  if len(args) != 2:
+    usage('A log file and a gateway url are required')
+  if SPEED <= 0:
+    usage('Invalid speed: {}'.format(SPEED))
+  if CONCURRENCY is not None and CONCURRENCY < 1:
+    usage('Invalid concurrency: {}'.format(CONCURRENCY))
+
+  try:
+    log = TrafficLog(args[0])
+  except (OSError, ValueError) as error:
+    print('Error: {}'.format(error), file=sys.stderr)
+    sys.exit(1)
+
+  with log:
+    if not len(log):
+      print('No requests to replay in {}'.format(args[0]))
+      sys.exit(1)
+
+    print('Replaying {} request(s) {}...'.format(
+      len(log),
+      'over {} connection(s)'.format(CONCURRENCY) if CONCURRENCY else 'at {}x speed'.format(SPEED)
+    ))
+    report = Replayer(log, args[1], speed=SPEED, concurrency=CONCURRENCY, connections=CONNECTIONS).run()
+
+  print('\n{:>12}  {:>12}  {:>12}'.format('', 'recorded', 'replayed'))
+  for name, value in report['replay'].items():
+    print('{:>12}  {:>12}  {:>12}'.format(name, str(report['recorded'].get(name, '')), str(value)))
+
+  diff = report['diff']
+  print('\n{} of {} response(s) differ from the recorded ones'.format(diff['different'], diff['compared']))
+  for response in diff['responses'][:MAX_DIFFS]:
+    print('  #{} {}: {}'.format(response['index'], response['request'], ', '.join(response['differences'])))
+  if diff['different'] > MAX_DIFFS:
+    print('  ...')
+
+  if OUTPUT_FILE_PATH:
+    with open(OUTPUT_FILE_PATH, 'w') as f:
+      json.dump(report, f, indent=2)
+    print('Report saved to {}'.format(OUTPUT_FILE_PATH))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+'''
+Route matching microbenchmark.
+
+Compares route_index.RouteIndex against a linear scan over compiled route patterns (the way
+rule-based routers match requests) for increasing numbers of routes.
+
+Usage: route_index_benchmark.py [route counts...]
+'''
+
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from route_index import RouteIndex, parse_route_key
+
+METHODS = ['GET', 'POST', 'PUT', 'DELETE']
+
+def generate_routes(count, seed=42):
+  '''
+  Generates count route keys mixing static, parameterized and greedy paths.
+  '''
+  rng = random.Random(seed)
+  routes = {}
+  i = 0
+  while len(routes) < count:
+    resource = 'resource{}'.format(i // 4)
+    kind = i % 4
+    if kind == 0:
+      path = '/{}'.format(resource)
+    elif kind == 1:
+      path = '/{}/{{id}}'.format(resource)
+    elif kind == 2:
+      path = '/{}/{{id}}/items/{{itemId}}'.format(resource)
+    else:
+      path = '/{}/files/{{proxy+}}'.format(resource)
+    routes['{} {}'.format(rng.choice(METHODS), path)] = i
+    i += 1
+  return routes
+
+def request_for(route_key):
+  method, path = parse_route_key(route_key)
+  path = path.replace('{proxy+}', 'a/b/c.txt').replace('{id}', '42').replace('{itemId}', '7')
+  return method, path
+
+def compile_linear(routes):
+  '''
+  Compiles every route into a regular expression to be scanned in order.
+  '''
+  patterns = []
+  for route_key, value in routes.items():
+    method, path = parse_route_key(route_key)
+    regex = ''
+    for segment in path.strip('/').split('/'):
+      if segment.endswith('+}'):
+        regex += '/(?P<{}>.+)'.format(segment[1:-2])
+      elif segment.startswith('{'):
+        regex += '/(?P<{}>[^/]+)'.format(segment[1:-1])
+      else:
+        regex += '/' + re.escape(segment)
+    patterns.append((method, re.compile('^' + regex + '$'), value))
+  return patterns
+
+def match_linear(patterns, method, path):
+  for route_method, pattern, value in patterns:
+    if route_method == method and pattern.match(path):
+      return value
+  return None
+
+if __name__ == '__main__':
+  counts = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 5000]
+  print('{:>8}  {:>16}  {:>16}'.format('routes', 'index (us/match)', 'linear (us/match)'))
+
+  for count in counts:
+    routes = generate_routes(count)
+    index = RouteIndex(routes)
+    patterns = compile_linear(routes)
+    requests = [request_for(key) for key in random.Random(1).sample(list(routes), min(200, count))]
+
+    # sanity check: both matchers must agree
+    for method, path in requests:
+      assert index.match(method, path).value == match_linear(patterns, method, path)
+
+    iterations = 20
+    index_time = timeit.timeit(
+      lambda: [index.match(method, path) for method, path in requests],
+      number=iterations
+    )
+    linear_time = timeit.timeit(
+      lambda: [match_linear(patterns, method, path) for method, path in requests],
+      number=max(1, iterations // 10)
+    )
+
+    print('{:>8}  {:>16.2f}  {:>16.2f}'.format(
+      count,
+      index_time / (iterations * len(requests)) * 1e6,
+      linear_time / (max(1, iterations // 10) * len(requests)) * 1e6
+    ))
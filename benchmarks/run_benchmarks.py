@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+'''
+Gateway benchmark suite.
+
+Starts api_router.ApiRouter on an ephemeral port with fake_executor.FakeExecutor in place of
+Docker, drives each scenario with the open-loop load generator, runs the microbenchmarks and
+saves everything as JSON so that runs can be compared between commits. The router's own logging
+is discarded during load runs (it's still performed, so its cost is part of the measurements).
+
+Usage: run_benchmarks.py [options]
+'''
+
+import contextlib
+import getopt
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+from fake_executor import FakeExecutor
+from load_generator import LoadGenerator
+import microbenchmarks
+
+from api_router import ApiRouter
+from payload import build_jwt
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+ENDPOINT_CONFIG = {
+  'GET /hello': {
+    'function': 'hello',
+    'method': 'GET',
+    'path': '/hello',
+    'runtime': 'python3.8',
+    'handler': 'main.handler',
+    'filepath': 'hello/main.py'
+  },
+  'GET /users/{id}': {
+    'function': 'users',
+    'method': 'GET',
+    'path': '/users/{id}',
+    'runtime': 'python3.8',
+    'handler': 'main.handler',
+    'filepath': 'users/main.py',
+    'authorizer': {'name': 'benchmark'}
+  },
+  'POST /items': {
+    'function': 'items',
+    'method': 'POST',
+    'path': '/items',
+    'runtime': 'python3.8',
+    'handler': 'main.handler',
+    'filepath': 'items/main.py'
+  }
+}
+
+SCENARIOS = {
+  'static_route': {'path': '/hello'},
+  'jwt_authorized': {
+    'path': '/users/42?fields=name',
+    'headers': {'Authorization': 'Bearer ' + build_jwt('user-42', name='Jane Doe')}
+  },
+  'post_body': {
+    'path': '/items',
+    'method': 'POST',
+    'headers': {'Content-Type': 'application/json'},
+    'body': json.dumps({'items': [{'id': i, 'name': 'item {}'.format(i)} for i in range(100)]}).encode('utf-8')
+  }
+}
+
+def usage(message=None):
+  if message:
+    print(message + '\n')
+
+  print('''Usage: {CMD} [options]
+
+Options:
+-r | --rate <requests/s>:   Offered load per scenario. Default: 200.
+-d | --duration <seconds>:  Duration of every load run. Default: 10.
+-c | --connections <count>: Concurrent client connections. Default: 16.
+-l | --latency <ms>:        Latency of the fake function executor. Default: 0.
+-i | --iterations <count>:  Iterations per microbenchmark. Default: {ITERATIONS}.
+-s | --scenario <name>:     Only run the given load scenario ({SCENARIOS}). Can be repeated.
+-o | --output <file path>:  Results file. Default: results/<commit>-<timestamp>.json.
+--compare <file path>:      Compare the results against a previous results file.
+--skip-load:                Skip the load scenarios.
+--skip-micro:               Skip the microbenchmarks.
+-h | --help:                Print this help message.
+'''.format(
+  CMD=os.path.basename(sys.argv[0]),
+  ITERATIONS=microbenchmarks.DEFAULT_ITERATIONS,
+  SCENARIOS=', '.join(SCENARIOS)
+))
+
+  sys.exit(1 if message else 0)
+
+def get_commit():
+  try:
+    return subprocess.check_output(
+      ['git', 'rev-parse', '--short', 'HEAD'],
+      cwd=BENCHMARKS_DIR,
+      stderr=subprocess.DEVNULL
+    ).decode('utf-8').strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+@contextlib.contextmanager
+def serve(executor):
+  '''
+  Serves an ApiRouter using executor on an ephemeral port, yielding its base url.
+  '''
+  from werkzeug.serving import make_server
+
+  router = ApiRouter(name='benchmark', endpoint_config=ENDPOINT_CONFIG, executor=executor)
+  server = make_server('127.0.0.1', 0, router, threaded=True)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  try:
+    yield 'http://127.0.0.1:{}'.format(server.server_port)
+  finally:
+    server.shutdown()
+    thread.join()
+
+def run_load(scenarios, rate, duration, connections, latency):
+  executor = FakeExecutor(latency=latency)
+  results = {}
+
+  with serve(executor) as url:
+    for name in scenarios:
+      scenario = SCENARIOS[name]
+      generator = LoadGenerator(
+        url + scenario['path'],
+        rate=rate,
+        duration=duration,
+        connections=connections,
+        method=scenario.get('method', 'GET'),
+        body=scenario.get('body'),
+        headers=scenario.get('headers')
+      )
+      print('Running scenario "{}" ({} requests/s for {}s)...'.format(name, rate, duration))
+      with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results[name] = generator.run()
+
+  return results
+
+def flatten(results, prefix=''):
+  values = {}
+  for name, value in results.items():
+    if isinstance(value, dict):
+      values.update(flatten(value, prefix + name + '.'))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+      values[prefix + name] = value
+  return values
+
+def compare(previous, current):
+  '''
+  Prints every numeric result of current next to its value in previous.
+  '''
+  old_values = flatten({key: previous.get(key, {}) for key in ('load', 'micro')})
+  new_values = flatten({key: current.get(key, {}) for key in ('load', 'micro')})
+
+  print('\nComparison against {}:'.format(previous.get('commit') or 'previous results'))
+  for name, new in new_values.items():
+    old = old_values.get(name)
+    if old is None:
+      continue
+    change = '{:+.1f}%'.format((new - old) / old * 100) if old else ''
+    print('{:<60}  {:>12}  {:>12}  {:>8}'.format(name, old, new, change))
+
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.getopt(
+      sys.argv[1:],
+      'r:d:c:l:i:s:o:h',
+      [
+        'rate=',
+        'duration=',
+        'connections=',
+        'latency=',
+        'iterations=',
+        'scenario=',
+        'output=',
+        'compare=',
+        'skip-load',
+        'skip-micro',
+        'help'
+      ]
+    )
+  except getopt.GetoptError as error:
+    usage('Invalid arguments: {}'.format(error))
+
+  RATE = 200
+  DURATION = 10
+  CONNECTIONS = 16
+  LATENCY = 0
+  ITERATIONS = microbenchmarks.DEFAULT_ITERATIONS
+  SCENARIO_NAMES = []
+  OUTPUT_FILE_PATH = None
+  COMPARE_FILE_PATH = None
+  SKIP_LOAD = False
+  SKIP_MICRO = False
+
+  for opt, arg in opts:
+    if opt in ('-r', '--rate'):
+      RATE = float(arg)
+    elif opt in ('-d', '--duration'):
+      DURATION = float(arg)
+    elif opt in ('-c', '--connections'):
+      CONNECTIONS = int(arg)
+    elif opt in ('-l', '--latency'):
+      LATENCY = float(arg) / 1000
+    elif opt in ('-i', '--iterations'):
+      ITERATIONS = int(arg)
+    elif opt in ('-s', '--scenario'):
+      if arg not in SCENARIOS:
+        usage('Unknown scenario \'{}\''.format(arg))
+      SCENARIO_NAMES.append(arg)
+    elif opt in ('-o', '--output'):
+      OUTPUT_FILE_PATH = arg
+    elif opt == '--compare':
+      COMPARE_FILE_PATH = arg
+    elif opt == '--skip-load':
+      SKIP_LOAD = True
+    elif opt == '--skip-micro':
+      SKIP_MICRO = True
+    elif opt in ('-h', '--help'):
+      usage()
+    else:
+      usage('Invalid option \'{}\''.format(opt))
+
+  commit = get_commit()
+  results = {
+    'commit': commit,
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'settings': {
+      'rate': RATE,
+      'duration': DURATION,
+      'connections': CONNECTIONS,
+      'latency_ms': LATENCY * 1000,
+      'iterations': ITERATIONS
+    }
+  }
+
+  if not SKIP_LOAD:
+    results['load'] = run_load(SCENARIO_NAMES or list(SCENARIOS), RATE, DURATION, CONNECTIONS, LATENCY)
+    for name, summary in results['load'].items():
+      print('{:<16}  {:>8} req/s  p50 {:>8} ms  p95 {:>8} ms  p99 {:>8} ms  errors {}'.format(
+        name,
+        summary['rps'],
+        summary['p50_ms'],
+        summary['p95_ms'],
+        summary['p99_ms'],
+        summary['errors']
+      ))
+
+  if not SKIP_MICRO:
+    print('Running microbenchmarks ({} iterations)...'.format(ITERATIONS))
+    results['micro'] = microbenchmarks.run(ITERATIONS)
+    for name, value in results['micro'].items():
+      print('{:<50}  {:>10.3f} us/call'.format(name, value))
+
+  if not OUTPUT_FILE_PATH:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    OUTPUT_FILE_PATH = os.path.join(
+      RESULTS_DIR,
+      '{}-{}.json'.format(commit or 'results', time.strftime('%Y%m%d%H%M%S'))
+    )
+
+  with open(OUTPUT_FILE_PATH, 'w') as f:
+    json.dump(results, f, indent=2)
+  print('Results saved to {}'.format(OUTPUT_FILE_PATH))
+
+  if COMPARE_FILE_PATH:
+    with open(COMPARE_FILE_PATH, 'r') as f:
+      compare(json.load(f), results)
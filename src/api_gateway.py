@@ -4,38 +4,291 @@
 API Gateway server.
 '''
 
+import atexit
 import getopt
 import json
 import os
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import CalledProcessError
-from flask_cors import CORS
 
-from api_router import ApiRouter
+from api_router import ApiRouter, DEFAULT_SPOOL_SIZE
+from asgi_router import AsgiRouter, DEFAULT_MAX_PENDING
+from config_cache import ConfigCache, compute_config_key, find_config_files
+from concurrency import ConcurrencyLimiter, DEFAULT_ACCOUNT_LIMIT, MemoryBudget
+from compression import DEFAULT_CONTENT_TYPES as DEFAULT_COMPRESSIBLE_TYPES, DEFAULT_MIN_SIZE as DEFAULT_COMPRESSION_MIN_SIZE, ResponseCompressor, brotli
+from container_pool import ContainerPool, REUSE_LIFO
+from cors import parse_cors_config
+from event_sources import SOURCE_SCHEDULE, SOURCE_SNS, SOURCE_SQS, SOURCE_TYPES, EventSources
+from file_watcher import FileWatcher, is_under
+from invoker import FunctionInvoker
+from route_index import DEFAULT_ROUTE, parse_route_key
+from native_pool import BACKEND_DOCKER, BACKEND_NATIVE, BACKENDS, NativePool, supports_native_backend
+from prefork import BACKEND_NAMES, Coordinator, serve, supports_reuse_port
+from response_cache import ResponseCache, DEFAULT_MAX_SIZE as DEFAULT_CACHE_SIZE
+from runtime_api import RuntimeApi, RUNTIME_IMAGES as DEFAULT_RUNTIME_IMAGES
+from schedules import parse_schedule
+from single_flight import SingleFlight
+from traffic_log import TrafficRecorder
+import docker_client
+import lambda_utils
+import metrics
 import utils
 
-def check_dependencies():
+DEPENDENCY_CACHE_FILE_PATH = os.path.join(
+  os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+  'cyclon',
+  'dependencies.json'
+)
+
+# options of the Flask gateway the ASGI router has no equivalent for
+ASGI_UNSUPPORTED_OPTIONS = (
+  '-w',
+  '--warm',
+  '-r',
+  '--runtime-api',
+  '--account-concurrency',
+  '--queue-size',
+  '--cache-size',
+  '--compression-min-size',
+  '--compression-types'
+)
+
+def check_dependencies(use_cache=True):
   '''
-  Checks that tool dependencies are met
+  Checks that tool dependencies are met. Checks run concurrently, and successful checks are
+  cached until the corresponding executable changes.
   '''
   deps = [
-    {'name': 'Docker', 'cmd': 'docker --version'},
-    {'name': 'Flask', 'cmd': 'flask --version'},
-    {'name': 'Serverless framework', 'cmd': 'sls --version'},
-    {'name': 'Python', 'cmd': 'python3 --version'}
+    {'name': 'Docker', 'check': lambda: docker_client.get_default_client().ping()},
+    {'name': 'Flask', 'cmd': 'flask --version', 'executable': 'flask'},
+    {'name': 'Serverless framework', 'cmd': 'sls --version', 'executable': 'sls'},
+    {'name': 'Python', 'cmd': 'python3 --version', 'executable': 'python3'}
   ]
 
-  deps_are_satisfied = True
-  for dep in deps:
+  cache = {}
+  if use_cache:
+    try:
+      cache = utils.load_json(DEPENDENCY_CACHE_FILE_PATH)
+    except (OSError, SyntaxError):
+      cache = {}
+
+  def check_dependency(dep):
+    if 'check' in dep:
+      # the Docker daemon may be stopped at any time, so its check is never cached
+      return dep['check'](), None
+
+    fingerprint = utils.executable_fingerprint(dep['executable'])
+    if not fingerprint:
+      return False, None
+
+    if cache.get(dep['name']) == fingerprint:
+      return True, fingerprint
+
     try:
       utils.run_cmd(dep['cmd'])
     except CalledProcessError:
+      return False, None
+
+    return True, fingerprint
+
+  with ThreadPoolExecutor(max_workers=len(deps)) as executor:
+    results = list(executor.map(check_dependency, deps))
+
+  deps_are_satisfied = True
+  new_cache = {}
+  for dep, (is_satisfied, fingerprint) in zip(deps, results):
+    if not is_satisfied:
       print('Missing dependency "{}". Please install it and retry.'.format(dep['name']))
       deps_are_satisfied = False
+    elif fingerprint:
+      new_cache[dep['name']] = fingerprint
+
+  if new_cache != cache:
+    try:
+      os.makedirs(os.path.dirname(DEPENDENCY_CACHE_FILE_PATH), exist_ok=True)
+      with open(DEPENDENCY_CACHE_FILE_PATH, 'w') as f:
+        json.dump(new_cache, f)
+    except OSError:
+      # caching is best-effort
+      pass
 
   return deps_are_satisfied
 
+def get_required_images(endpoint_config, runtime_images=None):
+  '''
+  Returns the Docker images needed to run the configured functions. If runtime_images (runtime
+  name -> image) is specified images are looked up by the functions' runtime (Runtime API mode).
+  '''
+  images = set()
+  for api in endpoint_config.values():
+    if runtime_images is not None:
+      if api['runtime'] in runtime_images:
+        images.add(runtime_images[api['runtime']])
+    else:
+      images.add(lambda_utils.IMAGES[lambda_utils.get_function_runtime(api['filepath'])])
+  return images
+
+def print_concurrency_stats(concurrency_limiter):
+  '''
+  Prints the invocation queueing and throttling counters of every invoked function.
+  '''
+  stats = concurrency_limiter.stats()
+  if not stats:
+    return
+
+  print('Concurrency stats:')
+  for function_name, function_stats in stats.items():
+    print(
+      '{}: {} invocation(s), {} queued (max depth: {}, avg wait: {:.3f}s, max wait: {:.3f}s), '
+      '{} throttled'.format(
+        function_name,
+        function_stats['invocations'],
+        function_stats['queued'],
+        function_stats['max_queue_depth'],
+        function_stats['total_wait_time'] / function_stats['queued'] if function_stats['queued'] else 0,
+        function_stats['max_wait_time'],
+        function_stats['throttles']
+      )
+    )
+
+def print_event_source_stats(event_sources):
+  '''
+  Prints the delivery counters and throughput of every event source.
+  '''
+  stats = event_sources.stats()
+  if not stats:
+    return
+
+  print('Event source stats:')
+  for key, source_stats in stats.items():
+    print(
+      '{}: {} message(s) received, {} processed ({:.2f}/s), {} retried, {} dropped, '
+      '{} invocation(s) (avg batch size: {:.1f}, avg duration: {:.3f}s), {} failed, {} throttled'.format(
+        key,
+        source_stats['received'],
+        source_stats['processed'],
+        source_stats['throughput'],
+        source_stats['retried'],
+        source_stats['dropped'],
+        source_stats['invocations'],
+        source_stats['average_batch_size'],
+        source_stats['average_duration'],
+        source_stats['failed_invocations'],
+        source_stats['throttles']
+      )
+    )
+
+def shutdown_backends(backends):
+  '''
+  Stops the event sources, prints the concurrency stats and stops the worker and container
+  pools of backends, a dictionary mapping backend names to the gateway's execution backends
+  (or None if unused).
+  '''
+  if backends.get('event_sources'):
+    backends['event_sources'].shutdown()
+    print_event_source_stats(backends['event_sources'])
+  print_concurrency_stats(backends['concurrency_limiter'])
+  for name in ('native_pool', 'runtime_api', 'container_pool'):
+    if backends.get(name):
+      backends[name].shutdown()
+
+def close_recorder(recorder):
+  recorder.close()
+  print('Captured {} request(s) to {}'.format(recorder.records, os.path.relpath(recorder.path)))
+
+def assign_backends(endpoint_config, default_backend=BACKEND_DOCKER, function_backends=None):
+  '''
+  Sets the execution backend ("backend" setting) of every endpoint config entry: the one in
+  function_backends (function name -> backend) or default_backend. Functions the native backend
+  can't run fall back to Docker unless they were explicitly assigned to it.
+  '''
+  function_backends = function_backends or {}
+  for function_name in function_backends:
+    if not any(api['function'] == function_name for api in endpoint_config.values()):
+      raise Exception('Unknown function "{}" passed to --backend'.format(function_name))
+
+  for api in endpoint_config.values():
+    backend = function_backends.get(api['function'], default_backend)
+    if backend == BACKEND_NATIVE and not supports_native_backend(api['filepath']):
+      if api['function'] in function_backends:
+        raise Exception(
+          'Function "{}" can\'t run on the native backend (Python and Node.js functions only)'.format(api['function'])
+        )
+      backend = BACKEND_DOCKER
+    api['backend'] = backend
+
+def watch_changes(router, load_endpoints, functions_dir, sls_config_file_path, env_file_path=None, environment=None, pools=()):
+  '''
+  Starts watching function sources, the Serverless configuration files and the environment
+  file, applying changes without restarting the gateway:
+  - function source changes recycle the function's workers in pools (objects with a
+    recycle(function_file_path=None) method),
+  - configuration changes reload the endpoints through load_endpoints (which returns a new
+    endpoint config) and recycle the functions of the routes that changed,
+  - environment file changes update environment (in place) and recycle every worker.
+  A configuration that fails to load is reported and the current one kept.
+  Returns the started FileWatcher.
+  '''
+  functions_dir = os.path.abspath(functions_dir)
+  env_file_path = os.path.abspath(env_file_path) if env_file_path else None
+  # files referenced through variables that can't be resolved statically aren't watched
+  config_files = set(find_config_files(sls_config_file_path) or [os.path.abspath(sls_config_file_path)])
+
+  roots = [functions_dir] + [os.path.dirname(file_path) for file_path in config_files]
+  if env_file_path:
+    roots.append(os.path.dirname(env_file_path))
+
+  def is_watched(file_path):
+    return is_under(file_path, functions_dir) or file_path in config_files or file_path == env_file_path
+
+  def recycle(function_file_path=None):
+    for pool in pools:
+      if pool:
+        pool.recycle(function_file_path)
+
+  def on_change(changed):
+    if env_file_path in changed:
+      print('Environment file changed, restarting functions...')
+      environment.clear()
+      environment.update(utils.read_env_file(env_file_path))
+      recycle()
+      return
+
+    if changed & config_files:
+      print('Serverless configuration changed, reloading endpoints...')
+      try:
+        endpoint_config = load_endpoints()
+      except Exception as error:
+        print('Error reloading endpoints, keeping the current ones: {}'.format(error), file=sys.stderr)
+        return
+
+      previous_config = router.endpoint_config
+      changed_routes = router.update_endpoints(endpoint_config)
+      config_files.update(find_config_files(sls_config_file_path) or [])
+      for route_key in sorted(changed_routes):
+        print('{} {}'.format(
+          utils.color('Reloaded' if route_key in endpoint_config else 'Removed', 'blue'),
+          route_key
+        ))
+        for config in (previous_config, endpoint_config):
+          if route_key in config:
+            recycle(config[route_key]['filepath'])
+
+    function_file_paths = set()
+    for file_path in changed:
+      for api in router.endpoint_config.values():
+        if is_under(file_path, os.path.dirname(api['filepath'])):
+          function_file_paths.add(api['filepath'])
+    for function_file_path in sorted(function_file_paths):
+      print('{} {}'.format(utils.color('Function changed:', 'blue'), os.path.relpath(function_file_path)))
+      recycle(function_file_path)
+
+  watcher = FileWatcher(roots, on_change, predicate=is_watched).start()
+  print('Watching for changes ({})'.format(watcher.mode))
+  return watcher
+
 def usage(message=None):
   if message:
     print(message + '\n')
@@ -57,6 +310,43 @@ Options:
 -e | --env <environment file path>: Path to the file containing environment variables passed to Lambda function. Default: "<current dir>/.env".
 -l | --layer <layer dir>:           Path to directory that will be mounted as Lambda function layer.
 -n | --network <docker network>:    The name of the Docker network Lambda functions should be created in.
+--stage <stage>:                    Stage used to resolve the Serverless configuration.
+--region <region>:                  Region used to resolve the Serverless configuration.
+--refresh-config:                   Ignore the cached Serverless configuration and resolve it again.
+--skip-pull:                        Don't pre-pull and warm up the Docker images used by the configured functions.
+--recheck-dependencies:             Ignore cached dependency checks and run them again.
+-w | --warm:                        Keep a pool of warm containers per function and reuse them across requests.
+--min-warm <count>:                 Minimum warm containers kept alive per function (requires --warm). Default: 0.
+--max-warm <count>:                 Maximum warm containers started per function (requires --warm). Default: 1.
+--idle-timeout <seconds>:           Seconds an idle warm container is kept alive (requires --warm). Default: 300.
+--reuse-policy <lifo|fifo>:         Which idle warm container serves the next request (requires --warm). Default: lifo.
+-r | --runtime-api:                 Serve invocations through a local Lambda Runtime API polled by long-lived runtime containers.
+--runtime-workers <count>:          Runtime containers started per function (requires --runtime-api). Default: 1.
+--runtime-image <runtime>=<image>:  Runtime API-compliant image used for the given runtime (requires --runtime-api). Can be repeated.
+--runtime-api-host <address>:       Address the Runtime API endpoints are served on (requires --runtime-api). Default: the host's address on Docker's bridge network (127.0.0.1 with --network host or if it can't be bound).
+--backend [<function>=]<backend>:   Execution backend of every function, or of the given one: "docker" or "native" (Python and Node.js functions only, run by local worker processes). Can be repeated. Default: docker.
+--native-workers <count>:           Native worker processes per function. Default: 1.
+--account-concurrency <count>:      Account-wide concurrency limit shared by functions without reserved concurrency. Default: {ACCOUNT_LIMIT}.
+--queue-size <count>:               Maximum invocations queued per concurrency pool before throttling. Default: 100.
+--queue-timeout <seconds>:          Seconds a queued invocation waits for a free slot before being throttled (also with --asgi). Default: 10.
+--memory-budget <MB>:               Memory running invocations may commit in total (the sum of their functions' memorySize), beyond which invocations are refused with a 503 status.
+-a | --asgi:                        Serve requests with the asyncio-native ASGI router (requires uvicorn). It runs every invocation in a new container and doesn't support warm containers, the Runtime API, the native backend, account concurrency, response caches, request coalescing, CORS nor compression.
+--max-concurrency <count>:          Maximum concurrent invocations per function (requires --asgi).
+--max-pending <count>:              Maximum invocations waiting per function before throttling (requires --max-concurrency). Default: {MAX_PENDING}.
+--jwt-secret <secret>:              Secret JWT authorizers verify HS256 tokens with, unless configured per authorizer. Default: "default".
+--jwks <jwks file path>:            JWKS file JWT authorizers verify RS256 tokens with, unless configured per authorizer.
+--max-output-size <bytes>:          Function output kept in memory per invocation, beyond which it's spilled to a temporary file. Default: {MAX_OUTPUT_SIZE}.
+--spool-size <bytes>:               Request body size beyond which uploads are spooled to disk. Default: {SPOOL_SIZE}.
+--cache-size <bytes>:               Total size of the responses kept for routes with a cache ("custom.cyclon.routes.<route>.cache"). Default: {CACHE_SIZE}.
+--no-compression:                   Don't compress responses.
+--compression-min-size <bytes>:     Size beyond which compressible responses are compressed (with brotli, if the brotli package is installed, or gzip) for clients accepting it. Default: {COMPRESSION_MIN_SIZE}.
+--compression-types <types>:        Comma-separated content types compressed: media types, "<type>/*" wildcards or "+<suffix>" suffixes. Default: "{COMPRESSIBLE_TYPES}".
+--capture <log file path>:          Append every request, its function event and its response to a traffic log that benchmarks/replay.py can replay.
+--capture-compress:                 Compress the records of the traffic log (requires --capture).
+--events-port <port>:               Port of the HTTP API feeding the SQS queues and SNS topics functions are subscribed to. Default: <server port> + 1.
+--metrics-path <path>:              Path metrics are served on in the Prometheus text format, or "" to disable them. Default: {METRICS_PATH}.
+--watch:                            Reload functions, the Serverless configuration and the environment file when they change.
+--workers <count>:                  Serve requests with the given number of pre-forked HTTP worker processes sharing the port (SO_REUSEPORT), all invoking functions through one coordinator process owning the containers, workers and concurrency limits. The response cache, request coalescing and metrics are held by the coordinator too (shared by every worker, at the cost of a round trip to it per lookup). Default: 1 (single process).
 -h | --help:                        Print this help message.
 -v | --verbose:                     Enable verbose output.
 
@@ -67,42 +357,169 @@ Example (simple):
 Example (advanced):
 
 {CMD} --functions ./my_function_dir --port 4004 --sls .serverless --env .env --network default
-'''.format(CMD=os.path.basename(sys.argv[0])))
+
+Example (warm containers):
+
+{CMD} --functions ./my_function_dir --warm --min-warm 1 --max-warm 4 --idle-timeout 600
+
+Example (Runtime API):
+
+{CMD} --functions ./my_function_dir --runtime-api --runtime-workers 2 --runtime-image python3.8=my-python-image
+
+Example (native Python workers, except for one function):
+
+{CMD} --functions ./my_function_dir --backend native --backend my_function=docker
+
+Example (hot reload):
+
+{CMD} --functions ./my_function_dir --backend native --watch
+
+Example (pre-forked HTTP workers):
+
+{CMD} --functions ./my_function_dir --warm --max-warm 4 --workers 8
+
+Example (event sources, sending a message to the "orders" SQS queue):
+
+{CMD} --functions ./my_function_dir --events-port 5001
+curl -X POST -d '{{"id": 1}}' http://127.0.0.1:5001/queues/orders
+
+Example (capturing traffic, then replaying it at twice its speed):
+
+{CMD} --functions ./my_function_dir --capture traffic.log --capture-compress
+benchmarks/replay.py traffic.log http://127.0.0.1:5000 --speed 2
+
+Example (asyncio):
+
+{CMD} --functions ./my_function_dir --asgi --max-concurrency 50 --max-pending 200
+'''.format(
+  CMD=os.path.basename(sys.argv[0]),
+  ACCOUNT_LIMIT=DEFAULT_ACCOUNT_LIMIT,
+  MAX_PENDING=DEFAULT_MAX_PENDING,
+  MAX_OUTPUT_SIZE=lambda_utils.DEFAULT_MAX_OUTPUT_SIZE,
+  SPOOL_SIZE=DEFAULT_SPOOL_SIZE,
+  METRICS_PATH=metrics.METRICS_PATH,
+  CACHE_SIZE=DEFAULT_CACHE_SIZE,
+  COMPRESSION_MIN_SIZE=DEFAULT_COMPRESSION_MIN_SIZE,
+  COMPRESSIBLE_TYPES=','.join(DEFAULT_COMPRESSIBLE_TYPES)
+))
 
   sys.exit(1 if message else 0)
 
 
-def extract_http_api_endpoints(sls_config_file_path, functions_base_dir):
+def load_serverless_config(sls_config_file_path, stage=None, region=None, refresh=False):
   '''
-  Parses generated Serverless configuration file (i.e. the one resulting from running "sls package"
-  as opposed to the regular Serverless configuration yaml file) and returns a dictionary describing
-  the configured AWS HTTP API endpoints, along with the path to the Lambda function handlers.
+  Resolves the Serverless configuration (i.e. the output of running "sls print") with the
+  optional stage and region options. Resolved configurations are cached on disk and reused as
+  long as the configuration files they come from don't change, unless refresh is True.
   '''
+  options = {}
+  if stage:
+    options['stage'] = stage
+  if region:
+    options['region'] = region
 
-  PROVIDER_TAG = 'provider'
-  FUNCTIONS_TAG = 'functions'
-  RUNTIME_TAG = 'runtime'
-  HANDLER_TAG = 'handler'
-  EVENTS_TAG = 'events'
-  HTTP_API_TAG = 'httpApi'
-  HTTP_API_METHOD_TAG = 'method'
-  HTTP_API_PATH_TAG = 'path'
+  cache = ConfigCache(sls_config_file_path)
+  cache_key = compute_config_key(sls_config_file_path, options)
+
+  if cache_key and not refresh:
+    config = cache.load(cache_key)
+    if config is not None:
+      return config
 
-  DUMP_CONFIG_CMD = 'cd "{}"; sls print --format json --config "{}"'.format(
+  dump_config_cmd = 'cd "{}"; sls print --format json --config "{}"'.format(
     os.path.dirname(sls_config_file_path),
     os.path.basename(sls_config_file_path)
   )
-  CONFIG = json.loads(utils.run_cmd(DUMP_CONFIG_CMD).stdout)
+  for option, value in options.items():
+    dump_config_cmd += ' --{} "{}"'.format(option, value)
 
-  apis = {}
+  config = json.loads(utils.run_cmd(dump_config_cmd).stdout)
+
+  if cache_key:
+    cache.store(cache_key, config)
+
+  return config
+
+def get_route_authorizer(http_event, authorizers, local_authorizers, service_dir):
+  '''
+  Returns the JWT authorizer configuration of an httpApi event: its name and scopes along with
+  the authorizer settings in "provider.httpApi.authorizers" and the local verification keys in
+  "custom.cyclon.authorizers" (an HS256 "secret" and/or a "jwksFile"). Returns None if the
+  route has no JWT authorizer.
+  '''
+  if not isinstance(http_event, dict) or not http_event.get('authorizer'):
+    return None
+
+  route_authorizer = http_event['authorizer']
+  if isinstance(route_authorizer, str):
+    route_authorizer = {'name': route_authorizer}
+
+  name = route_authorizer.get('name')
+  if not name or name not in authorizers:
+    print(
+      'WARNING: authorizer "{}" not found in provider.httpApi.authorizers. Skipping it.'.format(
+        name if name else route_authorizer.get('id', route_authorizer.get('type'))
+      ),
+      file=sys.stderr
+    )
+    return None
+
+  authorizer = authorizers[name]
+  if authorizer.get('type', 'jwt') != 'jwt':
+    print(
+      'WARNING: unsupported authorizer type "{}". Skipping authorizer "{}"'.format(authorizer['type'], name),
+      file=sys.stderr
+    )
+    return None
+
+  config = {
+    'name': name,
+    'identitySource': authorizer.get('identitySource'),
+    'issuerUrl': authorizer.get('issuerUrl'),
+    'audience': authorizer.get('audience'),
+    'scopes': route_authorizer.get('scopes')
+  }
+
+  local_authorizer = local_authorizers.get(name) or {}
+  if 'secret' in local_authorizer:
+    config['secret'] = local_authorizer['secret']
+  if 'jwksFile' in local_authorizer:
+    config['jwksFile'] = os.path.join(service_dir, local_authorizer['jwksFile'])
+
+  return config
+
+def extract_functions(config, functions_base_dir, event_types=None):
+  '''
+  Yields the name and configuration of every function of a resolved Serverless configuration
+  along with the settings shared by its endpoint config entries (runtime, handler, file path and
+  resource limits). Functions with unsupported runtimes are skipped, as well as those without
+  events of event_types (e.g. ['sqs']), if specified.
+  '''
+
+  PROVIDER_TAG = 'provider'
+  FUNCTIONS_TAG = 'functions'
+  RUNTIME_TAG = 'runtime'
+  HANDLER_TAG = 'handler'
+  EVENTS_TAG = 'events'
+  RESERVED_CONCURRENCY_TAG = 'reservedConcurrency'
+  MEMORY_SIZE_TAG = 'memorySize'
+  TIMEOUT_TAG = 'timeout'
 
   default_service_runtime = None
-  if RUNTIME_TAG in CONFIG[PROVIDER_TAG]:
-    default_service_runtime = CONFIG[PROVIDER_TAG][RUNTIME_TAG]
+  if RUNTIME_TAG in config[PROVIDER_TAG]:
+    default_service_runtime = config[PROVIDER_TAG][RUNTIME_TAG]
 
-  for FUNCTION in CONFIG[FUNCTIONS_TAG]:
+  default_memory_size = config[PROVIDER_TAG].get(MEMORY_SIZE_TAG) or lambda_utils.DEFAULT_MEMORY_SIZE
+  default_timeout = config[PROVIDER_TAG].get(TIMEOUT_TAG) or lambda_utils.DEFAULT_TIMEOUT
+
+  for FUNCTION in config[FUNCTIONS_TAG]:
     FUNCTION_NAME = list(FUNCTION)[0]
     FUNCTION_CONFIG = FUNCTION[FUNCTION_NAME]
+    if event_types is not None and not any(
+      event_type in event for event in FUNCTION_CONFIG.get(EVENTS_TAG) or [] for event_type in event_types
+    ):
+      continue
+
     runtime = default_service_runtime
     if RUNTIME_TAG in FUNCTION_CONFIG:
       runtime = FUNCTION_CONFIG[RUNTIME_TAG]
@@ -143,31 +560,226 @@ def extract_http_api_endpoints(sls_config_file_path, functions_base_dir):
     if not os.path.exists(FUNCTION_FILE_PATH):
       raise Exception('Handler function file path not found: "{}"'.format(FUNCTION_FILE_PATH))
 
+    yield FUNCTION_NAME, FUNCTION_CONFIG, {
+      'function': FUNCTION_NAME,
+      'runtime': runtime,
+      'handler': HANDLER_NAME,
+      'filepath': FUNCTION_FILE_PATH,
+      'reservedConcurrency': FUNCTION_CONFIG.get(RESERVED_CONCURRENCY_TAG),
+      'memorySize': int(FUNCTION_CONFIG.get(MEMORY_SIZE_TAG) or default_memory_size),
+      'timeout': float(FUNCTION_CONFIG.get(TIMEOUT_TAG) or default_timeout)
+    }
+
+def extract_http_api_endpoints(
+    sls_config_file_path,
+    functions_base_dir,
+    stage=None,
+    region=None,
+    refresh_config=False,
+    config=None
+  ):
+  '''
+  Parses generated Serverless configuration file (i.e. the one resulting from running "sls package"
+  as opposed to the regular Serverless configuration yaml file) and returns a dictionary describing
+  the configured AWS HTTP API endpoints, along with the path to the Lambda function handlers.
+  The configuration is resolved through load_serverless_config (see its options) unless config,
+  an already resolved configuration, is specified.
+  '''
+
+  PROVIDER_TAG = 'provider'
+  EVENTS_TAG = 'events'
+  HTTP_API_TAG = 'httpApi'
+  HTTP_API_METHOD_TAG = 'method'
+  HTTP_API_PATH_TAG = 'path'
+  AUTHORIZERS_TAG = 'authorizers'
+  CUSTOM_TAG = 'custom'
+  CYCLON_TAG = 'cyclon'
+  ROUTES_TAG = 'routes'
+  CACHE_TAG = 'cache'
+  COALESCE_TAG = 'coalesce'
+  CORS_TAG = 'cors'
+
+  CONFIG = config if config is not None else load_serverless_config(
+    sls_config_file_path,
+    stage=stage,
+    region=region,
+    refresh=refresh_config
+  )
+
+  apis = {}
+
+  authorizers = (CONFIG[PROVIDER_TAG].get(HTTP_API_TAG) or {}).get(AUTHORIZERS_TAG) or {}
+  cyclon_config = (CONFIG.get(CUSTOM_TAG) or {}).get(CYCLON_TAG) or {}
+  local_authorizers = cyclon_config.get(AUTHORIZERS_TAG) or {}
+  # CORS settings shared by every route
+  cors = parse_cors_config((CONFIG[PROVIDER_TAG].get(HTTP_API_TAG) or {}).get(CORS_TAG))
+
+  for FUNCTION_NAME, FUNCTION_CONFIG, function in extract_functions(CONFIG, functions_base_dir):
     if EVENTS_TAG in FUNCTION_CONFIG:
       HTTP_API_EVENTS = [e[HTTP_API_TAG] for e in FUNCTION_CONFIG[EVENTS_TAG] if HTTP_API_TAG in e]
       for http_event in HTTP_API_EVENTS:
-        RESOURCE_ID = http_event[HTTP_API_METHOD_TAG] + ' ' + http_event[HTTP_API_PATH_TAG]
+        # events can also be configured as a "<method> <path>" string, or "*" for $default
+        if isinstance(http_event, str):
+          RESOURCE_ID = http_event.strip()
+        else:
+          RESOURCE_ID = http_event[HTTP_API_METHOD_TAG] + ' ' + http_event[HTTP_API_PATH_TAG]
+
+        if RESOURCE_ID == '*':
+          RESOURCE_ID = DEFAULT_ROUTE
+
+        METHOD, PATH = parse_route_key(RESOURCE_ID)
+        if PATH is not None:
+          RESOURCE_ID = METHOD + ' ' + PATH
 
         if RESOURCE_ID in apis:
           raise Exception('Duplicated HTTP method: {}'.format(RESOURCE_ID))
 
-        apis[RESOURCE_ID] = {
-          'function': FUNCTION_NAME,
-          'method': http_event[HTTP_API_METHOD_TAG],
-          'path': http_event[HTTP_API_PATH_TAG],
-          'runtime': runtime,
-          'handler': HANDLER_NAME,
-          'filepath': FUNCTION_FILE_PATH
-        }
+        apis[RESOURCE_ID] = dict(
+          function,
+          method=METHOD,
+          path=PATH if PATH is not None else DEFAULT_ROUTE,
+          authorizer=get_route_authorizer(
+            http_event,
+            authorizers,
+            local_authorizers,
+            os.path.dirname(os.path.abspath(sls_config_file_path))
+          ),
+          cache=None,
+          coalesce=None,
+          cors=cors
+        )
+
+  # local route settings, e.g. "custom.cyclon.routes.<route key>.cache" or ".coalesce"
+  for route_key, route_config in (cyclon_config.get(ROUTES_TAG) or {}).items():
+    METHOD, PATH = parse_route_key(route_key.strip())
+    RESOURCE_ID = METHOD + ' ' + PATH if PATH is not None else DEFAULT_ROUTE
+    if RESOURCE_ID not in apis:
+      print('WARNING: route "{}" in custom.cyclon.routes not found. Skipping it.'.format(route_key), file=sys.stderr)
+      continue
+
+    # "true" enables a setting with its defaults
+    for tag in (CACHE_TAG, COALESCE_TAG):
+      value = (route_config or {}).get(tag)
+      if value:
+        apis[RESOURCE_ID][tag] = value if isinstance(value, dict) else {}
 
   return apis
 
 
+def resolve_resource(value, resources, name_property):
+  '''
+  Resolves the queue or topic an event refers to: an ARN, a name, or a "Fn::GetAtt"/"Ref"
+  reference to a resource of the configuration. Returns its name (the resource's name_property,
+  defaulting to its logical id) and its properties, or (None, {}) if it can't be resolved.
+  '''
+  if isinstance(value, str):
+    return (value.rsplit(':', 1)[-1] if value.startswith('arn:') else value), {}
+
+  if not isinstance(value, dict):
+    return None, {}
+  if 'Fn::GetAtt' in value:
+    attribute = value['Fn::GetAtt']
+    logical_id = attribute.split('.')[0] if isinstance(attribute, str) else attribute[0]
+  elif 'Ref' in value:
+    logical_id = value['Ref']
+  else:
+    return None, {}
+
+  properties = (resources.get(logical_id) or {}).get('Properties') or {}
+  name = properties.get(name_property)
+  return name if isinstance(name, str) else logical_id, properties
+
+def extract_event_sources(sls_config_file_path, functions_base_dir, config):
+  '''
+  Returns a dictionary describing the SQS, SNS and schedule events of the functions of a resolved
+  Serverless configuration: event source key ("<function>/<type>:<name>") -> the function's
+  settings (as in endpoint config entries) along with the event's "type", the "name" of its queue,
+  topic or schedule, and its delivery settings (see event_sources.EventSources).
+  Disabled events and those whose queue or topic can't be resolved are skipped.
+  '''
+
+  EVENTS_TAG = 'events'
+  RESOURCES_TAG = 'resources'
+  ENABLED_TAG = 'enabled'
+
+  resources = (config.get(RESOURCES_TAG) or {}).get('Resources') or {}
+  sources = {}
+
+  def add_source(function, source_type, name, **settings):
+    key = '{}/{}:{}'.format(function['function'], source_type, name)
+    if key in sources:
+      key += '#{}'.format(len(sources))
+    sources[key] = dict(function, type=source_type, name=name, **settings)
+
+  for FUNCTION_NAME, FUNCTION_CONFIG, function in extract_functions(config, functions_base_dir, SOURCE_TYPES):
+    schedule_count = 0
+    for event in FUNCTION_CONFIG.get(EVENTS_TAG) or []:
+      event_type = next((event_type for event_type in SOURCE_TYPES if event_type in event), None)
+      if event_type is None:
+        continue
+
+      settings = event[event_type]
+      if isinstance(settings, dict) and settings.get(ENABLED_TAG) is False:
+        continue
+
+      if event_type == SOURCE_SQS:
+        arn = settings if not isinstance(settings, dict) else settings.get('arn')
+        name, properties = resolve_resource(arn, resources, 'QueueName')
+        if not name:
+          print('WARNING: unable to resolve the SQS queue of function "{}". Skipping it.'.format(FUNCTION_NAME), file=sys.stderr)
+          continue
+
+        settings = settings if isinstance(settings, dict) else {}
+        add_source(
+          function,
+          SOURCE_SQS,
+          name,
+          batchSize=int(settings.get('batchSize') or 10),
+          maximumBatchingWindow=float(settings.get('maximumBatchingWindow') or 0),
+          maximumConcurrency=settings.get('maximumConcurrency'),
+          functionResponseType=settings.get('functionResponseType'),
+          maxReceiveCount=(properties.get('RedrivePolicy') or {}).get('maxReceiveCount')
+        )
+
+      elif event_type == SOURCE_SNS:
+        if isinstance(settings, dict):
+          name = settings.get('topicName') or resolve_resource(settings.get('arn'), resources, 'TopicName')[0]
+        else:
+          name = resolve_resource(settings, resources, 'TopicName')[0]
+        if not name:
+          print('WARNING: unable to resolve the SNS topic of function "{}". Skipping it.'.format(FUNCTION_NAME), file=sys.stderr)
+          continue
+        add_source(function, SOURCE_SNS, name)
+
+      else:
+        settings = settings if isinstance(settings, dict) else {'rate': settings}
+        rates = settings.get('rate')
+        event_input = settings.get('input')
+        if isinstance(event_input, str):
+          try:
+            event_input = json.loads(event_input)
+          except ValueError:
+            pass
+
+        # Serverless accepts a single expression or a list of them
+        for rate in rates if isinstance(rates, list) else [rates]:
+          schedule_count += 1
+          name = settings.get('name') or '{}-schedule-{}'.format(FUNCTION_NAME, schedule_count)
+          try:
+            parse_schedule(rate, 0)
+          except (TypeError, ValueError) as error:
+            print('WARNING: {}. Skipping schedule of function "{}".'.format(error, FUNCTION_NAME), file=sys.stderr)
+            continue
+          add_source(function, SOURCE_SCHEDULE, name, schedule=rate, input=event_input)
+
+  return sources
+
+
 if __name__ == '__main__':
   try:
     opts, args = getopt.getopt(
       args=sys.argv[1:],
-      shortopts='f:p:s:e:l:n:vh',
+      shortopts='f:p:s:e:l:n:wravh',
       longopts=[
         'functions=',
         'port=',
@@ -175,6 +787,43 @@ if __name__ == '__main__':
         'env=',
         'layer=',
         'network=',
+        'stage=',
+        'region=',
+        'refresh-config',
+        'skip-pull',
+        'recheck-dependencies',
+        'warm',
+        'min-warm=',
+        'max-warm=',
+        'idle-timeout=',
+        'reuse-policy=',
+        'runtime-api',
+        'runtime-workers=',
+        'runtime-image=',
+        'runtime-api-host=',
+        'account-concurrency=',
+        'backend=',
+        'native-workers=',
+        'queue-size=',
+        'queue-timeout=',
+        'memory-budget=',
+        'asgi',
+        'max-concurrency=',
+        'max-pending=',
+        'jwt-secret=',
+        'jwks=',
+        'max-output-size=',
+        'spool-size=',
+        'cache-size=',
+        'no-compression',
+        'compression-min-size=',
+        'compression-types=',
+        'capture=',
+        'capture-compress',
+        'events-port=',
+        'metrics-path=',
+        'watch',
+        'workers=',
         'verbose',
         'help'
       ]
@@ -189,6 +838,44 @@ if __name__ == '__main__':
   ENV_FILE_PATH = None
   LAYER_DIR = None
   DOCKER_NETWORK_NAME = None
+  STAGE = None
+  REGION = None
+  REFRESH_CONFIG = False
+  SKIP_PULL = False
+  RECHECK_DEPENDENCIES = False
+  WARM_CONTAINERS = False
+  MIN_WARM = 0
+  MAX_WARM = 1
+  IDLE_TIMEOUT = 300
+  REUSE_POLICY = REUSE_LIFO
+  RUNTIME_API = False
+  RUNTIME_WORKERS = 1
+  RUNTIME_IMAGES = {}
+  RUNTIME_API_HOST = None
+  DEFAULT_BACKEND = BACKEND_DOCKER
+  FUNCTION_BACKENDS = {}
+  NATIVE_WORKERS = 1
+  ACCOUNT_CONCURRENCY = DEFAULT_ACCOUNT_LIMIT
+  QUEUE_SIZE = 100
+  QUEUE_TIMEOUT = 10
+  MEMORY_BUDGET = None
+  ASGI = False
+  MAX_CONCURRENCY = None
+  MAX_PENDING = DEFAULT_MAX_PENDING
+  JWT_SECRET = None
+  JWKS_FILE_PATH = None
+  MAX_OUTPUT_SIZE = lambda_utils.DEFAULT_MAX_OUTPUT_SIZE
+  SPOOL_SIZE = DEFAULT_SPOOL_SIZE
+  CACHE_SIZE = DEFAULT_CACHE_SIZE
+  COMPRESSION = True
+  COMPRESSION_MIN_SIZE = DEFAULT_COMPRESSION_MIN_SIZE
+  COMPRESSIBLE_TYPES = DEFAULT_COMPRESSIBLE_TYPES
+  CAPTURE_FILE_PATH = None
+  CAPTURE_COMPRESS = False
+  METRICS_PATH = metrics.METRICS_PATH
+  EVENTS_PORT = None
+  WATCH = False
+  WORKERS = 1
 
   for opt, arg in opts:
     if opt in ('-f', '--functions'):
@@ -203,11 +890,119 @@ if __name__ == '__main__':
       LAYER_DIR = arg
     elif opt in ('-n', '--network'):
       DOCKER_NETWORK_NAME = arg
+    elif opt == '--stage':
+      STAGE = arg
+    elif opt == '--region':
+      REGION = arg
+    elif opt == '--refresh-config':
+      REFRESH_CONFIG = True
+    elif opt == '--skip-pull':
+      SKIP_PULL = True
+    elif opt == '--recheck-dependencies':
+      RECHECK_DEPENDENCIES = True
+    elif opt in ('-w', '--warm'):
+      WARM_CONTAINERS = True
+    elif opt == '--min-warm':
+      MIN_WARM = int(arg)
+    elif opt == '--max-warm':
+      MAX_WARM = int(arg)
+    elif opt == '--idle-timeout':
+      IDLE_TIMEOUT = float(arg)
+    elif opt == '--reuse-policy':
+      REUSE_POLICY = arg
+    elif opt in ('-r', '--runtime-api'):
+      RUNTIME_API = True
+    elif opt == '--runtime-workers':
+      RUNTIME_WORKERS = int(arg)
+    elif opt == '--runtime-image':
+      if '=' not in arg:
+        usage('Invalid runtime image \'{}\', expected <runtime>=<image>'.format(arg))
+      runtime, image = arg.split('=', 1)
+      RUNTIME_IMAGES[runtime] = image
+    elif opt == '--runtime-api-host':
+      RUNTIME_API_HOST = arg
+    elif opt == '--backend':
+      function_name, _, backend = arg.rpartition('=')
+      if backend not in BACKENDS:
+        usage('Invalid backend \'{}\', expected one of {}'.format(backend, ', '.join(BACKENDS)))
+      if function_name:
+        FUNCTION_BACKENDS[function_name] = backend
+      else:
+        DEFAULT_BACKEND = backend
+    elif opt == '--native-workers':
+      NATIVE_WORKERS = int(arg)
+    elif opt == '--account-concurrency':
+      ACCOUNT_CONCURRENCY = int(arg)
+    elif opt == '--queue-size':
+      QUEUE_SIZE = int(arg)
+    elif opt == '--queue-timeout':
+      QUEUE_TIMEOUT = float(arg)
+    elif opt == '--memory-budget':
+      MEMORY_BUDGET = int(arg)
+    elif opt in ('-a', '--asgi'):
+      ASGI = True
+    elif opt == '--max-concurrency':
+      MAX_CONCURRENCY = int(arg)
+    elif opt == '--max-pending':
+      MAX_PENDING = int(arg)
+    elif opt == '--jwt-secret':
+      JWT_SECRET = arg
+    elif opt == '--jwks':
+      JWKS_FILE_PATH = os.path.abspath(arg)
+    elif opt == '--max-output-size':
+      MAX_OUTPUT_SIZE = int(arg)
+    elif opt == '--spool-size':
+      SPOOL_SIZE = int(arg)
+    elif opt == '--cache-size':
+      CACHE_SIZE = int(arg)
+    elif opt == '--no-compression':
+      COMPRESSION = False
+    elif opt == '--compression-min-size':
+      COMPRESSION_MIN_SIZE = int(arg)
+    elif opt == '--compression-types':
+      COMPRESSIBLE_TYPES = [content_type.strip() for content_type in arg.split(',') if content_type.strip()]
+    elif opt == '--capture':
+      CAPTURE_FILE_PATH = arg
+    elif opt == '--capture-compress':
+      CAPTURE_COMPRESS = True
+    elif opt == '--events-port':
+      EVENTS_PORT = int(arg)
+    elif opt == '--metrics-path':
+      METRICS_PATH = arg
+    elif opt == '--watch':
+      WATCH = True
+    elif opt == '--workers':
+      WORKERS = int(arg)
     elif opt in ('-h', '--help'):
       usage()
     else:
       usage('Invalid option \'{}\''.format(opt))
 
+  if EVENTS_PORT is None:
+    EVENTS_PORT = int(PORT) + 1
+
+  if ASGI:
+    # options the ASGI router has no equivalent for
+    asgi_options = sorted({
+      {'-w': '--warm', '-r': '--runtime-api'}.get(opt, opt) for opt, _ in opts if opt in ASGI_UNSUPPORTED_OPTIONS
+    })
+    if asgi_options:
+      usage('{} can\'t be combined with --asgi'.format(', '.join(asgi_options)))
+
+  if CAPTURE_FILE_PATH:
+    if ASGI or WORKERS > 1:
+      usage('--capture can\'t be combined with --asgi or --workers')
+  elif CAPTURE_COMPRESS:
+    usage('--capture-compress requires --capture')
+
+  if WORKERS < 1:
+    usage('Invalid worker count: {}'.format(WORKERS))
+  if WORKERS > 1:
+    if ASGI or WATCH:
+      usage('--workers can\'t be combined with --asgi or --watch')
+    if not supports_reuse_port():
+      usage('--workers requires SO_REUSEPORT, which isn\'t supported on this platform')
+
   SLS_CONFIG_FILE_PATH = os.path.abspath(SLS_CONFIG_FILE_PATH)
   if not os.path.exists(SLS_CONFIG_FILE_PATH):
     print('Serverless configuration file not found: \'{}\''.format(SLS_CONFIG_FILE_PATH))
@@ -221,6 +1016,9 @@ if __name__ == '__main__':
 
     # load environment variables from file
     environment = utils.read_env_file(ENV_FILE_PATH)
+  if WATCH and not environment:
+    # environment file changes are applied to the same dict
+    environment = {}
 
   if LAYER_DIR:
     LAYER_DIR = os.path.abspath(LAYER_DIR)
@@ -228,43 +1026,289 @@ if __name__ == '__main__':
       print('Invalid layer directory: "{}"'.format(LAYER_DIR))
       sys.exit(1)
 
+  startup_timer = utils.PhaseTimer()
+
   # check that dependency tools are installed
-  if not check_dependencies():
-    sys.exit(1)
+  with startup_timer.phase('Dependency checks'):
+    if not check_dependencies(use_cache=not RECHECK_DEPENDENCIES):
+      sys.exit(1)
 
   try:
     print('Loading endpoints from {} config file...'.format(os.path.relpath(SLS_CONFIG_FILE_PATH)))
 
-    # extract HTTP API endpoints
-    endpoint_config = extract_http_api_endpoints(SLS_CONFIG_FILE_PATH, FUNCTIONS_DIR)
+    # extract HTTP API endpoints and event sources (SQS, SNS and schedule events)
+    with startup_timer.phase('Serverless config'):
+      sls_config = load_serverless_config(
+        SLS_CONFIG_FILE_PATH,
+        stage=STAGE,
+        region=REGION,
+        refresh=REFRESH_CONFIG
+      )
+      endpoint_config = extract_http_api_endpoints(SLS_CONFIG_FILE_PATH, FUNCTIONS_DIR, config=sls_config)
+      event_source_config = extract_event_sources(SLS_CONFIG_FILE_PATH, FUNCTIONS_DIR, sls_config)
 
-    if not endpoint_config:
+    if not endpoint_config and not event_source_config:
       print(
         'No HTTP API endpoints were found. Please make sure there\'s at least one function '
         'with one HTTP API event configured.'
       )
       sys.exit(1)
 
+    # every function invoked by the gateway, through its endpoints or its event sources
+    function_config = dict(endpoint_config, **event_source_config)
+
+    # pick every function's execution backend
+    try:
+      assign_backends(function_config, DEFAULT_BACKEND, FUNCTION_BACKENDS)
+    except Exception as error:
+      print(error)
+      sys.exit(1)
+
+    def load_endpoints():
+      endpoint_config = extract_http_api_endpoints(SLS_CONFIG_FILE_PATH, FUNCTIONS_DIR, stage=STAGE, region=REGION)
+      assign_backends(dict(endpoint_config, **event_source_config), DEFAULT_BACKEND, FUNCTION_BACKENDS)
+      return endpoint_config
+
+    native_config = {key: api for key, api in function_config.items() if api['backend'] == BACKEND_NATIVE}
+    if native_config and ASGI:
+      print('The native backend isn\'t supported in ASGI mode')
+      sys.exit(1)
+
+    if ASGI:
+      asgi_settings = [name for name, tag in (
+          ('response caches ("cache")', 'cache'),
+          ('request coalescing ("coalesce")', 'coalesce'),
+          ('CORS (provider.httpApi.cors)', 'cors')
+        ) if any(api[tag] for api in endpoint_config.values())]
+      if asgi_settings:
+        print('{} aren\'t supported in ASGI mode'.format(', '.join(asgi_settings)))
+        sys.exit(1)
+
     print('Serving HTTP requests on {} endpoint(s):'.format(len(endpoint_config.keys())))
     for api_resource in endpoint_config:
       api = endpoint_config[api_resource]
-      print('{} {} -> {}'.format(
+      url = 'http://' + HOSTNAME + ':' + str(PORT)
+      print('{} {} -> {}{}'.format(
         utils.color(api['method'], 'blue'),
-        utils.color('http://' + HOSTNAME + ':' + str(PORT) + api['path'], 'cyan'),
-        os.path.relpath(api['filepath'])
+        utils.color(url + '/* ({})'.format(DEFAULT_ROUTE) if api_resource == DEFAULT_ROUTE else url + api['path'], 'cyan'),
+        os.path.relpath(api['filepath']),
+        ' (native)' if api['backend'] == BACKEND_NATIVE else ''
       ))
 
+    if event_source_config and ASGI:
+      print('WARNING: event sources aren\'t supported in ASGI mode. Skipping them.', file=sys.stderr)
+      event_source_config = {}
+    elif event_source_config:
+      print('Consuming {} event source(s), fed through http://{}:{}:'.format(len(event_source_config), HOSTNAME, EVENTS_PORT))
+      for source in event_source_config.values():
+        print('{} {} -> {}{}'.format(
+          utils.color(source['type'].upper(), 'blue'),
+          utils.color(source['name'] + (' ({})'.format(source['schedule']) if source['type'] == SOURCE_SCHEDULE else ''), 'cyan'),
+          os.path.relpath(source['filepath']),
+          ' (native)' if source['backend'] == BACKEND_NATIVE else ''
+        ))
+
+    if not SKIP_PULL:
+      with startup_timer.phase('Image pre-pull'):
+        images = get_required_images(
+          {key: api for key, api in function_config.items() if api['backend'] != BACKEND_NATIVE},
+          runtime_images=dict(DEFAULT_RUNTIME_IMAGES, **RUNTIME_IMAGES) if RUNTIME_API else None
+        )
+        for image, (status, duration) in lambda_utils.prepare_images(images).items():
+          if isinstance(status, Exception):
+            print('WARNING: unable to prepare image "{}": {}'.format(image, status), file=sys.stderr)
+          else:
+            print('Image {} {} ({:.3f}s)'.format(utils.color(image, 'purple'), status, duration))
+
+    memory_budget = None
+    if MEMORY_BUDGET:
+      memory_budget = MemoryBudget(MEMORY_BUDGET)
+
+    if ASGI:
+      print('Startup timing:\n' + startup_timer.report())
+      try:
+        import uvicorn
+      except ImportError:
+        print('ASGI mode requires uvicorn. Please install it ("pip install uvicorn") and retry.')
+        sys.exit(1)
+
+      router = AsgiRouter(
+        endpoint_config=endpoint_config,
+        environment=environment,
+        layer_dir=LAYER_DIR,
+        docker_network_name=DOCKER_NETWORK_NAME,
+        concurrency_limit=MAX_CONCURRENCY,
+        max_pending=MAX_PENDING,
+        queue_timeout=QUEUE_TIMEOUT,
+        jwt_secret=JWT_SECRET,
+        jwks_file=JWKS_FILE_PATH,
+        max_output_size=MAX_OUTPUT_SIZE,
+        spool_size=SPOOL_SIZE,
+        metrics_path=METRICS_PATH,
+        memory_budget=memory_budget
+      )
+
+      if WATCH:
+        watch_changes(router, load_endpoints, FUNCTIONS_DIR, SLS_CONFIG_FILE_PATH, ENV_FILE_PATH, environment)
+
+      uvicorn.run(router, host=HOSTNAME, port=int(PORT), log_level='error')
+      sys.exit(0)
+
+    def create_backends():
+      '''
+      Creates the execution backends, run in the coordinator process in pre-forked mode.
+      '''
+      container_pool = None
+      if WARM_CONTAINERS:
+        container_pool = ContainerPool(
+          min_warm=MIN_WARM,
+          max_warm=MAX_WARM,
+          idle_timeout=IDLE_TIMEOUT,
+          reuse_policy=REUSE_POLICY,
+          layer_dir=LAYER_DIR,
+          docker_network_name=DOCKER_NETWORK_NAME,
+          environment=environment
+        )
+
+        if MIN_WARM:
+          print('Starting {} warm container(s) per function...'.format(MIN_WARM))
+          with startup_timer.phase('Container warm-up'):
+            container_pool.prewarm(function_config)
+
+      runtime_api = None
+      if RUNTIME_API:
+        runtime_api = RuntimeApi(
+          host=RUNTIME_API_HOST,
+          workers=RUNTIME_WORKERS,
+          runtime_images=RUNTIME_IMAGES,
+          layer_dir=LAYER_DIR,
+          docker_network_name=DOCKER_NETWORK_NAME,
+          environment=environment
+        )
+
+      native_pool = None
+      if native_config:
+        native_pool = NativePool(
+          max_workers=NATIVE_WORKERS,
+          environment=environment,
+          layer_dir=LAYER_DIR,
+          region=REGION
+        )
+
+        print('Starting native workers...')
+        with startup_timer.phase('Native worker start'):
+          native_pool.prewarm(native_config)
+
+      invoker = FunctionInvoker(
+        environment=environment,
+        layer_dir=LAYER_DIR,
+        docker_network_name=DOCKER_NETWORK_NAME,
+        container_pool=container_pool,
+        runtime_api=runtime_api,
+        native_pool=native_pool,
+        max_output_size=MAX_OUTPUT_SIZE
+      )
+      concurrency_limiter = ConcurrencyLimiter(
+        function_config,
+        account_limit=ACCOUNT_CONCURRENCY,
+        queue_size=QUEUE_SIZE,
+        queue_timeout=QUEUE_TIMEOUT
+      )
+
+      # event sources invoke functions through the same invoker and limits as HTTP requests
+      event_sources = None
+      if event_source_config:
+        event_sources = EventSources(
+          event_source_config,
+          invoker,
+          concurrency_limiter=concurrency_limiter,
+          memory_budget=memory_budget,
+          region=REGION
+        ).start(HOSTNAME, EVENTS_PORT)
+
+      # cached responses, coalesced invocations and metrics are shared by the HTTP workers too
+      response_cache = None
+      if WATCH or any(api['cache'] for api in endpoint_config.values()):
+        response_cache = ResponseCache(CACHE_SIZE)
+
+      return {
+        'invoker': invoker,
+        'response_cache': response_cache,
+        'single_flight': SingleFlight(),
+        'metrics': metrics.GatewayMetrics(container_pool, concurrency_limiter, memory_budget, response_cache),
+        'container_pool': container_pool,
+        'runtime_api': runtime_api,
+        'native_pool': native_pool,
+        'concurrency_limiter': concurrency_limiter,
+        'memory_budget': memory_budget,
+        'event_sources': event_sources
+      }
+
+    coordinator = None
+    if WORKERS > 1:
+      # HTTP workers share the coordinator's backends through proxies
+      with startup_timer.phase('Coordinator start'):
+        coordinator = Coordinator(create_backends, shutdown_backends).start()
+      backends = {name: coordinator.backend(name) for name in BACKEND_NAMES}
+    else:
+      backends = create_backends()
+      atexit.register(shutdown_backends, backends)
+
+    recorder = None
+    if CAPTURE_FILE_PATH:
+      recorder = TrafficRecorder(os.path.abspath(CAPTURE_FILE_PATH), compress=CAPTURE_COMPRESS)
+      atexit.register(close_recorder, recorder)
+      print('Capturing traffic to {}'.format(os.path.relpath(recorder.path)))
+
     # run custom Flask server
     router = ApiRouter(
       name='API Gateway server',
       endpoint_config=endpoint_config,
       environment=environment,
       layer_dir=LAYER_DIR,
-      docker_network_name=DOCKER_NETWORK_NAME
+      docker_network_name=DOCKER_NETWORK_NAME,
+      container_pool=backends['container_pool'],
+      runtime_api=backends.get('runtime_api'),
+      native_pool=backends.get('native_pool'),
+      concurrency_limiter=backends['concurrency_limiter'],
+      executor=backends['invoker'] if coordinator else None,
+      jwt_secret=JWT_SECRET,
+      jwks_file=JWKS_FILE_PATH,
+      max_output_size=MAX_OUTPUT_SIZE,
+      spool_size=SPOOL_SIZE,
+      metrics_path=METRICS_PATH,
+      memory_budget=backends['memory_budget'],
+      response_cache=backends['response_cache'],
+      compressor=ResponseCompressor(COMPRESSION_MIN_SIZE, COMPRESSIBLE_TYPES) if COMPRESSION else None,
+      recorder=recorder,
+      gateway_metrics=backends['metrics'],
+      single_flight=backends['single_flight']
     )
-    CORS(router)
 
-    router.run(host=HOSTNAME, port=PORT, debug=False, )
+    if router.compressor:
+      print('Compressing responses with {}{}'.format(
+        ', '.join(router.compressor.encodings),
+        '' if brotli else ' (install the "brotli" package to enable brotli)'
+      ))
+    if any(api['cors'] for api in endpoint_config.values()):
+      print('CORS enabled (provider.httpApi.cors)')
+
+    if WATCH:
+      watch_changes(
+        router,
+        load_endpoints,
+        FUNCTIONS_DIR,
+        SLS_CONFIG_FILE_PATH,
+        ENV_FILE_PATH,
+        environment,
+        pools=(backends['container_pool'], backends['runtime_api'], backends['native_pool'], router)
+      )
+
+    print('Startup timing:\n' + startup_timer.report())
+    if coordinator:
+      serve(router, HOSTNAME, PORT, WORKERS, coordinator)
+    else:
+      router.run(host=HOSTNAME, port=PORT, debug=False, )
 
   except Exception as error:
     print('Error: {}'.format(error), file=sys.stderr)
@@ -1,16 +1,47 @@
+import json
 import os
-from flask import Flask, request
-from payload import build_payload
+import sys
+import tempfile
+import time
+from flask import Flask, Response, g, request
+from payload import MAX_REQUEST_BODY_SIZE, parse_function_response
+from concurrency import ThrottledError
+from cors import ORIGIN, REQUEST_METHOD, VARY, is_cors_header, is_preflight
+from jwt_authorizer import ForbiddenError, UnauthorizedError
+from route_index import DEFAULT_ROUTE
+from route_table import RouteTable
+from response_cache import CACHEABLE_METHODS, CACHEABLE_STATUS_CODES, build_cache_key, bypasses_cache, get_response_ttl
+from single_flight import DEFAULT_MAX_WAITERS, SingleFlight, run_once
+from invoker import FunctionInvoker
+from traffic_log import BodyCapture
+import metrics
 import lambda_utils
 import logging
 
 AUTH_HEADER = 'Authorization'
 USER_AGENT = 'User-Agent'
+ACCEPT_ENCODING = 'Accept-Encoding'
+CONTENT_ENCODING = 'Content-Encoding'
+# methods routed to the Lambda functions (OPTIONS is only routed if a route declares it)
+HTTP_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD']
+# request body size beyond which uploads are spooled to disk
+DEFAULT_SPOOL_SIZE = 1024 * 1024
+# seconds coalesced requests wait for an invocation on top of its function's timeout, covering
+# its queueing and cold start
+COALESCE_WAIT_MARGIN = 30
 
 class ApiRouter(Flask):
   '''
   Custom Flask webserver that creates routes based on passed endpoint configuration
   and responds to requests by routing the request to the corresponding lambda function via Docker.
+  If specified, executor(config, payload) is called instead to invoke functions, returning a
+  response object like lambda_utils.run_function's (e.g. a stand-in backend for benchmarks).
+  Responses are compressed by compressor (a compression.ResponseCompressor), if specified, and
+  CORS is handled for the routes enabling it (see cors.py). If recorder (a
+  traffic_log.TrafficRecorder) is specified, routed requests are captured along with their
+  events and responses. gateway_metrics (a metrics.GatewayMetrics) and single_flight (a
+  single_flight.SingleFlight), created if not specified, may be proxies shared with other
+  processes, like response_cache.
   '''
   @staticmethod
   def __page_not_found(error):
@@ -20,13 +51,33 @@ class ApiRouter(Flask):
   def __method_not_allowed(error):
     return 'Method not allowed', 405
 
+  @staticmethod
+  def __request_too_large():
+    return json.dumps({'message': 'Request Entity Too Large'}), 413, {'content-type': 'application/json'}
+
   def __init__(
       self,
       name,
       endpoint_config,
       environment=None,
       layer_dir=None,
-      docker_network_name=None
+      docker_network_name=None,
+      container_pool=None,
+      runtime_api=None,
+      concurrency_limiter=None,
+      jwt_secret=None,
+      jwks_file=None,
+      max_output_size=lambda_utils.DEFAULT_MAX_OUTPUT_SIZE,
+      spool_size=DEFAULT_SPOOL_SIZE,
+      metrics_path=metrics.METRICS_PATH,
+      executor=None,
+      native_pool=None,
+      memory_budget=None,
+      response_cache=None,
+      compressor=None,
+      recorder=None,
+      gateway_metrics=None,
+      single_flight=None
     ):
     super().__init__(import_name=name)
 
@@ -38,25 +89,341 @@ class ApiRouter(Flask):
     self.docker_network_name = docker_network_name
     self.environment = environment
     self.layer_dir = layer_dir
+    self.container_pool = container_pool
+    self.runtime_api = runtime_api
+    self.concurrency_limiter = concurrency_limiter
+    self.max_output_size = max_output_size
+    self.spool_size = spool_size
+    self.executor = executor
+    self.native_pool = native_pool
+    self.memory_budget = memory_budget
+    self.response_cache = response_cache
+    self.compressor = compressor
+    self.recorder = recorder
+    self.single_flight = single_flight or SingleFlight()
+    self.jwt_secret = jwt_secret
+    self.jwks_file = jwks_file
 
     if self.layer_dir:
       self.layer_dir = os.path.abspath(layer_dir)
 
+    self.invoker = FunctionInvoker(
+      environment=environment,
+      layer_dir=layer_dir,
+      docker_network_name=docker_network_name,
+      container_pool=container_pool,
+      runtime_api=runtime_api,
+      native_pool=native_pool,
+      max_output_size=max_output_size
+    )
+
     self.errorhandler(404)(ApiRouter.__page_not_found)
     self.errorhandler(405)(ApiRouter.__method_not_allowed)
 
-    # for each configured endpoint create a Flask route
-    for api in self.endpoint_config:
-      api_config = endpoint_config[api]
-      self.route(
-        api_config['path'],
-        methods=[api_config['method']])(self.__route_request)
+    # requests are matched against a precompiled route index rather than Flask rules
+    self.routes = RouteTable(self.endpoint_config, jwt_secret, jwks_file)
+
+    self.metrics = gateway_metrics or metrics.GatewayMetrics(container_pool, concurrency_limiter, memory_budget, response_cache)
+    if recorder:
+      # registered first so that the response is captured as it's sent
+      self.before_request(self.__start_capture)
+      self.after_request(self.__capture_exchange)
+    self.before_request(self.__answer_preflight)
+    self.after_request(self.__record_request)
+    self.after_request(self.__finish_response)
+
+    if metrics_path:
+      route = self.routes.route_index.match('GET', metrics_path)
+      if route and route.route_key != DEFAULT_ROUTE:
+        print(
+          'WARNING: route "{}" conflicts with the metrics endpoint, which is disabled'.format(route.route_key),
+          file=sys.stderr
+        )
+      else:
+        self.add_url_rule(metrics_path, 'metrics', self.__serve_metrics, methods=['GET'])
+
+    methods = list(HTTP_METHODS)
+    if any(api['method'] == 'OPTIONS' for api in self.endpoint_config.values()):
+      methods.append('OPTIONS')
+
+    self.add_url_rule(
+      '/',
+      'route_request',
+      self.__route_request,
+      defaults={'path': ''},
+      methods=methods
+    )
+    self.add_url_rule('/<path:path>', 'route_request', self.__route_request, methods=methods)
+    self.__methods = methods
+
+  def update_endpoints(self, endpoint_config):
+    '''
+    Replaces the served endpoints with those of endpoint_config, keeping the state of unchanged
+    routes. Requests being handled complete against the routes they were matched with.
+    Returns the keys of the routes that were added, removed or reconfigured.
+    '''
+    previous = self.routes
+    routes = RouteTable(endpoint_config, self.jwt_secret, self.jwks_file, previous=previous)
+
+    if any(api['method'] == 'OPTIONS' for api in endpoint_config.values()) and 'OPTIONS' not in self.__methods:
+      print('WARNING: OPTIONS routes are only served after restarting the gateway', file=sys.stderr)
+
+    self.routes = routes
+    self.endpoint_config = endpoint_config
+    changed_routes = routes.changed_routes(previous)
+    if self.response_cache:
+      self.response_cache.invalidate(changed_routes)
+    return changed_routes
+
+  def recycle(self, function_file_path=None):
+    '''
+    Drops the cached responses of the routes served by the function located at
+    function_file_path (or every cached response if not specified).
+    '''
+    if self.response_cache:
+      self.response_cache.invalidate(None if function_file_path is None else {
+        route_key for route_key, api in self.endpoint_config.items() if api['filepath'] == function_file_path
+      })
+
+  def __invoke_function(self, config, payload):
+    '''
+    Invokes the Lambda function described by config using the configured execution backend.
+    '''
+    if self.executor:
+      return self.executor(config, payload)
+    return self.invoker(config, payload)
+
+  def __run_invocation(self, config, payload, timer):
+    '''
+    Invokes the function described by config within its concurrency and memory limits. Returns
+    the function's response, or the HTTP response to send back if the invocation is throttled or
+    refused.
+    '''
+    if self.concurrency_limiter:
+      try:
+        wait_time = self.concurrency_limiter.acquire(config['function'])
+      except ThrottledError:
+        print('{}: Throttled invocation of function "{}"'.format(
+          payload['routeKey'],
+          config['function']
+        ))
+        return json.dumps({'message': 'Too Many Requests'}), 429, {'content-type': 'application/json'}
+
+      if wait_time:
+        print('{}: Invocation queued for {:.3f}s'.format(payload['routeKey'], wait_time))
+        timer.add(metrics.PHASE_QUEUE, wait_time)
+
+    memory_size = config.get('memorySize') or lambda_utils.DEFAULT_MEMORY_SIZE
+    if self.memory_budget:
+      try:
+        self.memory_budget.reserve(memory_size)
+      except ThrottledError:
+        if self.concurrency_limiter:
+          self.concurrency_limiter.release(config['function'])
+        print('{}: Refused invocation of function "{}" ({} MB over the memory budget)'.format(
+          payload['routeKey'],
+          config['function'],
+          memory_size
+        ))
+        return json.dumps({'message': 'Service Unavailable'}), 503, {'content-type': 'application/json'}
+
+    print('{}: Invoking function "{}"...'.format(payload['routeKey'], config['function']))
+
+    self.metrics.invocation_started(config['function'])
+    try:
+      response = self.__invoke_function(config, payload)
+    finally:
+      self.metrics.invocation_finished(config['function'])
+      if self.memory_budget:
+        self.memory_budget.release(memory_size)
+      if self.concurrency_limiter:
+        self.concurrency_limiter.release(config['function'])
+    return response
+
+  def __serve_metrics(self):
+    return self.metrics.render(), 200, {'content-type': metrics.CONTENT_TYPE}
+
+  def __record_request(self, response):
+    if request.endpoint == 'route_request':
+      self.metrics.record_request(g.get('route_key', 'unmatched'), response.status_code)
+    return response
+
+  def __start_capture(self):
+    g.capture_time = time.time()
+    g.capture_start = time.perf_counter()
+    # the raw body is kept as it's read
+    g.capture_body = BodyCapture(request.stream, self.recorder.max_body_size)
+
+  def __capture_exchange(self, response):
+    '''
+    Captures a routed request, its event and its response once the response has been sent.
+    '''
+    if request.endpoint != 'route_request':
+      return response
+
+    query_string = request.query_string.decode('latin-1')
+    exchange = {
+      'method': request.method,
+      'path': request.path + ('?' + query_string if query_string else ''),
+      'headers': [[name, value] for name, value in request.headers],
+      'body': g.capture_body.body()
+    }
+    event = g.get('capture_event')
+    arrival_time = g.capture_time
+    start = g.capture_start
+    max_body_size = self.recorder.max_body_size
+
+    if response.is_streamed:
+      # streamed bodies are captured as they're sent
+      chunks = []
+      captured = {'size': 0}
+
+      def capture_chunks(body):
+        for chunk in body:
+          captured['size'] += len(chunk)
+          if captured['size'] <= max_body_size:
+            chunks.append(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+          yield chunk
 
-  def __route_request(self):
+      response.response = capture_chunks(response.response)
+
+      def get_body():
+        return b''.join(chunks) if captured['size'] <= max_body_size else None
+    else:
+      body = response.get_data()
+
+      def get_body():
+        return body if len(body) <= max_body_size else None
+
+    status_code = response.status_code
+    headers = [[name, value] for name, value in response.headers]
+
+    def record():
+      self.recorder.record(
+        arrival_time,
+        exchange,
+        event,
+        {'status': status_code, 'headers': headers, 'body': get_body()},
+        time.perf_counter() - start
+      )
+
+    response.call_on_close(record)
+    return response
+
+  def __answer_preflight(self):
+    '''
+    Answers the CORS preflight requests of routes with CORS enabled without invoking functions.
+    '''
+    if request.endpoint != 'route_request' or not is_preflight(request.method, request.headers):
+      return None
+
+    routes = self.routes
+    route = routes.route_index.match(request.headers[REQUEST_METHOD].strip().upper(), request.path)
+    policy = routes.cors_policies.get(route.route_key) if route else None
+    if policy is None:
+      # routed like any other request
+      return None
+
+    g.route_key = route.route_key
+    # preflight requests from origins that aren't allowed get no CORS headers, failing them
+    return '', 204, policy.headers(request.headers[ORIGIN], preflight=True) or {}
+
+  def __finish_response(self, response):
+    '''
+    Sets the CORS headers of the response of a route with CORS enabled and compresses it.
+    '''
+    policy = g.get('cors_policy')
+    if policy:
+      # the gateway's CORS headers replace those returned by functions
+      for name in {name for name in response.headers.keys() if is_cors_header(name)}:
+        del response.headers[name]
+      for name, value in (policy.headers(request.headers.get(ORIGIN)) or {}).items():
+        if name == VARY:
+          response.vary.add(value)
+        else:
+          response.headers[name] = value
+
+    if self.compressor:
+      self.__compress_response(response)
+    return response
+
+  def __compress_response(self, response):
+    '''
+    Compresses the response's body with the encoding negotiated with the client, if its content
+    type is compressible and it's large enough.
+    '''
+    if (
+      request.method == 'HEAD' or
+      response.status_code < 200 or
+      response.status_code in (204, 304) or
+      response.direct_passthrough or
+      CONTENT_ENCODING in response.headers or
+      'Content-Range' in response.headers or
+      response.cache_control.no_transform or
+      not self.compressor.is_compressible(response.headers.get('Content-Type'))
+    ):
+      return
+
+    # whether the response is compressed depends on the request's Accept-Encoding header
+    response.vary.add(ACCEPT_ENCODING)
+
+    # streamed bodies are compressed chunk by chunk as they're sent
+    body = None if response.is_streamed else response.get_data()
+    encoding = self.compressor.select_encoding(request.headers.get(ACCEPT_ENCODING), None if body is None else len(body))
+    if not encoding:
+      return
+
+    if body is None:
+      response.response = self.compressor.compress_chunks(response.response, encoding)
+      response.headers.pop('Content-Length', None)
+    else:
+      response.set_data(self.compressor.compress(body, encoding))
+    response.headers[CONTENT_ENCODING] = encoding
+
+    # compressed representations aren't byte-for-byte identical to the function's
+    etag, weak = response.get_etag()
+    if etag and not weak:
+      response.set_etag(etag, weak=True)
+
+  def __spool_request_body(self):
+    '''
+    Reads the request body into a file that's kept in memory up to spool_size bytes and spilled
+    to disk beyond that. Returns None if the body exceeds MAX_REQUEST_BODY_SIZE.
+    '''
+    body = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+    size = 0
+    while True:
+      chunk = g.get('capture_body', request.stream).read(65536)
+      if not chunk:
+        break
+      size += len(chunk)
+      if size > MAX_REQUEST_BODY_SIZE:
+        body.close()
+        return None
+      body.write(chunk)
+
+    body.seek(0)
+    return body
+
+  def __route_request(self, path=None):
     '''
     Handles incoming requests, builds the message payload and invokes the corresponding Lambda
     function.
     '''
+    timer = metrics.InvocationTimer()
+    # the routes may be replaced while the request is handled
+    routes = self.routes
+
+    with timer.phase(metrics.PHASE_ROUTE_MATCH):
+      route = routes.route_index.match(request.method, request.path)
+    if not route:
+      if routes.route_index.allowed_methods(request.path):
+        return ApiRouter.__method_not_allowed(None)
+      return ApiRouter.__page_not_found(None)
+
+    g.route_key = route.route_key
+    g.cors_policy = routes.cors_policies.get(route.route_key)
+
     params = {}
     for p in request.args:
       params[p] = request.args.get(p)
@@ -66,50 +433,135 @@ class ApiRouter(Flask):
     for header in request.headers:
       headers[header[0].lower()] = header[1]
 
+    authorizer = None
+    if route.route_key in routes.authorizers:
+      jwt_authorizer, scopes = routes.authorizers[route.route_key]
+      try:
+        with timer.phase(metrics.PHASE_AUTHORIZE):
+          authorizer = jwt_authorizer.authorize(headers, params, scopes)
+      except UnauthorizedError as error:
+        print('{}: Unauthorized request ({})'.format(route.route_key, error))
+        return json.dumps({'message': 'Unauthorized'}), 401, {'content-type': 'application/json'}
+      except ForbiddenError as error:
+        print('{}: Forbidden request ({})'.format(route.route_key, error))
+        return json.dumps({'message': 'Forbidden'}), 403, {'content-type': 'application/json'}
+
+    config = route.value
+
+    # requests of routes with a cache are answered from it when possible
+    cache_key = None
+    cache_config = config.get('cache')
+    if self.response_cache and cache_config and request.method in CACHEABLE_METHODS:
+      cache_key = build_cache_key(
+        route.route_key,
+        request.method,
+        request.path,
+        params,
+        headers,
+        authorizer,
+        cache_config
+      )
+      entry = None if bypasses_cache(headers) else self.response_cache.get(cache_key)
+      if entry:
+        print('{}: Served from cache'.format(route.route_key))
+        self.metrics.record_cache_lookup(route.route_key, True)
+        return Response(entry.body, status=entry.status_code, headers=dict(entry.headers, Age=str(entry.age())))
+      self.metrics.record_cache_lookup(route.route_key, False)
+
     user_agent = None
     if USER_AGENT in request.headers:
       user_agent = request.headers[USER_AGENT]
 
-    payload = build_payload(
-      route=request.path,
-      method=request.method,
-      user_agent=user_agent,
-      source_ip=request.remote_addr,
-      headers=headers,
-      params=params if params else None,
-      body=str(request.data, encoding='utf-8')
-    )
+    if (request.content_length or 0) > MAX_REQUEST_BODY_SIZE:
+      return ApiRouter.__request_too_large()
 
-    # TODO invoke corresponding Lambda function based on path
-    if payload['routeKey'] not in self.endpoint_config:
-      return 'Endpoint configuration not found', 500
+    with timer.phase(metrics.PHASE_PAYLOAD_BUILD):
+      body = self.__spool_request_body()
+      if body is None:
+        return ApiRouter.__request_too_large()
 
-    config = self.endpoint_config[payload['routeKey']]
+      with body:
+        payload = routes.payload_builders[route.route_key].build(
+          route=request.path,
+          method=request.method,
+          user_agent=user_agent,
+          source_ip=request.remote_addr,
+          headers=headers,
+          params=params if params else None,
+          body=body,
+          path_parameters=route.path_parameters,
+          authorizer=authorizer
+        )
+      if self.recorder:
+        g.capture_event = payload
 
-    print('{}: Invoking function "{}"...'.format(payload['routeKey'], config['function']))
+    # identical concurrent requests of routes coalescing them share a single invocation
+    shared = False
+    coalesce_config = config.get('coalesce')
+    if coalesce_config and request.method in CACHEABLE_METHODS:
+      coalesce_key = build_cache_key(
+        route.route_key,
+        request.method,
+        request.path,
+        params,
+        headers,
+        authorizer,
+        dict({'queryParameters': '*'}, **coalesce_config)
+      )
+      response, shared = run_once(
+        self.single_flight,
+        coalesce_key,
+        lambda: self.__run_invocation(config, payload, timer),
+        coalesce_config.get('maxWaiters', DEFAULT_MAX_WAITERS),
+        # waiters give up on an invocation that outlasts its timeout (e.g. its worker died)
+        (config.get('timeout') or lambda_utils.DEFAULT_TIMEOUT) + COALESCE_WAIT_MARGIN
+      )
+    else:
+      response = self.__run_invocation(config, payload, timer)
 
-    response = lambda_utils.run_function(
-      function_file_path=config['filepath'],
-      payload=payload,
-      layer_dir=self.layer_dir,
-      docker_network_name=self.docker_network_name,
-      environment=self.environment,
-      handler_name=config['handler']
-    )
+    if isinstance(response, tuple):
+      # the invocation was throttled or refused
+      return response
 
-    print('Lambda output:')
-    print(response['stdout'])
+    if shared:
+      print('{}: Shared the result of an identical invocation of function "{}"'.format(
+        payload['routeKey'],
+        config['function']
+      ))
+      self.metrics.record_coalesced(route.route_key)
+      status_code, headers, body = parse_function_response(response, stream=True)
+      return Response(body, status=status_code, headers=headers)
 
-    if response['exit_status'] != 0:
-      return response['return_value'], 500
+    for phase, duration in response.get('timings', {}).items():
+      timer.add(phase, duration)
+    # set by every backend, but not necessarily by executors
+    cold_start = response.get('cold_start', False)
 
-    status_code = response['return_value']['statusCode']
-    headers = {}
-    if 'headers' in response['return_value']:
-      headers = response['return_value']['headers']
+    with timer.phase(metrics.PHASE_OUTPUT_PARSE):
+      if cache_key and response['exit_status'] == 0:
+        # cacheable responses are decoded whole so that they can be kept
+        status_code, headers, body = parse_function_response(response)
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        ttl = get_response_ttl(cache_config, headers)
+        if status_code in CACHEABLE_STATUS_CODES and ttl > 0:
+          self.response_cache.put(cache_key, route.route_key, status_code, headers, body, ttl)
+      else:
+        # binary bodies are decoded and sent back chunk by chunk
+        status_code, headers, body = parse_function_response(response, stream=True)
+      http_response = Response(body, status=status_code, headers=headers)
+
+    write_start = time.perf_counter()
 
-    body = ''
-    if 'body' in response['return_value']:
-      body = response['return_value']['body']
+    def report():
+      # called once the response has been fully sent
+      timer.add(metrics.PHASE_RESPONSE_WRITE, time.perf_counter() - write_start)
+      print(timer.report_line(payload['requestContext']['requestId'], config['function'], cold_start))
+      self.metrics.record_invocation(
+        config['function'],
+        timer,
+        cold_start=cold_start,
+        error=response['exit_status'] != 0
+      )
 
-    return body, status_code, headers
+    http_response.call_on_close(report)
+    return http_response
@@ -0,0 +1,372 @@
+'''
+asyncio-native API Gateway router exposed as an ASGI application.
+
+Invocations run through lambda_utils.run_function_async so waiting for a function container
+doesn't tie up a thread, allowing a single process to hold hundreds of in-flight invocations.
+
+Reference: https://asgi.readthedocs.io/en/latest/specs/www.html
+'''
+
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl
+
+from payload import MAX_REQUEST_BODY_SIZE, get_log_prefix, parse_function_response
+from concurrency import ThrottledError
+from jwt_authorizer import ForbiddenError, UnauthorizedError
+from route_index import DEFAULT_ROUTE
+from route_table import RouteTable
+import lambda_utils
+import metrics
+
+USER_AGENT = 'user-agent'
+# request body size beyond which uploads are spooled to disk
+DEFAULT_SPOOL_SIZE = 1024 * 1024
+# invocations queued per function beyond its concurrency limit, and seconds they wait for a slot,
+# unless configured otherwise (like concurrency.ConcurrencyPool's)
+DEFAULT_MAX_PENDING = 100
+DEFAULT_QUEUE_TIMEOUT = 10
+
+class FunctionLimiter:
+  '''
+  Limits the number of concurrent invocations of a function to concurrency_limit, queueing
+  at most max_pending invocations beyond that which give up after queue_timeout seconds.
+  Entering it raises concurrency.ThrottledError if the invocation times out in the queue.
+  '''
+  def __init__(self, concurrency_limit, max_pending=DEFAULT_MAX_PENDING, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+    self.concurrency_limit = concurrency_limit
+    self.max_pending = max_pending
+    self.queue_timeout = queue_timeout
+    self.pending = 0
+    self.__semaphore = None
+
+  def is_full(self):
+    if self.concurrency_limit == 0:
+      return True
+    return self.pending >= self.max_pending and self.__get_semaphore().locked()
+
+  async def __aenter__(self):
+    self.pending += 1
+    try:
+      await asyncio.wait_for(self.__get_semaphore().acquire(), self.queue_timeout)
+    except asyncio.TimeoutError:
+      raise ThrottledError('Rate Exceeded')
+    finally:
+      self.pending -= 1
+
+  async def __aexit__(self, *args):
+    self.__get_semaphore().release()
+
+  def __get_semaphore(self):
+    # created lazily so that it's bound to the running event loop
+    if self.__semaphore is None:
+      self.__semaphore = asyncio.Semaphore(self.concurrency_limit)
+    return self.__semaphore
+
+class AsgiRouter:
+  '''
+  ASGI application that routes HTTP requests to Lambda functions based on the passed endpoint
+  configuration, the asyncio counterpart of api_router.ApiRouter.
+  If concurrency_limit is specified no more than that many invocations of the same function run
+  at a time (or its reserved concurrency, if configured), and requests are rejected with a 429
+  status once max_pending are already waiting or after waiting for queue_timeout seconds. If
+  memory_budget (concurrency.MemoryBudget) is
+  specified invocations that don't fit in it are rejected with a 503 status.
+  '''
+  def __init__(
+      self,
+      endpoint_config,
+      environment=None,
+      layer_dir=None,
+      docker_network_name=None,
+      concurrency_limit=None,
+      max_pending=DEFAULT_MAX_PENDING,
+      queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+      client=None,
+      jwt_secret=None,
+      jwks_file=None,
+      max_output_size=lambda_utils.DEFAULT_MAX_OUTPUT_SIZE,
+      spool_size=DEFAULT_SPOOL_SIZE,
+      metrics_path=metrics.METRICS_PATH,
+      memory_budget=None
+    ):
+    self.endpoint_config = endpoint_config
+    self.environment = environment
+    self.layer_dir = layer_dir
+    self.docker_network_name = docker_network_name
+    self.concurrency_limit = concurrency_limit
+    self.max_pending = max_pending
+    self.queue_timeout = queue_timeout
+    self.client = client
+    self.max_output_size = max_output_size
+    self.spool_size = spool_size
+    self.in_flight = 0
+    self.jwt_secret = jwt_secret
+    self.jwks_file = jwks_file
+    self.routes = RouteTable(endpoint_config, jwt_secret, jwks_file)
+    self.memory_budget = memory_budget
+    self.metrics = metrics.GatewayMetrics(memory_budget=memory_budget)
+    self.metrics_path = metrics_path
+
+    if metrics_path:
+      route = self.routes.route_index.match('GET', metrics_path)
+      if route and route.route_key != DEFAULT_ROUTE:
+        print(
+          'WARNING: route "{}" conflicts with the metrics endpoint, which is disabled'.format(route.route_key),
+          file=sys.stderr
+        )
+        self.metrics_path = None
+
+    self.__limiters = {}
+
+  def update_endpoints(self, endpoint_config):
+    '''
+    Replaces the served endpoints with those of endpoint_config, keeping the state of unchanged
+    routes. Requests being handled complete against the routes they were matched with.
+    Returns the keys of the routes that were added, removed or reconfigured.
+    '''
+    previous = self.routes
+    self.routes = RouteTable(endpoint_config, self.jwt_secret, self.jwks_file, previous=previous)
+    self.endpoint_config = endpoint_config
+    return self.routes.changed_routes(previous)
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] == 'lifespan':
+      await AsgiRouter.__lifespan(receive, send)
+    elif scope['type'] == 'http':
+      if scope['path'] == self.metrics_path and scope['method'] == 'GET':
+        await AsgiRouter.__send_response(send, 200, {'content-type': metrics.CONTENT_TYPE}, self.metrics.render())
+        return
+
+      # filled in by __route_request with the route key and, if invoked, the invocation details
+      invocation = {}
+      status_code, headers, body = await self.__route_request(scope, receive, invocation)
+
+      write_start = time.perf_counter()
+      await AsgiRouter.__send_response(send, status_code, headers, body)
+
+      self.metrics.record_request(invocation.get('route_key', 'unmatched'), status_code)
+      if 'response' in invocation:
+        self.__report_invocation(invocation, time.perf_counter() - write_start)
+
+  @staticmethod
+  async def __lifespan(receive, send):
+    while True:
+      message = await receive()
+      if message['type'] == 'lifespan.startup':
+        await send({'type': 'lifespan.startup.complete'})
+      elif message['type'] == 'lifespan.shutdown':
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+  async def __read_body(self, receive):
+    '''
+    Reads the request body into a file that's kept in memory up to spool_size bytes and spilled
+    to disk beyond that. Returns None if the body exceeds MAX_REQUEST_BODY_SIZE.
+    '''
+    body = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+    size = 0
+    while True:
+      message = await receive()
+      chunk = message.get('body', b'')
+      size += len(chunk)
+      if size > MAX_REQUEST_BODY_SIZE:
+        body.close()
+        return None
+      body.write(chunk)
+      if not message.get('more_body', False):
+        body.seek(0)
+        return body
+
+  @staticmethod
+  async def __send_response(send, status_code, headers, body):
+    await send({
+      'type': 'http.response.start',
+      'status': int(status_code),
+      'headers': [
+        (str(name).lower().encode('latin-1'), str(value).encode('latin-1'))
+        for name, value in headers.items()
+      ]
+    })
+
+    if isinstance(body, (str, bytes)) or not hasattr(body, '__iter__'):
+      if not isinstance(body, bytes):
+        body = str(body).encode('utf-8')
+      await send({'type': 'http.response.body', 'body': body})
+      return
+
+    # stream decoded binary bodies chunk by chunk
+    for chunk in body:
+      await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+  def __report_invocation(self, invocation, write_time):
+    timer = invocation['timer']
+    config = invocation['config']
+    response = invocation['response']
+    timer.add(metrics.PHASE_RESPONSE_WRITE, write_time)
+    # every invocation runs in a new container
+    cold_start = True
+
+    print(timer.report_line(invocation['request_id'], config['function'], cold_start))
+    self.metrics.record_invocation(
+      config['function'],
+      timer,
+      cold_start=cold_start,
+      error=response['exit_status'] != 0
+    )
+
+  def __get_limiter(self, config):
+    key = config['filepath'] + ':' + config['handler']
+    if key not in self.__limiters:
+      limit = config.get('reservedConcurrency')
+      if limit is None:
+        limit = self.concurrency_limit
+      self.__limiters[key] = FunctionLimiter(limit, self.max_pending, self.queue_timeout)
+    return self.__limiters[key]
+
+  async def __route_request(self, scope, receive, invocation):
+    '''
+    Handles incoming requests, builds the message payload and invokes the corresponding Lambda
+    function.
+    '''
+    method = scope['method']
+    route = scope['path']
+    timer = metrics.InvocationTimer()
+    # the routes may be replaced while the request is handled
+    routes = self.routes
+
+    with timer.phase(metrics.PHASE_ROUTE_MATCH):
+      match = routes.route_index.match(method, route)
+    if not match:
+      if routes.route_index.allowed_methods(route):
+        return 405, {}, 'Method not allowed'
+      return 404, {}, 'Page not found'
+
+    invocation['route_key'] = match.route_key
+
+    # pass headers, converting header names to lowercase
+    headers = {}
+    for name, value in scope['headers']:
+      headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+
+    params = {}
+    for name, value in parse_qsl(scope.get('query_string', b'').decode('latin-1')):
+      # only keep the first value, like ApiRouter does
+      params.setdefault(name, value)
+
+    authorizer = None
+    if match.route_key in routes.authorizers:
+      jwt_authorizer, scopes = routes.authorizers[match.route_key]
+      try:
+        with timer.phase(metrics.PHASE_AUTHORIZE):
+          authorizer = jwt_authorizer.authorize(headers, params, scopes)
+      except UnauthorizedError as error:
+        print('{}: Unauthorized request ({})'.format(match.route_key, error))
+        return 401, {'content-type': 'application/json'}, json.dumps({'message': 'Unauthorized'})
+      except ForbiddenError as error:
+        print('{}: Forbidden request ({})'.format(match.route_key, error))
+        return 403, {'content-type': 'application/json'}, json.dumps({'message': 'Forbidden'})
+
+    body_start = time.perf_counter()
+    body = await self.__read_body(receive)
+    if body is None:
+      return 413, {'content-type': 'application/json'}, json.dumps({'message': 'Request Entity Too Large'})
+
+    client = scope.get('client')
+
+    with body:
+      payload = routes.payload_builders[match.route_key].build(
+        route=route,
+        method=method,
+        user_agent=headers.get(USER_AGENT),
+        source_ip=client[0] if client else None,
+        headers=headers,
+        params=params if params else None,
+        body=body,
+        path_parameters=match.path_parameters,
+        authorizer=authorizer
+      )
+    timer.add(metrics.PHASE_PAYLOAD_BUILD, time.perf_counter() - body_start)
+
+    config = match.value
+
+    if self.concurrency_limit or config.get('reservedConcurrency') is not None:
+      limiter = self.__get_limiter(config)
+      if limiter.is_full():
+        print('{}: Throttled invocation of function "{}"'.format(payload['routeKey'], config['function']))
+        return 429, {'content-type': 'application/json'}, json.dumps({'message': 'Too Many Requests'})
+
+      queue_start = time.perf_counter()
+      try:
+        async with limiter:
+          timer.add(metrics.PHASE_QUEUE, time.perf_counter() - queue_start)
+          response = await self.__invoke_function(config, payload)
+      except ThrottledError:
+        print('{}: Throttled invocation of function "{}" after queueing for {:.3f}s'.format(
+          payload['routeKey'],
+          config['function'],
+          time.perf_counter() - queue_start
+        ))
+        return 429, {'content-type': 'application/json'}, json.dumps({'message': 'Too Many Requests'})
+    else:
+      response = await self.__invoke_function(config, payload)
+
+    if response is None:
+      return 503, {'content-type': 'application/json'}, json.dumps({'message': 'Service Unavailable'})
+
+    for phase, duration in response.get('timings', {}).items():
+      timer.add(phase, duration)
+
+    invocation.update(
+      timer=timer,
+      config=config,
+      response=response,
+      request_id=payload['requestContext']['requestId']
+    )
+
+    with timer.phase(metrics.PHASE_OUTPUT_PARSE):
+      return parse_function_response(response, stream=True)
+
+  async def __invoke_function(self, config, payload):
+    '''
+    Runs the function, returning None if it doesn't fit in the memory budget.
+    '''
+    memory_size = config.get('memorySize') or lambda_utils.DEFAULT_MEMORY_SIZE
+    if self.memory_budget:
+      try:
+        self.memory_budget.reserve(memory_size)
+      except ThrottledError:
+        print('{}: Refused invocation of function "{}" ({} MB over the memory budget)'.format(
+          payload['routeKey'],
+          config['function'],
+          memory_size
+        ))
+        return None
+
+    print('{}: Invoking function "{}"...'.format(payload['routeKey'], config['function']))
+
+    self.in_flight += 1
+    self.metrics.invocation_started(config['function'])
+    try:
+      return await lambda_utils.run_function_async(
+        function_file_path=config['filepath'],
+        payload=payload,
+        layer_dir=self.layer_dir,
+        docker_network_name=self.docker_network_name,
+        environment=self.environment,
+        handler_name=config['handler'],
+        client=self.client,
+        log_prefix=get_log_prefix(payload),
+        max_output_size=self.max_output_size,
+        memory_size=config.get('memorySize'),
+        timeout=config.get('timeout')
+      )
+    finally:
+      if self.memory_budget:
+        self.memory_budget.release(memory_size)
+      self.in_flight -= 1
+      self.metrics.invocation_finished(config['function'])
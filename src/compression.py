@@ -0,0 +1,159 @@
+'''
+Response compression.
+
+Response bodies are compressed with the encoding the client prefers (see its Accept-Encoding
+header) among those supported: brotli, if the optional brotli package is installed, and gzip.
+Only bodies of compressible content types (an allowlist of text-based types by default) are
+compressed, provided they're at least a minimum size; bodies streamed chunk by chunk, whose size
+isn't known up front, are compressed as they're sent.
+
+Reference: https://www.rfc-editor.org/rfc/rfc9110#section-12.5.3
+Reference: https://github.com/google/brotli/tree/master/python
+'''
+
+import functools
+import zlib
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+ENCODING_BROTLI = 'br'
+ENCODING_GZIP = 'gzip'
+
+# bodies smaller than this aren't worth compressing (they'd fit in a packet anyway)
+DEFAULT_MIN_SIZE = 1024
+# content types compressed unless configured otherwise: exact media types, "<type>/*" wildcards
+# and "+<suffix>" structured syntax suffixes
+DEFAULT_CONTENT_TYPES = (
+  'text/*',
+  'application/json',
+  'application/javascript',
+  'application/xml',
+  'application/x-yaml',
+  'application/yaml',
+  'application/graphql',
+  'image/svg+xml',
+  '+json',
+  '+xml',
+  '+yaml'
+)
+
+# levels trading some compression ratio for speed, as bodies are compressed on every response
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+def supported_encodings():
+  '''
+  Returns the available content encodings, most preferred first.
+  '''
+  return (ENCODING_BROTLI, ENCODING_GZIP) if brotli else (ENCODING_GZIP,)
+
+@functools.lru_cache(maxsize=256)
+def negotiate_encoding(accept_encoding, encodings):
+  '''
+  Returns the encoding among encodings (most preferred first) the client accepts with the
+  highest quality value according to its Accept-Encoding header, or None if it accepts none.
+  '''
+  qualities = {}
+  for coding in (accept_encoding or '').split(','):
+    name, *parameters = coding.split(';')
+    name = name.strip().lower()
+    if not name:
+      continue
+    quality = 1.0
+    for parameter in parameters:
+      key, _, value = parameter.strip().partition('=')
+      if key.strip().lower() == 'q':
+        try:
+          quality = float(value)
+        except ValueError:
+          quality = 0.0
+    qualities[name] = quality
+
+  selected = None
+  selected_quality = 0.0
+  for encoding in encodings:
+    quality = qualities.get(encoding, qualities.get('*', 0.0))
+    if quality > selected_quality:
+      selected, selected_quality = encoding, quality
+  return selected
+
+class BrotliCompressor:
+  '''
+  Adapts brotli's streaming compressor to zlib's compressobj interface.
+  '''
+  def __init__(self, quality=BROTLI_QUALITY):
+    self.__compressor = brotli.Compressor(quality=quality)
+
+  def compress(self, data):
+    return self.__compressor.process(data)
+
+  def flush(self):
+    return self.__compressor.finish()
+
+class ResponseCompressor:
+  '''
+  Selects the encoding responses are compressed with and compresses their bodies.
+  content_types are the compressible content types, in the format of DEFAULT_CONTENT_TYPES.
+  '''
+  def __init__(self, min_size=DEFAULT_MIN_SIZE, content_types=DEFAULT_CONTENT_TYPES, encodings=None):
+    self.min_size = min_size
+    self.encodings = tuple(encodings or supported_encodings())
+
+    content_types = [content_type.strip().lower() for content_type in content_types]
+    self.__media_types = frozenset(content_type for content_type in content_types if '*' not in content_type and not content_type.startswith('+'))
+    self.__prefixes = tuple(content_type[:-1] for content_type in content_types if content_type.endswith('/*'))
+    self.__suffixes = tuple(content_type for content_type in content_types if content_type.startswith('+'))
+
+  def is_compressible(self, content_type):
+    '''
+    Returns True if bodies of the content type (e.g. "text/html; charset=utf-8") are compressed.
+    '''
+    media_type = (content_type or '').split(';', 1)[0].strip().lower()
+    return bool(media_type) and (
+      media_type in self.__media_types or
+      media_type.startswith(self.__prefixes) or
+      media_type.endswith(self.__suffixes)
+    )
+
+  def select_encoding(self, accept_encoding, size):
+    '''
+    Returns the encoding a compressible body of size bytes (None if unknown) is sent with to a
+    client sending the provided Accept-Encoding header, or None if it's sent uncompressed.
+    '''
+    if size is not None and size < self.min_size:
+      return None
+    return negotiate_encoding(accept_encoding, self.encodings) if accept_encoding else None
+
+  @staticmethod
+  def compressor(encoding):
+    '''
+    Returns a new compressor object (see zlib.compressobj) for the encoding.
+    '''
+    if encoding == ENCODING_BROTLI:
+      return BrotliCompressor()
+    # a window of 16 + 15 bits produces a gzip header and trailer
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+  def compress(self, body, encoding):
+    '''
+    Returns the body (bytes) compressed with the encoding.
+    '''
+    compressor = ResponseCompressor.compressor(encoding)
+    return compressor.compress(body) + compressor.flush()
+
+  def compress_chunks(self, chunks, encoding):
+    '''
+    Compresses an iterable over the chunks of a body with the encoding, yielding the compressed
+    chunks.
+    '''
+    compressor = ResponseCompressor.compressor(encoding)
+    for chunk in chunks:
+      if isinstance(chunk, str):
+        chunk = chunk.encode('utf-8')
+      data = compressor.compress(chunk)
+      if data:
+        yield data
+    yield compressor.flush()
@@ -0,0 +1,225 @@
+'''
+Lambda concurrency limits emulation.
+
+Functions with reserved concurrency get a dedicated pool of that many concurrent executions,
+while the rest share what's left of the account-wide concurrency limit. Invocations over the
+limit wait in a bounded FIFO queue and are throttled once the queue is full or their wait
+times out, the same way AWS throttles them.
+
+Reference: https://docs.aws.amazon.com/lambda/latest/dg/configuration-concurrency.html
+'''
+
+import collections
+import threading
+import time
+
+# default AWS account-wide concurrency limit
+DEFAULT_ACCOUNT_LIMIT = 1000
+UNRESERVED_POOL = '$unreserved'
+
+class ThrottledError(Exception):
+  '''
+  Raised when an invocation is throttled.
+  '''
+
+class ConcurrencyPool:
+  '''
+  Pool of capacity concurrent executions, with a FIFO queue of at most queue_size waiters which
+  give up after queue_timeout seconds.
+  '''
+  def __init__(self, capacity, queue_size=100, queue_timeout=10):
+    self.capacity = capacity
+    self.queue_size = queue_size
+    self.queue_timeout = queue_timeout
+    self.in_flight = 0
+
+    self.__waiters = collections.deque()
+    self.__lock = threading.Condition()
+
+  def queue_depth(self):
+    return len(self.__waiters)
+
+  def acquire(self):
+    '''
+    Takes an execution slot, waiting for one to be released if necessary.
+    Returns a tuple with the time spent waiting, in seconds, and the queue depth found when
+    the invocation was queued. Raises ThrottledError if the invocation is throttled.
+    '''
+    with self.__lock:
+      if self.in_flight < self.capacity and not self.__waiters:
+        self.in_flight += 1
+        return 0, 0
+
+      if self.capacity == 0 or len(self.__waiters) >= self.queue_size:
+        raise ThrottledError('Rate Exceeded')
+
+      waiter = object()
+      self.__waiters.append(waiter)
+      queue_depth = len(self.__waiters)
+      start = time.time()
+      deadline = start + self.queue_timeout
+
+      # waiters are served in arrival order
+      while self.__waiters[0] is not waiter or self.in_flight >= self.capacity:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          self.__waiters.remove(waiter)
+          self.__lock.notify_all()
+          raise ThrottledError('Rate Exceeded')
+        self.__lock.wait(remaining)
+
+      self.__waiters.popleft()
+      self.in_flight += 1
+      # let the next waiter check whether there's another slot available
+      self.__lock.notify_all()
+      return time.time() - start, queue_depth
+
+  def release(self):
+    with self.__lock:
+      self.in_flight -= 1
+      self.__lock.notify_all()
+
+class FunctionStats:
+  '''
+  Concurrency counters for a single function.
+  '''
+  def __init__(self):
+    self.invocations = 0
+    self.throttles = 0
+    self.queued = 0
+    self.total_wait_time = 0
+    self.max_wait_time = 0
+    self.max_queue_depth = 0
+
+class ConcurrencyLimiter:
+  '''
+  Enforces per-function reserved concurrency (the "reservedConcurrency" endpoint config setting)
+  and the account-wide concurrency limit shared by every other function.
+  '''
+  def __init__(
+      self,
+      endpoint_config,
+      account_limit=DEFAULT_ACCOUNT_LIMIT,
+      queue_size=100,
+      queue_timeout=10
+    ):
+    self.account_limit = account_limit
+    self.__pools = {}
+    self.__stats = {}
+    self.__lock = threading.Lock()
+
+    reserved = {}
+    for api in endpoint_config.values():
+      if api.get('reservedConcurrency') is not None:
+        reserved[api['function']] = int(api['reservedConcurrency'])
+
+    if sum(reserved.values()) > account_limit:
+      raise ValueError(
+        'Total reserved concurrency ({}) exceeds the account concurrency limit ({})'.format(
+          sum(reserved.values()),
+          account_limit
+        )
+      )
+
+    for function_name, capacity in reserved.items():
+      self.__pools[function_name] = ConcurrencyPool(capacity, queue_size, queue_timeout)
+
+    self.__unreserved_pool = ConcurrencyPool(
+      account_limit - sum(reserved.values()),
+      queue_size,
+      queue_timeout
+    )
+
+  def acquire(self, function_name):
+    '''
+    Takes an execution slot for the specified function, waiting in its queue if necessary.
+    Returns the time spent waiting and raises ThrottledError if the invocation is throttled.
+    '''
+    pool = self.__get_pool(function_name)
+    stats = self.__get_stats(function_name)
+
+    with self.__lock:
+      stats.invocations += 1
+
+    try:
+      wait_time, queue_depth = pool.acquire()
+    except ThrottledError:
+      with self.__lock:
+        stats.throttles += 1
+      raise
+
+    if queue_depth:
+      with self.__lock:
+        stats.queued += 1
+        stats.total_wait_time += wait_time
+        stats.max_wait_time = max(stats.max_wait_time, wait_time)
+        stats.max_queue_depth = max(stats.max_queue_depth, queue_depth)
+
+    return wait_time
+
+  def release(self, function_name):
+    self.__get_pool(function_name).release()
+
+  def stats(self):
+    '''
+    Returns a dictionary with the concurrency counters of every invoked function.
+    '''
+    with self.__lock:
+      result = {}
+      for function_name, stats in self.__stats.items():
+        pool = self.__get_pool(function_name)
+        result[function_name] = {
+          'pool': function_name if function_name in self.__pools else UNRESERVED_POOL,
+          'capacity': pool.capacity,
+          'in_flight': pool.in_flight,
+          'queue_depth': pool.queue_depth(),
+          'max_queue_depth': stats.max_queue_depth,
+          'invocations': stats.invocations,
+          'queued': stats.queued,
+          'throttles': stats.throttles,
+          'total_wait_time': stats.total_wait_time,
+          'max_wait_time': stats.max_wait_time
+        }
+      return result
+
+  def __get_pool(self, function_name):
+    return self.__pools.get(function_name, self.__unreserved_pool)
+
+  def __get_stats(self, function_name):
+    with self.__lock:
+      if function_name not in self.__stats:
+        self.__stats[function_name] = FunctionStats()
+      return self.__stats[function_name]
+
+class MemoryBudget:
+  '''
+  Host memory budget, in MB, shared by running invocations: every invocation commits its
+  function's memory size while it runs, and invocations that would take the committed total
+  past the budget are refused rather than queued.
+  '''
+  def __init__(self, budget):
+    if budget <= 0:
+      raise ValueError('Invalid memory budget: {}'.format(budget))
+
+    self.budget = budget
+    self.committed = 0
+    self.refused = 0
+    self.__lock = threading.Lock()
+
+  def reserve(self, memory_size):
+    '''
+    Commits memory_size MB. Raises ThrottledError if they don't fit in the budget.
+    '''
+    with self.__lock:
+      if self.committed + memory_size > self.budget:
+        self.refused += 1
+        raise ThrottledError('Memory budget exceeded')
+      self.committed += memory_size
+
+  def release(self, memory_size):
+    with self.__lock:
+      self.committed -= memory_size
+
+  def stats(self):
+    with self.__lock:
+      return {'budget': self.budget, 'committed': self.committed, 'refused': self.refused}
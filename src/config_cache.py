@@ -0,0 +1,141 @@
+'''
+On-disk cache for resolved Serverless configurations.
+
+Resolving a configuration ("sls print") spawns a Node process that takes several seconds, so
+its output is cached keyed by a hash of the Serverless configuration file contents, every file
+it pulls in through ${file(...)} variables, the environment variables it references and the
+options (stage, region) used to resolve it. Configurations whose values depend on anything else,
+i.e. that reference remote variable sources (SSM parameters, CloudFormation outputs, S3 objects)
+or JavaScript and TypeScript files, which can compute anything, aren't cached.
+'''
+
+import hashlib
+import json
+import os
+import re
+
+CACHE_DIR_NAME = '.cyclon'
+CACHE_FILE_TEMPLATE = 'sls-config-{}.json'
+# maximum number of cached configurations (e.g. one per stage) kept per service
+MAX_ENTRIES = 8
+
+FILE_VARIABLE = re.compile(r'\$\{file\((?P<path>[^)]+)\)')
+ENV_VARIABLE = re.compile(r'\$\{env:(?P<name>[A-Za-z0-9_]+)')
+# variable sources resolved remotely, e.g. ${ssm:/path} or ${cf(us-east-1):stack.output}
+REMOTE_VARIABLE = re.compile(r'\$\{(?:ssm|cf|s3)[:(]')
+# configuration files (e.g. serverless.ts) and ${file(...)} references evaluated as code
+SCRIPT_EXTENSIONS = ('.js', '.cjs', '.mjs', '.ts', '.cts', '.mts')
+
+def find_config_files(sls_config_file_path):
+  '''
+  Returns the list of files the Serverless configuration consists of: the configuration file
+  itself followed by every file referenced through ${file(...)} variables, recursively.
+  Returns None if a file reference can't be resolved statically (i.e. it contains variables).
+  '''
+  service_dir = os.path.dirname(os.path.abspath(sls_config_file_path))
+  files = []
+  pending = [os.path.abspath(sls_config_file_path)]
+
+  while pending:
+    file_path = pending.pop(0)
+    if file_path in files:
+      continue
+    files.append(file_path)
+
+    if not os.path.isfile(file_path):
+      continue
+
+    with open(file_path, 'r') as f:
+      content = f.read()
+
+    for match in FILE_VARIABLE.finditer(content):
+      reference = match.group('path').strip().strip('\'"')
+      if '${' in reference:
+        return None
+
+      # paths are relative to the service directory, or to the referencing file's directory
+      path = os.path.join(service_dir, reference)
+      if not os.path.exists(path):
+        path = os.path.join(os.path.dirname(file_path), reference)
+      pending.append(os.path.abspath(path))
+
+  return files
+
+def compute_config_key(sls_config_file_path, options=None):
+  '''
+  Computes the cache key of a Serverless configuration resolved with the provided options,
+  or None if the configuration can't be cached.
+  '''
+  files = find_config_files(sls_config_file_path)
+  if files is None or any(file_path.endswith(SCRIPT_EXTENSIONS) for file_path in files):
+    return None
+
+  digest = hashlib.sha256()
+  digest.update(json.dumps(options if options else {}, sort_keys=True).encode('utf-8'))
+
+  env_names = set()
+  for file_path in files:
+    digest.update(file_path.encode('utf-8'))
+    if not os.path.isfile(file_path):
+      # missing files are part of the key so that creating them invalidates the cache
+      digest.update(b'\0missing')
+      continue
+
+    with open(file_path, 'rb') as f:
+      content = f.read()
+    text = content.decode('utf-8', errors='replace')
+    if REMOTE_VARIABLE.search(text):
+      return None
+    digest.update(hashlib.sha256(content).digest())
+    env_names.update(ENV_VARIABLE.findall(text))
+
+  for name in sorted(env_names):
+    digest.update('{}={}'.format(name, os.environ.get(name)).encode('utf-8'))
+
+  return digest.hexdigest()
+
+class ConfigCache:
+  '''
+  Stores resolved configurations as json files in cache_dir (by default a ".cyclon" directory
+  next to the Serverless configuration file).
+  '''
+  def __init__(self, sls_config_file_path, cache_dir=None):
+    self.sls_config_file_path = os.path.abspath(sls_config_file_path)
+    self.cache_dir = cache_dir if cache_dir else os.path.join(
+      os.path.dirname(self.sls_config_file_path),
+      CACHE_DIR_NAME
+    )
+
+  def load(self, key):
+    '''
+    Returns the configuration cached under key, or None if there's none.
+    '''
+    try:
+      with open(self.__cache_file_path(key), 'r') as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def store(self, key, config):
+    '''
+    Caches config under key, evicting the least recently written entries beyond MAX_ENTRIES.
+    '''
+    os.makedirs(self.cache_dir, exist_ok=True)
+
+    # write to a temporary file first so that readers never see partial contents
+    cache_file_path = self.__cache_file_path(key)
+    temp_file_path = cache_file_path + '.tmp'
+    with open(temp_file_path, 'w') as f:
+      json.dump(config, f)
+    os.replace(temp_file_path, cache_file_path)
+
+    entries = [
+      os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+      if name.startswith('sls-config-') and name.endswith('.json')
+    ]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for entry in entries[MAX_ENTRIES:]:
+      os.remove(entry)
+
+  def __cache_file_path(self, key):
+    return os.path.join(self.cache_dir, CACHE_FILE_TEMPLATE.format(key))
@@ -0,0 +1,378 @@
+'''
+Warm Lambda container pool.
+
+Containers are started in lambci's "stay-open" mode (DOCKER_LAMBDA_STAY_OPEN=1), in which the
+runtime bootstraps once and then serves invocations through a Lambda-compatible HTTP API, so
+subsequent requests routed to the same function skip the container and runtime cold start.
+
+Reference: https://github.com/lambci/docker-lambda#running-in-stay-open-api-mode
+'''
+
+import base64
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import docker_client
+import lambda_utils
+
+CONTAINER_API_PORT = '9001/tcp'
+INVOKE_PATH = '/2015-03-31/functions/function/invocations'
+FUNCTION_ERROR_HEADER = 'X-Amz-Function-Error'
+LOG_RESULT_HEADER = 'X-Amz-Log-Result'
+
+# most recently used containers are reused first so that the rest can go idle and be evicted
+REUSE_LIFO = 'lifo'
+# least recently used containers are reused first, spreading requests across the pool
+REUSE_FIFO = 'fifo'
+REUSE_POLICIES = (REUSE_LIFO, REUSE_FIFO)
+
+class WarmContainer:
+  '''
+  A running stay-open Lambda container bound to a host port.
+  '''
+  def __init__(self, container_id, port):
+    self.container_id = container_id
+    self.port = port
+    self.created_at = time.time()
+    self.last_used = self.created_at
+    self.invocations = 0
+    # the function's generation (see ContainerPool.recycle) when the container was started
+    self.generation = 0
+
+class ContainerPool:
+  '''
+  Keeps a per-function pool of warm Lambda containers and routes invocations to them.
+
+  min_warm containers per function are kept alive regardless of the idle timeout, and at most
+  max_warm containers per function are ever started; requests exceeding that number wait for
+  a container to be released. Idle containers are stopped after idle_timeout seconds.
+  reuse_policy selects which idle container serves the next request ('lifo' or 'fifo').
+  '''
+  def __init__(
+      self,
+      min_warm=0,
+      max_warm=1,
+      idle_timeout=300,
+      reuse_policy=REUSE_LIFO,
+      layer_dir=None,
+      docker_network_name=None,
+      environment=None,
+      startup_timeout=30,
+      invocation_timeout=None,
+      client=None
+    ):
+    if reuse_policy not in REUSE_POLICIES:
+      raise ValueError(
+        'Invalid reuse policy "{}". Please pass one of {}'.format(reuse_policy, REUSE_POLICIES)
+      )
+
+    if max_warm < 1 or min_warm < 0 or min_warm > max_warm:
+      raise ValueError('Invalid warm container limits (min: {}, max: {})'.format(min_warm, max_warm))
+
+    self.min_warm = min_warm
+    self.max_warm = max_warm
+    self.idle_timeout = idle_timeout
+    self.reuse_policy = reuse_policy
+    self.layer_dir = layer_dir
+    self.docker_network_name = docker_network_name
+    self.environment = environment
+    self.startup_timeout = startup_timeout
+    self.invocation_timeout = invocation_timeout
+    self.client = client if client else docker_client.get_default_client()
+
+    self.cold_starts = 0
+    self.warm_starts = 0
+
+    # function key -> list of idle containers, ordered from least to most recently used
+    self.__idle = {}
+    # function key -> number of containers started (idle + busy)
+    self.__started = {}
+    # function key -> number of times the function was recycled
+    self.__generations = {}
+    self.__lock = threading.Condition()
+    self.__closed = False
+
+    self.__evictor = threading.Thread(target=self.__evict_idle_containers, daemon=True)
+    self.__evictor.start()
+
+  @staticmethod
+  def __function_key(function_file_path, handler_name):
+    return function_file_path + ':' + handler_name
+
+  def prewarm(self, endpoint_config):
+    '''
+    Starts min_warm containers for every function found in the provided endpoint configuration.
+    Containers are started in parallel.
+    '''
+    functions = {}
+    for api in endpoint_config.values():
+      functions[ContainerPool.__function_key(api['filepath'], api['handler'])] = api
+
+    def start_container(key):
+      api = functions[key]
+      with self.__lock:
+        if self.__started.get(key, 0) >= self.max_warm:
+          return
+        self.__started[key] = self.__started.get(key, 0) + 1
+
+      try:
+        container = self.__start_container(api)
+      except Exception:
+        with self.__lock:
+          self.__started[key] -= 1
+        raise
+
+      self.__release(key, container)
+
+    keys = [key for key in functions for _ in range(self.min_warm)]
+    if not keys:
+      return
+
+    with ThreadPoolExecutor(max_workers=min(len(keys), 16)) as executor:
+      # consume results so that startup errors are raised
+      list(executor.map(start_container, keys))
+
+  def invoke(self, api_config, payload):
+    '''
+    Invokes the function described by api_config (an endpoint config entry) with the provided
+    payload using a warm container, starting a new one if none is available.
+    Returns the same object as lambda_utils.run_function, plus a 'cold_start' flag. Its
+    'container' timing is the time spent acquiring a container, including cold starts.
+    Containers running for longer than the function's timeout (or invocation_timeout) are
+    killed.
+    '''
+    key = ContainerPool.__function_key(api_config['filepath'], api_config['handler'])
+    timeout = api_config.get('timeout') or self.invocation_timeout
+    start = time.perf_counter()
+    container, cold_start = self.__acquire(key, api_config)
+    acquire_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+      response = self.__invoke_container(container, payload, cold_start, timeout)
+    except socket.timeout:
+      self.__discard(key, container)
+      response = lambda_utils.build_timeout_response(timeout)
+      response['cold_start'] = cold_start
+      response['timings'] = {'container': acquire_time, 'handler': time.perf_counter() - start}
+      return response
+    except Exception:
+      # the container is in an unknown state, don't hand it out again
+      out_of_memory = self.__is_oom_killed(container)
+      self.__discard(key, container)
+      if not out_of_memory:
+        raise
+      response = lambda_utils.build_out_of_memory_response(api_config.get('memorySize'))
+      response['cold_start'] = cold_start
+      response['timings'] = {'container': acquire_time, 'handler': time.perf_counter() - start}
+      return response
+    invoke_time = time.perf_counter() - start
+
+    container.invocations += 1
+    self.__release(key, container)
+
+    response['cold_start'] = cold_start
+    response['timings'] = dict(
+      {'container': acquire_time},
+      **lambda_utils.split_run_time(invoke_time, lambda_utils.parse_report(response['stdout']))
+    )
+    return response
+
+  def recycle(self, function_file_path=None):
+    '''
+    Stops the idle containers of the function located at function_file_path (or every idle
+    container if not specified). Busy containers are stopped as soon as they're released, so
+    that new requests are served by fresh containers.
+    '''
+    stale = []
+    with self.__lock:
+      for key in self.__started:
+        if function_file_path is None or key.startswith(function_file_path + ':'):
+          self.__generations[key] = self.__generations.get(key, 0) + 1
+          idle = self.__idle.pop(key, [])
+          stale.extend(idle)
+          self.__started[key] -= len(idle)
+      self.__lock.notify_all()
+
+    for container in stale:
+      self.__stop_container(container)
+
+  def stats(self):
+    '''
+    Returns the pool's cold/warm start counters along with the current container count.
+    '''
+    with self.__lock:
+      return {
+        'cold_starts': self.cold_starts,
+        'warm_starts': self.warm_starts,
+        'containers': sum(self.__started.values()),
+        'idle_containers': sum(len(idle) for idle in self.__idle.values())
+      }
+
+  def shutdown(self):
+    '''
+    Stops every idle container and prevents new ones from being started.
+    '''
+    with self.__lock:
+      self.__closed = True
+    self.recycle()
+
+  def __acquire(self, key, api_config):
+    with self.__lock:
+      while True:
+        if self.__closed:
+          raise RuntimeError('Container pool has been shut down')
+
+        idle = self.__idle.get(key)
+        if idle:
+          container = idle.pop() if self.reuse_policy == REUSE_LIFO else idle.pop(0)
+          self.warm_starts += 1
+          return container, False
+
+        if self.__started.get(key, 0) < self.max_warm:
+          self.__started[key] = self.__started.get(key, 0) + 1
+          self.cold_starts += 1
+          generation = self.__generations.get(key, 0)
+          break
+
+        # all containers for this function are busy, wait for one to be released
+        self.__lock.wait()
+
+    try:
+      container = self.__start_container(api_config)
+      container.generation = generation
+      return container, True
+    except Exception:
+      with self.__lock:
+        self.__started[key] -= 1
+        self.__lock.notify_all()
+      raise
+
+  def __release(self, key, container):
+    with self.__lock:
+      if not self.__closed and container.generation == self.__generations.get(key, 0):
+        container.last_used = time.time()
+        self.__idle.setdefault(key, []).append(container)
+        self.__lock.notify_all()
+        return
+
+    # the pool was shut down or the function recycled while the container was busy
+    self.__discard(key, container)
+
+  def __discard(self, key, container):
+    with self.__lock:
+      self.__started[key] -= 1
+      self.__lock.notify_all()
+    self.__stop_container(container)
+
+  def __evict_idle_containers(self):
+    while True:
+      time.sleep(max(1, min(self.idle_timeout / 2, 10)))
+
+      expired = []
+      with self.__lock:
+        if self.__closed:
+          return
+
+        now = time.time()
+        for key, idle in self.__idle.items():
+          # idle lists are ordered by last use, so the oldest containers come first
+          while idle and self.__started[key] > self.min_warm and \
+              now - idle[0].last_used > self.idle_timeout:
+            expired.append(idle.pop(0))
+            self.__started[key] -= 1
+
+      for container in expired:
+        self.__stop_container(container)
+
+  def __start_container(self, api_config):
+    function_file_path = api_config['filepath']
+    handler_name = api_config['handler']
+    function_name = os.path.splitext(os.path.basename(function_file_path))[0]
+    runtime = lambda_utils.get_function_runtime(function_file_path)
+
+    options = lambda_utils.build_container_options(
+      os.path.dirname(function_file_path),
+      layer_dir=self.layer_dir,
+      docker_network_name=self.docker_network_name,
+      environment=self.environment,
+      memory_size=api_config.get('memorySize'),
+      timeout=api_config.get('timeout')
+    )
+    options['env']['DOCKER_LAMBDA_STAY_OPEN'] = 1
+
+    container_id = self.client.create_container(
+      lambda_utils.IMAGES[runtime],
+      cmd=['{}.{}'.format(function_name, handler_name)],
+      port_bindings={CONTAINER_API_PORT: '127.0.0.1'},
+      **options
+    )
+
+    try:
+      self.client.start_container(container_id)
+      # find out which host port docker assigned to the container's API port
+      port = self.client.get_host_port(container_id, CONTAINER_API_PORT)
+    except Exception:
+      self.client.remove_container(container_id)
+      raise
+
+    return WarmContainer(container_id, port)
+
+  def __stop_container(self, container):
+    try:
+      self.client.remove_container(container.container_id)
+    except docker_client.DockerApiError:
+      # container is already gone
+      pass
+
+  def __is_oom_killed(self, container):
+    try:
+      return self.client.inspect_container(container.container_id)['State'].get('OOMKilled', False)
+    except (OSError, docker_client.DockerApiError):
+      return False
+
+  def __invoke_container(self, container, payload, cold_start, timeout):
+    body = json.dumps(payload if payload else {})
+
+    # a freshly started container may not be listening yet: retry until it's ready
+    deadline = time.time() + self.startup_timeout
+    while True:
+      connection = http.client.HTTPConnection(
+        '127.0.0.1',
+        container.port,
+        timeout=timeout
+      )
+      try:
+        connection.request(
+          'POST',
+          INVOKE_PATH,
+          body=body,
+          headers={'Content-Type': 'application/json', 'X-Amz-Log-Type': 'Tail'}
+        )
+        http_response = connection.getresponse()
+        # never read more than the largest response a function may return
+        function_output = http_response.read(lambda_utils.MAX_RESPONSE_SIZE + 1)
+        break
+      except (ConnectionError, http.client.RemoteDisconnected):
+        if not cold_start or time.time() > deadline:
+          raise
+        time.sleep(0.05)
+      finally:
+        connection.close()
+
+    stdout = ''
+    log_result = http_response.getheader(LOG_RESULT_HEADER)
+    if log_result:
+      stdout = base64.b64decode(log_result).decode('utf-8', errors='replace')
+
+    if len(function_output) > lambda_utils.MAX_RESPONSE_SIZE:
+      size = int(http_response.getheader('Content-Length', len(function_output)))
+      return lambda_utils.build_response(lambda_utils.build_response_too_large_error(size), 1, stdout)
+
+    retcode = 1 if http_response.getheader(FUNCTION_ERROR_HEADER) else 0
+    return lambda_utils.build_response(function_output.decode('utf-8').strip(), retcode, stdout)
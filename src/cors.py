@@ -0,0 +1,150 @@
+'''
+Native CORS handling.
+
+When the Serverless configuration enables CORS for the HTTP API ("provider.httpApi.cors"), the
+gateway handles it the way API Gateway does: preflight requests are answered directly, without
+invoking any function (whether or not an OPTIONS route is configured), and the CORS headers of
+the other responses of allowed origins are set by the gateway, replacing those functions return.
+Every route's headers are computed once, when its routes are loaded, so that requests only
+check their origin against them.
+
+Reference: https://docs.aws.amazon.com/apigateway/latest/developerguide/http-api-cors.html
+Reference: https://www.serverless.com/framework/docs/providers/aws/events/http-api#cors-setup
+'''
+
+import json
+
+from route_index import ANY_METHOD, parse_route_key
+
+ORIGIN = 'origin'
+REQUEST_METHOD = 'access-control-request-method'
+
+ALLOW_ORIGIN = 'Access-Control-Allow-Origin'
+ALLOW_CREDENTIALS = 'Access-Control-Allow-Credentials'
+ALLOW_METHODS = 'Access-Control-Allow-Methods'
+ALLOW_HEADERS = 'Access-Control-Allow-Headers'
+EXPOSE_HEADERS = 'Access-Control-Expose-Headers'
+MAX_AGE = 'Access-Control-Max-Age'
+VARY = 'Vary'
+
+# settings of "cors: true", also used for those an object leaves out (see the Serverless docs)
+DEFAULT_ALLOWED_ORIGINS = ['*']
+DEFAULT_ALLOWED_HEADERS = [
+  'Content-Type',
+  'X-Amz-Date',
+  'Authorization',
+  'X-Api-Key',
+  'X-Amz-Security-Token',
+  'X-Amz-User-Agent',
+  'X-Amzn-Trace-Id'
+]
+
+def parse_cors_config(cors):
+  '''
+  Normalizes a "provider.httpApi.cors" setting (true or an object) into a dictionary with its
+  allowedOrigins, allowedHeaders, allowedMethods (None to allow the methods of the configured
+  routes), allowCredentials, exposedResponseHeaders and maxAge. Returns None if CORS isn't
+  enabled. Raises ValueError if the setting is invalid.
+  '''
+  if not cors:
+    return None
+  if cors is True:
+    cors = {}
+  if not isinstance(cors, dict):
+    raise ValueError('Invalid CORS configuration: {}'.format(json.dumps(cors)))
+
+  def get_list(name, default=None):
+    value = cors.get(name)
+    if value is None:
+      return default
+    return [value] if isinstance(value, str) else [str(item) for item in value]
+
+  config = {
+    'allowedOrigins': get_list('allowedOrigins', DEFAULT_ALLOWED_ORIGINS),
+    'allowedHeaders': get_list('allowedHeaders', DEFAULT_ALLOWED_HEADERS),
+    'allowedMethods': get_list('allowedMethods'),
+    'allowCredentials': bool(cors.get('allowCredentials')),
+    'exposedResponseHeaders': get_list('exposedResponseHeaders', []),
+    'maxAge': cors.get('maxAge')
+  }
+
+  if config['allowCredentials'] and '*' in config['allowedOrigins']:
+    raise ValueError('CORS credentials can\'t be allowed for every origin ("*")')
+  return config
+
+def is_preflight(method, headers):
+  '''
+  Returns True if a request (headers being its lowercase headers) is a CORS preflight request.
+  '''
+  return method == 'OPTIONS' and ORIGIN in headers and REQUEST_METHOD in headers
+
+def is_cors_header(name):
+  return name.lower().startswith('access-control-')
+
+class CorsPolicy:
+  '''
+  The CORS headers of the responses of a route, built from its CORS configuration (see
+  parse_cors_config). allowed_methods are the methods allowed unless configured.
+  '''
+  def __init__(self, config, allowed_methods):
+    origins = config['allowedOrigins']
+    self.any_origin = '*' in origins
+    self.origins = frozenset(origin.lower() for origin in origins)
+
+    headers = {}
+    if config['allowCredentials']:
+      headers[ALLOW_CREDENTIALS] = 'true'
+    if self.any_origin:
+      headers[ALLOW_ORIGIN] = '*'
+    else:
+      # responses depend on the request's origin
+      headers[VARY] = 'Origin'
+
+    self.response_headers = dict(headers)
+    if config['exposedResponseHeaders']:
+      self.response_headers[EXPOSE_HEADERS] = ','.join(config['exposedResponseHeaders'])
+
+    methods = config['allowedMethods'] or allowed_methods
+    self.preflight_headers = dict(headers, **{
+      ALLOW_METHODS: '*' if '*' in methods else ','.join(methods)
+    })
+    if config['allowedHeaders']:
+      self.preflight_headers[ALLOW_HEADERS] = ','.join(config['allowedHeaders'])
+    if config['maxAge'] is not None:
+      self.preflight_headers[MAX_AGE] = str(int(config['maxAge']))
+
+  def headers(self, origin, preflight=False):
+    '''
+    Returns the CORS headers of a response (or preflight response) to a request from origin, or
+    None if origin isn't allowed.
+    '''
+    headers = self.preflight_headers if preflight else self.response_headers
+    if self.any_origin:
+      return headers
+    if not origin or origin.lower() not in self.origins:
+      return None
+    return dict(headers, **{ALLOW_ORIGIN: origin})
+
+def build_cors_policies(endpoint_config):
+  '''
+  Returns the CORS policy of every route of an endpoint configuration with CORS enabled (see the
+  "cors" setting of its entries), as a dictionary: route key -> CorsPolicy. Unless configured,
+  the allowed methods are those of the routes sharing the same settings, plus OPTIONS.
+  '''
+  routes = {}
+  for route_key, api in endpoint_config.items():
+    if api.get('cors'):
+      routes.setdefault(json.dumps(api['cors'], sort_keys=True), []).append(route_key)
+
+  policies = {}
+  for route_keys in routes.values():
+    methods = {'OPTIONS'}
+    for route_key in route_keys:
+      method, _ = parse_route_key(route_key)
+      methods.add('*' if method == ANY_METHOD else method)
+
+    # routes with the same settings share their policy
+    policy = CorsPolicy(endpoint_config[route_keys[0]]['cors'], sorted(methods))
+    for route_key in route_keys:
+      policies[route_key] = policy
+  return policies
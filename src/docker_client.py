@@ -0,0 +1,711 @@
+'''
+Minimal Docker Engine API client talking to the Docker daemon over its Unix socket.
+
+Regular API calls are served through a pool of persistent (keep-alive) connections, while
+attaching to a container's output uses a dedicated hijacked connection which is streamed
+until the container exits.
+
+Reference: https://docs.docker.com/engine/api/v1.40/
+'''
+
+import asyncio
+import http.client
+import json
+import os
+import queue
+import select
+import socket
+import struct
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+DEFAULT_SOCKET_PATH = '/var/run/docker.sock'
+API_VERSION = 'v1.40'
+# methods whose requests can be repeated if the daemon may have received them already
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE')
+
+# stream types used by Docker's multiplexed attach/logs protocol
+STDIN = 0
+STDOUT = 1
+STDERR = 2
+STREAM_HEADER = struct.Struct('>BxxxL')
+
+# exit code of a container whose process was killed with SIGKILL (e.g. by the OOM killer)
+KILLED_EXIT_CODE = 137
+
+class DockerApiError(Exception):
+  '''
+  Error returned by the Docker Engine API.
+  '''
+  def __init__(self, status, message):
+    super().__init__('Docker API error ({}): {}'.format(status, message))
+    self.status = status
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+  '''
+  HTTP connection over a Unix domain socket.
+  '''
+  def __init__(self, socket_path, timeout=None):
+    super().__init__('localhost', timeout=timeout)
+    self.socket_path = socket_path
+
+  def connect(self):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(self.timeout)
+    sock.connect(self.socket_path)
+    self.sock = sock
+
+def get_socket_path():
+  '''
+  Returns the Docker daemon socket path, honoring DOCKER_HOST when it points to a Unix socket.
+  '''
+  docker_host = os.environ.get('DOCKER_HOST', '')
+  if docker_host.startswith('unix://'):
+    return docker_host[len('unix://'):]
+  return DEFAULT_SOCKET_PATH
+
+def demultiplex(reader, on_frame):
+  '''
+  Reads Docker's multiplexed stream format (8-byte header + payload frames) from the provided
+  file-like reader until EOF, calling on_frame(stream_type, data) for every frame.
+  '''
+  while True:
+    header = reader.read(STREAM_HEADER.size)
+    if len(header) < STREAM_HEADER.size:
+      return
+    stream_type, size = STREAM_HEADER.unpack(header)
+    data = reader.read(size)
+    on_frame(stream_type, data)
+
+def parse_image_name(image):
+  '''
+  Splits an image name into its repository and tag ('latest' if not specified).
+  '''
+  repository, _, tag = image.rpartition(':')
+  if not repository or '/' in tag:
+    return image, 'latest'
+  return repository, tag
+
+def decode_api_response(status, content_type, content, expected_status=None):
+  '''
+  Decodes an API response body, returning the parsed json (or raw text if the response is not
+  json) or raising a DockerApiError if the status is not one of expected_status (any 2xx
+  status by default).
+  '''
+  if expected_status:
+    success = status in expected_status
+  else:
+    success = 200 <= status < 300
+
+  text = content.decode('utf-8', errors='replace')
+  if not success:
+    try:
+      message = json.loads(text)['message']
+    except (ValueError, KeyError, TypeError):
+      message = text
+    raise DockerApiError(status, message)
+
+  if 'json' in (content_type or ''):
+    # image pulls stream progress as a sequence of json objects, only keep the last one
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) > 1:
+      result = json.loads(lines[-1])
+      if 'error' in result:
+        raise DockerApiError(status, result['error'])
+      return result
+    return json.loads(text) if text.strip() else None
+
+  return text
+
+def build_container_config(
+    image,
+    cmd=None,
+    env=None,
+    binds=None,
+    network=None,
+    port_bindings=None,
+    open_stdin=False,
+    labels=None,
+    host_config=None
+  ):
+  '''
+  Builds the body of a container creation request.
+  env is a dictionary of environment variables, binds a list of "host:container[:options]"
+  volume specs and port_bindings a dictionary mapping container ports ("9001/tcp") to host
+  addresses ("127.0.0.1" binds to an ephemeral port on that address).
+  '''
+  _host_config = {'Binds': binds if binds else []}
+  if network:
+    _host_config['NetworkMode'] = network
+  if port_bindings:
+    _host_config['PortBindings'] = {
+      port: [{'HostIp': host_ip, 'HostPort': ''}] for port, host_ip in port_bindings.items()
+    }
+  if host_config:
+    _host_config.update(host_config)
+
+  config = {
+    'Image': image,
+    'Cmd': cmd if cmd else [],
+    'Env': ['{}={}'.format(key, value) for key, value in (env if env else {}).items()],
+    'AttachStdout': True,
+    'AttachStderr': True,
+    'AttachStdin': open_stdin,
+    'OpenStdin': open_stdin,
+    'StdinOnce': open_stdin,
+    'Tty': False,
+    'Labels': labels if labels else {},
+    'HostConfig': _host_config
+  }
+  if port_bindings:
+    config['ExposedPorts'] = {port: {} for port in port_bindings}
+
+  return config
+
+def build_attach_request(container_id, stdin=False):
+  '''
+  Builds the raw HTTP request that hijacks a connection to attach to a container's streams.
+  '''
+  path = '/{}/containers/{}/attach?{}'.format(
+    API_VERSION,
+    container_id,
+    urlencode({'stream': 1, 'stdout': 1, 'stderr': 1, 'stdin': 1 if stdin else 0})
+  )
+  return (
+    'POST {} HTTP/1.1\r\n'
+    'Host: localhost\r\n'
+    'Connection: Upgrade\r\n'
+    'Upgrade: tcp\r\n'
+    'Content-Length: 0\r\n\r\n'
+  ).format(path).encode('ascii')
+
+class DockerClient:
+  '''
+  Docker Engine API client with a pool of up to pool_size persistent connections.
+  '''
+  def __init__(self, socket_path=None, pool_size=8, timeout=60):
+    self.socket_path = socket_path if socket_path else get_socket_path()
+    self.timeout = timeout
+    self.__pool = queue.LifoQueue(maxsize=pool_size)
+
+  def ping(self):
+    '''
+    Returns True if the Docker daemon is reachable.
+    '''
+    try:
+      return self.request('GET', '/_ping', versioned=False) == 'OK'
+    except (OSError, DockerApiError):
+      return False
+
+  def version(self):
+    return self.request('GET', '/version')
+
+  def pull_image(self, image):
+    '''
+    Pulls the provided image (i.e. "repository:tag") and waits until the pull completes.
+    '''
+    repository, tag = parse_image_name(image)
+    self.request('POST', '/images/create', params={'fromImage': repository, 'tag': tag})
+
+  def image_exists(self, image):
+    try:
+      self.request('GET', '/images/{}/json'.format(quote(image, safe='')))
+      return True
+    except DockerApiError as error:
+      if error.status == 404:
+        return False
+      raise
+
+  def create_container(self, image, name=None, **kwargs):
+    '''
+    Creates a container and returns its id. See build_container_config for the supported options.
+    '''
+    params = {'name': name} if name else None
+    return self.request(
+      'POST',
+      '/containers/create',
+      body=build_container_config(image, **kwargs),
+      params=params
+    )['Id']
+
+  def start_container(self, container_id):
+    self.request('POST', '/containers/{}/start'.format(container_id))
+
+  def inspect_container(self, container_id):
+    return self.request('GET', '/containers/{}/json'.format(container_id))
+
+  def get_host_port(self, container_id, port):
+    '''
+    Returns the host port a container port (e.g. "9001/tcp") is published on.
+    '''
+    ports = self.inspect_container(container_id)['NetworkSettings']['Ports']
+    return int(ports[port][0]['HostPort'])
+
+  def inspect_network(self, network):
+    return self.request('GET', '/networks/{}'.format(quote(network, safe='')))
+
+  def wait_container(self, container_id):
+    '''
+    Waits for the container to stop and returns its exit code.
+    '''
+    return self.request(
+      'POST',
+      '/containers/{}/wait'.format(container_id),
+      timeout=None
+    )['StatusCode']
+
+  def stop_container(self, container_id, timeout=1):
+    self.request(
+      'POST',
+      '/containers/{}/stop'.format(container_id),
+      params={'t': timeout},
+      expected_status=(204, 304)
+    )
+
+  def kill_container(self, container_id):
+    self.request('POST', '/containers/{}/kill'.format(container_id))
+
+  def remove_container(self, container_id, force=True):
+    self.request(
+      'DELETE',
+      '/containers/{}'.format(container_id),
+      params={'force': 1 if force else 0}
+    )
+
+  def attach_container(self, container_id, stdin=False):
+    '''
+    Attaches to a (created or running) container's output and returns the hijacked socket,
+    ready to be read using the multiplexed stream format (see demultiplex).
+    If stdin is True the container's stdin can be written to through the returned socket.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(self.socket_path)
+
+    sock.sendall(build_attach_request(container_id, stdin))
+
+    # read the response headers byte by byte so no stream data is consumed
+    response = b''
+    while not response.endswith(b'\r\n\r\n'):
+      data = sock.recv(1)
+      if not data:
+        sock.close()
+        raise DockerApiError(0, 'Connection closed while attaching to container')
+      response += data
+
+    status = int(response.split(b' ', 2)[1])
+    if status not in (101, 200):
+      sock.close()
+      raise DockerApiError(status, response.decode('utf-8', errors='replace'))
+
+    return sock
+
+  def run_container(
+      self,
+      image,
+      cmd=None,
+      on_output=None,
+      stdin=None,
+      timings=None,
+      timeout=None,
+      status=None,
+      **kwargs
+    ):
+    '''
+    Creates, attaches to, starts and removes a container, the equivalent of "docker run --rm".
+    Output frames are passed to on_output(stream_type, data) as they're produced if specified.
+    If stdin (bytes) is specified it's written to the container's stdin, which is then closed.
+    If timings (a dictionary) is specified the seconds spent starting the container, running it
+    until its output ends and removing it are stored under 'start', 'run' and 'remove'.
+    The container is killed if it runs for longer than timeout seconds. If status (a dictionary)
+    is specified whether that happened and whether the container was killed for running out of
+    memory are stored under 'timed_out' and 'oom_killed'.
+    Returns a tuple with the container's exit code and its captured stdout and stderr.
+    '''
+    stdout = []
+    stderr = []
+    timings = timings if timings is not None else {}
+    status = status if status is not None else {}
+    timed_out = threading.Event()
+    watchdog = None
+
+    def kill():
+      timed_out.set()
+      try:
+        self.kill_container(container_id)
+      except (OSError, DockerApiError):
+        # the container already exited
+        pass
+
+    def capture_output(stream_type, data):
+      (stderr if stream_type == STDERR else stdout).append(data)
+
+    start = time.perf_counter()
+    container_id = self.create_container(image, cmd=cmd, open_stdin=stdin is not None, **kwargs)
+    try:
+      # attach before starting so that no output is missed
+      sock = self.attach_container(container_id, stdin=stdin is not None)
+      try:
+        self.start_container(container_id)
+        if timeout is not None:
+          watchdog = threading.Timer(timeout, kill)
+          watchdog.daemon = True
+          watchdog.start()
+        if stdin is not None:
+          # stdin is sent as is (no framing) and closed by shutting down the socket's write side
+          sock.sendall(memoryview(stdin))
+          sock.shutdown(socket.SHUT_WR)
+        timings['start'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with sock.makefile('rb') as reader:
+          demultiplex(reader, on_output if on_output else capture_output)
+        timings['run'] = time.perf_counter() - start
+      finally:
+        sock.close()
+
+      exit_code = self.wait_container(container_id)
+      if watchdog:
+        watchdog.cancel()
+      status['timed_out'] = timed_out.is_set()
+      status['oom_killed'] = False
+      if exit_code == KILLED_EXIT_CODE and not timed_out.is_set():
+        status['oom_killed'] = self.inspect_container(container_id)['State'].get('OOMKilled', False)
+    finally:
+      if watchdog:
+        watchdog.cancel()
+      start = time.perf_counter()
+      try:
+        self.remove_container(container_id)
+      except DockerApiError:
+        pass
+      timings['remove'] = time.perf_counter() - start
+
+    return exit_code, b''.join(stdout), b''.join(stderr)
+
+  def request(
+      self,
+      method,
+      path,
+      body=None,
+      params=None,
+      versioned=True,
+      expected_status=None,
+      timeout=False
+    ):
+    '''
+    Performs an API request using a pooled connection and returns the decoded json response
+    (or raw text if the response is not json).
+    '''
+    url = '/' + API_VERSION + path if versioned else path
+    if params:
+      url += '?' + urlencode(params)
+
+    headers = {}
+    data = None
+    if body is not None:
+      data = json.dumps(body).encode('utf-8')
+      headers['Content-Type'] = 'application/json'
+
+    connection = self.__get_connection()
+    if timeout is not False:
+      connection.timeout = timeout
+      if connection.sock:
+        connection.sock.settimeout(timeout)
+
+    try:
+      sent = False
+      try:
+        connection.request(method, url, body=data, headers=headers)
+        sent = True
+        response = connection.getresponse()
+      except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+        # the pooled connection was closed by the daemon: retry once on a fresh one, unless the
+        # daemon may have acted on a request that isn't safe to repeat (e.g. creating a container)
+        if sent and method not in IDEMPOTENT_METHODS:
+          raise
+        connection.close()
+        connection.request(method, url, body=data, headers=headers)
+        response = connection.getresponse()
+
+      content = response.read()
+    except Exception:
+      connection.close()
+      raise
+    finally:
+      if timeout is not False:
+        connection.timeout = self.timeout
+        if connection.sock:
+          connection.sock.settimeout(self.timeout)
+
+    self.__release_connection(connection, response)
+
+    return decode_api_response(
+      response.status,
+      response.getheader('Content-Type'),
+      content,
+      expected_status
+    )
+
+  def close(self):
+    '''
+    Closes every pooled connection.
+    '''
+    while True:
+      try:
+        self.__pool.get_nowait().close()
+      except queue.Empty:
+        return
+
+  def __get_connection(self):
+    try:
+      connection = self.__pool.get_nowait()
+    except queue.Empty:
+      return UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+
+    # an idle connection is only readable once the daemon closed it: reconnect rather than
+    # finding out after sending a request
+    if connection.sock and select.select([connection.sock], [], [], 0)[0]:
+      connection.close()
+    return connection
+
+  def __release_connection(self, connection, response):
+    if response.will_close:
+      connection.close()
+      return
+
+    try:
+      self.__pool.put_nowait(connection)
+    except queue.Full:
+      connection.close()
+
+class AsyncDockerClient:
+  '''
+  asyncio-based Docker Engine API client. Every request uses its own (cheap) Unix socket
+  connection, with at most max_connections of them open at the same time.
+  '''
+  def __init__(self, socket_path=None, max_connections=256):
+    self.socket_path = socket_path if socket_path else get_socket_path()
+    self.max_connections = max_connections
+    self.__connections = None
+
+  async def ping(self):
+    try:
+      return await self.request('GET', '/_ping', versioned=False) == 'OK'
+    except (OSError, DockerApiError):
+      return False
+
+  async def pull_image(self, image):
+    repository, tag = parse_image_name(image)
+    await self.request('POST', '/images/create', params={'fromImage': repository, 'tag': tag})
+
+  async def create_container(self, image, name=None, **kwargs):
+    params = {'name': name} if name else None
+    response = await self.request(
+      'POST',
+      '/containers/create',
+      body=build_container_config(image, **kwargs),
+      params=params
+    )
+    return response['Id']
+
+  async def start_container(self, container_id):
+    await self.request('POST', '/containers/{}/start'.format(container_id))
+
+  async def wait_container(self, container_id):
+    response = await self.request('POST', '/containers/{}/wait'.format(container_id))
+    return response['StatusCode']
+
+  async def kill_container(self, container_id):
+    await self.request('POST', '/containers/{}/kill'.format(container_id))
+
+  async def remove_container(self, container_id, force=True):
+    await self.request(
+      'DELETE',
+      '/containers/{}'.format(container_id),
+      params={'force': 1 if force else 0}
+    )
+
+  async def attach_container(self, container_id, stdin=False):
+    '''
+    Attaches to a (created or running) container's streams and returns the hijacked
+    connection's (reader, writer) pair.
+    '''
+    reader, writer = await asyncio.open_unix_connection(self.socket_path)
+    writer.write(build_attach_request(container_id, stdin))
+    await writer.drain()
+
+    status, _ = await AsyncDockerClient.__read_headers(reader)
+    if status not in (101, 200):
+      writer.close()
+      raise DockerApiError(status, 'Unable to attach to container {}'.format(container_id))
+
+    return reader, writer
+
+  async def run_container(
+      self,
+      image,
+      cmd=None,
+      on_output=None,
+      stdin=None,
+      timings=None,
+      timeout=None,
+      status=None,
+      **kwargs
+    ):
+    '''
+    Async equivalent of DockerClient.run_container.
+    '''
+    stdout = []
+    stderr = []
+    timings = timings if timings is not None else {}
+    status = status if status is not None else {}
+    timed_out = False
+
+    def capture_output(stream_type, data):
+      (stderr if stream_type == STDERR else stdout).append(data)
+
+    if not on_output:
+      on_output = capture_output
+
+    start = time.perf_counter()
+    container_id = await self.create_container(image, cmd=cmd, open_stdin=stdin is not None, **kwargs)
+    try:
+      # attach before starting so that no output is missed
+      reader, writer = await self.attach_container(container_id, stdin=stdin is not None)
+      try:
+        await self.start_container(container_id)
+        if stdin is not None:
+          writer.write(stdin)
+          await writer.drain()
+          writer.write_eof()
+        timings['start'] = time.perf_counter() - start
+
+        async def read_output():
+          while True:
+            try:
+              header = await reader.readexactly(STREAM_HEADER.size)
+            except asyncio.IncompleteReadError:
+              break
+            stream_type, size = STREAM_HEADER.unpack(header)
+            on_output(stream_type, await reader.readexactly(size))
+
+        start = time.perf_counter()
+        try:
+          await asyncio.wait_for(read_output(), timeout)
+        except asyncio.TimeoutError:
+          timed_out = True
+          try:
+            await self.kill_container(container_id)
+          except (OSError, DockerApiError):
+            # the container already exited
+            pass
+        timings['run'] = time.perf_counter() - start
+      finally:
+        writer.close()
+
+      start = time.perf_counter()
+      exit_code = await self.wait_container(container_id)
+      status['timed_out'] = timed_out
+      status['oom_killed'] = False
+      if exit_code == KILLED_EXIT_CODE and not timed_out:
+        state = (await self.request('GET', '/containers/{}/json'.format(container_id)))['State']
+        status['oom_killed'] = state.get('OOMKilled', False)
+    finally:
+      try:
+        await self.remove_container(container_id)
+      except DockerApiError:
+        pass
+      timings['remove'] = time.perf_counter() - start
+
+    return exit_code, b''.join(stdout), b''.join(stderr)
+
+  async def request(self, method, path, body=None, params=None, versioned=True, expected_status=None):
+    '''
+    Performs an API request and returns the decoded json response (or raw text if the response
+    is not json).
+    '''
+    url = '/' + API_VERSION + path if versioned else path
+    if params:
+      url += '?' + urlencode(params)
+
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    request = (
+      '{} {} HTTP/1.1\r\n'
+      'Host: localhost\r\n'
+      'Connection: close\r\n'
+      'Content-Type: application/json\r\n'
+      'Content-Length: {}\r\n\r\n'
+    ).format(method, url, len(data)).encode('ascii') + data
+
+    # the semaphore is created lazily so that it's bound to the running event loop
+    if self.__connections is None:
+      self.__connections = asyncio.Semaphore(self.max_connections)
+
+    async with self.__connections:
+      reader, writer = await asyncio.open_unix_connection(self.socket_path)
+      try:
+        writer.write(request)
+        await writer.drain()
+        status, headers = await AsyncDockerClient.__read_headers(reader)
+        content = await AsyncDockerClient.__read_body(reader, headers)
+      finally:
+        writer.close()
+
+    return decode_api_response(status, headers.get('content-type'), content, expected_status)
+
+  @staticmethod
+  async def __read_headers(reader):
+    status_line = await reader.readline()
+    if not status_line:
+      raise DockerApiError(0, 'Connection closed by the Docker daemon')
+    status = int(status_line.split(b' ', 2)[1])
+
+    headers = {}
+    while True:
+      line = await reader.readline()
+      if line in (b'\r\n', b'\n', b''):
+        return status, headers
+      name, value = line.decode('latin-1').split(':', 1)
+      headers[name.strip().lower()] = value.strip()
+
+  @staticmethod
+  async def __read_body(reader, headers):
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+      chunks = []
+      while True:
+        size = int((await reader.readline()).split(b';', 1)[0], 16)
+        if size == 0:
+          await reader.readline()
+          return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
+
+    if 'content-length' in headers:
+      return await reader.readexactly(int(headers['content-length']))
+
+    return await reader.read()
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_default_client():
+  '''
+  Returns a shared client connected to the local Docker daemon.
+  '''
+  global _default_client
+  with _default_client_lock:
+    if _default_client is None:
+      _default_client = DockerClient()
+    return _default_client
+
+_default_async_client = None
+
+def get_default_async_client():
+  '''
+  Returns a shared asyncio client connected to the local Docker daemon.
+  '''
+  global _default_async_client
+  if _default_async_client is None:
+    _default_async_client = AsyncDockerClient()
+  return _default_async_client
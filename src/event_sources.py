@@ -0,0 +1,564 @@
+'''
+Event source simulation.
+
+Functions subscribed to SQS queues, SNS topics or schedules in the Serverless configuration are
+invoked the way Lambda's event sources invoke them. Queues and topics are kept in memory and fed
+through a small HTTP API:
+
+  POST /queues/<name>         sends the request body as a message to an SQS queue
+  POST /queues/<name>/batch   sends every item of a JSON array as a message
+  POST /topics/<name>         publishes the request body to an SNS topic (?subject=<subject>)
+  GET /stats                  returns every event source's counters
+
+Every event source has a poller that takes batches of up to batchSize messages from its queue,
+waiting up to maximumBatchingWindow seconds for a batch to fill up, and dispatches them
+concurrently (up to maximumConcurrency invocations at once) through the gateway's invoker,
+concurrency limiter and memory budget. A batch of messages costs a single invocation, as it
+does on AWS. Failed batches (or the items a function reports with ReportBatchItemFailures) are
+retried with an exponential backoff until their messages have been received maxReceiveCount
+times (SQS queues' redrive policy) or, for SNS and schedules, like asynchronous invocations:
+three attempts in total. SNS subscriptions and schedules deliver one event per invocation.
+
+Reference: https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html
+Reference: https://docs.aws.amazon.com/lambda/latest/dg/with-sns.html
+Reference: https://docs.aws.amazon.com/lambda/latest/dg/invocation-async.html
+'''
+
+import collections
+import datetime
+import hashlib
+import heapq
+import itertools
+import json
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import lambda_utils
+from concurrency import ThrottledError
+from schedules import parse_schedule
+
+SOURCE_SQS = 'sqs'
+SOURCE_SNS = 'sns'
+SOURCE_SCHEDULE = 'schedule'
+SOURCE_TYPES = (SOURCE_SQS, SOURCE_SNS, SOURCE_SCHEDULE)
+
+ACCOUNT_ID = '000000000000'
+DEFAULT_REGION = 'us-east-1'
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_MAX_CONCURRENCY = 5
+# receives of an SQS message before it's dropped, unless its queue has a redrive policy
+DEFAULT_MAX_RECEIVE_COUNT = 5
+# attempts of asynchronous invocations (SNS notifications and schedules)
+ASYNC_ATTEMPTS = 3
+# seconds before a failed batch is retried the first time, doubled on every retry
+DEFAULT_RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+REPORT_BATCH_ITEM_FAILURES = 'ReportBatchItemFailures'
+
+def format_timestamp(timestamp):
+  return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+class Message:
+  '''
+  A message waiting in a queue, along with its delivery attempts.
+  '''
+  def __init__(self, body, subject=None, sent_at=None):
+    self.id = str(uuid.uuid4())
+    self.body = body
+    self.subject = subject
+    self.sent_at = sent_at if sent_at is not None else time.time()
+    self.receive_count = 0
+    self.first_received_at = None
+
+  def receive(self):
+    self.receive_count += 1
+    if self.first_received_at is None:
+      self.first_received_at = time.time()
+
+class MessageQueue:
+  '''
+  In-memory message queue. Messages put back after a failed delivery become visible again once
+  their delay elapses.
+  '''
+  def __init__(self, name):
+    self.name = name
+    self.__visible = collections.deque()
+    # (time the message becomes visible, sequence number, message) heap
+    self.__delayed = []
+    self.__sequence = itertools.count()
+    self.__condition = threading.Condition()
+    self.__closed = False
+
+  def put(self, messages, delay=0):
+    with self.__condition:
+      if delay:
+        visible_at = time.monotonic() + delay
+        for message in messages:
+          heapq.heappush(self.__delayed, (visible_at, next(self.__sequence), message))
+      else:
+        self.__visible.extend(messages)
+      self.__condition.notify_all()
+
+  def depth(self):
+    with self.__condition:
+      return len(self.__visible) + len(self.__delayed)
+
+  def close(self):
+    with self.__condition:
+      self.__closed = True
+      self.__condition.notify_all()
+
+  def take(self, max_messages, window=0):
+    '''
+    Waits for a message to be visible and returns up to max_messages messages, waiting up to
+    window seconds after the first one for more. Returns an empty list once the queue is closed.
+    '''
+    with self.__condition:
+      while not self.__closed:
+        self.__reveal()
+        if self.__visible:
+          break
+        self.__condition.wait(self.__next_reveal())
+
+      deadline = time.monotonic() + window
+      while not self.__closed and len(self.__visible) < max_messages:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        next_reveal = self.__next_reveal()
+        self.__condition.wait(remaining if next_reveal is None else min(remaining, next_reveal))
+        self.__reveal()
+
+      if self.__closed:
+        return []
+      return [self.__visible.popleft() for _ in range(min(max_messages, len(self.__visible)))]
+
+  def __reveal(self):
+    now = time.monotonic()
+    while self.__delayed and self.__delayed[0][0] <= now:
+      self.__visible.append(heapq.heappop(self.__delayed)[2])
+
+  def __next_reveal(self):
+    if not self.__delayed:
+      return None
+    return max(0, self.__delayed[0][0] - time.monotonic())
+
+class SourceStats:
+  def __init__(self):
+    self.started_at = time.time()
+    self.received = 0
+    self.processed = 0
+    self.retried = 0
+    self.dropped = 0
+    self.invocations = 0
+    self.failed_invocations = 0
+    self.throttles = 0
+    self.invocation_time = 0
+
+class EventSource:
+  '''
+  A function subscribed to a queue (its own one for SNS subscriptions and schedules), along
+  with its delivery settings and counters. config is the source's event source config entry.
+  '''
+  def __init__(self, key, config, queue, region):
+    self.key = key
+    self.config = config
+    self.queue = queue
+    self.type = config['type']
+    self.arn = 'arn:aws:{}:{}:{}:{}'.format(
+      'events' if self.type == SOURCE_SCHEDULE else self.type,
+      region,
+      ACCOUNT_ID,
+      'rule/' + config['name'] if self.type == SOURCE_SCHEDULE else config['name']
+    )
+    self.region = region
+
+    if self.type == SOURCE_SQS:
+      self.batch_size = config.get('batchSize') or DEFAULT_BATCH_SIZE
+      self.batching_window = config.get('maximumBatchingWindow') or 0
+      self.max_receive_count = config.get('maxReceiveCount') or DEFAULT_MAX_RECEIVE_COUNT
+    else:
+      self.batch_size = 1
+      self.batching_window = 0
+      self.max_receive_count = ASYNC_ATTEMPTS
+    self.max_concurrency = config.get('maximumConcurrency') or DEFAULT_MAX_CONCURRENCY
+    self.slots = threading.Semaphore(self.max_concurrency)
+
+    self.schedule = None
+    if self.type == SOURCE_SCHEDULE:
+      self.schedule = parse_schedule(config['schedule'], time.time())
+
+    self.stats = SourceStats()
+
+  @property
+  def label(self):
+    return '{}:{}'.format(self.type, self.config['name'])
+
+  def build_event(self, messages):
+    '''
+    Returns the event a batch of messages is delivered to the function as.
+    '''
+    if self.type == SOURCE_SQS:
+      return {'Records': [{
+        'messageId': message.id,
+        'receiptHandle': '{}#{}'.format(message.id, message.receive_count),
+        'body': message.body,
+        'attributes': {
+          'ApproximateReceiveCount': str(message.receive_count),
+          'SentTimestamp': str(int(message.sent_at * 1000)),
+          'SenderId': ACCOUNT_ID,
+          'ApproximateFirstReceiveTimestamp': str(int(message.first_received_at * 1000))
+        },
+        'messageAttributes': {},
+        'md5OfBody': hashlib.md5(message.body.encode('utf-8')).hexdigest(),
+        'eventSource': 'aws:sqs',
+        'eventSourceARN': self.arn,
+        'awsRegion': self.region
+      } for message in messages]}
+
+    if self.type == SOURCE_SNS:
+      return {'Records': [{
+        'EventSource': 'aws:sns',
+        'EventVersion': '1.0',
+        'EventSubscriptionArn': '{}:{}'.format(self.arn, self.config['function']),
+        'Sns': {
+          'Type': 'Notification',
+          'MessageId': message.id,
+          'TopicArn': self.arn,
+          'Subject': message.subject,
+          'Message': message.body,
+          'Timestamp': format_timestamp(message.sent_at),
+          'SignatureVersion': '1',
+          'Signature': 'EXAMPLE',
+          'SigningCertUrl': 'EXAMPLE',
+          'UnsubscribeUrl': 'EXAMPLE',
+          'MessageAttributes': {}
+        }
+      } for message in messages]}
+
+    # schedules deliver their configured input, or EventBridge's scheduled event
+    message = messages[0]
+    if self.config.get('input') is not None:
+      return self.config['input']
+    return {
+      'version': '0',
+      'id': message.id,
+      'detail-type': 'Scheduled Event',
+      'source': 'aws.events',
+      'account': ACCOUNT_ID,
+      'time': format_timestamp(message.sent_at)[:-5] + 'Z',
+      'region': self.region,
+      'resources': [self.arn],
+      'detail': {}
+    }
+
+  def failed_messages(self, messages, response):
+    '''
+    Returns the messages of a batch whose delivery failed according to the function's response.
+    '''
+    if response is None or response['exit_status'] != 0:
+      return messages
+    if self.config.get('functionResponseType') != REPORT_BATCH_ITEM_FAILURES:
+      return []
+
+    return_value = response.get('return_value')
+    failures = return_value.get('batchItemFailures') if isinstance(return_value, dict) else None
+    if not failures:
+      return []
+    failed_ids = {failure.get('itemIdentifier') for failure in failures if isinstance(failure, dict)}
+    return [message for message in messages if message.id in failed_ids]
+
+class EventSourceRequestHandler(BaseHTTPRequestHandler):
+  '''
+  Serves the event sources' HTTP API.
+  '''
+  event_sources = None
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    if urllib.parse.urlsplit(self.path).path != '/stats':
+      self.__reply(404, {'message': 'Not found'})
+      return
+    self.__reply(200, self.event_sources.stats())
+
+  def do_POST(self):
+    url = urllib.parse.urlsplit(self.path)
+    parts = [urllib.parse.unquote(part) for part in url.path.strip('/').split('/')]
+    body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8', errors='replace')
+
+    try:
+      if len(parts) == 2 and parts[0] == 'queues':
+        self.__reply(200, {'messageIds': self.event_sources.send_messages(parts[1], [body])})
+      elif len(parts) == 3 and parts[0] == 'queues' and parts[2] == 'batch':
+        bodies = json.loads(body)
+        if not isinstance(bodies, list):
+          raise ValueError('Expected a JSON array of messages')
+        bodies = [item if isinstance(item, str) else json.dumps(item) for item in bodies]
+        self.__reply(200, {'messageIds': self.event_sources.send_messages(parts[1], bodies)})
+      elif len(parts) == 2 and parts[0] == 'topics':
+        subject = urllib.parse.parse_qs(url.query).get('subject', [None])[0]
+        self.__reply(200, {'messageId': self.event_sources.publish(parts[1], body, subject)})
+      else:
+        self.__reply(404, {'message': 'Not found'})
+    except KeyError as error:
+      self.__reply(404, {'message': 'Unknown queue or topic: {}'.format(error.args[0])})
+    except ValueError as error:
+      self.__reply(400, {'message': str(error)})
+
+  def __reply(self, status, obj):
+    body = json.dumps(obj).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+class EventSources:
+  '''
+  Runs the event sources described by event_source_config (event source key -> config entry,
+  see api_gateway's extract_event_sources), invoking functions through invoker (see
+  invoker.FunctionInvoker) within concurrency_limiter and memory_budget, if specified.
+  Throttled batches are put back in their queue and retried without counting as a receive.
+  '''
+  def __init__(
+      self,
+      event_source_config,
+      invoker,
+      concurrency_limiter=None,
+      memory_budget=None,
+      region=None,
+      retry_delay=DEFAULT_RETRY_DELAY
+    ):
+    self.invoker = invoker
+    self.concurrency_limiter = concurrency_limiter
+    self.memory_budget = memory_budget
+    self.region = region if region else DEFAULT_REGION
+    self.retry_delay = retry_delay
+
+    # SQS queue name -> queue shared by the functions consuming it
+    self.queues = {}
+    # SNS topic name -> queues of its subscriptions
+    self.topics = {}
+    self.sources = []
+
+    for key, config in event_source_config.items():
+      if config['type'] == SOURCE_SQS:
+        queue = self.queues.setdefault(config['name'], MessageQueue(config['name']))
+      else:
+        queue = MessageQueue(key)
+        if config['type'] == SOURCE_SNS:
+          self.topics.setdefault(config['name'], []).append(queue)
+      self.sources.append(EventSource(key, config, queue, self.region))
+
+    self.server = None
+    self.__stopped = threading.Event()
+    self.__threads = []
+    self.__lock = threading.Lock()
+    self.__executor = ThreadPoolExecutor(
+      max_workers=max(1, sum(source.max_concurrency for source in self.sources)),
+      thread_name_prefix='event-source'
+    )
+
+  def start(self, host, port):
+    '''
+    Starts polling the queues, firing the schedules and serving the HTTP API on host:port.
+    '''
+    handler = type('Handler', (EventSourceRequestHandler,), {'event_sources': self})
+    self.server = ThreadingHTTPServer((host, port), handler)
+    self.server.daemon_threads = True
+
+    targets = [self.server.serve_forever]
+    for source in self.sources:
+      targets.append(lambda source=source: self.__poll(source))
+      if source.schedule:
+        targets.append(lambda source=source: self.__run_schedule(source))
+
+    for target in targets:
+      thread = threading.Thread(target=target, daemon=True)
+      thread.start()
+      self.__threads.append(thread)
+    return self
+
+  def send_messages(self, queue_name, bodies):
+    '''
+    Sends messages to an SQS queue, returning their ids. Raises KeyError if no function
+    consumes the queue.
+    '''
+    queue = self.queues[queue_name]
+    messages = [Message(body) for body in bodies]
+    self.__count_received(queue, len(messages))
+    queue.put(messages)
+    return [message.id for message in messages]
+
+  def publish(self, topic_name, body, subject=None):
+    '''
+    Publishes a message to every subscription of an SNS topic, returning its id. Raises
+    KeyError if no function is subscribed to the topic.
+    '''
+    message_id = str(uuid.uuid4())
+    sent_at = time.time()
+    for queue in self.topics[topic_name]:
+      # every subscription gets its own copy of the message
+      message = Message(body, subject, sent_at)
+      message.id = message_id
+      self.__count_received(queue, 1)
+      queue.put([message])
+    return message_id
+
+  def stats(self):
+    '''
+    Returns the counters of every event source, including its throughput (processed messages
+    per second) and average batch size.
+    '''
+    now = time.time()
+    result = {}
+    with self.__lock:
+      for source in self.sources:
+        stats = source.stats
+        result[source.key] = {
+          'function': source.config['function'],
+          'source': source.label,
+          'received': stats.received,
+          'processed': stats.processed,
+          'retried': stats.retried,
+          'dropped': stats.dropped,
+          'queue_depth': source.queue.depth(),
+          'invocations': stats.invocations,
+          'failed_invocations': stats.failed_invocations,
+          'throttles': stats.throttles,
+          'average_batch_size': (stats.processed + stats.retried + stats.dropped) / stats.invocations if stats.invocations else 0,
+          'average_duration': stats.invocation_time / stats.invocations if stats.invocations else 0,
+          'throughput': stats.processed / max(now - stats.started_at, 1e-3)
+        }
+    return result
+
+  def shutdown(self):
+    '''
+    Stops polling and firing schedules, waiting for the invocations in progress. Messages left
+    in the queues are discarded.
+    '''
+    self.__stopped.set()
+    for source in self.sources:
+      source.queue.close()
+    if self.server:
+      self.server.shutdown()
+      self.server.server_close()
+    self.__executor.shutdown(wait=True)
+
+  def __count_received(self, queue, count):
+    with self.__lock:
+      for source in self.sources:
+        if source.queue is queue:
+          source.stats.received += count
+          # consumers of a shared queue compete for its messages
+          break
+
+  def __poll(self, source):
+    while not self.__stopped.is_set():
+      # messages are only taken once they can be dispatched
+      source.slots.acquire()
+      messages = source.queue.take(source.batch_size, source.batching_window)
+      if not messages:
+        source.slots.release()
+        continue
+      try:
+        self.__executor.submit(self.__dispatch, source, messages)
+      except RuntimeError:
+        # shutting down
+        source.slots.release()
+        return
+
+  def __run_schedule(self, source):
+    fire_time = source.schedule.next_time(time.time())
+    while fire_time is not None and not self.__stopped.wait(max(0, fire_time - time.time())):
+      source.queue.put([Message(None, sent_at=fire_time)])
+      with self.__lock:
+        source.stats.received += 1
+      fire_time = source.schedule.next_time(max(fire_time, time.time()))
+
+  def __acquire(self, config):
+    '''
+    Takes an execution slot and reserves memory for an invocation of config's function,
+    returning False if the invocation is throttled.
+    '''
+    if self.concurrency_limiter:
+      try:
+        self.concurrency_limiter.acquire(config['function'])
+      except ThrottledError:
+        return False
+
+    if self.memory_budget:
+      try:
+        self.memory_budget.reserve(config.get('memorySize') or lambda_utils.DEFAULT_MEMORY_SIZE)
+      except ThrottledError:
+        if self.concurrency_limiter:
+          self.concurrency_limiter.release(config['function'])
+        return False
+    return True
+
+  def __release(self, config):
+    if self.memory_budget:
+      self.memory_budget.release(config.get('memorySize') or lambda_utils.DEFAULT_MEMORY_SIZE)
+    if self.concurrency_limiter:
+      self.concurrency_limiter.release(config['function'])
+
+  def __dispatch(self, source, messages):
+    try:
+      if not self.__acquire(source.config):
+        print('{}: Throttled invocation of function "{}", retrying'.format(source.label, source.config['function']))
+        with self.__lock:
+          source.stats.throttles += 1
+        source.queue.put(messages, self.retry_delay)
+        return
+
+      for message in messages:
+        message.receive()
+      log_prefix = '{} [{}] '.format(source.label, uuid.uuid4().hex[:8])
+      print('{}: Invoking function "{}" with {} message(s)...'.format(
+        source.label,
+        source.config['function'],
+        len(messages)
+      ))
+
+      start = time.perf_counter()
+      try:
+        response = self.invoker(source.config, source.build_event(messages), log_prefix=log_prefix)
+      except Exception as error:
+        print('{}: Error invoking function "{}": {}'.format(source.label, source.config['function'], error), file=sys.stderr)
+        response = None
+      finally:
+        self.__release(source.config)
+      duration = time.perf_counter() - start
+
+      failed = source.failed_messages(messages, response)
+      retried = [message for message in failed if message.receive_count < source.max_receive_count]
+      dropped = len(failed) - len(retried)
+
+      with self.__lock:
+        stats = source.stats
+        stats.invocations += 1
+        stats.invocation_time += duration
+        stats.processed += len(messages) - len(failed)
+        stats.retried += len(retried)
+        stats.dropped += dropped
+        if response is None or response['exit_status'] != 0:
+          stats.failed_invocations += 1
+
+      if retried:
+        delay = min(self.retry_delay * 2 ** (min(message.receive_count for message in retried) - 1), MAX_RETRY_DELAY)
+        print('{}: {} message(s) failed, retrying in {}s'.format(source.label, len(retried), delay))
+        source.queue.put(retried, delay)
+      if dropped:
+        print(
+          'WARNING: {}: dropped {} message(s) after {} attempt(s)'.format(source.label, dropped, source.max_receive_count),
+          file=sys.stderr
+        )
+    finally:
+      source.slots.release()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+'''
+Stand-in Docker daemon serving the subset of the Docker Engine API used by docker_client over a
+Unix socket. Containers don't run anything: their output is produced by a runner function,
+which by default emulates a lambci image echoing the received event back to the caller. Runners
+returning exit code 137 emulate containers killed for running out of memory, and containers
+killed while their runner runs end right away, the way a timed out container does.
+
+Usage: fake_docker_daemon.py <socket path>
+Then point Cyclon to it with DOCKER_HOST=unix://<socket path>.
+'''
+
+import json
+import os
+import re
+import socket
+import socketserver
+import sys
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import docker_client
+
+CONTAINER_PATH = re.compile(r'^/v[\d.]+/containers/(?P<id>[^/]+)(?P<action>/[a-z]+)?$')
+IMAGE_PATH = re.compile(r'^/v[\d.]+/images/(?P<name>.+)/json$')
+
+def echo_runner(config, stdin):
+  '''
+  Default runner: emulates a lambci image, logging to stderr and writing a response that echoes
+  the event (passed via stdin or as the last command argument) to stdout.
+  Returns a tuple with the exit code, stdout and stderr.
+  '''
+  event = stdin if stdin else (config['Cmd'][-1].encode('utf-8') if len(config['Cmd']) > 1 else b'{}')
+  response = {
+    'statusCode': 200,
+    'headers': {'content-type': 'application/json'},
+    'body': event.decode('utf-8')
+  }
+  stderr = 'START RequestId: {0}\nEND RequestId: {0}\n'.format(uuid.uuid4()).encode('utf-8')
+  return 0, json.dumps(response).encode('utf-8') + b'\n', stderr
+
+class FakeContainer:
+  '''
+  State of a container created through the stand-in daemon.
+  '''
+  def __init__(self, config):
+    self.id = uuid.uuid4().hex
+    self.config = config
+    self.started = threading.Event()
+    self.finished = threading.Event()
+    self.exit_code = None
+    self.oom_killed = False
+    self.server = None
+    self.ports = {}
+
+  def is_stay_open(self):
+    return 'DOCKER_LAMBDA_STAY_OPEN=1' in self.config.get('Env', [])
+
+class FakeDockerDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  '''
+  Threaded Unix socket server emulating the Docker daemon.
+  '''
+  daemon_threads = True
+  request_queue_size = 1024
+
+  def __init__(self, socket_path, runner=echo_runner):
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+    super().__init__(socket_path, FakeDockerRequestHandler)
+    self.socket_path = socket_path
+    self.runner = runner
+    self.containers = {}
+    self.lock = threading.Lock()
+
+  def start(self):
+    '''
+    Serves requests in a background thread.
+    '''
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+    for container in list(self.containers.values()):
+      if container.server:
+        container.server.shutdown()
+    if os.path.exists(self.socket_path):
+      os.remove(self.socket_path)
+
+  def run(self, container, stdin=None):
+    exit_code, stdout, stderr = self.runner(container.config, stdin)
+    with self.lock:
+      # the exit code of a container killed in the meantime is kept
+      if container.exit_code is None:
+        container.exit_code = exit_code
+        container.oom_killed = exit_code == docker_client.KILLED_EXIT_CODE
+    return stdout, stderr
+
+  def start_stay_open(self, container):
+    '''
+    Serves stay-open invocations for the container on an ephemeral local port.
+    '''
+    daemon = self
+
+    class InvokeHandler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def log_message(self, format, *args):
+        pass
+
+      def do_POST(self):
+        event = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        stdout, _ = daemon.run(container, event)
+        body = stdout.strip().splitlines()[-1] if stdout.strip() else b'null'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    container.server = ThreadingHTTPServer(('127.0.0.1', 0), InvokeHandler)
+    for port in container.config.get('ExposedPorts', {}):
+      container.ports[port] = [{'HostIp': '127.0.0.1', 'HostPort': str(container.server.server_address[1])}]
+    threading.Thread(target=container.server.serve_forever, daemon=True).start()
+
+class FakeDockerRequestHandler(BaseHTTPRequestHandler):
+  '''
+  Serves Docker Engine API requests.
+  '''
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    path = self.path.split('?', 1)[0]
+    if path == '/_ping':
+      self.__reply(200, 'OK', content_type='text/plain')
+    elif path.endswith('/version'):
+      self.__reply(200, {'Version': 'fake', 'ApiVersion': docker_client.API_VERSION[1:]})
+    elif IMAGE_PATH.match(path):
+      self.__reply(200, {'Id': 'sha256:' + uuid.uuid4().hex})
+    else:
+      container, action = self.__get_container(path)
+      if not container or action != '/json':
+        return
+      self.__reply(200, {
+        'Id': container.id,
+        'State': {
+          'Running': container.started.is_set() and not container.finished.is_set(),
+          'OOMKilled': container.oom_killed
+        },
+        'NetworkSettings': {'Ports': container.ports}
+      })
+
+  def do_DELETE(self):
+    container, _ = self.__get_container(self.path.split('?', 1)[0])
+    if not container:
+      return
+    self.__stop(container)
+    with self.server.lock:
+      del self.server.containers[container.id]
+    self.__reply(204)
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    path = self.path.split('?', 1)[0]
+
+    if path.endswith('/images/create'):
+      self.__reply(200, {'status': 'Download complete'})
+      return
+
+    if path.endswith('/containers/create'):
+      container = FakeContainer(json.loads(body))
+      with self.server.lock:
+        self.server.containers[container.id] = container
+      self.__reply(201, {'Id': container.id, 'Warnings': []})
+      return
+
+    container, action = self.__get_container(path)
+    if not container:
+      return
+
+    if action == '/start':
+      if container.is_stay_open():
+        self.server.start_stay_open(container)
+      container.started.set()
+      self.__reply(204)
+    elif action == '/attach':
+      self.__attach(container)
+    elif action == '/wait':
+      container.finished.wait()
+      self.__reply(200, {'StatusCode': container.exit_code, 'Error': None})
+    elif action in ('/stop', '/kill'):
+      self.__stop(container)
+      self.__reply(204)
+    else:
+      self.__reply(404, {'message': 'page not found'})
+
+  def __attach(self, container):
+    self.send_response(101)
+    self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+    self.send_header('Connection', 'Upgrade')
+    self.send_header('Upgrade', 'tcp')
+    self.end_headers()
+    self.wfile.flush()
+
+    stdin = None
+    if container.config.get('OpenStdin'):
+      # stdin is streamed through the hijacked connection until the client shuts down writes
+      chunks = []
+      while True:
+        data = self.rfile.read1(65536)
+        if not data:
+          break
+        chunks.append(data)
+      stdin = b''.join(chunks)
+
+    container.started.wait()
+    if not container.is_stay_open():
+      output = []
+
+      def run():
+        try:
+          output.extend(self.server.run(container, stdin))
+        except Exception:
+          # runners of killed containers may fail as their environment goes away
+          if not container.finished.is_set():
+            raise
+
+      runner = threading.Thread(target=run, daemon=True)
+      runner.start()
+      # a container killed while running ends without any further output
+      while runner.is_alive() and not container.finished.wait(0.01):
+        pass
+      if output:
+        stdout, stderr = output
+        for stream_type, data in ((docker_client.STDERR, stderr), (docker_client.STDOUT, stdout)):
+          if data:
+            self.wfile.write(docker_client.STREAM_HEADER.pack(stream_type, len(data)) + data)
+      container.finished.set()
+
+    self.wfile.flush()
+    self.close_connection = True
+    self.connection.shutdown(socket.SHUT_RDWR)
+
+  def __stop(self, container):
+    if container.server:
+      container.server.shutdown()
+      container.server = None
+    with self.server.lock:
+      if container.exit_code is None:
+        container.exit_code = docker_client.KILLED_EXIT_CODE
+    container.finished.set()
+
+  def __get_container(self, path):
+    match = CONTAINER_PATH.match(path)
+    container = None
+    if match:
+      with self.server.lock:
+        container = self.server.containers.get(match.group('id'))
+
+    if not container:
+      self.__reply(404, {'message': 'No such container'})
+      return None, None
+
+    return container, match.group('action')
+
+  def __reply(self, status, obj=None, content_type='application/json'):
+    body = b''
+    if obj is not None:
+      body = (obj if isinstance(obj, str) else json.dumps(obj)).encode('utf-8')
+    self.send_response(status)
+    if body:
+      self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+if __name__ == '__main__':
+  if len(sys.argv) != 2:
+    print('Usage: {} <socket path>'.format(os.path.basename(sys.argv[0])))
+    sys.exit(1)
+
+  daemon = FakeDockerDaemon(sys.argv[1])
+  print('Fake Docker daemon listening on unix://{}'.format(daemon.socket_path))
+  try:
+    daemon.serve_forever()
+  except KeyboardInterrupt:
+    daemon.stop()
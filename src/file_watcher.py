@@ -0,0 +1,309 @@
+'''
+File watching.
+
+FingerprintIndex keeps the modification time, size and content hash of every file under a set of
+directories, so that rescanning part of a tree reports the files whose content actually changed
+(saving a file without modifying it, or touching it, isn't a change). FileWatcher keeps such an
+index up to date and reports changes to a callback: on Linux it uses inotify (through ctypes) to
+find out which directories to rescan, elsewhere, or if inotify is unavailable or runs out of
+watches, it falls back to rescanning everything periodically.
+
+Reference: https://man7.org/linux/man-pages/man7/inotify.7.html
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+import utils
+
+# directories never indexed: version control, caches and installed dependencies
+IGNORED_DIRS = ('.git', '.hg', '.svn', '__pycache__', '.serverless', '.cyclon', 'node_modules')
+# files larger than this are only compared by modification time and size
+MAX_HASHED_FILE_SIZE = 16 * 1024 * 1024
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+  IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+INOTIFY_EVENT = struct.Struct('iIII')
+
+def hash_file(file_path):
+  digest = hashlib.blake2b(digest_size=16)
+  with open(file_path, 'rb') as f:
+    for chunk in iter(lambda: f.read(65536), b''):
+      digest.update(chunk)
+  return digest.digest()
+
+def is_under(path, directory):
+  return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+class FingerprintIndex:
+  '''
+  Index of the files under roots (directories), mapping every file path to its modification
+  time, size and content hash. If predicate is specified only the files it accepts are indexed.
+  '''
+  def __init__(self, roots, predicate=None, ignored_dirs=IGNORED_DIRS):
+    self.roots = [os.path.abspath(root) for root in roots]
+    self.predicate = predicate
+    self.ignored_dirs = ignored_dirs
+    # file path -> (mtime, size, content hash)
+    self.entries = {}
+    self.__lock = threading.Lock()
+
+    for root in self.roots:
+      self.refresh(root)
+
+  def files(self, directory=None):
+    '''
+    Returns the indexed files, or those under directory if specified.
+    '''
+    with self.__lock:
+      return sorted(path for path in self.entries if directory is None or is_under(path, directory))
+
+  def fingerprint(self, directory=None):
+    '''
+    Returns a digest of the content of the indexed files (under directory, if specified).
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    with self.__lock:
+      for path in sorted(self.entries):
+        if directory is None or is_under(path, directory):
+          digest.update(path.encode('utf-8', errors='surrogateescape'))
+          digest.update(self.entries[path][2] or b'')
+    return digest.hexdigest()
+
+  def refresh(self, path=None):
+    '''
+    Rescans path (a file or a directory, recursively) or every root if not specified, returning
+    the set of files that were added, removed or whose content changed.
+    '''
+    if path is None:
+      changed = set()
+      for root in self.roots:
+        changed |= self.refresh(root)
+      return changed
+
+    path = os.path.abspath(path)
+    if not any(is_under(path, root) for root in self.roots):
+      return set()
+
+    found = {}
+    if os.path.isdir(path):
+      if os.path.basename(path) not in self.ignored_dirs:
+        for file_path, stat in utils.scan_files(path, recursive=True, ignored_dirs=self.ignored_dirs):
+          if not self.predicate or self.predicate(file_path):
+            found[file_path] = stat
+    else:
+      try:
+        stat = os.stat(path)
+        if not self.predicate or self.predicate(path):
+          found[path] = stat
+      except OSError:
+        pass
+
+    changed = set()
+    with self.__lock:
+      # files that used to be under path but weren't found anymore
+      for file_path in [p for p in self.entries if is_under(p, path) and p not in found]:
+        del self.entries[file_path]
+        changed.add(file_path)
+      previous_entries = {p: self.entries.get(p) for p in found}
+
+    updates = {}
+    for file_path, stat in found.items():
+      previous = previous_entries[file_path]
+      if previous and previous[0] == stat.st_mtime_ns and previous[1] == stat.st_size:
+        continue
+
+      try:
+        content_hash = hash_file(file_path) if stat.st_size <= MAX_HASHED_FILE_SIZE else None
+      except OSError:
+        continue
+      updates[file_path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+      if not previous or content_hash is None or previous[2] != content_hash:
+        changed.add(file_path)
+
+    with self.__lock:
+      self.entries.update(updates)
+    return changed
+
+class Inotify:
+  '''
+  Minimal inotify binding. Raises OSError if inotify isn't available.
+  '''
+  def __init__(self):
+    library = ctypes.util.find_library('c')
+    self.libc = ctypes.CDLL(library if library else 'libc.so.6', use_errno=True)
+    if not hasattr(self.libc, 'inotify_init1'):
+      raise OSError(errno.ENOSYS, 'inotify is not supported')
+
+    self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+    if self.fd < 0:
+      error = ctypes.get_errno()
+      raise OSError(error, os.strerror(error))
+
+    # watch descriptor -> directory
+    self.watches = {}
+
+  def add_watch(self, directory):
+    wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+    if wd < 0:
+      error = ctypes.get_errno()
+      raise OSError(error, os.strerror(error), directory)
+    self.watches[wd] = directory
+    return wd
+
+  def read_events(self, timeout=None):
+    '''
+    Waits up to timeout seconds for events, returning a list of (directory, mask, name) tuples.
+    '''
+    readable, _, _ = select.select([self.fd], [], [], timeout)
+    if not readable:
+      return []
+
+    data = os.read(self.fd, 65536)
+    events = []
+    offset = 0
+    while offset + INOTIFY_EVENT.size <= len(data):
+      wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+      offset += INOTIFY_EVENT.size
+      name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+      offset += length
+
+      directory = self.watches.get(wd)
+      if mask & IN_IGNORED:
+        self.watches.pop(wd, None)
+      if directory is not None or mask & IN_Q_OVERFLOW:
+        events.append((directory, mask, name))
+    return events
+
+  def close(self):
+    os.close(self.fd)
+
+class FileWatcher:
+  '''
+  Watches the files under roots (directories) accepted by predicate, calling on_change with the
+  set of changed files once changes settle for debounce seconds. Files are rescanned every
+  poll_interval seconds when inotify can't be used (or if use_inotify is False).
+  '''
+  def __init__(self, roots, on_change, predicate=None, debounce=0.2, poll_interval=1, use_inotify=True):
+    # nested roots are covered by their parents
+    roots = sorted(set(os.path.abspath(root) for root in roots))
+    roots = [root for root in roots if not any(root != other and is_under(root, other) for other in roots)]
+
+    self.on_change = on_change
+    self.debounce = debounce
+    self.poll_interval = poll_interval
+    self.index = FingerprintIndex(roots, predicate)
+    self.inotify = None
+    self.__stopped = threading.Event()
+
+    if use_inotify and sys.platform.startswith('linux'):
+      try:
+        self.inotify = Inotify()
+        for root in roots:
+          self.__watch_tree(root)
+      except OSError as error:
+        print('WARNING: unable to watch files with inotify ({}), polling instead'.format(error), file=sys.stderr)
+        if self.inotify:
+          self.inotify.close()
+        self.inotify = None
+
+    self.__thread = threading.Thread(target=self.__run, daemon=True)
+
+  @property
+  def mode(self):
+    return 'inotify' if self.inotify else 'polling'
+
+  def start(self):
+    self.__thread.start()
+    return self
+
+  def stop(self):
+    self.__stopped.set()
+    self.__thread.join()
+    if self.inotify:
+      self.inotify.close()
+
+  def __watch_tree(self, directory):
+    self.inotify.add_watch(directory)
+    pending = [directory]
+    while pending:
+      try:
+        entries = list(os.scandir(pending.pop()))
+      except OSError:
+        continue
+      for entry in entries:
+        if entry.is_dir(follow_symlinks=False) and entry.name not in IGNORED_DIRS:
+          self.inotify.add_watch(entry.path)
+          pending.append(entry.path)
+
+  def __notify(self, changed):
+    if not changed:
+      return
+    try:
+      self.on_change(changed)
+    except Exception as error:
+      print('Error handling file changes: {}'.format(error), file=sys.stderr)
+
+  def __run(self):
+    if self.inotify:
+      try:
+        self.__run_inotify()
+        return
+      except OSError as error:
+        # e.g. the watch limit was reached while watching a new directory
+        print('WARNING: inotify failed ({}), polling instead'.format(error), file=sys.stderr)
+        self.inotify.close()
+        self.inotify = None
+        self.__notify(self.index.refresh())
+
+    while not self.__stopped.wait(self.poll_interval):
+      self.__notify(self.index.refresh())
+
+  def __run_inotify(self):
+    pending = set()
+    while not self.__stopped.is_set():
+      events = self.inotify.read_events(self.debounce if pending else 0.5)
+      if events:
+        for directory, mask, name in events:
+          if mask & IN_Q_OVERFLOW:
+            # events were lost, rescan everything
+            pending.update(self.index.roots)
+            continue
+
+          path = os.path.join(directory, name) if name else directory
+          pending.add(path)
+          if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and name not in IGNORED_DIRS:
+            self.__watch_tree(path)
+        continue
+
+      if pending:
+        # no events during the debounce window
+        changed = set()
+        for path in pending:
+          changed |= self.index.refresh(path)
+        pending = set()
+        self.__notify(changed)
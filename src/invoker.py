@@ -0,0 +1,83 @@
+'''
+Function invocation through the gateway's execution backends.
+'''
+
+import os
+
+import lambda_utils
+from native_pool import BACKEND_NATIVE
+from payload import get_log_prefix
+
+class FunctionInvoker:
+  '''
+  Invokes functions with the backend each one is configured with: native worker processes
+  (native_pool), the Runtime API's long-lived containers (runtime_api), warm containers
+  (container_pool) or, if none of them is specified, a new container per invocation.
+  Calling an invoker with an endpoint config entry and a payload returns the same object as
+  lambda_utils.run_function, plus a 'cold_start' flag. The function's logs are printed prefixed with log_prefix, or with the
+  payload's route key and request id (see payload.get_log_prefix) if not specified.
+  '''
+  def __init__(
+      self,
+      environment=None,
+      layer_dir=None,
+      docker_network_name=None,
+      container_pool=None,
+      runtime_api=None,
+      native_pool=None,
+      max_output_size=lambda_utils.DEFAULT_MAX_OUTPUT_SIZE
+    ):
+    self.environment = environment
+    self.layer_dir = os.path.abspath(layer_dir) if layer_dir else None
+    self.docker_network_name = docker_network_name
+    self.container_pool = container_pool
+    self.runtime_api = runtime_api
+    self.native_pool = native_pool
+    self.max_output_size = max_output_size
+
+  def __call__(self, config, payload, log_prefix=None):
+    if log_prefix is None:
+      log_prefix = get_log_prefix(payload)
+
+    if self.native_pool and config.get('backend') == BACKEND_NATIVE:
+      # run the handler in one of the function's native worker processes
+      response = self.native_pool.invoke(config, payload)
+      if response['stdout']:
+        lambda_utils.print_function_output(response['stdout'], log_prefix)
+      return response
+
+    if self.runtime_api:
+      # hand the event to the function's long-lived runtime workers
+      return self.runtime_api.invoke(config, payload)
+
+    if self.container_pool:
+      # reuse a warm container if there's one available for this function
+      response = self.container_pool.invoke(config, payload)
+      stats = self.container_pool.stats()
+      print('{}: {} start (cold starts: {}, warm starts: {})'.format(
+        payload.get('routeKey', config['function']),
+        'Cold' if response['cold_start'] else 'Warm',
+        stats['cold_starts'],
+        stats['warm_starts']
+      ))
+      # warm containers return their logs along with the response
+      if response['stdout']:
+        lambda_utils.print_function_output(response['stdout'], log_prefix)
+      return response
+
+    # logs are streamed as the function produces them
+    response = lambda_utils.run_function(
+      function_file_path=config['filepath'],
+      payload=payload,
+      layer_dir=self.layer_dir,
+      docker_network_name=self.docker_network_name,
+      environment=self.environment,
+      handler_name=config['handler'],
+      log_prefix=log_prefix,
+      max_output_size=self.max_output_size,
+      memory_size=config.get('memorySize'),
+      timeout=config.get('timeout')
+    )
+    # every invocation starts a new container
+    response['cold_start'] = True
+    return response
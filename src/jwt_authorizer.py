@@ -0,0 +1,288 @@
+'''
+Local HTTP API JWT authorizers.
+
+Tokens are verified the way API Gateway JWT authorizers verify them (issuer, audience, expiry,
+scopes) but against locally configured keys: an HMAC secret for HS256 tokens (like the ones
+payload.build_jwt generates) and/or a JWKS file for RS256 tokens. Verified claims are kept in a
+bounded LRU cache keyed by token, so repeated requests from the same client skip signature
+verification and parsing.
+
+Reference: https://docs.aws.amazon.com/apigateway/latest/developerguide/http-api-jwt-authorizer.html
+'''
+
+import base64
+import collections
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+# secret payload.build_jwt signs tokens with by default
+DEFAULT_SECRET = 'default'
+DEFAULT_IDENTITY_SOURCE = '$request.header.Authorization'
+DEFAULT_CACHE_SIZE = 1024
+
+# DER encoded DigestInfo prefix of SHA-256 digests (RFC 8017, section 9.2)
+SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')
+
+class UnauthorizedError(Exception):
+  '''
+  Raised when a request's token is missing or invalid.
+  '''
+
+class ForbiddenError(Exception):
+  '''
+  Raised when a valid token doesn't grant any of the route's scopes.
+  '''
+
+def b64url_decode(data):
+  '''
+  Decodes url-safe base64 data with or without padding.
+  '''
+  if isinstance(data, str):
+    data = data.encode('ascii')
+  return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+def b64url_to_int(data):
+  return int.from_bytes(b64url_decode(data), 'big')
+
+def load_jwks(jwks_file_path):
+  '''
+  Loads the RSA public keys of a JWKS file as a list of (kid, n, e) tuples.
+  '''
+  with open(jwks_file_path, 'r') as f:
+    jwks = json.load(f)
+
+  keys = []
+  for key in jwks.get('keys', []):
+    if key.get('kty') != 'RSA' or key.get('use', 'sig') != 'sig':
+      continue
+    keys.append((key.get('kid'), b64url_to_int(key['n']), b64url_to_int(key['e'])))
+  return keys
+
+def verify_hs256(signing_input, signature, secret):
+  expected = hmac.new(secret.encode('utf-8'), signing_input, hashlib.sha256).digest()
+  return hmac.compare_digest(expected, signature)
+
+def verify_rs256(signing_input, signature, n, e):
+  '''
+  Verifies an RSASSA-PKCS1-v1_5 SHA-256 signature with the public key (n, e).
+  '''
+  key_length = (n.bit_length() + 7) // 8
+  if len(signature) != key_length:
+    return False
+
+  s = int.from_bytes(signature, 'big')
+  if s >= n:
+    return False
+
+  encoded = pow(s, e, n).to_bytes(key_length, 'big')
+
+  # EMSA-PKCS1-v1_5: 0x00 0x01 0xff..0xff 0x00 DigestInfo
+  digest_info = SHA256_DIGEST_INFO + hashlib.sha256(signing_input).digest()
+  padding_length = key_length - len(digest_info) - 3
+  if padding_length < 8:
+    return False
+  expected = b'\x00\x01' + b'\xff' * padding_length + b'\x00' + digest_info
+
+  return hmac.compare_digest(encoded, expected)
+
+def get_token_scopes(claims):
+  '''
+  Returns the scopes granted by a token, from its "scope" (space separated) or "scp" claims.
+  '''
+  scopes = claims.get('scope', claims.get('scp'))
+  if isinstance(scopes, str):
+    return scopes.split()
+  if isinstance(scopes, list):
+    return scopes
+  return []
+
+class JwtAuthorizer:
+  '''
+  JWT authorizer verifying tokens taken from identity_source (e.g. "$request.header.Authorization")
+  against secret (HS256) and the keys of jwks_file (RS256). If issuer is specified tokens must
+  have been issued by it, and if audience is specified they must be meant for one of its values.
+  '''
+  def __init__(
+      self,
+      name,
+      issuer=None,
+      audience=None,
+      identity_source=DEFAULT_IDENTITY_SOURCE,
+      secret=None,
+      jwks_file=None,
+      cache_size=DEFAULT_CACHE_SIZE,
+      leeway=0
+    ):
+    self.name = name
+    self.issuer = issuer.rstrip('/') if issuer else None
+    self.audience = [audience] if isinstance(audience, str) else (audience or [])
+    self.identity_source = identity_source if identity_source else DEFAULT_IDENTITY_SOURCE
+    self.secret = secret
+    self.keys = load_jwks(jwks_file) if jwks_file else []
+    self.cache_size = cache_size
+    self.leeway = leeway
+    self.cache_hits = 0
+    self.cache_misses = 0
+
+    if self.secret is None and not self.keys:
+      self.secret = DEFAULT_SECRET
+
+    self.__cache = collections.OrderedDict()
+    self.__lock = threading.Lock()
+
+  def get_token(self, headers, params=None):
+    '''
+    Returns the token found in the request's identity source (lowercase headers and query string
+    parameters), stripping the "Bearer" prefix, or None if there's none.
+    '''
+    source = self.identity_source.split(',')[0].strip()
+    token = None
+    if source.lower().startswith('$request.header.'):
+      token = headers.get(source[len('$request.header.'):].lower())
+    elif source.startswith('$request.querystring.') and params:
+      token = params.get(source[len('$request.querystring.'):])
+
+    if not token:
+      return None
+
+    token = token.strip()
+    if token[:7].lower() == 'bearer ':
+      token = token[7:].strip()
+    return token
+
+  def authorize(self, headers, params=None, scopes=None):
+    '''
+    Authorizes a request, returning the requestContext:authorizer object of its payload.
+    Raises UnauthorizedError if the token is missing or invalid and ForbiddenError if it doesn't
+    grant any of the required scopes.
+    '''
+    token = self.get_token(headers, params)
+    if not token:
+      raise UnauthorizedError('Missing token')
+
+    claims = self.verify(token)
+    token_scopes = get_token_scopes(claims)
+
+    if scopes and not any(scope in token_scopes for scope in scopes):
+      raise ForbiddenError('Insufficient scopes')
+
+    return {
+      'jwt': {
+        'claims': claims,
+        'scopes': token_scopes if token_scopes else None
+      }
+    }
+
+  def verify(self, token):
+    '''
+    Returns the claims of token, verifying it unless it's cached. Raises UnauthorizedError if
+    it's invalid.
+    '''
+    now = time.time()
+
+    with self.__lock:
+      cached = self.__cache.get(token)
+      if cached is not None:
+        claims, expiry = cached
+        if expiry is None or now < expiry + self.leeway:
+          self.__cache.move_to_end(token)
+          self.cache_hits += 1
+          return claims
+        del self.__cache[token]
+      self.cache_misses += 1
+
+    claims = self.__verify(token, now)
+
+    with self.__lock:
+      # time claims may be strings, which __verify accepts
+      self.__cache[token] = (claims, float(claims['exp']) if 'exp' in claims else None)
+      self.__cache.move_to_end(token)
+      while len(self.__cache) > self.cache_size:
+        self.__cache.popitem(last=False)
+
+    return claims
+
+  def __verify(self, token, now):
+    try:
+      header_b64, claims_b64, signature_b64 = token.split('.')
+      header = json.loads(b64url_decode(header_b64))
+      claims = json.loads(b64url_decode(claims_b64))
+      signature = b64url_decode(signature_b64)
+    except ValueError:
+      raise UnauthorizedError('Malformed token')
+
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+      raise UnauthorizedError('Malformed token')
+
+    signing_input = (header_b64 + '.' + claims_b64).encode('ascii')
+    algorithm = header.get('alg')
+
+    if algorithm == 'HS256' and self.secret is not None:
+      valid = verify_hs256(signing_input, signature, self.secret)
+    elif algorithm == 'RS256' and self.keys:
+      kid = header.get('kid')
+      valid = any(
+        verify_rs256(signing_input, signature, n, e)
+        for key_id, n, e in self.keys
+        if kid is None or key_id is None or key_id == kid
+      )
+    else:
+      raise UnauthorizedError('Unsupported signing algorithm: {}'.format(algorithm))
+
+    if not valid:
+      raise UnauthorizedError('Invalid signature')
+
+    if self.issuer and str(claims.get('iss', '')).rstrip('/') != self.issuer:
+      raise UnauthorizedError('Invalid issuer')
+
+    if self.audience:
+      audience = claims.get('aud', claims.get('client_id'))
+      audience = audience if isinstance(audience, list) else [audience]
+      if not any(aud in self.audience for aud in audience):
+        raise UnauthorizedError('Invalid audience')
+
+    try:
+      if 'exp' in claims and now >= float(claims['exp']) + self.leeway:
+        raise UnauthorizedError('Token expired')
+      if 'nbf' in claims and now < float(claims['nbf']) - self.leeway:
+        raise UnauthorizedError('Token not yet valid')
+      if 'iat' in claims and now < float(claims['iat']) - self.leeway:
+        raise UnauthorizedError('Token issued in the future')
+    except (TypeError, ValueError):
+      raise UnauthorizedError('Invalid time claims')
+
+    return claims
+
+def build_route_authorizers(endpoint_config, secret=None, jwks_file=None):
+  '''
+  Creates the JWT authorizers of the routes of endpoint_config, returning a dictionary that maps
+  route keys to (authorizer, scopes) tuples. Routes sharing an authorizer share its cache.
+  secret and jwks_file are used by authorizers that don't configure their own keys.
+  '''
+  authorizers = {}
+  route_authorizers = {}
+
+  for route_key, api in endpoint_config.items():
+    config = api.get('authorizer')
+    if not config:
+      continue
+
+    name = config['name']
+    if name not in authorizers:
+      authorizer_secret = config.get('secret', secret)
+      authorizer_jwks_file = config.get('jwksFile', jwks_file)
+      authorizers[name] = JwtAuthorizer(
+        name,
+        issuer=config.get('issuerUrl'),
+        audience=config.get('audience'),
+        identity_source=config.get('identitySource'),
+        secret=authorizer_secret,
+        jwks_file=authorizer_jwks_file
+      )
+
+    route_authorizers[route_key] = (authorizers[name], config.get('scopes'))
+
+  return route_authorizers
@@ -1,12 +1,255 @@
 import os
-import subprocess
 import json
-import utils
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import docker_client
 
 NODE_IMAGE_NAME = 'lambci/lambda:nodejs12.x'
 PYTHON_IMAGE_NAME = 'lambci/lambda:python3.7'
 IMAGE_TASK_DIR = '/var/task'
 IMAGE_LAYER_DIR = '/opt'
+# makes lambci images read the event from stdin
+USE_STDIN_VARIABLE = 'DOCKER_LAMBDA_USE_STDIN'
+
+# AWS Lambda synchronous invocation response payload limit
+MAX_RESPONSE_SIZE = 6 * 1024 * 1024
+# function output kept in memory per invocation, beyond which it's spilled to a temporary file
+DEFAULT_MAX_OUTPUT_SIZE = 1024 * 1024
+# directory output is spilled to, only the most recent files of which are kept
+OUTPUT_DIR = os.path.join(tempfile.gettempdir(), 'cyclon-output')
+MAX_OUTPUT_FILES = 20
+# longest partial log line held before it's forwarded anyway
+MAX_LOG_LINE_SIZE = 64 * 1024
+
+# Serverless framework defaults for functions without memorySize or timeout settings
+DEFAULT_MEMORY_SIZE = 1024
+DEFAULT_TIMEOUT = 6
+# AWS Lambda allocates CPU in proportion to memory: a function gets a full vCPU at 1769 MB
+MEMORY_PER_VCPU = 1769
+# CPU shares Docker gives a container by default, i.e. a full vCPU's worth
+CPU_SHARES_PER_VCPU = 1024
+
+# REPORT line fields printed by Lambda runtimes after every invocation
+REPORT_FIELD = re.compile(rb'(Init Duration|Billed Duration|Duration): ([\d.]+) ms')
+
+# the Docker Lambda images we currently support
+IMAGES = {
+  'node': NODE_IMAGE_NAME,
+  'python': PYTHON_IMAGE_NAME
+}
+
+def get_function_runtime(function_file_path):
+  '''
+  Returns the runtime name ('node' or 'python') matching the function's source file extension.
+  '''
+  function_extension = os.path.splitext(function_file_path)[1]
+  if function_extension == '.js':
+    return 'node'
+  if function_extension == '.py':
+    return 'python'
+
+  raise TypeError(
+    'Cannot find matching Lambda runtime for function extension "{}"'.format(function_extension)
+  )
+
+def prepare_images(images, client=None, warm_up=True, max_workers=8):
+  '''
+  Pulls the provided images in parallel (skipping those already present) so that the first
+  invocation of a function never pays for a pull. If warm_up is True a throwaway container is
+  created from every image to prime the image layers as well.
+  Returns a dictionary mapping every image to a (status, seconds taken) tuple, where status is
+  one of 'present', 'pulled' or the error raised while preparing the image.
+  '''
+  if not client:
+    client = docker_client.get_default_client()
+
+  def prepare_image(image):
+    start = time.perf_counter()
+    try:
+      status = 'present'
+      if not client.image_exists(image):
+        client.pull_image(image)
+        status = 'pulled'
+
+      if warm_up:
+        client.remove_container(client.create_container(image))
+    except (OSError, docker_client.DockerApiError) as error:
+      status = error
+
+    return status, time.perf_counter() - start
+
+  images = sorted(set(images))
+  if not images:
+    return {}
+
+  with ThreadPoolExecutor(max_workers=min(max_workers, len(images))) as executor:
+    return dict(zip(images, executor.map(prepare_image, images)))
+
+def build_container_options(
+    function_dir,
+    layer_dir=None,
+    docker_network_name=None,
+    environment=None,
+    memory_size=None,
+    timeout=None
+  ):
+  '''
+  Builds the container options shared by every Lambda container (function and layer mounts,
+  environment variables, network and, if memory_size is specified, resource limits), as
+  expected by docker_client.DockerClient.create_container.
+  '''
+  binds = ['{}:{}:ro,delegated'.format(function_dir, IMAGE_TASK_DIR)]
+
+  # mount layer if present
+  if layer_dir:
+    layer_dir = os.path.abspath(layer_dir)
+    if not os.path.exists(layer_dir) and not os.path.isdir(layer_dir):
+      raise FileNotFoundError(
+        'Layer directory \'{}\' not found or is not a directory'.format(layer_dir)
+      )
+    binds.append('{}:{}:ro,delegated'.format(layer_dir, IMAGE_LAYER_DIR))
+
+  options = {
+    'binds': binds,
+    # pass function environment variables
+    'env': dict(environment) if environment else {},
+    # pass network if any to allow this container to access other services
+    'network': docker_network_name,
+    'host_config': {}
+  }
+
+  if memory_size:
+    options['host_config'].update(build_resource_limits(memory_size))
+    # read by the runtimes to fill in the context object
+    options['env']['AWS_LAMBDA_FUNCTION_MEMORY_SIZE'] = str(memory_size)
+  if timeout:
+    options['env']['AWS_LAMBDA_FUNCTION_TIMEOUT'] = str(timeout)
+
+  return options
+
+def build_resource_limits(memory_size):
+  '''
+  Returns the container HostConfig settings emulating a Lambda function with memory_size MB of
+  memory: a hard memory limit without swap, and CPU shares proportional to memory.
+  '''
+  memory = int(memory_size) * 1024 * 1024
+  return {
+    'Memory': memory,
+    'MemorySwap': memory,
+    # Docker's minimum
+    'CpuShares': max(2, int(CPU_SHARES_PER_VCPU * memory_size / MEMORY_PER_VCPU))
+  }
+
+def build_timeout_response(timeout, stdout=''):
+  '''
+  Returns the response object of an invocation killed after running for timeout seconds,
+  flagged with 'timed_out'.
+  '''
+  response = build_response(
+    json.dumps({
+      'errorType': 'TimeoutError',
+      'errorMessage': 'Task timed out after {:.2f} seconds'.format(timeout)
+    }),
+    1,
+    stdout
+  )
+  response['timed_out'] = True
+  return response
+
+def build_out_of_memory_response(memory_size, stdout=''):
+  '''
+  Returns the response object of an invocation killed for going over its memory_size MB memory
+  limit, flagged with 'out_of_memory'.
+  '''
+  response = build_response(
+    json.dumps({
+      'errorType': 'Runtime.OutOfMemory',
+      'errorMessage': 'Runtime exited with error: signal: killed (memory limit of {} MB exceeded)'.format(memory_size)
+    }),
+    1,
+    stdout
+  )
+  response['out_of_memory'] = True
+  return response
+
+def build_response_too_large_error(size):
+  '''
+  Returns the error object AWS Lambda returns when a function's response exceeds
+  MAX_RESPONSE_SIZE, as a json string.
+  '''
+  return json.dumps({
+    'errorType': 'Function.ResponseSizeTooLarge',
+    'errorMessage': 'Response payload size ({} bytes) exceeded maximum allowed payload size ({} bytes).'.format(
+      size,
+      MAX_RESPONSE_SIZE
+    )
+  })
+
+def build_response(function_output, retcode, stdout, stdout_file=None):
+  '''
+  Builds the response object returned by run_function out of the function's raw return value
+  (a json string), its exit code and its captured output (or the path of the file it was
+  spilled to if it was too large to keep in memory).
+  Return values over MAX_RESPONSE_SIZE are replaced with the error AWS Lambda returns for them.
+  '''
+  if function_output and len(function_output) * 4 > MAX_RESPONSE_SIZE:
+    size = len(function_output.encode('utf-8'))
+    if size > MAX_RESPONSE_SIZE:
+      function_output = build_response_too_large_error(size)
+      retcode = retcode if retcode else 1
+
+  ret_value = json.loads(function_output) if function_output else None
+  response = {
+    'raw_output': function_output if function_output != 'null' else None,
+    'return_value': ret_value,
+    'exit_status': retcode,
+    'stdout': stdout,
+    'stdout_file': stdout_file
+  }
+
+  if ret_value:
+    response['error_type'] = ret_value['errorType'] if 'errorType' in ret_value else None
+    response['error_message'] = ret_value['errorMessage'] if 'errorMessage' in ret_value else None
+    response['stack_trace'] = ret_value['stackTrace'] if 'stackTrace' in ret_value else None
+
+  return response
+
+def parse_report(output):
+  '''
+  Returns the durations (in seconds) found in the REPORT line a Lambda runtime prints after an
+  invocation, keyed by field name ('Duration', 'Init Duration'), if any.
+  '''
+  if isinstance(output, str):
+    output = output.encode('utf-8')
+  report = output.rfind(b'REPORT RequestId:')
+  if report == -1:
+    return {}
+  end = output.find(b'\n', report)
+  line = output[report:end] if end != -1 else output[report:]
+  return {name.decode('ascii'): float(value) / 1000 for name, value in REPORT_FIELD.findall(line)}
+
+def split_run_time(run_time, report):
+  '''
+  Splits the time a function took to run into runtime initialization and handler time, based on
+  the handler duration reported by its runtime if available. Returns a dictionary with 'init'
+  and 'handler' durations.
+  '''
+  handler_time = min(report['Duration'], run_time) if 'Duration' in report else run_time
+  return {'init': run_time - handler_time, 'handler': handler_time}
+
+def build_run_timings(timings, report):
+  '''
+  Converts the timings measured by docker_client's run_container into invocation phases:
+  'container' (create and start), 'init', 'handler' and 'teardown' (wait and remove).
+  '''
+  result = {'container': timings.get('start', 0)}
+  result.update(split_run_time(timings.get('run', 0), report))
+  result['teardown'] = timings.get('remove', 0)
+  return result
 
 def run_function(
     function_file_path,
@@ -14,7 +257,12 @@ def run_function(
     layer_dir=None,
     docker_network_name=None,
     environment=None,
-    handler_name='handler'
+    handler_name='handler',
+    client=None,
+    log_prefix=None,
+    max_output_size=DEFAULT_MAX_OUTPUT_SIZE,
+    memory_size=None,
+    timeout=None
   ):
   '''
   Runs the specified Lambda function and returns an object containing information
@@ -26,18 +274,130 @@ def run_function(
   If environment is passed, the values contained will be passed as environment
   variables which the function's runtime will be able to access.
   The function's entrypoint name can be configure by specifying handler_name (default: 'handler').
+  Containers are run through the provided docker_client.DockerClient, or a shared client
+  connected to the local Docker daemon if not specified.
+  If log_prefix is specified the function's logs are printed line by line, prefixed with it,
+  as they're produced. Captured output over max_output_size bytes is spilled to a temporary
+  file instead of being kept in memory.
+  If memory_size (MB) is specified the container's memory and CPU shares are limited the way
+  AWS Lambda limits them, and if timeout is specified it's killed after timeout seconds.
 
   Return type (dict):
   {
     'raw_output': Raw string with the function's return value if any>.
     'return_value': A Python type with the function's return value(s).
     'exit_status': A number indicating the function's exit code (zero means success).
-    'stdout': The full function output as captured via stdout.
+    'stdout': The function's output (logs), or None if it was spilled to a file.
+    'stdout_file': Path of the temporary file the function output was spilled to, if any.
+    'timings': Seconds spent in every phase of the invocation ('container', 'init', 'handler',
+      'teardown').
     'error_type': The (unhandled) exception type that was caught when the function was run.
     'error_message': The error message that was generated, if any.
     'stack_trace': The stack trace produced by the unhandled error, if any.
+    'timed_out': Set if the function was killed after running for longer than timeout seconds.
+    'out_of_memory': Set if the function was killed for using more than memory_size MB.
   }
   '''
+  image, cmd, options = build_run_config(
+    function_file_path,
+    payload=payload,
+    layer_dir=layer_dir,
+    docker_network_name=docker_network_name,
+    environment=environment,
+    handler_name=handler_name,
+    memory_size=memory_size,
+    timeout=timeout
+  )
+
+  if not client:
+    client = docker_client.get_default_client()
+
+  output = FunctionOutput(log_prefix=log_prefix, max_output_size=max_output_size)
+  timings = {}
+  status = {}
+  try:
+    retcode, _, _ = client.run_container(
+      image,
+      cmd=cmd,
+      on_output=output.capture,
+      timings=timings,
+      timeout=timeout,
+      status=status,
+      **options
+    )
+  finally:
+    output.close()
+
+  response = output.build_killed_response(status, memory_size, timeout) or output.build_response(retcode)
+  response['timings'] = build_run_timings(timings, output.report)
+  return response
+
+async def run_function_async(
+    function_file_path,
+    payload=None,
+    layer_dir=None,
+    docker_network_name=None,
+    environment=None,
+    handler_name='handler',
+    client=None,
+    log_prefix=None,
+    max_output_size=DEFAULT_MAX_OUTPUT_SIZE,
+    memory_size=None,
+    timeout=None
+  ):
+  '''
+  asyncio equivalent of run_function: the function container is run through the provided
+  docker_client.AsyncDockerClient (or a shared one) without blocking the event loop.
+  Returns the same object as run_function.
+  '''
+  image, cmd, options = build_run_config(
+    function_file_path,
+    payload=payload,
+    layer_dir=layer_dir,
+    docker_network_name=docker_network_name,
+    environment=environment,
+    handler_name=handler_name,
+    memory_size=memory_size,
+    timeout=timeout
+  )
+
+  if not client:
+    client = docker_client.get_default_async_client()
+
+  output = FunctionOutput(log_prefix=log_prefix, max_output_size=max_output_size)
+  timings = {}
+  status = {}
+  try:
+    retcode, _, _ = await client.run_container(
+      image,
+      cmd=cmd,
+      on_output=output.capture,
+      timings=timings,
+      timeout=timeout,
+      status=status,
+      **options
+    )
+  finally:
+    output.close()
+
+  response = output.build_killed_response(status, memory_size, timeout) or output.build_response(retcode)
+  response['timings'] = build_run_timings(timings, output.report)
+  return response
+
+def build_run_config(
+    function_file_path,
+    payload=None,
+    layer_dir=None,
+    docker_network_name=None,
+    environment=None,
+    handler_name='handler',
+    memory_size=None,
+    timeout=None
+  ):
+  '''
+  Returns the image, command and container options used to run the specified Lambda function.
+  The options include the serialized payload to be written to the container's stdin.
+  '''
   # validate function directory exists
   if not os.path.exists(function_file_path) and not os.path.isfile(function_file_path):
     raise FileNotFoundError(
@@ -47,74 +407,222 @@ def run_function(
   function_name = os.path.splitext(os.path.basename(function_file_path))[0]
   function_dir = os.path.dirname(function_file_path)
 
-  runtime = None
-  function_extension = os.path.splitext(function_file_path)[1]
-  if function_extension == '.js':
-    runtime = 'node'
-  elif function_extension == '.py':
-    runtime = 'python'
-  else:
-    raise TypeError(
-      'Cannot find matching Lambda runtime for function extension "{}"'.format(function_extension)
+  runtime = get_function_runtime(function_file_path)
+
+  cmd = ['{}.{}'.format(function_name, handler_name)]
+
+  options = build_container_options(
+    function_dir,
+    layer_dir=layer_dir,
+    docker_network_name=docker_network_name,
+    environment=environment,
+    memory_size=memory_size,
+    timeout=timeout
+  )
+
+  # the event is streamed through stdin rather than passed as a command argument, which is
+  # limited in size
+  options['env'][USE_STDIN_VARIABLE] = '1'
+  options['stdin'] = json.dumps(payload if payload else {}).encode('utf-8')
+
+  return IMAGES[runtime], cmd, options
+
+def print_function_output(output, log_prefix=''):
+  '''
+  Prints a function's captured output line by line, prefixed with log_prefix.
+  '''
+  for line in output.splitlines():
+    sys.stdout.write(log_prefix + line + '\n')
+  sys.stdout.flush()
+
+_output_files_lock = threading.Lock()
+# output files still being written to, which are never deleted
+_open_output_files = set()
+
+def create_output_file():
+  '''
+  Creates a file in OUTPUT_DIR for function output to be spilled to, deleting the oldest ones
+  so that at most MAX_OUTPUT_FILES are kept, apart from those still open.
+  The file must be closed with close_output_file.
+  '''
+  with _output_files_lock:
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    paths = []
+    for name in os.listdir(OUTPUT_DIR):
+      path = os.path.join(OUTPUT_DIR, name)
+      try:
+        paths.append((os.path.getmtime(path), path))
+      except OSError:
+        pass
+    for _, path in sorted(paths)[:max(len(paths) - MAX_OUTPUT_FILES + 1, 0)]:
+      if path in _open_output_files:
+        continue
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+    output_file = tempfile.NamedTemporaryFile(
+      dir=OUTPUT_DIR,
+      prefix='cyclon-output-',
+      suffix='.log',
+      delete=False
     )
+    _open_output_files.add(output_file.name)
+    return output_file
 
-  # the Docker Lambda images we currently support
-  IMAGES = {
-    'node': NODE_IMAGE_NAME,
-    'python': PYTHON_IMAGE_NAME
-  }
+def close_output_file(output_file):
+  '''
+  Closes a file created by create_output_file, allowing it to be deleted.
+  '''
+  output_file.close()
+  with _output_files_lock:
+    _open_output_files.discard(output_file.name)
 
-  # build Docker command:
-  cmd = 'docker run --rm -it -v {}:{}:ro,delegated'.format(function_dir, IMAGE_TASK_DIR)
+class FunctionOutput:
+  '''
+  Captures a function container's output as it's produced, keeping the function's return value
+  (the last line printed by the runtime to stdout) apart from its logs, which make up the
+  captured output.
+  Only the current stdout line is buffered, up to MAX_RESPONSE_SIZE bytes: earlier lines are
+  logs, and longer lines are counted but dropped since they can't be valid responses anyway.
+  Logs are printed as they arrive if log_prefix is specified, and the captured output is kept in
+  memory up to max_output_size bytes, spilling to a file in OUTPUT_DIR beyond that (see
+  create_output_file).
+  '''
+  def __init__(self, log_prefix=None, max_output_size=DEFAULT_MAX_OUTPUT_SIZE):
+    self.log_prefix = log_prefix
+    self.max_output_size = max_output_size
+    self.output_size = 0
+    self.output_file_path = None
+    # durations of the runtime's REPORT line
+    self.report = {}
 
-  # mount layer if present
-  if layer_dir:
-    layer_dir = os.path.abspath(layer_dir)
-    if not os.path.exists(layer_dir) and not os.path.isdir(layer_dir):
-      raise FileNotFoundError(
-        'Layer directory \'{}\' not found or is not a directory'.format(layer_dir)
-      )
-    cmd += ' -v {}:{}:ro,delegated'.format(layer_dir, IMAGE_LAYER_DIR)
+    self.__output = bytearray()
+    self.__output_file = None
+    # partial log line of each stream
+    self.__log_lines = {}
+    self.__result = bytearray()
+    self.__result_size = 0
+    self.__result_complete = False
 
-  # pass function environment variables
-  if environment:
-    for key in environment:
-      cmd += ' -e {}=\'{}\''.format(key, environment[key])
+  def capture(self, stream_type, data):
+    if stream_type != docker_client.STDOUT:
+      self.__capture_output(data)
+      self.__stream_log(stream_type, data)
+      if b'REPORT RequestId:' in data:
+        self.report = parse_report(data)
+      return
 
-  # pass network if any to allow this container to access other services
-  if docker_network_name:
-    cmd += ' --network {}'.format(docker_network_name)
+    # only the last stdout line is the function's return value: anything before it is output
+    newline = data.rfind(b'\n', 0, len(data) - 1)
+    if newline != -1 or (self.__result_complete and data):
+      output = bytes(self.__result) + data[:newline + 1]
+      self.__capture_output(output)
+      self.__stream_log(stream_type, output)
+      self.__result.clear()
+      self.__result_size = 0
+      data = data[newline + 1:]
 
-  # configure lambda Docker image and function entrypoint
-  cmd += ' {} {}.{}'.format(IMAGES[runtime], function_name, handler_name)
+    self.__result_complete = data.endswith(b'\n')
+    self.__result_size += len(data)
+    if self.__result_size <= MAX_RESPONSE_SIZE + 1:
+      self.__result += data
+    else:
+      self.__result.clear()
 
-  if payload:
-    cmd += ' \'{}\''.format(json.dumps(payload))
+  def close(self):
+    '''
+    Flushes any pending log line and closes the spill file, if any.
+    '''
+    for log_line in self.__log_lines.values():
+      if log_line:
+        self.__print_log_line(bytes(log_line))
+    self.__log_lines = {}
 
-  # run lambda
-  retcode = 0
-  stdout = ''
-  try:
-    output = utils.run_cmd(cmd)
-    retcode = output.returncode
-    stdout = output.stdout.decode('utf-8')
-  except subprocess.CalledProcessError as error:
-    retcode = error.returncode
-    stdout = error.stdout.decode('utf-8')
-
-  # last line is a string returned by the function runtime, if any
-  function_output = stdout.splitlines()[-1]
-  ret_value = json.loads(function_output)
-  response = {
-    'raw_output': function_output if function_output != 'null' else None,
-    'return_value': ret_value,
-    'exit_status': retcode,
-    'stdout': stdout
-  }
+    if self.__output_file:
+      close_output_file(self.__output_file)
+      self.__output_file = None
 
-  if ret_value:
-    response['error_type'] = ret_value['errorType'] if 'errorType' in ret_value else None
-    response['error_message'] = ret_value['errorMessage'] if 'errorMessage' in ret_value else None
-    response['stack_trace'] = ret_value['stackTrace'] if 'stackTrace' in ret_value else None
+  def build_response(self, retcode):
+    self.close()
 
-  return response
+    stdout = None
+    if self.output_file_path is None:
+      stdout = self.__output.decode('utf-8', errors='replace')
+
+    result_size = self.__result_size - (1 if self.__result.endswith(b'\n') else 0)
+    if result_size > MAX_RESPONSE_SIZE:
+      function_output = build_response_too_large_error(result_size)
+      retcode = retcode if retcode else 1
+    else:
+      function_output = self.__result.decode('utf-8', errors='replace').strip()
+
+    return build_response(
+      function_output if function_output else None,
+      retcode,
+      stdout,
+      stdout_file=self.output_file_path
+    )
+
+  def build_killed_response(self, status, memory_size, timeout):
+    '''
+    Returns the response of an invocation whose container was killed for running out of time
+    or memory, according to the status filled in by docker_client's run_container, or None if
+    it wasn't. Whatever was printed last is part of the output rather than a return value.
+    '''
+    if not status.get('timed_out') and not status.get('oom_killed'):
+      return None
+
+    self.__capture_output(bytes(self.__result))
+    self.__result.clear()
+    self.close()
+
+    stdout = None
+    if self.output_file_path is None:
+      stdout = self.__output.decode('utf-8', errors='replace')
+
+    if status.get('timed_out'):
+      response = build_timeout_response(timeout, stdout)
+    else:
+      response = build_out_of_memory_response(memory_size, stdout)
+    response['stdout_file'] = self.output_file_path
+    return response
+
+  def __capture_output(self, data):
+    self.output_size += len(data)
+
+    if self.__output_file is None and self.output_size > self.max_output_size:
+      self.__output_file = create_output_file()
+      self.output_file_path = self.__output_file.name
+      self.__output_file.write(self.__output)
+      self.__output = bytearray()
+      if self.log_prefix is not None:
+        sys.stdout.write('{}Output exceeds {} bytes, capturing it to {}\n'.format(
+          self.log_prefix,
+          self.max_output_size,
+          self.output_file_path
+        ))
+
+    if self.__output_file is not None:
+      self.__output_file.write(data)
+    else:
+      self.__output += data
+
+  def __stream_log(self, stream_type, data):
+    if self.log_prefix is None:
+      return
+
+    log_line = self.__log_lines.setdefault(stream_type, bytearray())
+    log_line += data
+    newline = log_line.rfind(b'\n')
+    if newline != -1:
+      self.__print_log_line(bytes(log_line[:newline]))
+      del log_line[:newline + 1]
+
+    if len(log_line) > MAX_LOG_LINE_SIZE:
+      self.__print_log_line(bytes(log_line))
+      log_line.clear()
+
+  def __print_log_line(self, data):
+    print_function_output(data.decode('utf-8', errors='replace'), self.log_prefix)
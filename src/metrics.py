@@ -0,0 +1,359 @@
+'''
+Gateway metrics: per-invocation phase timings, reported as Lambda-style REPORT lines and
+collected into counters, gauges and histograms exposed in the Prometheus text format.
+
+Reference: https://prometheus.io/docs/instrumenting/exposition_formats/
+'''
+
+import math
+import threading
+
+import utils
+
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# invocation phases, in the order they happen
+PHASE_ROUTE_MATCH = 'route_match'
+PHASE_AUTHORIZE = 'authorize'
+PHASE_PAYLOAD_BUILD = 'payload_build'
+PHASE_QUEUE = 'queue'
+PHASE_CONTAINER = 'container'
+PHASE_INIT = 'init'
+PHASE_HANDLER = 'handler'
+PHASE_TEARDOWN = 'teardown'
+PHASE_OUTPUT_PARSE = 'output_parse'
+PHASE_RESPONSE_WRITE = 'response_write'
+
+PHASE_NAMES = {
+  PHASE_ROUTE_MATCH: 'Route Match',
+  PHASE_AUTHORIZE: 'Authorize',
+  PHASE_PAYLOAD_BUILD: 'Payload Build',
+  PHASE_QUEUE: 'Queue',
+  PHASE_CONTAINER: 'Container',
+  PHASE_INIT: 'Init',
+  PHASE_HANDLER: 'Handler',
+  PHASE_TEARDOWN: 'Teardown',
+  PHASE_OUTPUT_PARSE: 'Output Parse',
+  PHASE_RESPONSE_WRITE: 'Response Write'
+}
+
+# histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def format_labels(labels):
+  if not labels:
+    return ''
+  return '{' + ','.join(
+    '{}="{}"'.format(
+      name,
+      str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    )
+    for name, value in labels
+  ) + '}'
+
+def format_value(value):
+  if value == math.inf:
+    return '+Inf'
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+  return str(value)
+
+class Metric:
+  '''
+  Base class of labeled metrics. Samples are keyed by a tuple of (label name, value) pairs.
+  '''
+  type = 'untyped'
+
+  def __init__(self, name, help_text):
+    self.name = name
+    self.help_text = help_text
+    self.samples = {}
+    self.lock = threading.Lock()
+
+  @staticmethod
+  def key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+  def render(self):
+    lines = [
+      '# HELP {} {}'.format(self.name, self.help_text),
+      '# TYPE {} {}'.format(self.name, self.type)
+    ]
+    with self.lock:
+      for key, value in sorted(self.samples.items()):
+        lines.extend(self.render_sample(key, value))
+    return lines
+
+  def render_sample(self, key, value):
+    return ['{}{} {}'.format(self.name, format_labels(key), format_value(value))]
+
+class Counter(Metric):
+  type = 'counter'
+
+  def inc(self, value=1, **labels):
+    key = Metric.key(labels)
+    with self.lock:
+      self.samples[key] = self.samples.get(key, 0) + value
+
+class Gauge(Metric):
+  type = 'gauge'
+
+  def set(self, value, **labels):
+    with self.lock:
+      self.samples[Metric.key(labels)] = value
+
+  def inc(self, value=1, **labels):
+    key = Metric.key(labels)
+    with self.lock:
+      self.samples[key] = self.samples.get(key, 0) + value
+
+  def dec(self, value=1, **labels):
+    self.inc(-value, **labels)
+
+class Histogram(Metric):
+  '''
+  Histogram with cumulative buckets (upper bounds, in ascending order).
+  '''
+  type = 'histogram'
+
+  def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+    super().__init__(name, help_text)
+    self.buckets = tuple(buckets) + (math.inf,)
+
+  def observe(self, value, **labels):
+    key = Metric.key(labels)
+    with self.lock:
+      sample = self.samples.get(key)
+      if sample is None:
+        # per-bucket counts, sum and count
+        sample = self.samples[key] = [[0] * len(self.buckets), 0, 0]
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          sample[0][i] += 1
+          break
+      sample[1] += value
+      sample[2] += 1
+
+  def render_sample(self, key, sample):
+    counts, total, count = sample
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(self.buckets, counts):
+      cumulative += bucket_count
+      lines.append('{}_bucket{} {}'.format(
+        self.name,
+        format_labels(key + (('le', format_value(bound)),)),
+        cumulative
+      ))
+    lines.append('{}_sum{} {}'.format(self.name, format_labels(key), format_value(total)))
+    lines.append('{}_count{} {}'.format(self.name, format_labels(key), count))
+    return lines
+
+class Registry:
+  '''
+  Set of metrics rendered together. Collectors are functions called at render time that return
+  extra metrics, e.g. gauges built from another component's stats.
+  '''
+  def __init__(self):
+    self.metrics = []
+    self.collectors = []
+
+  def register(self, metric):
+    self.metrics.append(metric)
+    return metric
+
+  def render(self):
+    metrics = list(self.metrics)
+    for collector in self.collectors:
+      metrics.extend(collector())
+    return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+class InvocationTimer(utils.PhaseTimer):
+  '''
+  Measures the phases of a single invocation, from route match to response write.
+  '''
+  def add(self, name, duration):
+    self.phases.append((name, duration))
+
+  def durations(self):
+    '''
+    Returns the total duration of every phase, in seconds.
+    '''
+    result = {}
+    for name, duration in self.phases:
+      result[name] = result.get(name, 0) + duration
+    return result
+
+  def report_line(self, request_id, function_name, cold_start=False):
+    '''
+    Returns a Lambda-style REPORT line with the invocation's phase durations.
+    '''
+    durations = self.durations()
+    fields = [
+      'REPORT RequestId: {}'.format(request_id),
+      'Function: {}'.format(function_name),
+      'Duration: {:.2f} ms'.format(sum(durations.values()) * 1000)
+    ]
+    for phase, duration in durations.items():
+      fields.append('{}: {:.2f} ms'.format(PHASE_NAMES.get(phase, phase), duration * 1000))
+    fields.append('Cold Start: {}'.format('yes' if cold_start else 'no'))
+    return '\t'.join(fields)
+
+class GatewayMetrics:
+  '''
+  Request, error, cold start and in-flight counters along with per-function phase histograms.
+  If specified, the stats of container_pool (container_pool.ContainerPool),
+  concurrency_limiter (concurrency.ConcurrencyLimiter), memory_budget
+  (concurrency.MemoryBudget) and response_cache (response_cache.ResponseCache) are exposed as
+  well. Metrics are only updated through methods, so that pre-forked HTTP workers can share
+  the coordinator's (see prefork.py).
+  '''
+  def __init__(self, container_pool=None, concurrency_limiter=None, memory_budget=None, response_cache=None):
+    self.container_pool = container_pool
+    self.concurrency_limiter = concurrency_limiter
+    self.memory_budget = memory_budget
+    self.response_cache = response_cache
+    self.registry = Registry()
+
+    self.requests = self.registry.register(Counter(
+      'cyclon_requests_total',
+      'HTTP requests handled, by route and status code.'
+    ))
+    self.invocations = self.registry.register(Counter(
+      'cyclon_invocations_total',
+      'Function invocations, by function.'
+    ))
+    self.errors = self.registry.register(Counter(
+      'cyclon_invocation_errors_total',
+      'Function invocations that returned an error, by function.'
+    ))
+    self.cold_starts = self.registry.register(Counter(
+      'cyclon_cold_starts_total',
+      'Function invocations served by a new container, by function.'
+    ))
+    self.in_flight = self.registry.register(Gauge(
+      'cyclon_in_flight_invocations',
+      'Function invocations in progress, by function.'
+    ))
+    self.duration = self.registry.register(Histogram(
+      'cyclon_invocation_duration_seconds',
+      'End to end invocation duration, by function.'
+    ))
+    self.phase_duration = self.registry.register(Histogram(
+      'cyclon_invocation_phase_duration_seconds',
+      'Invocation phase durations, by function and phase.'
+    ))
+    self.cache_hits = self.registry.register(Counter(
+      'cyclon_cache_hits_total',
+      'Requests answered from the response cache, by route.'
+    ))
+    self.cache_misses = self.registry.register(Counter(
+      'cyclon_cache_misses_total',
+      'Cacheable requests that invoked their function, by route.'
+    ))
+    self.coalesced = self.registry.register(Counter(
+      'cyclon_coalesced_requests_total',
+      'Requests that shared the invocation of an identical concurrent request (i.e. invocations saved), by route.'
+    ))
+    self.registry.collectors.append(self.__collect)
+
+  def record_request(self, route_key, status_code):
+    self.requests.inc(route=route_key, status=status_code)
+
+  def record_cache_lookup(self, route_key, hit):
+    (self.cache_hits if hit else self.cache_misses).inc(route=route_key)
+
+  def record_coalesced(self, route_key):
+    self.coalesced.inc(route=route_key)
+
+  def invocation_started(self, function_name):
+    self.in_flight.inc(function=function_name)
+
+  def invocation_finished(self, function_name):
+    self.in_flight.dec(function=function_name)
+
+  def record_invocation(self, function_name, timer, cold_start=False, error=False):
+    '''
+    Records a completed invocation and its phase timings.
+    '''
+    durations = timer.durations()
+    self.invocations.inc(function=function_name)
+    if cold_start:
+      self.cold_starts.inc(function=function_name)
+    if error:
+      self.errors.inc(function=function_name)
+
+    self.duration.observe(sum(durations.values()), function=function_name)
+    for phase, duration in durations.items():
+      self.phase_duration.observe(duration, function=function_name, phase=phase)
+
+  def render(self):
+    '''
+    Returns the metrics in the Prometheus text format.
+    '''
+    return self.registry.render()
+
+  def __collect(self):
+    metrics = []
+
+    cold_start_ratio = Gauge('cyclon_cold_start_ratio', 'Ratio of invocations that were cold starts, by function.')
+    with self.invocations.lock, self.cold_starts.lock:
+      for key, count in self.invocations.samples.items():
+        cold_start_ratio.samples[key] = self.cold_starts.samples.get(key, 0) / count if count else 0
+    metrics.append(cold_start_ratio)
+
+    if self.container_pool:
+      stats = self.container_pool.stats()
+      for name, help_text in (
+          ('cold_starts', 'Container pool cold starts.'),
+          ('warm_starts', 'Container pool warm starts.'),
+          ('containers', 'Containers started by the container pool.'),
+          ('idle_containers', 'Idle warm containers.')
+        ):
+        metric = (Counter if name.endswith('starts') else Gauge)(
+          'cyclon_container_pool_' + name + ('_total' if name.endswith('starts') else ''),
+          help_text
+        )
+        metric.samples[()] = stats[name]
+        metrics.append(metric)
+
+    if self.concurrency_limiter:
+      gauges = {
+        'capacity': Gauge('cyclon_concurrency_capacity', 'Concurrency pool capacity, by function.'),
+        'in_flight': Gauge('cyclon_concurrency_in_flight', 'Concurrency pool executions in progress, by function.'),
+        'queue_depth': Gauge('cyclon_concurrency_queue_depth', 'Invocations waiting for an execution slot, by function.')
+      }
+      counters = {
+        'queued': Counter('cyclon_concurrency_queued_total', 'Invocations that waited for an execution slot, by function.'),
+        'throttles': Counter('cyclon_concurrency_throttles_total', 'Throttled invocations, by function.'),
+        'total_wait_time': Counter('cyclon_concurrency_wait_seconds_total', 'Time spent waiting for execution slots, by function.')
+      }
+      for function_name, stats in self.concurrency_limiter.stats().items():
+        key = (('function', function_name),)
+        for name, metric in list(gauges.items()) + list(counters.items()):
+          metric.samples[key] = stats[name]
+      metrics.extend(gauges.values())
+      metrics.extend(counters.values())
+
+    if self.response_cache:
+      stats = self.response_cache.stats()
+      for metric, value in (
+          (Gauge('cyclon_cache_entries', 'Responses held by the response cache.'), stats['entries']),
+          (Gauge('cyclon_cache_size_bytes', 'Size of the responses held by the response cache.'), stats['size']),
+          (Counter('cyclon_cache_evictions_total', 'Responses evicted from the response cache to make room.'), stats['evictions'])
+        ):
+        metric.samples[()] = value
+        metrics.append(metric)
+
+    if self.memory_budget:
+      stats = self.memory_budget.stats()
+      for metric, value in (
+          (Gauge('cyclon_memory_budget_megabytes', 'Host memory budget shared by running invocations.'), stats['budget']),
+          (Gauge('cyclon_memory_committed_megabytes', 'Memory committed by running invocations.'), stats['committed']),
+          (Counter('cyclon_memory_refused_total', 'Invocations refused for exceeding the memory budget.'), stats['refused'])
+        ):
+        metric.samples[()] = value
+        metrics.append(metric)
+
+    return metrics
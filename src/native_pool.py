@@ -0,0 +1,427 @@
+'''
+Native execution backend.
+
+Python and Node.js functions are run by pools of long-lived worker processes (native_worker.py
+and native_worker.js) rather than Docker containers: every worker loads its function's handler
+once and then serves invocations over a pipe, so warm invocations take milliseconds. Workers run
+the gateway host's interpreters with an environment made only of the Lambda runtime variables
+and the configured environment. They're killed when an invocation times out, replaced when they
+crash and recycled when the function's source files change. Without cgroups, memory limits are
+approximated with the interpreters' own limits: a data segment limit for Python workers and a
+heap limit for Node.js ones.
+
+Reference: https://docs.aws.amazon.com/lambda/latest/dg/python-handler.html
+Reference: https://docs.aws.amazon.com/lambda/latest/dg/nodejs-handler.html
+'''
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import lambda_utils
+import utils
+from native_worker import read_frame, write_frame
+
+BACKEND_DOCKER = 'docker'
+BACKEND_NATIVE = 'native'
+BACKENDS = (BACKEND_DOCKER, BACKEND_NATIVE)
+
+# worker script run for every runtime the native backend supports
+WORKER_SCRIPTS = {
+  'node': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'native_worker.js'),
+  'python': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'native_worker.py')
+}
+NATIVE_RUNTIMES = tuple(WORKER_SCRIPTS)
+NODE_EXECUTABLE = 'node'
+# source files whose changes recycle a function's workers, per runtime
+SOURCE_EXTENSIONS = {
+  'node': ('.js', '.json'),
+  'python': ('.py',)
+}
+
+DEFAULT_REGION = 'us-east-1'
+
+def supports_native_backend(function_file_path):
+  try:
+    return lambda_utils.get_function_runtime(function_file_path) in NATIVE_RUNTIMES
+  except TypeError:
+    return False
+
+def source_fingerprint(function_file_path):
+  '''
+  Returns a value that changes whenever one of the source files of the function's directory (or
+  its subdirectories) is added, removed or modified.
+  '''
+  extensions = SOURCE_EXTENSIONS[lambda_utils.get_function_runtime(function_file_path)]
+  fingerprint = []
+  function_dir = os.path.dirname(os.path.abspath(function_file_path))
+  for path in sorted(utils.list_files(function_dir, lambda path: path.endswith(extensions), recursive=True)):
+    try:
+      stat = os.stat(path)
+    except OSError:
+      continue
+    fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+  return hash(tuple(fingerprint))
+
+class NativeWorker:
+  '''
+  A running worker process serving one function.
+  '''
+  def __init__(self, process, generation):
+    self.process = process
+    self.generation = generation
+    self.timed_out = False
+    self.created_at = time.time()
+    self.last_used = self.created_at
+    self.invocations = 0
+
+class NativePool:
+  '''
+  Keeps a per-function pool of native worker processes and routes invocations to them.
+
+  At most max_workers workers per function are started; requests exceeding that number wait
+  for a worker to be released. Workers get environment (e.g. read with utils.read_env_file) on
+  top of the Lambda runtime variables, and see layer_dir's packages like /opt's. Invocations
+  running for more than their function's timeout (the "timeout" endpoint config setting, or
+  timeout seconds) are aborted by killing their worker, and workers' memory is limited to their
+  function's "memorySize" (or memory_size MB). Functions' source files are checked for changes
+  at most every check_interval seconds.
+  '''
+  def __init__(
+      self,
+      max_workers=1,
+      environment=None,
+      layer_dir=None,
+      region=None,
+      memory_size=lambda_utils.DEFAULT_MEMORY_SIZE,
+      timeout=lambda_utils.DEFAULT_TIMEOUT,
+      check_interval=1
+    ):
+    if max_workers < 1:
+      raise ValueError('Invalid worker limit: {}'.format(max_workers))
+
+    self.max_workers = max_workers
+    self.environment = environment
+    self.layer_dir = layer_dir
+    self.region = region if region else DEFAULT_REGION
+    self.memory_size = memory_size
+    self.timeout = timeout
+    self.check_interval = check_interval
+
+    self.cold_starts = 0
+    self.warm_starts = 0
+
+    # function key -> list of idle workers, ordered from least to most recently used
+    self.__idle = {}
+    # function key -> number of workers started (idle + busy)
+    self.__started = {}
+    # function key -> generation, bumped when the function's workers are recycled
+    self.__generations = {}
+    # function file path -> (time of the last check, source fingerprint)
+    self.__fingerprints = {}
+    self.__lock = threading.Condition()
+    self.__closed = False
+
+  @staticmethod
+  def __function_key(function_file_path, handler_name):
+    return function_file_path + ':' + handler_name
+
+  def prewarm(self, endpoint_config):
+    '''
+    Starts a worker for every function found in the provided endpoint configuration.
+    '''
+    functions = {}
+    for api in endpoint_config.values():
+      functions[NativePool.__function_key(api['filepath'], api['handler'])] = api
+
+    for key, api in functions.items():
+      with self.__lock:
+        if self.__started.get(key, 0) >= self.max_workers:
+          continue
+        self.__started[key] = self.__started.get(key, 0) + 1
+        generation = self.__generations.get(key, 0)
+
+      try:
+        worker = self.__start_worker(api, generation)
+      except Exception:
+        with self.__lock:
+          self.__started[key] -= 1
+        raise
+
+      self.__release(key, worker)
+
+  def invoke(self, api_config, payload):
+    '''
+    Invokes the function described by api_config (an endpoint config entry) with the provided
+    payload using an idle worker, starting a new one if none is available.
+    Returns the same object as lambda_utils.run_function, plus a 'cold_start' flag. Its
+    'container' timing is the time spent acquiring a worker, including starting it.
+    '''
+    self.__check_sources(api_config['filepath'])
+
+    key = NativePool.__function_key(api_config['filepath'], api_config['handler'])
+    start = time.perf_counter()
+    worker, cold_start = self.__acquire(key, api_config)
+    acquire_time = time.perf_counter() - start
+
+    # events other than HTTP API payloads (e.g. SQS batches) don't carry a request id
+    request_id = (payload or {}).get('requestContext', {}).get('requestId') or str(uuid.uuid4())
+    timeout = api_config.get('timeout') or self.timeout
+    # the worker is killed if it's still busy once the invocation times out
+    watchdog = threading.Timer(timeout, NativePool.__kill_worker, (worker,))
+    watchdog.daemon = True
+
+    start = time.perf_counter()
+    watchdog.start()
+    try:
+      write_frame(worker.process.stdin, {
+        'request_id': request_id,
+        'deadline_ms': int((time.time() + timeout) * 1000),
+        'event': payload if payload else {}
+      })
+      frame = read_frame(worker.process.stdout)
+    except (OSError, ValueError):
+      frame = None
+    finally:
+      watchdog.cancel()
+    invoke_time = time.perf_counter() - start
+
+    if frame is None:
+      self.__discard(key, worker)
+      self.__replace(key, api_config)
+
+      if worker.timed_out:
+        response = lambda_utils.build_timeout_response(timeout)
+      elif worker.process.poll() == -signal.SIGABRT:
+        # Node.js aborts once its heap limit is reached
+        response = lambda_utils.build_out_of_memory_response(self.__memory_size(api_config))
+      else:
+        # the worker exited (e.g. the handler called sys.exit or crashed the interpreter)
+        response = lambda_utils.build_response(json.dumps({
+          'errorType': 'Runtime.ExitError',
+          'errorMessage': 'RequestId: {} Error: Runtime exited with error: exit status {}'.format(
+            request_id,
+            worker.process.poll()
+          )
+        }), 1, '')
+    else:
+      worker.invocations += 1
+      if worker.timed_out:
+        # the watchdog fired right as the response came in
+        self.__discard(key, worker)
+        self.__replace(key, api_config)
+      else:
+        self.__release(key, worker)
+      response = lambda_utils.build_response(frame['output'], frame['exit_status'], frame['logs'])
+      if response['exit_status'] != 0 and response.get('error_type') == 'MemoryError':
+        # Python raises MemoryError once its data segment limit is reached
+        response = lambda_utils.build_out_of_memory_response(self.__memory_size(api_config), frame['logs'])
+
+    response['cold_start'] = cold_start
+    response['timings'] = dict(
+      {'container': acquire_time},
+      **lambda_utils.split_run_time(invoke_time, lambda_utils.parse_report(response['stdout']))
+    )
+    return response
+
+  def recycle(self, function_file_path=None):
+    '''
+    Stops the idle workers of the function located at function_file_path (or every idle worker
+    if not specified). Busy workers are stopped as soon as they're released, so that new
+    requests are served by workers running the function's current code.
+    '''
+    stale = []
+    with self.__lock:
+      for key in self.__started:
+        if function_file_path is None or key.startswith(function_file_path + ':'):
+          self.__generations[key] = self.__generations.get(key, 0) + 1
+          idle = self.__idle.pop(key, [])
+          stale.extend(idle)
+          self.__started[key] -= len(idle)
+      self.__lock.notify_all()
+
+    for worker in stale:
+      NativePool.__stop_worker(worker)
+
+  def stats(self):
+    '''
+    Returns the pool's cold/warm start counters along with the current worker count.
+    '''
+    with self.__lock:
+      return {
+        'cold_starts': self.cold_starts,
+        'warm_starts': self.warm_starts,
+        'workers': sum(self.__started.values()),
+        'idle_workers': sum(len(idle) for idle in self.__idle.values())
+      }
+
+  def shutdown(self):
+    '''
+    Stops every idle worker and prevents new ones from being started.
+    '''
+    with self.__lock:
+      self.__closed = True
+    self.recycle()
+
+  def __check_sources(self, function_file_path):
+    now = time.time()
+    with self.__lock:
+      checked = self.__fingerprints.get(function_file_path)
+      if checked and now - checked[0] < self.check_interval:
+        return
+
+    fingerprint = source_fingerprint(function_file_path)
+    with self.__lock:
+      previous = self.__fingerprints.get(function_file_path)
+      self.__fingerprints[function_file_path] = (now, fingerprint)
+    if previous and previous[1] != fingerprint:
+      print('Source of {} changed, recycling its workers'.format(os.path.relpath(function_file_path)))
+      self.recycle(function_file_path)
+
+  def __replace(self, key, api_config):
+    '''
+    Starts a worker in the background to replace one that crashed or was killed, so that the
+    function's next invocation doesn't pay for a cold start.
+    '''
+    with self.__lock:
+      if self.__closed or self.__started.get(key, 0) >= self.max_workers:
+        return
+      self.__started[key] = self.__started.get(key, 0) + 1
+      generation = self.__generations.get(key, 0)
+
+    def start_worker():
+      try:
+        worker = self.__start_worker(api_config, generation)
+      except Exception as error:
+        print('Unable to restart worker of function "{}": {}'.format(api_config['function'], error), file=sys.stderr)
+        with self.__lock:
+          self.__started[key] -= 1
+          self.__lock.notify_all()
+        return
+      self.__release(key, worker)
+
+    threading.Thread(target=start_worker, daemon=True).start()
+
+  def __acquire(self, key, api_config):
+    with self.__lock:
+      while True:
+        if self.__closed:
+          raise RuntimeError('Native worker pool has been shut down')
+
+        idle = self.__idle.get(key)
+        if idle:
+          self.warm_starts += 1
+          return idle.pop(), False
+
+        if self.__started.get(key, 0) < self.max_workers:
+          self.__started[key] = self.__started.get(key, 0) + 1
+          self.cold_starts += 1
+          generation = self.__generations.get(key, 0)
+          break
+
+        # all workers for this function are busy, wait for one to be released
+        self.__lock.wait()
+
+    try:
+      return self.__start_worker(api_config, generation), True
+    except Exception:
+      with self.__lock:
+        self.__started[key] -= 1
+        self.__lock.notify_all()
+      raise
+
+  def __release(self, key, worker):
+    with self.__lock:
+      if not self.__closed and worker.generation == self.__generations.get(key, 0):
+        worker.last_used = time.time()
+        self.__idle.setdefault(key, []).append(worker)
+        self.__lock.notify_all()
+        return
+
+      # the pool was shut down or the function's workers recycled while it was busy
+      self.__started[key] -= 1
+      self.__lock.notify_all()
+    NativePool.__stop_worker(worker)
+
+  def __discard(self, key, worker):
+    with self.__lock:
+      self.__started[key] -= 1
+      self.__lock.notify_all()
+    NativePool.__stop_worker(worker)
+
+  def __build_environment(self, api_config, runtime):
+    function_name = api_config['function']
+    handler_module = os.path.splitext(os.path.basename(api_config['filepath']))[0]
+
+    # workers don't inherit the gateway's environment, like functions running in containers
+    env = {
+      'PATH': os.environ.get('PATH', os.defpath),
+      'LANG': 'en_US.UTF-8',
+      'TZ': ':UTC',
+      'LAMBDA_TASK_ROOT': os.path.dirname(os.path.abspath(api_config['filepath'])),
+      '_HANDLER': '{}.{}'.format(handler_module, api_config['handler']),
+      'AWS_REGION': self.region,
+      'AWS_DEFAULT_REGION': self.region,
+      'AWS_LAMBDA_FUNCTION_NAME': function_name,
+      'AWS_LAMBDA_FUNCTION_VERSION': '$LATEST',
+      'AWS_LAMBDA_FUNCTION_MEMORY_SIZE': str(self.__memory_size(api_config)),
+      'AWS_LAMBDA_LOG_GROUP_NAME': '/aws/lambda/' + function_name,
+      'AWS_LAMBDA_LOG_STREAM_NAME': '{}/[$LATEST]{}'.format(time.strftime('%Y/%m/%d'), uuid.uuid4().hex)
+    }
+    if self.layer_dir and runtime == 'node':
+      env['NODE_PATH'] = os.pathsep.join([
+        os.path.join(self.layer_dir, 'nodejs', 'node_modules'),
+        os.path.join(self.layer_dir, 'node_modules')
+      ])
+    if self.environment:
+      env.update(self.environment)
+    return env
+
+  def __memory_size(self, api_config):
+    return api_config.get('memorySize') or self.memory_size
+
+  def __start_worker(self, api_config, generation):
+    runtime = lambda_utils.get_function_runtime(api_config['filepath'])
+
+    if runtime == 'node':
+      cmd = [NODE_EXECUTABLE, '--max-old-space-size={}'.format(self.__memory_size(api_config))]
+    else:
+      # Python workers limit their own memory (see native_worker.py), as a preexec_fn isn't
+      # safe to run in a threaded process
+      cmd = [sys.executable]
+    cmd += [WORKER_SCRIPTS[runtime], api_config['filepath'], api_config['handler']]
+    if self.layer_dir and runtime == 'python':
+      cmd.append(self.layer_dir)
+
+    process = subprocess.Popen(
+      cmd,
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+      cwd=os.path.dirname(os.path.abspath(api_config['filepath'])),
+      env=self.__build_environment(api_config, runtime)
+    )
+    return NativeWorker(process, generation)
+
+  @staticmethod
+  def __kill_worker(worker):
+    worker.timed_out = True
+    worker.process.kill()
+
+  @staticmethod
+  def __stop_worker(worker):
+    # workers exit once their input is closed
+    try:
+      worker.process.stdin.close()
+    except OSError:
+      pass
+    try:
+      worker.process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+      worker.process.kill()
+      worker.process.wait()
+    worker.process.stdout.close()
@@ -0,0 +1,252 @@
+/*
+ * Native Node.js function worker.
+ *
+ * Started by native_pool.NativePool with the function's directory as working directory, it
+ * requires the function's handler once and then serves invocations sent by the gateway until its
+ * input is closed. Messages are exchanged over the worker's stdin and stdout as frames made of a
+ * 4-byte big-endian length followed by a json document, the same protocol native_worker.py
+ * speaks. Console output is captured in the Lambda log format and returned along with every
+ * response. Both async handlers and callback-style handlers are supported.
+ *
+ * Usage: node native_worker.js <function file path> <handler name>
+ */
+
+'use strict';
+
+const path = require('path');
+const util = require('util');
+
+const FRAME_HEADER_SIZE = 4;
+// logs captured per invocation, beyond which they're truncated
+const MAX_LOG_SIZE = 1024 * 1024;
+
+const [functionFilePath, handlerName] = process.argv.slice(2);
+
+// frames are written through the real stdout, everything else is captured
+const writeStdout = process.stdout.write.bind(process.stdout);
+
+let logChunks = [];
+let logSize = 0;
+let logTruncated = false;
+let currentRequestId = null;
+
+function captureLog(text) {
+  if (logSize < MAX_LOG_SIZE) {
+    logChunks.push(text);
+    logSize += text.length;
+  } else {
+    logTruncated = true;
+  }
+}
+
+function takeLogs() {
+  let logs = logChunks.join('');
+  if (logTruncated) {
+    logs = logs.slice(0, MAX_LOG_SIZE) + '\n[log output truncated]\n';
+  }
+  logChunks = [];
+  logSize = 0;
+  logTruncated = false;
+  return logs;
+}
+
+function captureStream(stream) {
+  stream.write = (chunk, encoding, callback) => {
+    captureLog(typeof chunk === 'string' ? chunk : Buffer.from(chunk).toString('utf8'));
+    if (typeof encoding === 'function') {
+      encoding();
+    } else if (typeof callback === 'function') {
+      callback();
+    }
+    return true;
+  };
+}
+
+captureStream(process.stdout);
+captureStream(process.stderr);
+
+// console output uses the Lambda Node.js runtime's log format
+for (const [method, level] of [['log', 'INFO'], ['info', 'INFO'], ['warn', 'WARN'], ['error', 'ERROR'], ['debug', 'DEBUG'], ['trace', 'TRACE']]) {
+  console[method] = (...args) => {
+    const message = util.format(...args).replace(/\n/g, '\r');
+    captureLog(`${new Date().toISOString()}\t${currentRequestId || 'undefined'}\t${level}\t${message}\n`);
+  };
+}
+
+function writeFrame(obj) {
+  const data = Buffer.from(JSON.stringify(obj), 'utf8');
+  const header = Buffer.alloc(FRAME_HEADER_SIZE);
+  header.writeUInt32BE(data.length, 0);
+  writeStdout(Buffer.concat([header, data]));
+}
+
+function buildError(error) {
+  if (error instanceof Error) {
+    return {
+      errorType: error.name,
+      errorMessage: error.message,
+      trace: error.stack ? error.stack.split('\n') : []
+    };
+  }
+  return {
+    errorType: typeof error,
+    errorMessage: String(error),
+    trace: []
+  };
+}
+
+function loadHandler() {
+  const moduleName = path.basename(functionFilePath, path.extname(functionFilePath));
+  let module;
+  try {
+    module = require(path.resolve(functionFilePath));
+  } catch (error) {
+    return [null, {
+      errorType: 'Runtime.ImportModuleError',
+      errorMessage: `Error: Cannot load module '${moduleName}': ${error.message}`,
+      trace: error.stack ? error.stack.split('\n') : []
+    }];
+  }
+
+  const handler = module[handlerName];
+  if (typeof handler !== 'function') {
+    return [null, {
+      errorType: 'Runtime.HandlerNotFound',
+      errorMessage: `${moduleName}.${handlerName} is undefined or not exported`,
+      trace: []
+    }];
+  }
+  return [handler, null];
+}
+
+function buildContext(requestId, deadlineMs, finish) {
+  const functionName = process.env.AWS_LAMBDA_FUNCTION_NAME;
+  return {
+    callbackWaitsForEmptyEventLoop: true,
+    functionName,
+    functionVersion: process.env.AWS_LAMBDA_FUNCTION_VERSION,
+    invokedFunctionArn: `arn:aws:lambda:${process.env.AWS_REGION}:000000000000:function:${functionName}`,
+    memoryLimitInMB: process.env.AWS_LAMBDA_FUNCTION_MEMORY_SIZE,
+    awsRequestId: requestId,
+    logGroupName: process.env.AWS_LAMBDA_LOG_GROUP_NAME,
+    logStreamName: process.env.AWS_LAMBDA_LOG_STREAM_NAME,
+    identity: undefined,
+    clientContext: undefined,
+    getRemainingTimeInMillis: () => Math.max(deadlineMs - Date.now(), 0),
+    // legacy context methods
+    done: (error, result) => finish(error, result),
+    succeed: (result) => finish(null, result),
+    fail: (error) => finish(error || 'handled')
+  };
+}
+
+function runHandler(handler, request) {
+  return new Promise((resolve) => {
+    let finished = false;
+    const finish = (error, result) => {
+      if (!finished) {
+        finished = true;
+        resolve([error, result]);
+      }
+    };
+
+    const context = buildContext(request.request_id, request.deadline_ms, finish);
+    try {
+      const returned = handler(request.event, context, finish);
+      if (returned && typeof returned.then === 'function') {
+        returned.then((result) => finish(null, result), (error) => finish(error || 'handled'));
+      } else if (handler.length < 3) {
+        // synchronous handlers that don't take a callback respond once they return
+        finish(null, returned);
+      }
+    } catch (error) {
+      finish(error);
+    }
+  });
+}
+
+async function invoke(handler, initError, initDuration, request) {
+  currentRequestId = request.request_id;
+  captureLog(`START RequestId: ${request.request_id} Version: $LATEST\n`);
+
+  const start = process.hrtime.bigint();
+  let output;
+  let exitStatus = 0;
+
+  if (initError) {
+    output = JSON.stringify(initError);
+    exitStatus = 1;
+  } else {
+    const [error, result] = await runHandler(handler, request);
+    if (error !== null && error !== undefined) {
+      const errorObject = buildError(error);
+      console.error('Invoke Error', JSON.stringify(errorObject));
+      output = JSON.stringify(errorObject);
+      exitStatus = 1;
+    } else {
+      try {
+        output = JSON.stringify(result === undefined ? null : result);
+      } catch (error) {
+        output = JSON.stringify({
+          errorType: 'Runtime.MarshalError',
+          errorMessage: `Unable to stringify response body: ${error.message}`,
+          trace: []
+        });
+        exitStatus = 1;
+      }
+    }
+  }
+  const duration = Number(process.hrtime.bigint() - start) / 1e6;
+
+  captureLog(`END RequestId: ${request.request_id}\n`);
+  let report = `REPORT RequestId: ${request.request_id}\tDuration: ${duration.toFixed(2)} ms\t` +
+    `Billed Duration: ${Math.ceil(duration)} ms\t` +
+    `Memory Size: ${process.env.AWS_LAMBDA_FUNCTION_MEMORY_SIZE} MB\t` +
+    `Max Memory Used: ${Math.round(process.memoryUsage().rss / (1024 * 1024))} MB`;
+  if (initDuration !== null) {
+    report += `\tInit Duration: ${initDuration.toFixed(2)} ms`;
+  }
+  captureLog(report + '\n');
+  currentRequestId = null;
+
+  return { output, exit_status: exitStatus, logs: takeLogs() };
+}
+
+function main() {
+  const start = process.hrtime.bigint();
+  const [handler, initError] = loadHandler();
+  let initDuration = Number(process.hrtime.bigint() - start) / 1e6;
+  let initLogs = takeLogs();
+
+  let buffer = Buffer.alloc(0);
+  let queue = Promise.resolve();
+
+  process.stdin.on('data', (chunk) => {
+    buffer = Buffer.concat([buffer, chunk]);
+    while (buffer.length >= FRAME_HEADER_SIZE) {
+      const size = buffer.readUInt32BE(0);
+      if (buffer.length < FRAME_HEADER_SIZE + size) {
+        break;
+      }
+      const request = JSON.parse(buffer.slice(FRAME_HEADER_SIZE, FRAME_HEADER_SIZE + size).toString('utf8'));
+      buffer = buffer.slice(FRAME_HEADER_SIZE + size);
+
+      // invocations are served one at a time, in order
+      queue = queue.then(async () => {
+        const response = await invoke(handler, initError, initDuration, request);
+        if (initLogs) {
+          response.logs = initLogs + response.logs;
+          initLogs = null;
+        }
+        initDuration = null;
+        writeFrame(response);
+      });
+    }
+  });
+
+  process.stdin.on('end', () => {
+    queue.then(() => process.exit(0));
+  });
+}
+
+main();
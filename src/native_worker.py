@@ -0,0 +1,221 @@
+'''
+Native Python function worker.
+
+Started by native_pool.NativePool with the function's directory as working directory, it imports
+the function's handler once and then serves invocations sent by the gateway until its input is
+closed. Messages are exchanged over the worker's stdin and stdout as frames made of a 4-byte
+big-endian length followed by a json document. Output written by the handler (print, logging)
+is captured and returned along with every response; anything written directly to the stdout
+file descriptor is sent to stderr instead so that it can't corrupt the protocol.
+
+This module must only depend on the standard library: it runs in the function's interpreter,
+where the gateway's own modules would shadow the function's.
+'''
+
+import io
+import json
+import math
+import os
+import resource
+import struct
+import sys
+import time
+import traceback
+
+FRAME_HEADER = struct.Struct('>I')
+# logs captured per invocation, beyond which they're truncated
+MAX_LOG_SIZE = 1024 * 1024
+
+def read_frame(stream):
+  '''
+  Reads a frame from stream, returning its decoded json document or None at end of stream.
+  '''
+  header = stream.read(FRAME_HEADER.size)
+  if len(header) < FRAME_HEADER.size:
+    return None
+  size, = FRAME_HEADER.unpack(header)
+  data = stream.read(size)
+  if len(data) < size:
+    return None
+  return json.loads(data)
+
+def write_frame(stream, obj):
+  data = json.dumps(obj).encode('utf-8')
+  stream.write(FRAME_HEADER.pack(len(data)) + data)
+  stream.flush()
+
+class LogStream(io.TextIOBase):
+  '''
+  Text stream capturing the output of the current invocation.
+  '''
+  encoding = 'utf-8'
+
+  def __init__(self):
+    self.__chunks = []
+    self.__size = 0
+    self.__truncated = False
+
+  def writable(self):
+    return True
+
+  def write(self, text):
+    if self.__size < MAX_LOG_SIZE:
+      self.__chunks.append(text)
+      self.__size += len(text)
+    else:
+      self.__truncated = True
+    return len(text)
+
+  def take(self):
+    '''
+    Returns and clears the captured output.
+    '''
+    output = ''.join(self.__chunks)
+    if self.__truncated:
+      output = output[:MAX_LOG_SIZE] + '\n[log output truncated]\n'
+    self.__chunks = []
+    self.__size = 0
+    self.__truncated = False
+    return output
+
+class LambdaContext:
+  '''
+  The context object passed to handlers, with the same attributes as the one AWS Lambda's
+  Python runtime passes.
+  '''
+  def __init__(self, request_id, deadline_ms):
+    self.aws_request_id = request_id
+    self.function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+    self.function_version = os.environ.get('AWS_LAMBDA_FUNCTION_VERSION')
+    self.invoked_function_arn = 'arn:aws:lambda:{}:000000000000:function:{}'.format(
+      os.environ.get('AWS_REGION'),
+      self.function_name
+    )
+    self.memory_limit_in_mb = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    self.log_group_name = os.environ.get('AWS_LAMBDA_LOG_GROUP_NAME')
+    self.log_stream_name = os.environ.get('AWS_LAMBDA_LOG_STREAM_NAME')
+    self.identity = None
+    self.client_context = None
+    self.__deadline_ms = deadline_ms
+
+  def get_remaining_time_in_millis(self):
+    return max(int(self.__deadline_ms - time.time() * 1000), 0)
+
+def build_error(error_type, error, stack_trace=None):
+  return {
+    'errorMessage': str(error),
+    'errorType': error_type,
+    'stackTrace': stack_trace if stack_trace is not None else []
+  }
+
+def load_handler(function_file_path, handler_name):
+  '''
+  Imports the function's module, returning a (handler, init error) tuple.
+  '''
+  module_name = os.path.splitext(os.path.basename(function_file_path))[0]
+  try:
+    module = __import__(module_name)
+  except Exception as error:
+    return None, build_error(
+      'Runtime.ImportModuleError',
+      'Unable to import module \'{}\': {}'.format(module_name, error)
+    )
+
+  handler = getattr(module, handler_name, None)
+  if not callable(handler):
+    return None, build_error(
+      'Runtime.HandlerNotFound',
+      'Handler \'{}\' missing on module \'{}\''.format(handler_name, module_name)
+    )
+  return handler, None
+
+def invoke(handler, init_error, init_duration, request, logs):
+  '''
+  Runs the handler with the request's event, returning the response frame.
+  '''
+  request_id = request['request_id']
+  print('START RequestId: {} Version: $LATEST'.format(request_id))
+
+  start = time.perf_counter()
+  exit_status = 0
+  if init_error:
+    output = json.dumps(init_error)
+    exit_status = 1
+  else:
+    try:
+      result = handler(request['event'], LambdaContext(request_id, request['deadline_ms']))
+      try:
+        output = json.dumps(result)
+      except (TypeError, ValueError) as error:
+        output = json.dumps(build_error('Runtime.MarshalError', 'Unable to marshal response: {}'.format(error)))
+        exit_status = 1
+    except Exception as error:
+      # leave the worker's own frame out of the trace
+      tb = error.__traceback__.tb_next
+      print(''.join(traceback.format_exception(type(error), error, tb)), end='')
+      output = json.dumps(build_error(type(error).__name__, error, traceback.format_list(traceback.extract_tb(tb))))
+      exit_status = 1
+  duration = (time.perf_counter() - start) * 1000
+
+  print('END RequestId: {}'.format(request_id))
+  report = 'REPORT RequestId: {}\tDuration: {:.2f} ms\tBilled Duration: {} ms\tMemory Size: {} MB\tMax Memory Used: {} MB'.format(
+    request_id,
+    duration,
+    math.ceil(duration),
+    os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE'),
+    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+  )
+  if init_duration is not None:
+    report += '\tInit Duration: {:.2f} ms'.format(init_duration * 1000)
+  print(report)
+
+  return {'output': output, 'exit_status': exit_status, 'logs': logs.take()}
+
+def main():
+  # the function's memory size is enforced as a limit on the worker's heap
+  memory_size = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+  if memory_size:
+    memory = int(memory_size) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_DATA, (memory, memory))
+
+  function_file_path, handler_name = sys.argv[1:3]
+  layer_dir = sys.argv[3] if len(sys.argv) > 3 else None
+
+  # the protocol uses private copies of stdin and stdout
+  requests = os.fdopen(os.dup(0), 'rb')
+  responses = os.fdopen(os.dup(1), 'wb')
+  null_fd = os.open(os.devnull, os.O_RDONLY)
+  os.dup2(null_fd, 0)
+  os.close(null_fd)
+  os.dup2(2, 1)
+
+  # handlers' output is captured, including by logging handlers created while importing them
+  logs = LogStream()
+  sys.stdout = sys.stderr = logs
+
+  # resolve imports like the Lambda runtime: task root first, then layers
+  sys.path[0] = os.path.dirname(os.path.abspath(function_file_path))
+  if layer_dir:
+    sys.path[1:1] = [
+      os.path.join(layer_dir, 'python'),
+      os.path.join(layer_dir, 'python', 'lib', 'python{}.{}'.format(*sys.version_info[:2]), 'site-packages')
+    ]
+
+  start = time.perf_counter()
+  handler, init_error = load_handler(function_file_path, handler_name)
+  init_duration = time.perf_counter() - start
+  init_logs = logs.take()
+
+  while True:
+    request = read_frame(requests)
+    if request is None:
+      break
+    response = invoke(handler, init_error, init_duration, request, logs)
+    if init_logs:
+      response['logs'] = init_logs + response['logs']
+      init_logs = None
+    init_duration = None
+    write_frame(responses, response)
+
+if __name__ == '__main__':
+  main()
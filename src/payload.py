@@ -2,6 +2,8 @@ import base64
 import hmac
 from hashlib import sha256
 import json
+import random
+import time
 
 '''
 Lambda function payload utilities for AWS HTTP API payload v2.0.
@@ -13,6 +15,26 @@ AUTH_HEADER = 'authorization'
 CONTENT_TYPE = 'content-type'
 CONTENT_LENGTH = 'content-length'
 
+# HTTP API request payload limit
+MAX_REQUEST_BODY_SIZE = 10 * 1024 * 1024
+# size of the raw body chunks encoded or decoded at a time (a multiple of 3 so that base64
+# encoded chunks can be concatenated)
+BODY_CHUNK_SIZE = 3 * 64 * 1024
+# characters base64 encoded bodies may be wrapped with (see iter_base64_body)
+BASE64_WHITESPACE = str.maketrans('', '', ' \t\n\r\x0b\x0c')
+
+# content types passed to functions as text, any other content type is base64 encoded
+TEXT_CONTENT_TYPES = (
+  'application/json',
+  'application/javascript',
+  'application/xml',
+  'application/x-www-form-urlencoded',
+  'application/graphql',
+  'application/x-yaml',
+  'application/yaml'
+)
+TEXT_CONTENT_TYPE_SUFFIXES = ('+json', '+xml', '+yaml')
+
 def build_jwt(user_id, name=None, email=None, secret='default'):
   '''
   Builds a JWT with the provided user_id (as JWT's "sub" property), an optional name and signs it
@@ -64,6 +86,221 @@ def build_jwt(user_id, name=None, email=None, secret='default'):
 
   return str(jwt_header_b64 + b'.' + jwt_payload_b64 + b'.' + signature, encoding='utf-8')
 
+# API Gateway request time format, e.g. "12/Mar/2020:19:03:58 +0000"
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+REQUEST_TIME_TEMPLATE = '{:02d}/{}/{:04d}:{:02d}:{:02d}:{:02d} +0000'
+
+# (second, formatted time) of the last formatted request time
+_last_request_time = (None, '')
+
+def format_request_time(timestamp):
+  '''
+  Formats a Unix timestamp the way API Gateway formats requestContext:time. Requests received
+  within the same second share the formatted value.
+  '''
+  global _last_request_time
+
+  second = int(timestamp)
+  cached_second, formatted = _last_request_time
+  if cached_second == second:
+    return formatted
+
+  t = time.gmtime(second)
+  formatted = REQUEST_TIME_TEMPLATE.format(
+    t.tm_mday,
+    MONTHS[t.tm_mon - 1],
+    t.tm_year,
+    t.tm_hour,
+    t.tm_min,
+    t.tm_sec
+  )
+  _last_request_time = (second, formatted)
+  return formatted
+
+def new_request_id():
+  '''
+  Returns a random UUID-formatted request id. Request ids only need to be unique, so they're
+  generated from the non-cryptographic PRNG, which is several times faster than uuid.uuid4.
+  '''
+  h = '%032x' % random.getrandbits(128)
+  return '{}-{}-4{}-{}-{}'.format(h[:8], h[8:12], h[13:16], h[16:20], h[20:])
+
+class PayloadBuilder:
+  '''
+  Builds the payloads of the requests matching a route. Fields shared by every request are
+  computed once, when the builder is created, so that building a payload only fills in the
+  fields of the request itself.
+  If route_key is not specified the request's method and path are used instead.
+  '''
+  def __init__(self, route_key=None, server_hostname=None, stage='$default'):
+    self.route_key = route_key.strip() if route_key else None
+    self.domain_name = server_hostname if server_hostname else 'localhost'
+    self.stage = stage
+
+  def build(
+      self,
+      route='/',
+      method='GET',
+      user_agent=None,
+      source_ip=None,
+      headers=None,
+      params=None,
+      body=None,
+      path_parameters=None,
+      authorizer=None
+    ):
+    '''
+    Builds the payload event object of a request. See build_payload.
+    authorizer is the requestContext:authorizer object returned by the route's authorizer, if
+    the route has one.
+    '''
+    route = route.strip()
+    method = method.strip()
+    route_key = self.route_key if self.route_key else method + ' ' + route
+    now = time.time()
+
+    # populate provided headers while converting header names to lowercase
+    _headers = {}
+    if headers:
+      for header in headers:
+        _headers[header.lower()] = headers[header]
+
+    is_base64_encoded = False
+    body_length = 0
+    if body is not None:
+      body, is_base64_encoded, body_length = encode_body(body, _headers.get(CONTENT_TYPE))
+
+    # add content-length header if missing
+    if CONTENT_LENGTH not in _headers:
+      _headers[CONTENT_LENGTH] = body_length
+
+    # default content type
+    if CONTENT_TYPE not in _headers:
+      _headers[CONTENT_TYPE] = 'application/json'
+
+    request_context = {
+      'accountId': '',
+      'apiId': '',
+      'domainName': self.domain_name,
+      'domainPrefix': '',
+      'http': {
+        'method': method,
+        'path': route,
+        'protocol': 'HTTP/1.1',
+        'sourceIp': source_ip if source_ip else '0.0.0.0',
+        'userAgent': user_agent if user_agent else ''
+      },
+      'requestId': new_request_id(),
+      'routeKey': route_key,
+      'stage': self.stage,
+      'time': format_request_time(now),
+      'timeEpoch': int(now * 1000)
+    }
+
+    payload = {
+      'version': '2.0',
+      'routeKey': route_key,
+      'rawPath': route,
+      'rawQueryString': '',
+      'headers': _headers,
+      'requestContext': request_context,
+      'isBase64Encoded': is_base64_encoded
+    }
+
+    if path_parameters:
+      payload['pathParameters'] = path_parameters
+
+    if body:
+      payload['body'] = body
+
+    # include the claims verified by the route's authorizer or, if authorization header is
+    # provided, its decoded jwt payload
+    if authorizer:
+      request_context['authorizer'] = authorizer
+    elif AUTH_HEADER in _headers:
+      request_context['authorizer'] = {
+        'jwt': {
+          'claims': parse_jwt_payload(_headers[AUTH_HEADER])
+        },
+        'scopes': None
+      }
+
+    if params:
+      payload['queryStringParameters'] = dict(params)
+      payload['rawQueryString'] = '&'.join(
+        '{}={}'.format(param.strip(), str(value).strip()) for param, value in params.items()
+      )
+
+    return payload
+
+def is_text_content_type(content_type):
+  '''
+  Returns True if the content type (e.g. "application/json; charset=utf-8") denotes text.
+  '''
+  media_type = content_type.split(';', 1)[0].strip().lower()
+  return media_type.startswith('text/') or media_type in TEXT_CONTENT_TYPES or \
+    media_type.endswith(TEXT_CONTENT_TYPE_SUFFIXES)
+
+def encode_body(body, content_type=None):
+  '''
+  Encodes a request body the way API Gateway passes it to functions. body can be a string,
+  raw bytes or a binary file object (e.g. a spooled upload), which is read in chunks.
+  Raw bodies with a non-text content type, or that aren't valid utf-8, are base64 encoded.
+  Returns a tuple with the encoded body, whether it's base64 encoded and its raw length.
+  '''
+  if isinstance(body, str):
+    return body, False, len(body)
+
+  is_file = hasattr(body, 'read')
+  is_text = not content_type or is_text_content_type(content_type)
+
+  if is_text:
+    data = body.read() if is_file else body
+    try:
+      return str(data, encoding='utf-8'), False, len(data)
+    except UnicodeDecodeError:
+      return base64.b64encode(data).decode('ascii'), True, len(data)
+
+  if not is_file:
+    return base64.b64encode(body).decode('ascii'), True, len(body)
+
+  # encode files chunk by chunk so that the raw body is never fully held in memory
+  chunks = []
+  length = 0
+  while True:
+    data = body.read(BODY_CHUNK_SIZE)
+    if not data:
+      break
+    length += len(data)
+    chunks.append(base64.b64encode(data).decode('ascii'))
+  return ''.join(chunks), True, length
+
+def iter_base64_body(body, chunk_size=BODY_CHUNK_SIZE):
+  '''
+  Decodes a base64 encoded body chunk by chunk, yielding about chunk_size raw bytes at a time.
+  Whitespace (e.g. line breaks of MIME-style encoders) is ignored, like base64.b64decode does.
+  '''
+  # every 4 base64 characters encode 3 bytes: whitespace is dropped so that chunks are decoded
+  # on 4 character boundaries
+  encoded_chunk_size = chunk_size // 3 * 4
+  pending = ''
+  for i in range(0, len(body), encoded_chunk_size):
+    pending += body[i:i + encoded_chunk_size].translate(BASE64_WHITESPACE)
+    decodable = len(pending) - len(pending) % 4
+    if decodable:
+      yield base64.b64decode(pending[:decodable])
+      pending = pending[decodable:]
+  if pending:
+    # an incomplete group: let b64decode report the padding error
+    yield base64.b64decode(pending)
+
+def get_log_prefix(payload):
+  '''
+  Returns the prefix of the log lines of the invocation handling payload, made of its route key
+  and the beginning of its request id (e.g. "GET /users/{id} [1b9d6bcd] ").
+  '''
+  return '{} [{}] '.format(payload['routeKey'], payload['requestContext']['requestId'][:8])
+
 def build_payload(
     route='/',
     method='GET',
@@ -72,66 +309,31 @@ def build_payload(
     server_hostname=None,
     headers=None,
     params=None,
-    body=None
+    body=None,
+    route_key=None,
+    path_parameters=None
   ):
   '''
   Builds a payload event object with the provided parameters.
+  route_key is the key of the matched route (e.g. "GET /users/{id}", defaults to the request's
+  method and path) and path_parameters the parameters extracted from the path, if any.
   If auth is provided it will be interpreted as a Json Web Token and its JWT payload
   (not to be confused with the API payload which this function builds) will be included under
   requestContext:authorizer:jwt:claims object property.
+  body can be a string, raw bytes or a binary file object: raw bodies are encoded with
+  encode_body.
+  Routers building many payloads for the same route should keep a PayloadBuilder per route.
   '''
-
-  payload = json.loads(payload_template.format(
-    ROUTE=route.strip(),
-    METHOD=method.strip(),
-    USER_AGENT=user_agent if user_agent else '',
-    SOURCE_IP=source_ip if source_ip else '0.0.0.0',
-    SERVER_HOST=server_hostname if server_hostname else 'localhost'
-  ))
-
-  # populate provided headers while converting header names to lowercase
-  _headers = {}
-  if headers:
-    for header in headers:
-      _headers[header.lower()] = headers[header]
-
-  # add content-length header if missing
-  if CONTENT_LENGTH not in _headers:
-    _headers[CONTENT_LENGTH] = len(body) if body else 0
-
-  # default content type
-  if CONTENT_TYPE not in _headers:
-    _headers[CONTENT_TYPE] = 'application/json'
-
-  # populate headers
-  for header in _headers:
-    payload['headers'][header] = _headers[header]
-
-  if body:
-    payload['body'] = body
-
-  # if authorization header is provided, include it along with decoded jwt payload
-  if AUTH_HEADER in _headers:
-    jwt = _headers[AUTH_HEADER]
-    payload['headers'][AUTH_HEADER] = jwt
-    payload['requestContext']['authorizer'] = {
-      'jwt': {
-        'claims': parse_jwt_payload(jwt)
-      },
-      'scopes': None
-    }
-
-  if params:
-    rawQueryString = ''
-    payload['queryStringParameters'] = {}
-    for param in params:
-      payload['queryStringParameters'][param] = params[param]
-      rawQueryString += '{}={}&'.format(param.strip(), str(params[param]).strip())
-    if rawQueryString:
-      rawQueryString = rawQueryString[:-1]
-    payload['rawQueryString'] = rawQueryString
-
-  return payload
+  return PayloadBuilder(route_key, server_hostname).build(
+    route=route,
+    method=method,
+    user_agent=user_agent,
+    source_ip=source_ip,
+    headers=headers,
+    params=params,
+    body=body,
+    path_parameters=path_parameters
+  )
 
 def build_authenticated_payload(user_id, authentication_header='Authorization', **kwargs):
   '''
@@ -144,6 +346,43 @@ def build_authenticated_payload(user_id, authentication_header='Authorization',
   kwargs['headers'][authentication_header] = build_jwt(user_id)
   return build_payload(**kwargs)
 
+def parse_function_response(response, stream=False):
+  '''
+  Converts the object returned by lambda_utils.run_function into the HTTP response API Gateway
+  would send back, as a (status code, headers, body) tuple.
+  Function errors are returned as a 500 response with the error object as json body, except for
+  timeouts (504) and functions killed for running out of memory (502).
+  Base64 encoded bodies ("isBase64Encoded": true) are decoded into bytes or, if stream is True,
+  an iterator over the decoded body chunks.
+  '''
+  ret_value = response['return_value']
+
+  if response.get('timed_out'):
+    return 504, {CONTENT_TYPE: 'application/json'}, json.dumps({'message': 'Endpoint request timed out'})
+
+  if response.get('out_of_memory'):
+    return 502, {CONTENT_TYPE: 'application/json'}, json.dumps({'message': 'Internal Server Error'})
+
+  if response['exit_status'] != 0:
+    return 500, {CONTENT_TYPE: 'application/json'}, json.dumps(ret_value)
+
+  # payload v2.0 responses without a status code are returned as json with a 200 status
+  if not isinstance(ret_value, dict) or 'statusCode' not in ret_value:
+    return 200, {CONTENT_TYPE: 'application/json'}, json.dumps(ret_value)
+
+  headers = {}
+  if 'headers' in ret_value and ret_value['headers']:
+    headers = ret_value['headers']
+
+  body = ''
+  if 'body' in ret_value and ret_value['body'] is not None:
+    body = ret_value['body']
+
+  if ret_value.get('isBase64Encoded') and body:
+    body = iter_base64_body(body) if stream else base64.b64decode(body)
+
+  return ret_value['statusCode'], headers, body
+
 def parse_jwt_payload(jwt):
   '''
   Parses the provided JWT's payload, decodes and returns it as a Python object.
@@ -158,33 +397,3 @@ def parse_jwt_payload(jwt):
     payload += '='
 
   return json.loads(base64.b64decode(payload))
-
-payload_template = '''\
-{{
-  "version": "2.0",
-  "routeKey": "{METHOD} {ROUTE}",
-  "rawPath": "{ROUTE}",
-  "rawQueryString": "",
-  "headers": {{
-  }},
-  "requestContext": {{
-    "accountId": "",
-    "apiId": "",
-    "domainName": "{SERVER_HOST}",
-    "domainPrefix": "",
-    "http": {{
-      "method": "{METHOD}",
-      "path": "{ROUTE}",
-      "protocol": "HTTP/1.1",
-      "sourceIp": "{SOURCE_IP}",
-      "userAgent": "{USER_AGENT}"
-    }},
-    "requestId": "",
-    "routeKey": "{METHOD} {ROUTE}",
-    "stage": "$default",
-    "time": "",
-    "timeEpoch": 0
-  }},
-  "isBase64Encoded": false
-}}
-'''
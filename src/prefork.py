@@ -0,0 +1,227 @@
+'''
+Pre-forked serving mode.
+
+Once the endpoint configuration is loaded and the router built, the gateway forks a coordinator
+process and a number of HTTP worker processes, which all share that state copy-on-write rather
+than parsing the configuration again. Every worker runs its own threaded WSGI server bound to the
+gateway's port with SO_REUSEPORT, the kernel spreading incoming connections across them, so
+requests aren't serialized by a single interpreter's GIL. Workers don't run functions
+themselves: they invoke them through the coordinator, which owns the execution backends (warm
+containers, Runtime API containers and native workers) along with the concurrency and memory
+accounting, so that adding workers neither multiplies cold starts nor loosens limits. The
+response cache, request coalescing and metrics live in the coordinator too, so that workers
+share cached responses and invocations and /metrics reports the whole gateway.
+
+Reference: https://lwn.net/Articles/542629/
+Reference: https://docs.python.org/3/library/multiprocessing.html#managers
+'''
+
+import functools
+import gc
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import sys
+import time
+from multiprocessing.managers import BaseManager
+
+from werkzeug.serving import ThreadedWSGIServer
+
+# backends the coordinator can share with the workers
+BACKEND_NAMES = (
+  'invoker',
+  'concurrency_limiter',
+  'memory_budget',
+  'container_pool',
+  'response_cache',
+  'single_flight',
+  'metrics'
+)
+# seconds before a worker that exited unexpectedly is restarted
+RESTART_DELAY = 1
+# seconds the coordinator is given to stop its backends
+STOP_TIMEOUT = 60
+
+# workers and the coordinator are forked so that they inherit the gateway's state
+CONTEXT = multiprocessing.get_context('fork')
+
+# the backends owned by the coordinator (only set in the coordinator process)
+_backends = {}
+
+def _get_backend(name):
+  return _backends[name]
+
+def _list_backends():
+  return [name for name in BACKEND_NAMES if _backends.get(name) is not None]
+
+class CoordinatorManager(BaseManager):
+  '''
+  Manager whose server runs in the coordinator process, handing out proxies to its backends.
+  '''
+
+for backend_name in BACKEND_NAMES:
+  # invokers are only called, other backends expose their public methods
+  CoordinatorManager.register(
+    backend_name,
+    callable=functools.partial(_get_backend, backend_name),
+    exposed=('__call__',) if backend_name == 'invoker' else None
+  )
+
+def supports_reuse_port():
+  return hasattr(socket, 'SO_REUSEPORT')
+
+def _run_coordinator(authkey, create_backends, shutdown_backends, connection):
+  # interrupting the gateway stops the workers first, then the coordinator
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+  # backends that aren't shared (e.g. the pools used by the invoker) are only shut down
+  backends = create_backends()
+  _backends.update(backends)
+  try:
+    server = CoordinatorManager(authkey=authkey).get_server()
+    connection.send((server.address, _list_backends()))
+    connection.close()
+    server.serve_forever()
+  finally:
+    if shutdown_backends:
+      shutdown_backends(backends)
+
+class Coordinator:
+  '''
+  Process owning the execution backends shared by the HTTP workers.
+
+  create_backends is called in the coordinator process and returns a dictionary mapping (some
+  of) BACKEND_NAMES to the backends to share, or None for those that aren't used. If specified,
+  shutdown_backends is called with that dictionary when the coordinator is stopped. Once
+  started, backend(name) returns a proxy to a backend that can be passed to the router (e.g. the
+  invoker as its executor): forked workers inherit it and call the coordinator's backend with
+  their own connections.
+  '''
+  def __init__(self, create_backends, shutdown_backends=None):
+    self.create_backends = create_backends
+    self.shutdown_backends = shutdown_backends
+    self.process = None
+    self.__proxies = {}
+
+  @property
+  def sentinel(self):
+    return self.process.sentinel
+
+  def start(self):
+    '''
+    Starts the coordinator process, returning once its backends are ready.
+    '''
+    authkey = os.urandom(32)
+    reader, writer = CONTEXT.Pipe(duplex=False)
+    self.process = CONTEXT.Process(
+      target=_run_coordinator,
+      args=(authkey, self.create_backends, self.shutdown_backends, writer),
+      name='coordinator',
+      daemon=True
+    )
+    self.process.start()
+    writer.close()
+
+    try:
+      address, names = reader.recv()
+    except EOFError:
+      self.process.join()
+      raise RuntimeError('Coordinator process failed to start (exit code {})'.format(self.process.exitcode))
+    finally:
+      reader.close()
+
+    manager = CoordinatorManager(address=address, authkey=authkey)
+    manager.connect()
+    self.__proxies = {name: getattr(manager, name)() for name in names}
+    return self
+
+  def backend(self, name):
+    '''
+    Returns a proxy to the named backend, or None if the coordinator doesn't have it.
+    '''
+    return self.__proxies.get(name)
+
+  def stop(self, timeout=STOP_TIMEOUT):
+    '''
+    Stops the coordinator, waiting up to timeout seconds for its backends to shut down.
+    '''
+    if self.process is None or not self.process.is_alive():
+      return
+    self.process.terminate()
+    self.process.join(timeout)
+    if self.process.is_alive():
+      print('WARNING: coordinator didn\'t stop within {}s, killing it'.format(timeout), file=sys.stderr)
+      self.process.kill()
+      self.process.join()
+
+class ReusePortWSGIServer(ThreadedWSGIServer):
+  '''
+  Threaded WSGI server whose listening socket can be bound by other processes too.
+  '''
+  def server_bind(self):
+    self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    super().server_bind()
+
+def _run_worker(app, host, port):
+  # terminating a worker stops its server like interrupting it does
+  signal.signal(signal.SIGTERM, signal.default_int_handler)
+  server = ReusePortWSGIServer(host, port, app)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+def serve(app, host, port, workers, coordinator=None):
+  '''
+  Serves the WSGI app on host:port with workers pre-forked processes until interrupted. Workers
+  exiting unexpectedly are restarted. If the coordinator exits, serving stops; it's stopped
+  along with the workers otherwise.
+  '''
+  if not supports_reuse_port():
+    raise RuntimeError('Pre-forked workers require SO_REUSEPORT, which isn\'t supported on this platform')
+
+  def start_worker(index):
+    process = CONTEXT.Process(target=_run_worker, args=(app, host, int(port)), name='worker-{}'.format(index))
+    process.start()
+    return process
+
+  # objects created so far are never collected, so that the collector doesn't write to (and
+  # copy) the memory pages the workers share
+  gc.freeze()
+
+  processes = [start_worker(index) for index in range(workers)]
+  print('Started {} HTTP workers (pids: {})'.format(workers, ', '.join(str(p.pid) for p in processes)))
+
+  previous_handler = signal.signal(signal.SIGTERM, signal.default_int_handler)
+  try:
+    while True:
+      sentinels = {process.sentinel: index for index, process in enumerate(processes)}
+      if coordinator:
+        sentinels[coordinator.sentinel] = None
+
+      for sentinel in multiprocessing.connection.wait(list(sentinels)):
+        index = sentinels[sentinel]
+        if index is None:
+          raise RuntimeError('Coordinator process exited (exit code {})'.format(coordinator.process.exitcode))
+
+        processes[index].join()
+        print(
+          'WARNING: HTTP worker {} exited (exit code {}), restarting it'.format(processes[index].pid, processes[index].exitcode),
+          file=sys.stderr
+        )
+        time.sleep(RESTART_DELAY)
+        processes[index] = start_worker(index)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    signal.signal(signal.SIGTERM, previous_handler)
+    for process in processes:
+      if process.is_alive():
+        process.terminate()
+    for process in processes:
+      process.join()
+    if coordinator:
+      coordinator.stop()
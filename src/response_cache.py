@@ -0,0 +1,193 @@
+'''
+Per-route response cache.
+
+Routes with a "cache" setting (see api_gateway's "custom.cyclon.routes") have the responses of
+their GET and HEAD requests kept for a while, so that repeated requests are answered without
+invoking the function. Responses are keyed on the route, method and path along with the query
+parameters, headers and authorizer principal the route's configuration selects, expire after the
+configured TTL (or their own Cache-Control max-age, if shorter) and are evicted least recently
+used first once the cache holds more than its size limit in bytes.
+
+Reference: https://www.rfc-editor.org/rfc/rfc9111#section-5.2
+'''
+
+import collections
+import hashlib
+import json
+import threading
+import time
+
+CACHEABLE_METHODS = ('GET', 'HEAD')
+CACHEABLE_STATUS_CODES = (200,)
+CACHE_CONTROL = 'cache-control'
+# seconds responses are cached for unless configured otherwise
+DEFAULT_TTL = 60
+# total size of the cached responses
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+# fixed accounting overhead of an entry, on top of its body and headers
+ENTRY_OVERHEAD = 256
+
+def parse_cache_control(value):
+  '''
+  Parses a Cache-Control header into a dictionary mapping lowercase directive names to their
+  value (None for directives without one).
+  '''
+  directives = {}
+  for directive in (value or '').split(','):
+    name, _, argument = directive.strip().partition('=')
+    if name:
+      directives[name.lower()] = argument.strip('"') if argument else None
+  return directives
+
+def get_principal(authorizer):
+  '''
+  Returns the principal (the "sub" claim) of a payload's requestContext:authorizer object.
+  '''
+  if not authorizer or 'jwt' not in authorizer:
+    return None
+  return authorizer['jwt'].get('claims', {}).get('sub')
+
+def build_cache_key(route_key, method, path, params, headers, authorizer, cache_config):
+  '''
+  Returns the cache key of a request: its route key, method and path along with the query
+  parameters, headers (lowercase names) and authorizer principal selected by cache_config.
+  Query parameters and headers aren't part of the key unless listed in cache_config's
+  "queryParameters" and "headers" (or "*" for every query parameter).
+  '''
+  query_parameters = cache_config.get('queryParameters') or []
+  if query_parameters == '*' or '*' in query_parameters:
+    selected_params = sorted((params or {}).items())
+  else:
+    selected_params = [(name, (params or {}).get(name)) for name in sorted(query_parameters)]
+
+  selected_headers = [(name.lower(), headers.get(name.lower())) for name in sorted(cache_config.get('headers') or [])]
+
+  key = json.dumps([
+    route_key,
+    method,
+    path,
+    selected_params,
+    selected_headers,
+    get_principal(authorizer) if cache_config.get('principal', True) else None
+  ])
+  return route_key + ':' + hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+def get_response_ttl(cache_config, headers):
+  '''
+  Returns for how many seconds a response with the provided headers may be cached on the route
+  configured with cache_config: its configured TTL, capped by the response's own Cache-Control
+  max-age. Returns 0 if the response mustn't be cached.
+  '''
+  ttl = float(cache_config.get('ttl', DEFAULT_TTL))
+
+  cache_control = None
+  for name, value in headers.items():
+    if name.lower() == CACHE_CONTROL:
+      cache_control = parse_cache_control(value)
+  if cache_control:
+    if any(directive in cache_control for directive in ('no-store', 'no-cache', 'private')):
+      return 0
+    for directive in ('s-maxage', 'max-age'):
+      if directive in cache_control:
+        try:
+          return min(ttl, float(cache_control[directive]))
+        except (TypeError, ValueError):
+          return 0
+
+  return ttl
+
+def bypasses_cache(headers):
+  '''
+  Returns True if a request's Cache-Control header (lowercase header names) asks for a fresh
+  response.
+  '''
+  cache_control = parse_cache_control(headers.get(CACHE_CONTROL))
+  return 'no-cache' in cache_control or 'no-store' in cache_control or cache_control.get('max-age') == '0'
+
+class CacheEntry:
+  '''
+  A cached response.
+  '''
+  def __init__(self, route_key, status_code, headers, body, ttl):
+    self.route_key = route_key
+    self.status_code = status_code
+    self.headers = headers
+    self.body = body
+    self.created_at = time.time()
+    self.expires_at = self.created_at + ttl
+    self.size = len(body) + sum(len(name) + len(str(value)) for name, value in headers.items()) + ENTRY_OVERHEAD
+
+  def age(self):
+    return int(time.time() - self.created_at)
+
+class ResponseCache:
+  '''
+  LRU cache of responses holding at most max_size bytes (bodies and headers).
+  '''
+  def __init__(self, max_size=DEFAULT_MAX_SIZE):
+    self.max_size = max_size
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    # cache key -> entry, ordered from least to most recently used
+    self.__entries = collections.OrderedDict()
+    self.__lock = threading.Lock()
+
+  def get(self, key):
+    '''
+    Returns the entry cached under key, or None if there's none or it expired.
+    '''
+    with self.__lock:
+      entry = self.__entries.get(key)
+      if entry and entry.expires_at <= time.time():
+        self.__remove(key)
+        entry = None
+
+      if entry:
+        self.__entries.move_to_end(key)
+        self.hits += 1
+      else:
+        self.misses += 1
+      return entry
+
+  def put(self, key, route_key, status_code, headers, body, ttl):
+    '''
+    Caches a response (body being bytes) under key for ttl seconds, evicting the least
+    recently used entries if needed. Responses larger than the whole cache aren't cached.
+    '''
+    entry = CacheEntry(route_key, status_code, headers, body, ttl)
+    if ttl <= 0 or entry.size > self.max_size:
+      return
+
+    with self.__lock:
+      if key in self.__entries:
+        self.__remove(key)
+      self.__entries[key] = entry
+      self.size += entry.size
+
+      while self.size > self.max_size:
+        self.__remove(next(iter(self.__entries)))
+        self.evictions += 1
+
+  def invalidate(self, route_keys=None):
+    '''
+    Drops the entries of the provided routes, or every entry if not specified.
+    '''
+    with self.__lock:
+      for key in [key for key, entry in self.__entries.items() if route_keys is None or entry.route_key in route_keys]:
+        self.__remove(key)
+
+  def stats(self):
+    with self.__lock:
+      return {
+        'entries': len(self.__entries),
+        'size': self.size,
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions
+      }
+
+  def __remove(self, key):
+    self.size -= self.__entries.pop(key).size
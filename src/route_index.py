@@ -0,0 +1,192 @@
+'''
+Precompiled HTTP API route index.
+
+Routes are stored in a tree over path segments, so matching a request only walks the request
+path's segments regardless of how many routes are configured. Matching follows AWS HTTP API
+route precedence: static segments win over path parameters ("{id}"), which win over greedy path
+variables ("{proxy+}"); an exact method wins over ANY, and the $default route catches every
+request no other route matches.
+
+Reference: https://docs.aws.amazon.com/apigateway/latest/developerguide/http-api-develop-routes.html
+'''
+
+ANY_METHOD = 'ANY'
+DEFAULT_ROUTE = '$default'
+
+class RouteMatch:
+  '''
+  A matched route: its route key (e.g. "GET /users/{id}"), the value it was registered with and
+  the path parameters extracted from the request path.
+  '''
+  def __init__(self, route_key, value, path_parameters):
+    self.route_key = route_key
+    self.value = value
+    self.path_parameters = path_parameters
+
+class RouteNode:
+  '''
+  Route tree node, representing one path segment.
+  '''
+  __slots__ = ('static', 'param', 'param_name', 'greedy', 'greedy_name', 'routes')
+
+  def __init__(self):
+    self.static = {}
+    self.param = None
+    self.param_name = None
+    self.greedy = None
+    self.greedy_name = None
+    # method -> (route key, value)
+    self.routes = {}
+
+def split_path(path):
+  '''
+  Splits a request path or route path into its segments.
+  '''
+  path = path.strip('/')
+  return path.split('/') if path else []
+
+def parse_route_key(route_key):
+  '''
+  Splits a route key ("GET /path", "ANY /path" or "$default") into its method and path.
+  '''
+  if route_key == DEFAULT_ROUTE:
+    return ANY_METHOD, None
+
+  method, _, path = route_key.strip().partition(' ')
+  method = method.upper()
+  if method == '*':
+    method = ANY_METHOD
+  return method, path.strip()
+
+class RouteIndex:
+  '''
+  Index of HTTP API routes supporting path parameters, greedy path variables, ANY methods and
+  the $default route.
+  '''
+  def __init__(self, routes=None):
+    self.__root = RouteNode()
+    self.__default = None
+    self.size = 0
+
+    if routes:
+      for route_key, value in routes.items():
+        self.add(route_key, value)
+
+  def add(self, route_key, value):
+    '''
+    Adds a route identified by its route key (e.g. "GET /users/{id}") to the index.
+    '''
+    method, path = parse_route_key(route_key)
+
+    if path is None:
+      if self.__default:
+        raise ValueError('Duplicated route: {}'.format(DEFAULT_ROUTE))
+      self.__default = (DEFAULT_ROUTE, value)
+      self.size += 1
+      return
+
+    node = self.__root
+    segments = split_path(path)
+    for i, segment in enumerate(segments):
+      if segment.startswith('{') and segment.endswith('+}'):
+        if i != len(segments) - 1:
+          raise ValueError(
+            'Invalid route "{}": greedy path variables must be the last segment'.format(route_key)
+          )
+        if node.greedy is None:
+          node.greedy = RouteNode()
+          node.greedy_name = segment[1:-2]
+        elif node.greedy_name != segment[1:-2]:
+          raise ValueError('Conflicting path variable names in route "{}"'.format(route_key))
+        node = node.greedy
+      elif segment.startswith('{') and segment.endswith('}'):
+        if node.param is None:
+          node.param = RouteNode()
+          node.param_name = segment[1:-1]
+        elif node.param_name != segment[1:-1]:
+          raise ValueError('Conflicting path parameter names in route "{}"'.format(route_key))
+        node = node.param
+      else:
+        if segment not in node.static:
+          node.static[segment] = RouteNode()
+        node = node.static[segment]
+
+    if method in node.routes:
+      raise ValueError('Duplicated route: {}'.format(route_key))
+
+    node.routes[method] = (route_key, value)
+    self.size += 1
+
+  def match(self, method, path):
+    '''
+    Returns the RouteMatch for the provided request method and path, or None if no route
+    (including $default) matches it.
+    '''
+    path_parameters = {}
+    route = RouteIndex.__match_node(self.__root, split_path(path), 0, method.upper(), path_parameters)
+
+    if route:
+      return RouteMatch(route[0], route[1], path_parameters if path_parameters else None)
+
+    if self.__default:
+      return RouteMatch(self.__default[0], self.__default[1], None)
+
+    return None
+
+  def allowed_methods(self, path):
+    '''
+    Returns the methods of the routes matching the provided path, regardless of their method.
+    '''
+    methods = set()
+    RouteIndex.__collect_methods(self.__root, split_path(path), 0, methods)
+    return methods
+
+  @staticmethod
+  def __select_route(node, method):
+    route = node.routes.get(method)
+    if route is None:
+      route = node.routes.get(ANY_METHOD)
+    return route
+
+  @staticmethod
+  def __match_node(node, segments, i, method, path_parameters):
+    if i == len(segments):
+      return RouteIndex.__select_route(node, method)
+
+    segment = segments[i]
+
+    child = node.static.get(segment)
+    if child is not None:
+      route = RouteIndex.__match_node(child, segments, i + 1, method, path_parameters)
+      if route:
+        return route
+
+    if node.param is not None and segment:
+      route = RouteIndex.__match_node(node.param, segments, i + 1, method, path_parameters)
+      if route:
+        path_parameters[node.param_name] = segment
+        return route
+
+    if node.greedy is not None:
+      route = RouteIndex.__select_route(node.greedy, method)
+      if route:
+        path_parameters[node.greedy_name] = '/'.join(segments[i:])
+        return route
+
+    return None
+
+  @staticmethod
+  def __collect_methods(node, segments, i, methods):
+    if i == len(segments):
+      methods.update(node.routes)
+      return
+
+    child = node.static.get(segments[i])
+    if child is not None:
+      RouteIndex.__collect_methods(child, segments, i + 1, methods)
+
+    if node.param is not None and segments[i]:
+      RouteIndex.__collect_methods(node.param, segments, i + 1, methods)
+
+    if node.greedy is not None:
+      methods.update(node.greedy.routes)
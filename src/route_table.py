@@ -0,0 +1,59 @@
+'''
+Per-route request handling state shared by the routers.
+'''
+
+from cors import build_cors_policies
+from jwt_authorizer import build_route_authorizers
+from payload import PayloadBuilder
+from route_index import RouteIndex
+
+class RouteTable:
+  '''
+  The routes of an endpoint configuration along with the state precomputed for them: the index
+  requests are matched against, and every route's payload builder, JWT authorizer and CORS
+  policy.
+
+  Tables aren't modified once built: routers replace theirs whole, so a request always works
+  with a consistent set of routes even if the configuration is reloaded while it's handled.
+  If previous (the table being replaced) is specified, the state of the routes whose
+  configuration didn't change is carried over (e.g. authorizers keep their token caches).
+  '''
+  def __init__(self, endpoint_config, jwt_secret=None, jwks_file=None, previous=None):
+    self.endpoint_config = endpoint_config
+    self.route_index = RouteIndex(endpoint_config)
+
+    unchanged = set()
+    if previous:
+      unchanged = {
+        route_key for route_key, api in endpoint_config.items()
+          if previous.endpoint_config.get(route_key) == api
+      }
+
+    # the route-invariant part of every route's payloads is computed once, up front
+    self.payload_builders = {
+      route_key: previous.payload_builders[route_key] if route_key in unchanged else PayloadBuilder(route_key)
+        for route_key in endpoint_config
+    }
+
+    # route key -> (JWT authorizer, required scopes)
+    self.authorizers = build_route_authorizers(
+      {route_key: api for route_key, api in endpoint_config.items() if route_key not in unchanged},
+      jwt_secret,
+      jwks_file
+    )
+    for route_key in unchanged:
+      if route_key in previous.authorizers:
+        self.authorizers[route_key] = previous.authorizers[route_key]
+
+    # route key -> CORS policy, for the routes with CORS enabled
+    self.cors_policies = build_cors_policies(endpoint_config)
+
+  def changed_routes(self, previous):
+    '''
+    Returns the keys of the routes that were added, removed or reconfigured since previous.
+    '''
+    route_keys = set(self.endpoint_config) | set(previous.endpoint_config)
+    return {
+      route_key for route_key in route_keys
+        if self.endpoint_config.get(route_key) != previous.endpoint_config.get(route_key)
+    }
@@ -0,0 +1,563 @@
+'''
+Local implementation of the AWS Lambda Runtime API.
+
+Each function gets its own Runtime API endpoint which long-lived runtime containers poll for
+work (GET /runtime/invocation/next) and report results to (POST /runtime/invocation/<id>/response
+or /error), the same way they do on AWS. Invocations are queued and the caller waits on a future
+instead of spawning a process per event, and return values travel separately from log output.
+Every worker polls the endpoint's queue through a server of its own, so that the first
+invocation it processes, which waited for its runtime to initialize, is reported as a cold start.
+
+Reference: https://docs.aws.amazon.com/lambda/latest/dg/runtimes-api.html
+'''
+
+import json
+import os
+import queue
+import re
+import select
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import docker_client
+import lambda_utils
+import utils
+
+API_VERSION = '2018-06-01'
+NEXT_INVOCATION_PATH = '/{}/runtime/invocation/next'.format(API_VERSION)
+INVOCATION_RESULT_PATH = re.compile(
+  r'^/' + API_VERSION + r'/runtime/invocation/(?P<request_id>[^/]+)/(?P<result>response|error)$'
+)
+INIT_ERROR_PATH = '/{}/runtime/init/error'.format(API_VERSION)
+
+# hostname containers use to reach the Runtime API server running on the host
+DOCKER_HOST_NAME = 'host.docker.internal'
+# network whose gateway (the host's address on it) Runtime API servers bind to by default
+DOCKER_BRIDGE_NETWORK = 'bridge'
+LOCALHOST = '127.0.0.1'
+
+# seconds between the checks of a long-polling worker's connection and endpoint
+POLL_INTERVAL = 1
+# seconds before a worker that exited unexpectedly is replaced
+RESTART_DELAY = 1
+
+# AWS base images implement the Runtime API client and accept the handler as their command
+RUNTIME_IMAGES = {
+  'python3.7': 'public.ecr.aws/lambda/python:3.7',
+  'python3.8': 'public.ecr.aws/lambda/python:3.8',
+  'python3.9': 'public.ecr.aws/lambda/python:3.9',
+  'nodejs12.x': 'public.ecr.aws/lambda/nodejs:12',
+  'nodejs14.x': 'public.ecr.aws/lambda/nodejs:14'
+}
+
+FUNCTION_ARN_TEMPLATE = 'arn:aws:lambda:us-east-1:000000000000:function:{}'
+
+class Invocation:
+  '''
+  A queued function invocation whose result is delivered through a future.
+  '''
+  def __init__(self, payload, timeout):
+    self.request_id = str(uuid.uuid4())
+    self.event = json.dumps(payload if payload else {}).encode('utf-8')
+    self.deadline_ms = int((time.time() + timeout) * 1000)
+    self.future = Future()
+    # when the invocation was queued and handed to a runtime worker
+    self.queued_at = time.perf_counter()
+    self.started_at = None
+    # set if the worker it was handed to hadn't processed any invocation yet
+    self.cold_start = False
+
+class RuntimeWorker:
+  '''
+  A runtime container of a FunctionEndpoint, along with the server it polls the endpoint
+  through.
+  '''
+  def __init__(self, endpoint, host):
+    self.container_id = None
+    # whether the worker was handed an invocation yet, and the one it's processing
+    self.initialized = False
+    self.invocation = None
+
+    handler = type('Handler', (RuntimeApiRequestHandler,), {'endpoint': endpoint, 'worker': self})
+    self.server = ThreadingHTTPServer((host, 0), handler)
+    self.server.daemon_threads = True
+    self.port = self.server.server_address[1]
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+  def stop_server(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+class FunctionEndpoint:
+  '''
+  Runtime API endpoint (and its workers) for a single function.
+  '''
+  def __init__(self, api_config, host):
+    self.api_config = api_config
+    self.host = host
+    self.invocations = queue.Queue()
+    self.in_flight = {}
+    self.lock = threading.Lock()
+    self.workers = []
+    # set once the endpoint is stopped, releasing its long-polling workers
+    self.stopped = threading.Event()
+
+  def take(self, request_id):
+    '''
+    Removes an invocation from those being processed, returning it, or None if it's not.
+    '''
+    with self.lock:
+      invocation = self.in_flight.pop(request_id, None)
+      if invocation:
+        for worker in self.workers:
+          if worker.invocation is invocation:
+            worker.invocation = None
+      return invocation
+
+  def find_worker(self, invocation):
+    '''
+    Returns the worker processing an invocation, or None.
+    '''
+    with self.lock:
+      return next((worker for worker in self.workers if worker.invocation is invocation), None)
+
+class RuntimeApiRequestHandler(BaseHTTPRequestHandler):
+  '''
+  Serves Runtime API calls made by one of a function's runtime workers.
+  '''
+  endpoint = None
+  worker = None
+
+  def log_message(self, format, *args):
+    # keep the gateway output focused on function logs
+    pass
+
+  def do_GET(self):
+    if self.path != NEXT_INVOCATION_PATH:
+      self.__reply(404, {'errorMessage': 'Not found', 'errorType': 'InvalidRequest'})
+      return
+
+    # long-poll until there's an event for this function, as long as the worker is connected
+    while True:
+      try:
+        invocation = self.endpoint.invocations.get(timeout=POLL_INTERVAL)
+      except queue.Empty:
+        if self.endpoint.stopped.is_set() or self.__is_disconnected():
+          self.close_connection = True
+          return
+        continue
+      if invocation.future.done():
+        continue
+      if self.endpoint.stopped.is_set() or self.__is_disconnected():
+        # leave the invocation to another worker
+        self.endpoint.invocations.put(invocation)
+        self.close_connection = True
+        return
+      break
+
+    invocation.started_at = time.perf_counter()
+    with self.endpoint.lock:
+      self.endpoint.in_flight[invocation.request_id] = invocation
+      invocation.cold_start = not self.worker.initialized
+      self.worker.initialized = True
+      self.worker.invocation = invocation
+
+    try:
+      self.__send_invocation(invocation)
+    except OSError:
+      # the worker went away: requeue the invocation for another one
+      if self.endpoint.take(invocation.request_id):
+        invocation.started_at = None
+        invocation.cold_start = False
+        self.endpoint.invocations.put(invocation)
+      self.close_connection = True
+
+  def __is_disconnected(self):
+    '''
+    Returns True if the worker closed its connection while waiting for an invocation.
+    '''
+    try:
+      readable, _, _ = select.select([self.connection], [], [], 0)
+      return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+    except (OSError, ValueError):
+      return True
+
+  def __send_invocation(self, invocation):
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(invocation.event)))
+    self.send_header('Lambda-Runtime-Aws-Request-Id', invocation.request_id)
+    self.send_header('Lambda-Runtime-Deadline-Ms', str(invocation.deadline_ms))
+    self.send_header(
+      'Lambda-Runtime-Invoked-Function-Arn',
+      FUNCTION_ARN_TEMPLATE.format(self.endpoint.api_config['function'])
+    )
+    self.send_header('Lambda-Runtime-Trace-Id', 'Root=1-{}'.format(uuid.uuid4().hex[:24]))
+    self.end_headers()
+    self.wfile.write(invocation.event)
+    self.wfile.flush()
+
+  def do_POST(self):
+    content_length = int(self.headers.get('Content-Length', 0))
+    if content_length > lambda_utils.MAX_RESPONSE_SIZE:
+      self.__reject_response(content_length)
+      return
+
+    body = self.rfile.read(content_length)
+
+    if self.path == INIT_ERROR_PATH:
+      print(
+        'Runtime initialization error in function "{}": {}'.format(
+          self.endpoint.api_config['function'],
+          body.decode('utf-8', errors='replace')
+        ),
+        file=sys.stderr
+      )
+      self.__reply(202, {'status': 'OK'})
+      return
+
+    match = INVOCATION_RESULT_PATH.match(self.path)
+    if not match:
+      self.__reply(404, {'errorMessage': 'Not found', 'errorType': 'InvalidRequest'})
+      return
+
+    invocation = self.endpoint.take(match.group('request_id'))
+    if not invocation:
+      self.__reply(400, {'errorMessage': 'Invalid request ID', 'errorType': 'InvalidRequestID'})
+      return
+
+    function_output = body.decode('utf-8').strip()
+    retcode = 0 if match.group('result') == 'response' else 1
+    try:
+      invocation.future.set_result(lambda_utils.build_response(function_output, retcode, ''))
+    except InvalidStateError:
+      # the caller already gave up on this invocation
+      pass
+
+    self.__reply(202, {'status': 'OK'})
+
+  def __reject_response(self, content_length):
+    '''
+    Rejects a result over the Lambda response size limit without holding it in memory, failing
+    its invocation the way AWS Lambda does.
+    '''
+    remaining = content_length
+    while remaining > 0:
+      chunk = self.rfile.read(min(remaining, 65536))
+      if not chunk:
+        break
+      remaining -= len(chunk)
+
+    match = INVOCATION_RESULT_PATH.match(self.path)
+    invocation = self.endpoint.take(match.group('request_id')) if match else None
+    if invocation:
+      try:
+        invocation.future.set_result(lambda_utils.build_response(
+          lambda_utils.build_response_too_large_error(content_length),
+          1,
+          ''
+        ))
+      except InvalidStateError:
+        pass
+
+    self.__reply(413, {
+      'errorMessage': 'Exceeded maximum allowed payload size ({} bytes).'.format(lambda_utils.MAX_RESPONSE_SIZE),
+      'errorType': 'RequestEntityTooLarge'
+    })
+
+  def __reply(self, status, obj):
+    body = json.dumps(obj).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+class RuntimeApi:
+  '''
+  Manages the per-function Runtime API endpoints and the long-lived runtime containers polling
+  them. Workers for a function are started on its first invocation, and replaced if they exit.
+  Images are picked from runtime_images (runtime name -> image), which defaults to the AWS
+  Lambda base images and can be extended to support any Runtime API-compliant image.
+  Endpoints are served on host which, unless specified, is the host's address on Docker's bridge
+  network (only reachable by containers and the host itself), or 127.0.0.1 with host networking
+  or if that address can't be bound (e.g. Docker Desktop).
+  '''
+  def __init__(
+      self,
+      host=None,
+      workers=1,
+      timeout=30,
+      runtime_images=None,
+      layer_dir=None,
+      docker_network_name=None,
+      environment=None,
+      client=None
+    ):
+    self.host = host
+    self.workers = workers
+    self.timeout = timeout
+    self.runtime_images = dict(RUNTIME_IMAGES)
+    if runtime_images:
+      self.runtime_images.update(runtime_images)
+    self.layer_dir = layer_dir
+    self.docker_network_name = docker_network_name
+    self.environment = environment
+    self.client = client if client else docker_client.get_default_client()
+
+    self.__endpoints = {}
+    self.__lock = threading.Lock()
+
+  def get_host(self):
+    '''
+    Returns the address Runtime API endpoints are served on, resolving it on first use.
+    '''
+    with self.__lock:
+      if self.host is None:
+        self.host = self.__resolve_host()
+      return self.host
+
+  def __resolve_host(self):
+    if self.docker_network_name == 'host':
+      return LOCALHOST
+    try:
+      address = self.client.inspect_network(DOCKER_BRIDGE_NETWORK)['IPAM']['Config'][0]['Gateway']
+      # the gateway may not be a host address (e.g. with Docker Desktop's virtual machine)
+      with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((address, 0))
+      return address
+    except (OSError, docker_client.DockerApiError, KeyError, IndexError, TypeError):
+      return LOCALHOST
+
+  def invoke(self, api_config, payload):
+    '''
+    Queues an invocation of the function described by api_config (an endpoint config entry) and
+    waits for one of its runtime workers to process it.
+    Returns the same object as lambda_utils.run_function, plus a 'cold_start' flag.
+    '''
+    endpoint = self.__get_endpoint(api_config)
+    timeout = api_config.get('timeout') or self.timeout
+    invocation = Invocation(payload, timeout)
+    endpoint.invocations.put(invocation)
+
+    try:
+      response = invocation.future.result(timeout=timeout)
+      # time waiting for a worker (including worker cold starts) and time spent by the worker
+      # invocations failed before a worker picked them up were never started
+      started_at = invocation.started_at or time.perf_counter()
+      response['timings'] = {
+        'container': started_at - invocation.queued_at,
+        'handler': time.perf_counter() - started_at
+      }
+      response['cold_start'] = invocation.cold_start
+      return response
+    except FutureTimeoutError:
+      # discard the invocation so that it's not handed out or its late result accepted
+      invocation.future.cancel()
+      worker = endpoint.find_worker(invocation)
+      if endpoint.take(invocation.request_id) and worker:
+        # a worker is still running the invocation: replace it, since there's no way to
+        # interrupt a runtime in the middle of an invocation
+        self.__kill_worker(worker)
+      response = lambda_utils.build_timeout_response(timeout)
+      response['cold_start'] = invocation.cold_start
+      return response
+
+  def recycle(self, function_file_path=None):
+    '''
+    Replaces the endpoint of the function located at function_file_path (or every endpoint if
+    not specified): new invocations are served by fresh workers, while the old ones are stopped
+    once they've processed the invocations already queued for them.
+    '''
+    with self.__lock:
+      keys = [
+        key for key in self.__endpoints
+          if function_file_path is None or key.startswith(function_file_path + ':')
+      ]
+      endpoints = [self.__endpoints.pop(key) for key in keys]
+
+    for endpoint in endpoints:
+      threading.Thread(target=self.__retire_endpoint, args=(endpoint,), daemon=True).start()
+
+  def shutdown(self):
+    '''
+    Stops every runtime worker and Runtime API endpoint.
+    '''
+    with self.__lock:
+      endpoints = list(self.__endpoints.values())
+      self.__endpoints = {}
+
+    for endpoint in endpoints:
+      self.__stop_endpoint(endpoint)
+
+  def __retire_endpoint(self, endpoint):
+    deadline = time.time() + self.timeout
+    idle_checks = 0
+    while time.time() < deadline and idle_checks < 2:
+      # an invocation is briefly in neither place while a worker picks it up
+      with endpoint.lock:
+        idle = endpoint.invocations.empty() and not endpoint.in_flight
+      idle_checks = idle_checks + 1 if idle else 0
+      time.sleep(0.1)
+    self.__stop_endpoint(endpoint)
+
+  def __kill_endpoint(self, endpoint):
+    '''
+    Stops an endpoint right away, failing the invocations it was processing or had queued.
+    '''
+    key = endpoint.api_config['filepath'] + ':' + endpoint.api_config['handler']
+    with self.__lock:
+      if self.__endpoints.get(key) is endpoint:
+        del self.__endpoints[key]
+    self.__stop_endpoint(endpoint)
+
+    with endpoint.lock:
+      invocations = list(endpoint.in_flight.values())
+      endpoint.in_flight.clear()
+    while not endpoint.invocations.empty():
+      invocations.append(endpoint.invocations.get_nowait())
+
+    error = json.dumps({
+      'errorType': 'Runtime.ExitError',
+      'errorMessage': 'Runtime exited: the function\'s workers were stopped'
+    })
+    for invocation in invocations:
+      try:
+        invocation.future.set_result(lambda_utils.build_response(error, 1, ''))
+      except InvalidStateError:
+        pass
+
+  def __kill_worker(self, worker):
+    '''
+    Removes a worker's container, which gets it replaced (see __replace_worker).
+    '''
+    try:
+      self.client.remove_container(worker.container_id)
+    except docker_client.DockerApiError:
+      pass
+
+  def __stop_endpoint(self, endpoint):
+    endpoint.stopped.set()
+    with endpoint.lock:
+      workers = list(endpoint.workers)
+    for worker in workers:
+      try:
+        self.client.remove_container(worker.container_id)
+      except docker_client.DockerApiError:
+        pass
+      worker.stop_server()
+
+  def __get_endpoint(self, api_config):
+    if api_config['runtime'] not in self.runtime_images:
+      raise Exception('No runtime image configured for runtime "{}"'.format(api_config['runtime']))
+
+    key = api_config['filepath'] + ':' + api_config['handler']
+    host = self.get_host()
+    with self.__lock:
+      endpoint = self.__endpoints.get(key)
+      if endpoint:
+        return endpoint
+      endpoint = self.__endpoints[key] = FunctionEndpoint(api_config, host)
+
+    # workers are started outside the lock so that other functions' first invocations don't
+    # wait for them; invocations queue up on the endpoint in the meantime
+    try:
+      for _ in range(self.workers):
+        self.__start_worker(endpoint)
+    except Exception:
+      self.__kill_endpoint(endpoint)
+      raise
+    return endpoint
+
+  def __replace_worker(self, endpoint, worker):
+    '''
+    Fails the invocation a worker that exited was processing, and replaces the worker if its
+    endpoint is still serving.
+    '''
+    invocation = worker.invocation
+    if invocation and endpoint.take(invocation.request_id):
+      try:
+        invocation.future.set_result(lambda_utils.build_response(json.dumps({
+          'errorType': 'Runtime.ExitError',
+          'errorMessage': 'RequestId: {} Error: Runtime exited without providing a reason'.format(invocation.request_id)
+        }), 1, ''))
+      except InvalidStateError:
+        pass
+
+    with endpoint.lock:
+      if endpoint.stopped.is_set() or worker not in endpoint.workers:
+        return
+      endpoint.workers.remove(worker)
+    worker.stop_server()
+
+    print(
+      'WARNING: runtime worker of function "{}" exited, replacing it'.format(endpoint.api_config['function']),
+      file=sys.stderr
+    )
+    time.sleep(RESTART_DELAY)
+    if endpoint.stopped.is_set():
+      return
+    try:
+      self.__start_worker(endpoint)
+    except (OSError, docker_client.DockerApiError) as error:
+      print('Error replacing the runtime worker of function "{}": {}'.format(endpoint.api_config['function'], error), file=sys.stderr)
+
+  def __start_worker(self, endpoint):
+    api_config = endpoint.api_config
+    worker = RuntimeWorker(endpoint, endpoint.host)
+    function_name = os.path.splitext(os.path.basename(api_config['filepath']))[0]
+
+    options = lambda_utils.build_container_options(
+      os.path.dirname(api_config['filepath']),
+      layer_dir=self.layer_dir,
+      docker_network_name=self.docker_network_name,
+      environment=self.environment,
+      memory_size=api_config.get('memorySize'),
+      timeout=api_config.get('timeout') or self.timeout
+    )
+    # with host networking, containers reach the endpoint on the loopback interface
+    runtime_host = LOCALHOST if self.docker_network_name == 'host' else DOCKER_HOST_NAME
+    options['env']['AWS_LAMBDA_RUNTIME_API'] = '{}:{}'.format(runtime_host, worker.port)
+    options['env']['AWS_LAMBDA_FUNCTION_NAME'] = api_config['function']
+    options['host_config'].update({'AutoRemove': True, 'ExtraHosts': [DOCKER_HOST_NAME + ':host-gateway']})
+
+    try:
+      worker.container_id = self.client.create_container(
+        self.runtime_images[api_config['runtime']],
+        cmd=['{}.{}'.format(function_name, api_config['handler'])],
+        **options
+      )
+      # forward worker logs as they're produced, separately from invocation results
+      sock = self.client.attach_container(worker.container_id)
+    except Exception:
+      worker.stop_server()
+      raise
+
+    def forward_logs():
+      prefix = utils.color('[{}]'.format(api_config['function']), 'gray')
+      pending = [b'']
+
+      def print_lines(_, data):
+        lines = (pending[0] + data).split(b'\n')
+        pending[0] = lines.pop()
+        for line in lines:
+          print('{} {}'.format(prefix, line.decode('utf-8', errors='replace').rstrip()))
+
+      with sock, sock.makefile('rb') as reader:
+        try:
+          docker_client.demultiplex(reader, print_lines)
+        except OSError:
+          pass
+      # the output ends when the worker exits
+      self.__replace_worker(endpoint, worker)
+
+    with endpoint.lock:
+      endpoint.workers.append(worker)
+    threading.Thread(target=forward_logs, daemon=True).start()
+    self.client.start_container(worker.container_id)
+    return worker
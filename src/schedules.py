@@ -0,0 +1,157 @@
+'''
+Schedule expressions.
+
+Parses the rate and cron expressions of "schedule" events (EventBridge's syntax) and computes
+their fire times. Cron expressions have six fields (minutes, hours, day of month, month, day of
+week and year, the last one being optional here), evaluated in UTC; "?" must be used in either
+the day of month or the day of week field, and the "L", "W" and "#" wildcards aren't supported.
+
+Reference: https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-scheduled-rule-pattern.html
+'''
+
+import datetime
+import math
+import re
+
+RATE_EXPRESSION = re.compile(r'^rate\(\s*(?P<value>\d+)\s+(?P<unit>minutes?|hours?|days?)\s*\)$')
+CRON_EXPRESSION = re.compile(r'^cron\((?P<fields>[^)]*)\)$')
+
+RATE_UNITS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+MONTH_NAMES = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+DAY_NAMES = ['SUN', 'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT']
+
+# (minimum, maximum, names) of every cron field
+CRON_FIELDS = [
+  (0, 59, None),
+  (0, 23, None),
+  (1, 31, None),
+  (1, 12, MONTH_NAMES),
+  (1, 7, DAY_NAMES),
+  (1970, 2199, None)
+]
+
+class RateSchedule:
+  '''
+  Fires every period seconds from start (a timestamp).
+  '''
+  def __init__(self, period, start):
+    self.period = period
+    self.start = start
+
+  def next_time(self, after):
+    '''
+    Returns the first fire time (a timestamp) later than after.
+    '''
+    if after < self.start:
+      return self.start + self.period
+    return self.start + (math.floor((after - self.start) / self.period) + 1) * self.period
+
+class CronSchedule:
+  '''
+  Fires at the minutes matching a cron expression's fields (sets of accepted values, None for
+  a day field set to "?").
+  '''
+  def __init__(self, minutes, hours, days, months, weekdays, years):
+    self.minutes = minutes
+    self.hours = hours
+    self.days = days
+    self.months = months
+    self.weekdays = weekdays
+    self.years = years
+
+  def matches_day(self, time):
+    if self.days is None:
+      # days of week are numbered from 1 (Sunday) to 7 (Saturday)
+      return (time.weekday() + 1) % 7 + 1 in self.weekdays
+    return time.day in self.days
+
+  def next_time(self, after):
+    '''
+    Returns the first fire time (a timestamp) later than after, or None if there's none.
+    '''
+    time = datetime.datetime.fromtimestamp(after, datetime.timezone.utc).replace(second=0, microsecond=0)
+    time += datetime.timedelta(minutes=1)
+
+    # skip whole years, months, days and hours that don't match
+    while time.year <= max(self.years):
+      if time.year not in self.years:
+        time = time.replace(year=time.year + 1, month=1, day=1, hour=0, minute=0)
+      elif time.month not in self.months:
+        if time.month == 12:
+          time = time.replace(year=time.year + 1, month=1, day=1, hour=0, minute=0)
+        else:
+          time = time.replace(month=time.month + 1, day=1, hour=0, minute=0)
+      elif not self.matches_day(time):
+        time = time.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+      elif time.hour not in self.hours:
+        time = time.replace(minute=0) + datetime.timedelta(hours=1)
+      elif time.minute not in self.minutes:
+        time += datetime.timedelta(minutes=1)
+      else:
+        return time.timestamp()
+    return None
+
+def parse_cron_value(value, names):
+  if names and value.upper() in names:
+    return names.index(value.upper()) + 1
+  return int(value)
+
+def parse_cron_field(field, minimum, maximum, names=None):
+  '''
+  Returns the set of values a cron field accepts.
+  '''
+  values = set()
+  for part in field.split(','):
+    part, _, step = part.partition('/')
+    if part in ('*', '?'):
+      start, end = minimum, maximum
+    elif '-' in part:
+      start, end = (parse_cron_value(value, names) for value in part.split('-', 1))
+    else:
+      start = parse_cron_value(part, names)
+      # "<start>/<step>" runs up to the maximum
+      end = maximum if step else start
+
+    if start < minimum or end > maximum or start > end:
+      raise ValueError('Value out of range in cron field "{}"'.format(field))
+    values.update(range(start, end + 1, int(step) if step else 1))
+  return values
+
+def parse_schedule(expression, start):
+  '''
+  Parses a rate or cron expression, returning an object whose next_time(after) method returns
+  the first fire time later than after. Rates count from start (a timestamp).
+  Raises ValueError if the expression is invalid or unsupported.
+  '''
+  expression = expression.strip()
+
+  match = RATE_EXPRESSION.match(expression)
+  if match:
+    value = int(match.group('value'))
+    if value < 1:
+      raise ValueError('Invalid rate: "{}"'.format(expression))
+    return RateSchedule(value * RATE_UNITS[match.group('unit').rstrip('s')], start)
+
+  match = CRON_EXPRESSION.match(expression)
+  if not match:
+    raise ValueError('Invalid schedule expression: "{}"'.format(expression))
+
+  fields = match.group('fields').split()
+  if len(fields) == 5:
+    fields.append('*')
+  if len(fields) != 6:
+    raise ValueError('Invalid cron expression: "{}"'.format(expression))
+  if any(wildcard in fields[2] for wildcard in ('L', 'W')) or any(wildcard in fields[4] for wildcard in ('L', '#')):
+    raise ValueError('Unsupported cron wildcard in "{}"'.format(expression))
+  if (fields[2] == '?') == (fields[4] == '?'):
+    raise ValueError('Cron expressions must use "?" in either the day of month or the day of week field: "{}"'.format(expression))
+
+  try:
+    values = [
+      None if field == '?' and index in (2, 4) else parse_cron_field(field, *CRON_FIELDS[index])
+        for index, field in enumerate(fields)
+    ]
+  except ValueError as error:
+    raise ValueError('Invalid cron expression "{}": {}'.format(expression, error))
+  return CronSchedule(*values)
@@ -0,0 +1,126 @@
+'''
+Request coalescing.
+
+Routes with a "coalesce" setting (see api_gateway's "custom.cyclon.routes") have their identical
+concurrent GET and HEAD requests share a single invocation: the first request invokes the
+function while those arriving before it completes wait for its result instead of starting
+invocations of their own, up to a number of waiters per invocation.
+
+A call is split in two steps, begin and finish, so that the requests of every pre-forked HTTP
+worker can share their calls through the coordinator's SingleFlight (see prefork.py), which
+can't be handed the function to call.
+'''
+
+import itertools
+import threading
+
+# requests that may wait for the same invocation unless configured otherwise
+DEFAULT_MAX_WAITERS = 100
+
+# roles of the callers of SingleFlight.begin
+LEADER = 'leader'
+SHARED = 'shared'
+ALONE = 'alone'
+
+class Call:
+  '''
+  An invocation in progress and the requests waiting for its result.
+  '''
+  def __init__(self, token):
+    # identifies the call to its leader, whose finish must not complete a later call for the key
+    self.token = token
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+    self.waiters = 0
+
+class SingleFlight:
+  '''
+  Runs at most one call per key at a time, handing its result to the callers asking for the same
+  key while it runs.
+  '''
+  def __init__(self):
+    # calls whose result was shared rather than computed
+    self.saved = 0
+
+    self.__calls = {}
+    self.__tokens = itertools.count(1)
+    self.__lock = threading.Lock()
+
+  def begin(self, key, max_waiters=DEFAULT_MAX_WAITERS, timeout=None):
+    '''
+    Starts a call for key, returning the caller's role along with the call's result:
+    - LEADER if no call for key is in progress: the caller makes the call and must report its
+      outcome with finish, passing the token returned in place of the result.
+    - SHARED if a call is in progress: its result is returned once it completes, and its
+      exception raised if it failed.
+    - ALONE if the call in progress already has max_waiters waiters, or didn't complete within
+      timeout seconds (e.g. its leader died): the caller makes a call of its own.
+    '''
+    with self.__lock:
+      call = self.__calls.get(key)
+      if call is None:
+        call = self.__calls[key] = Call(next(self.__tokens))
+        return LEADER, call.token
+      if call.waiters >= max_waiters:
+        return ALONE, None
+      call.waiters += 1
+
+    if not call.done.wait(timeout):
+      with self.__lock:
+        call.waiters -= 1
+        # the call is abandoned, so that the next caller leads a new one
+        if self.__calls.get(key) is call:
+          del self.__calls[key]
+      return ALONE, None
+    if call.error is not None:
+      raise call.error
+    with self.__lock:
+      self.saved += 1
+    return SHARED, call.result
+
+  def finish(self, key, token, result=None, error=None):
+    '''
+    Completes the call for key started by begin with its result, or the exception it raised,
+    unless the call was abandoned by its waiters since (and possibly replaced by another one).
+    '''
+    with self.__lock:
+      call = self.__calls.get(key)
+      if call is None or call.token != token:
+        return
+      del self.__calls[key]
+      call.result = result
+      call.error = error
+      call.done.set()
+
+  def do(self, key, fn, max_waiters=DEFAULT_MAX_WAITERS, timeout=None):
+    '''
+    Returns the result of fn, or of the call to it already in progress for key, along with
+    whether the result was shared (see begin).
+    '''
+    return run_once(self, key, fn, max_waiters, timeout)
+
+  def stats(self):
+    with self.__lock:
+      return {'in_flight': len(self.__calls), 'saved': self.saved}
+
+def run_once(single_flight, key, fn, max_waiters=DEFAULT_MAX_WAITERS, timeout=None):
+  '''
+  Calls fn through single_flight, a SingleFlight or a proxy to one, returning its result (or
+  the result of the call already in progress for key) and whether it was shared. Exceptions
+  raised by fn are raised to every waiter.
+  '''
+  role, result = single_flight.begin(key, max_waiters, timeout)
+  if role == SHARED:
+    return result, True
+  if role == ALONE:
+    return fn(), False
+
+  token = result
+  try:
+    result = fn()
+  except Exception as error:
+    single_flight.finish(key, token, error=error)
+    raise
+  single_flight.finish(key, token, result)
+  return result, False
@@ -0,0 +1,246 @@
+'''
+Traffic capture log.
+
+In capture mode (see api_gateway's --capture option) the gateway appends every request it
+serves, along with the event passed to the function and the response sent back, to a log file
+the replay tool (benchmarks/replay.py) plays back against a gateway. The log is a header followed
+by length-prefixed records, all big-endian:
+
+  header: magic ("CYCLOG"), format version (1 byte), compression (1 byte: 0 for none, 1 for zlib)
+  record: data length (4 bytes), arrival time (8 bytes, seconds since the epoch), data
+
+Every record's data is a JSON object (see TrafficRecorder.record), compressed on its own if the
+log is compressed. Records are appended as responses complete, so readers order them by arrival
+time; a record cut short (e.g. by the gateway being killed) ends the log, and is truncated when
+the log is reopened for appending.
+
+Reference: https://docs.python.org/3/library/mmap.html
+'''
+
+import base64
+import json
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+
+MAGIC = b'CYCLOG'
+VERSION = 1
+HEADER = struct.Struct('>6sBB')
+RECORD_HEADER = struct.Struct('>Id')
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LEVEL = 6
+
+# request and response bodies larger than this are recorded without their body
+DEFAULT_MAX_BODY_SIZE = 1024 * 1024
+# size of the reads draining request bodies that weren't read to capture them
+READ_SIZE = 65536
+
+def read_header(data, path):
+  '''
+  Parses a log's header, returning its compression. Raises ValueError if it isn't a valid log.
+  '''
+  if len(data) < HEADER.size:
+    raise ValueError('Not a traffic log: "{}"'.format(path))
+  magic, version, compression = HEADER.unpack_from(data, 0)
+  if magic != MAGIC:
+    raise ValueError('Not a traffic log: "{}"'.format(path))
+  if version != VERSION or compression not in (COMPRESSION_NONE, COMPRESSION_ZLIB):
+    raise ValueError('Unsupported traffic log format (version {}, compression {}): "{}"'.format(version, compression, path))
+  return compression
+
+def index_records(data, size):
+  '''
+  Indexes the complete records of a log's data (bytes or a memory map) of size bytes. Returns
+  their (arrival time, offset, length) in file order and the offset the complete records end at.
+  '''
+  entries = []
+  offset = HEADER.size
+  while offset + RECORD_HEADER.size <= size:
+    length, arrival_time = RECORD_HEADER.unpack_from(data, offset)
+    start = offset + RECORD_HEADER.size
+    if start + length > size:
+      break
+    entries.append((arrival_time, start, length))
+    offset = start + length
+  return entries, offset
+
+def encode_body(body):
+  return base64.b64encode(body).decode('ascii') if body else ''
+
+def decode_body(body):
+  return base64.b64decode(body) if body else b''
+
+class BodyCapture:
+  '''
+  Wraps a request's input stream, keeping the first max_size bytes read from it.
+  '''
+  def __init__(self, stream, max_size=DEFAULT_MAX_BODY_SIZE):
+    self.stream = stream
+    self.max_size = max_size
+    self.size = 0
+    self.__data = bytearray()
+
+  def read(self, size=-1):
+    chunk = self.stream.read(size)
+    self.size += len(chunk)
+    if self.size <= self.max_size:
+      self.__data += chunk
+    return chunk
+
+  def body(self):
+    '''
+    Reads what's left of the body, if it wasn't read whole (e.g. the request was rejected), and
+    returns it as bytes, or None if it exceeds max_size bytes.
+    '''
+    while self.size <= self.max_size and self.read(READ_SIZE):
+      pass
+    return bytes(self.__data) if self.size <= self.max_size else None
+
+class TrafficRecorder:
+  '''
+  Appends records to a traffic log, creating it if needed. Records are written by a background
+  thread so that requests don't wait for the disk. Logs that already exist must have been
+  created with the same compression, and a record they end with that was cut short is dropped.
+  '''
+  def __init__(self, path, compress=False, max_body_size=DEFAULT_MAX_BODY_SIZE):
+    self.path = path
+    self.compression = COMPRESSION_ZLIB if compress else COMPRESSION_NONE
+    self.max_body_size = max_body_size
+    self.records = 0
+
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+      with open(path, 'rb') as file:
+        compression = read_header(file.read(HEADER.size), path)
+      if compression != self.compression:
+        raise ValueError('Traffic log "{}" was created {} compression'.format(path, 'with' if compression else 'without'))
+      TrafficRecorder.__truncate_partial_record(path)
+      self.__file = open(path, 'ab')
+    else:
+      self.__file = open(path, 'ab')
+      self.__file.write(HEADER.pack(MAGIC, VERSION, self.compression))
+
+    self.__queue = queue.Queue()
+    self.__lock = threading.Lock()
+    self.__writer = threading.Thread(target=self.__write, name='traffic-recorder', daemon=True)
+    self.__writer.start()
+
+  @staticmethod
+  def __truncate_partial_record(path):
+    with open(path, 'r+b') as file:
+      size = os.fstat(file.fileno()).st_size
+      with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        _, end = index_records(data, size)
+      if end < size:
+        print('WARNING: dropping the last record of traffic log "{}", cut short ({} bytes)'.format(path, size - end), file=sys.stderr)
+        file.truncate(end)
+
+  def record(self, arrival_time, request, event, response, duration):
+    '''
+    Appends a record: the request (its "method", "path" with the query string, "headers" as a
+    list of [name, value] pairs and raw "body" as bytes, or None if it exceeds max_body_size)
+    that arrived at arrival_time (a timestamp), the event it was passed to the function as (None
+    if it wasn't), the response (its "status", "headers" and "body" as bytes, or None if it
+    exceeds max_body_size) and the time it took to send.
+    '''
+    body = response['body']
+    request_body = request.get('body')
+    data = json.dumps({
+      'request': dict(request, body=encode_body(request_body) if request_body is not None else None),
+      'event': event,
+      'response': {
+        'status': response['status'],
+        'headers': response['headers'],
+        'body': encode_body(body) if body is not None else None
+      },
+      'duration': duration
+    }, separators=(',', ':')).encode('utf-8')
+
+    if self.compression == COMPRESSION_ZLIB:
+      data = zlib.compress(data, COMPRESSION_LEVEL)
+    self.__queue.put(RECORD_HEADER.pack(len(data), arrival_time) + data)
+    with self.__lock:
+      self.records += 1
+
+  def close(self):
+    '''
+    Writes the pending records and closes the log.
+    '''
+    if self.__writer.is_alive():
+      self.__queue.put(None)
+      self.__writer.join()
+    self.__file.close()
+
+  def __write(self):
+    while True:
+      data = self.__queue.get()
+      if data is None:
+        break
+      self.__file.write(data)
+      # flush whenever the writer catches up, so that the log survives the gateway being killed
+      if self.__queue.empty():
+        self.__file.flush()
+    self.__file.flush()
+
+class TrafficLog:
+  '''
+  Reads a traffic log through a read-only memory map, so that only the records being read are
+  paged in. Records are indexed (without being decoded) in arrival order when the log is opened:
+  entries lists their (arrival time, offset, length) and read(index) decodes one.
+  '''
+  def __init__(self, path):
+    self.path = path
+    self.__file = open(path, 'rb')
+    try:
+      size = os.fstat(self.__file.fileno()).st_size
+      if size < HEADER.size:
+        raise ValueError('Not a traffic log: "{}"'.format(path))
+      self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+      self.__file.close()
+      raise
+
+    self.compression = read_header(self.__map, path)
+
+    self.entries, _ = index_records(self.__map, size)
+    self.entries.sort(key=lambda entry: entry[0])
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __iter__(self):
+    for index in range(len(self.entries)):
+      yield self.read(index)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def read(self, index):
+    '''
+    Decodes the index-th record (in arrival order), returning it as a dictionary like the
+    arguments of TrafficRecorder.record, with its "time" and the request and response bodies as
+    bytes (None if they weren't recorded).
+    '''
+    arrival_time, start, length = self.entries[index]
+    data = self.__map[start:start + length]
+    if self.compression == COMPRESSION_ZLIB:
+      data = zlib.decompress(data)
+
+    record = json.loads(data)
+    record['time'] = arrival_time
+    for message in (record['request'], record['response']):
+      body = message.get('body')
+      message['body'] = decode_body(body) if body is not None else None
+    return record
+
+  def close(self):
+    self.__map.close()
+    self.__file.close()
@@ -2,9 +2,12 @@
 System utilities.
 '''
 
+import contextlib
 import json
 import os
+import shutil
 import subprocess
+import time
 
 COLORS = {
   'red': '\033[91m',
@@ -33,32 +36,40 @@ def list_directories(path):
   '''
   return [dir for dir in os.listdir(path) if os.path.isdir(os.path.join(path, dir))]
 
+def scan_files(path, recursive=False, ignored_dirs=()):
+  '''
+  Yields a (path, stat result) tuple for every file found at the provided path, scanning
+  subdirectories as well if recursive is True (except those named in ignored_dirs).
+  Directories are read with os.scandir, which reports entry types along with their names so
+  that only files need to be stat'ed.
+  '''
+  pending = [os.path.abspath(path)]
+  while pending:
+    try:
+      entries = list(os.scandir(pending.pop()))
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+      continue
+
+    for entry in entries:
+      try:
+        if entry.is_dir():
+          if recursive and entry.name not in ignored_dirs:
+            pending.append(entry.path)
+        elif entry.is_file():
+          yield entry.path, entry.stat()
+      except FileNotFoundError:
+        # removed while scanning
+        continue
+
 def list_files(path, predicate=None, recursive=False):
   '''
   Returns a list containing all files found at the provided path. If recursive
-  is True then subdirectories wull be scanned as well. If predicate is specified
+  is True then subdirectories will be scanned as well. If predicate is specified
   it will be used to filter out the paths included.
   '''
-  if not predicate:
-    predicate = lambda _: True
-
-  def recursive_list_files(files, base_path):
-    for p in os.listdir(base_path):
-      abs_path = os.path.abspath(os.path.join(base_path, p))
-      if os.path.isdir(abs_path):
-        recursive_list_files(files, abs_path)
-      elif os.path.isfile(abs_path) and predicate(abs_path):
-        files.append(abs_path)
-
-  path = os.path.abspath(path)
-  if recursive:
-    files = []
-    recursive_list_files(files, path)
-    return files
-
   return [
-    os.path.abspath(p) for p in os.listdir(path) \
-      if os.path.isfile(os.path.join(path, p)) and predicate(os.path.abspath(p))
+    file_path for file_path, _ in scan_files(path, recursive)
+      if not predicate or predicate(file_path)
   ]
 
 def run_cmd(cmd):
@@ -67,6 +78,47 @@ def run_cmd(cmd):
   '''
   return subprocess.run(cmd, capture_output=True, shell=True, check=True)
 
+def executable_fingerprint(name):
+  '''
+  Returns a string identifying the installed version of the provided executable (its resolved
+  path, size and modification time), or None if it's not found in PATH.
+  '''
+  path = shutil.which(name)
+  if not path:
+    return None
+
+  stat = os.stat(os.path.realpath(path))
+  return '{}:{}:{}'.format(os.path.realpath(path), stat.st_size, int(stat.st_mtime))
+
+class PhaseTimer:
+  '''
+  Measures the duration of consecutive named phases, e.g.:
+
+  with timer.phase('Loading config'):
+    ...
+  '''
+  def __init__(self):
+    self.phases = []
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.phases.append((name, time.perf_counter() - start))
+
+  def report(self):
+    '''
+    Returns a printable breakdown of the measured phases.
+    '''
+    width = max(len(name) for name, _ in self.phases) if self.phases else 0
+    lines = [
+      '{}  {:>8.3f}s'.format(name.ljust(width), duration) for name, duration in self.phases
+    ]
+    lines.append('{}  {:>8.3f}s'.format('Total'.ljust(width), sum(d for _, d in self.phases)))
+    return '\n'.join(lines)
+
 def read_env_file(env_file_path):
   '''
   Parses the provided environment file and returns a
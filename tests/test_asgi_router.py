@@ -0,0 +1,137 @@
+'''
+Tests of asgi_router.AsgiRouter's per-function concurrency limits, invoking functions through
+the stand-in Docker daemon (see fake_docker_daemon.py).
+'''
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from asgi_router import AsgiRouter, FunctionLimiter
+from concurrency import ThrottledError
+from docker_client import AsyncDockerClient
+from fake_docker_daemon import FakeDockerDaemon, echo_runner
+
+async def send_request(router, method, path, body=b''):
+  '''
+  Sends a request to an ASGI app, returning the response's status code and body.
+  '''
+  scope = {
+    'type': 'http',
+    'method': method,
+    'path': path,
+    'query_string': b'',
+    'headers': [(b'host', b'localhost')],
+    'client': ('127.0.0.1', 12345)
+  }
+  messages = []
+
+  async def receive():
+    return {'type': 'http.request', 'body': body, 'more_body': False}
+
+  async def send(message):
+    messages.append(message)
+
+  await router(scope, receive, send)
+  status = next(message['status'] for message in messages if message['type'] == 'http.response.start')
+  return status, b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+
+class FunctionLimiterTest(unittest.TestCase):
+  def test_queued_invocations_time_out(self):
+    async def run():
+      limiter = FunctionLimiter(1, max_pending=1, queue_timeout=0.1)
+      async with limiter:
+        with self.assertRaises(ThrottledError):
+          async with limiter:
+            pass
+      self.assertEqual(limiter.pending, 0)
+      async with limiter:
+        pass
+
+    asyncio.run(run())
+
+  def test_full_once_max_pending_wait(self):
+    async def run():
+      limiter = FunctionLimiter(1, max_pending=1, queue_timeout=1)
+      self.assertFalse(limiter.is_full())
+      async with limiter:
+        waiter = asyncio.ensure_future(limiter.__aenter__())
+        await asyncio.sleep(0.01)
+        self.assertTrue(limiter.is_full())
+      await waiter
+      await limiter.__aexit__()
+
+    asyncio.run(run())
+
+  def test_zero_concurrency_is_full(self):
+    self.assertTrue(FunctionLimiter(0).is_full())
+
+class AsgiRouterLimitTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.function_path = os.path.join(self.temp_dir.name, 'app.py')
+    with open(self.function_path, 'w') as f:
+      f.write('def handler(event, context):\n  return event\n')
+    self.release = threading.Event()
+    self.release.set()
+
+    def runner(config, stdin):
+      self.release.wait(10)
+      return echo_runner(config, stdin)
+
+    self.daemon = FakeDockerDaemon(os.path.join(self.temp_dir.name, 'docker.sock'), runner=runner).start()
+    self.client = AsyncDockerClient(self.daemon.socket_path)
+
+  def tearDown(self):
+    self.release.set()
+    self.daemon.stop()
+    self.temp_dir.cleanup()
+
+  def create_router(self, **kwargs):
+    return AsgiRouter(
+      endpoint_config={
+        'POST /echo': {
+          'function': 'echo',
+          'filepath': self.function_path,
+          'handler': 'handler',
+          'method': 'POST',
+          'path': '/echo',
+          'authorizer': None,
+          'timeout': 5
+        }
+      },
+      client=self.client,
+      **kwargs
+    )
+
+  def test_request_through_limiter(self):
+    router = self.create_router(concurrency_limit=2)
+    status, body = asyncio.run(send_request(router, 'POST', '/echo', b'hello'))
+
+    self.assertEqual(status, 200)
+    self.assertEqual(json.loads(body)['body'], 'hello')
+
+  def test_queued_request_is_throttled_after_queue_timeout(self):
+    router = self.create_router(concurrency_limit=1, queue_timeout=0.2)
+    self.release.clear()
+
+    async def run():
+      first = asyncio.ensure_future(send_request(router, 'POST', '/echo', b'first'))
+      await asyncio.sleep(0.1)
+      second = await send_request(router, 'POST', '/echo', b'second')
+      self.release.set()
+      return await first, second
+
+    (first_status, _), (second_status, second_body) = asyncio.run(run())
+    self.assertEqual(first_status, 200)
+    self.assertEqual(second_status, 429)
+    self.assertEqual(json.loads(second_body), {'message': 'Too Many Requests'})
+
+if __name__ == '__main__':
+  unittest.main()
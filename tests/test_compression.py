@@ -0,0 +1,30 @@
+'''
+Tests of compression's content encoding negotiation.
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from compression import negotiate_encoding
+
+ENCODINGS = ('br', 'gzip')
+
+class NegotiateEncodingTest(unittest.TestCase):
+  def test_preferred_encoding(self):
+    self.assertEqual(negotiate_encoding('gzip, deflate, br', ENCODINGS), 'br')
+    self.assertEqual(negotiate_encoding('gzip', ENCODINGS), 'gzip')
+
+  def test_quality_values(self):
+    self.assertEqual(negotiate_encoding('br;q=0.5, gzip;q=0.8', ENCODINGS), 'gzip')
+    self.assertEqual(negotiate_encoding('*;q=0.1, gzip;q=0', ENCODINGS), 'br')
+    self.assertIsNone(negotiate_encoding('br;q=0, gzip;q=oops', ENCODINGS))
+
+  def test_no_accepted_encoding(self):
+    self.assertIsNone(negotiate_encoding(None, ENCODINGS))
+    self.assertIsNone(negotiate_encoding('identity', ENCODINGS))
+
+if __name__ == '__main__':
+  unittest.main()
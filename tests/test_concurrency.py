@@ -0,0 +1,57 @@
+'''
+Tests of concurrency.ConcurrencyPool's queueing of invocations.
+'''
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from concurrency import ConcurrencyPool, ThrottledError
+
+class ConcurrencyPoolTest(unittest.TestCase):
+  def test_waiters_served_in_arrival_order(self):
+    pool = ConcurrencyPool(1, queue_timeout=5)
+    self.assertEqual(pool.acquire(), (0, 0))
+    acquired = []
+
+    def wait(index):
+      _, queue_depth = pool.acquire()
+      acquired.append((index, queue_depth))
+      pool.release()
+
+    threads = []
+    for index in range(3):
+      threads.append(threading.Thread(target=wait, args=(index,)))
+      threads[-1].start()
+      while pool.queue_depth() <= index:
+        time.sleep(0.01)
+
+    pool.release()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(acquired, [(0, 1), (1, 2), (2, 3)])
+
+  def test_full_queue_throttled(self):
+    pool = ConcurrencyPool(1, queue_size=0)
+    pool.acquire()
+    with self.assertRaises(ThrottledError):
+      pool.acquire()
+    with self.assertRaises(ThrottledError):
+      ConcurrencyPool(0).acquire()
+
+  def test_queue_timeout(self):
+    pool = ConcurrencyPool(1, queue_timeout=0.05)
+    pool.acquire()
+    with self.assertRaises(ThrottledError):
+      pool.acquire()
+    self.assertEqual(pool.queue_depth(), 0)
+
+    pool.release()
+    self.assertEqual(pool.acquire(), (0, 0))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,48 @@
+'''
+Tests of which Serverless configurations config_cache considers cacheable.
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from config_cache import compute_config_key
+
+class ComputeConfigKeyTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+
+  def write(self, name, content):
+    path = os.path.join(self.temp_dir.name, name)
+    with open(path, 'w') as f:
+      f.write(content)
+    return path
+
+  def test_key_depends_on_referenced_files(self):
+    self.write('custom.yml', 'stage: dev\n')
+    config_path = self.write('serverless.yml', 'custom: ${file(./custom.yml)}\n')
+    key = compute_config_key(config_path)
+
+    self.assertIsNotNone(key)
+    self.assertEqual(compute_config_key(config_path), key)
+    self.write('custom.yml', 'stage: prod\n')
+    self.assertNotEqual(compute_config_key(config_path), key)
+
+  def test_script_configurations_not_cached(self):
+    for name in ('serverless.js', 'serverless.ts'):
+      self.assertIsNone(compute_config_key(self.write(name, 'module.exports = {}\n')))
+
+    self.write('custom.ts', 'export default {}\n')
+    self.assertIsNone(compute_config_key(self.write('serverless.yml', 'custom: ${file(./custom.ts)}\n')))
+
+  def test_remote_variables_not_cached(self):
+    self.assertIsNone(compute_config_key(self.write('serverless.yml', 'key: ${ssm:/app/key}\n')))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,176 @@
+'''
+Tests of docker_client.DockerClient.run_container against the stand-in Docker daemon (see
+fake_docker_daemon.py), and of how requests are retried on pooled connections.
+'''
+
+import http.client
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from docker_client import DockerClient, KILLED_EXIT_CODE, STDERR, STDOUT
+from fake_docker_daemon import FakeDockerDaemon
+
+IMAGE = 'lambci/lambda:python3.8'
+
+class RunContainerTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.socket_path = os.path.join(self.temp_dir.name, 'docker.sock')
+    self.daemon = None
+
+  def tearDown(self):
+    if self.daemon:
+      self.daemon.stop()
+    self.temp_dir.cleanup()
+
+  def start_daemon(self, runner=None):
+    self.daemon = FakeDockerDaemon(self.socket_path, **({'runner': runner} if runner else {})).start()
+    return DockerClient(self.socket_path)
+
+  def test_normal_exit(self):
+    client = self.start_daemon()
+    status = {}
+    timings = {}
+
+    exit_code, stdout, stderr = client.run_container(IMAGE, cmd=['app.handler', '{"a": 1}'], status=status, timings=timings)
+
+    self.assertEqual(exit_code, 0)
+    self.assertEqual(json.loads(json.loads(stdout)['body']), {'a': 1})
+    self.assertIn(b'START RequestId:', stderr)
+    self.assertEqual(status, {'timed_out': False, 'oom_killed': False})
+    self.assertEqual(set(timings), {'start', 'run', 'remove'})
+    # the container is removed once it exits
+    self.assertEqual(self.daemon.containers, {})
+
+  def test_exit_code_and_output_streams(self):
+    client = self.start_daemon(lambda config, stdin: (3, b'out\n', b'err\n'))
+    frames = []
+
+    exit_code, stdout, stderr = client.run_container(IMAGE, on_output=lambda stream_type, data: frames.append((stream_type, data)))
+
+    self.assertEqual(exit_code, 3)
+    # output passed to on_output isn't captured
+    self.assertEqual((stdout, stderr), (b'', b''))
+    self.assertEqual(sorted(frames), [(STDOUT, b'out\n'), (STDERR, b'err\n')])
+
+  def test_stdin_payload(self):
+    received = []
+
+    def runner(config, stdin):
+      received.append((config.get('OpenStdin'), stdin))
+      return 0, stdin + b'\n', b''
+
+    client = self.start_daemon(runner)
+    payload = json.dumps({'body': 'x' * 200000}).encode('utf-8')
+
+    exit_code, stdout, _ = client.run_container(IMAGE, stdin=payload)
+
+    self.assertEqual(exit_code, 0)
+    self.assertEqual(received, [(True, payload)])
+    self.assertEqual(stdout.strip(), payload)
+
+  def test_timeout_kill(self):
+    release = threading.Event()
+
+    def runner(config, stdin):
+      release.wait(10)
+      return 0, b'too late\n', b''
+
+    client = self.start_daemon(runner)
+    status = {}
+    start = time.perf_counter()
+
+    try:
+      exit_code, stdout, _ = client.run_container(IMAGE, timeout=0.2, status=status)
+    finally:
+      release.set()
+
+    self.assertLess(time.perf_counter() - start, 5)
+    self.assertEqual(exit_code, KILLED_EXIT_CODE)
+    self.assertEqual(stdout, b'')
+    self.assertEqual(status, {'timed_out': True, 'oom_killed': False})
+
+  def test_out_of_memory(self):
+    client = self.start_daemon(lambda config, stdin: (KILLED_EXIT_CODE, b'', b'allocating\n'))
+    status = {}
+
+    exit_code, _, stderr = client.run_container(IMAGE, timeout=10, status=status)
+
+    self.assertEqual(exit_code, KILLED_EXIT_CODE)
+    self.assertEqual(stderr, b'allocating\n')
+    self.assertEqual(status, {'timed_out': False, 'oom_killed': True})
+
+class ClosingDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  '''
+  Answers one request per connection then closes it, either without replying (drop_replies) or
+  after a keep-alive reply, the way a daemon closing idle connections would.
+  '''
+  daemon_threads = True
+
+  def __init__(self, socket_path, drop_replies=False):
+    self.drop_replies = drop_replies
+    self.requests = []
+    super().__init__(socket_path, ClosingHandler)
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+
+class ClosingHandler(socketserver.StreamRequestHandler):
+  def handle(self):
+    request_line = self.rfile.readline()
+    if not request_line:
+      return
+    length = 0
+    for line in iter(self.rfile.readline, b'\r\n'):
+      name, _, value = line.partition(b':')
+      if name.strip().lower() == b'content-length':
+        length = int(value)
+    self.rfile.read(length)
+    self.server.requests.append(request_line.split(b' ')[0].decode('ascii'))
+    if not self.server.drop_replies:
+      self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}')
+      self.wfile.flush()
+      # let the client pool the connection before it's closed
+      time.sleep(0.1)
+
+class RequestRetryTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.socket_path = os.path.join(self.temp_dir.name, 'docker.sock')
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.temp_dir.cleanup()
+
+  def test_closed_idle_connection_is_replaced(self):
+    self.server = ClosingDaemon(self.socket_path)
+    client = DockerClient(self.socket_path)
+
+    client.request('POST', '/containers/create', body={})
+    time.sleep(0.3)
+    client.request('POST', '/containers/create', body={})
+
+    self.assertEqual(self.server.requests, ['POST', 'POST'])
+
+  def test_sent_requests_only_retried_if_idempotent(self):
+    self.server = ClosingDaemon(self.socket_path, drop_replies=True)
+    client = DockerClient(self.socket_path)
+
+    with self.assertRaises(http.client.RemoteDisconnected):
+      client.request('POST', '/containers/create', body={})
+    self.assertEqual(self.server.requests, ['POST'])
+
+    with self.assertRaises(http.client.RemoteDisconnected):
+      client.request('GET', '/containers/json')
+    self.assertEqual(self.server.requests, ['POST', 'GET', 'GET'])
+
+if __name__ == '__main__':
+  unittest.main()
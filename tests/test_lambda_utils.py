@@ -0,0 +1,57 @@
+'''
+Tests of lambda_utils.FunctionOutput's spilling of large outputs to files.
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import lambda_utils
+from docker_client import STDERR
+
+class OutputFileTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.saved = lambda_utils.OUTPUT_DIR, lambda_utils.MAX_OUTPUT_FILES
+    lambda_utils.OUTPUT_DIR = self.temp_dir.name
+    lambda_utils.MAX_OUTPUT_FILES = 2
+
+  def tearDown(self):
+    lambda_utils.OUTPUT_DIR, lambda_utils.MAX_OUTPUT_FILES = self.saved
+    self.temp_dir.cleanup()
+
+  def spill(self, data=b'x' * 10):
+    output = lambda_utils.FunctionOutput(max_output_size=5)
+    output.capture(STDERR, data)
+    return output
+
+  def test_output_spilled_beyond_max_size(self):
+    output = self.spill(b'log line\n')
+    response = output.build_response(0)
+
+    self.assertIsNone(response['stdout'])
+    with open(response['stdout_file'], 'rb') as f:
+      self.assertEqual(f.read(), b'log line\n')
+
+  def test_oldest_closed_files_pruned(self):
+    for _ in range(4):
+      self.spill().close()
+
+    self.assertEqual(len(os.listdir(self.temp_dir.name)), 2)
+
+  def test_open_files_not_pruned(self):
+    writing = self.spill()
+    for _ in range(3):
+      self.spill().close()
+
+    self.assertTrue(os.path.exists(writing.output_file_path))
+    writing.capture(STDERR, b'more\n')
+    writing.close()
+    with open(writing.output_file_path, 'rb') as f:
+      self.assertEqual(f.read(), b'x' * 10 + b'more\n')
+
+if __name__ == '__main__':
+  unittest.main()
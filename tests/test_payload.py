@@ -0,0 +1,37 @@
+'''
+Tests of payload's streamed decoding of base64 encoded response bodies.
+'''
+
+import base64
+import binascii
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from payload import iter_base64_body
+
+class IterBase64BodyTest(unittest.TestCase):
+  def setUp(self):
+    self.body = bytes(range(256)) * 20
+
+  def test_chunked_decoding(self):
+    chunks = list(iter_base64_body(base64.b64encode(self.body).decode('ascii'), chunk_size=300))
+
+    self.assertEqual(b''.join(chunks), self.body)
+    self.assertEqual(len(chunks[0]), 300)
+
+  def test_whitespace_ignored(self):
+    # wrapped every 76 characters, which isn't a multiple of the encoded chunk size
+    encoded = base64.encodebytes(self.body).decode('ascii').replace('\n', '\r\n')
+
+    for chunk_size in (3, 300, 3 * 64 * 1024):
+      self.assertEqual(b''.join(iter_base64_body(encoded, chunk_size=chunk_size)), self.body)
+
+  def test_incomplete_encoding(self):
+    with self.assertRaises(binascii.Error):
+      list(iter_base64_body('QUJD\nQQ', chunk_size=3))
+
+if __name__ == '__main__':
+  unittest.main()
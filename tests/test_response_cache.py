@@ -0,0 +1,63 @@
+'''
+Tests of response_cache's TTLs and LRU eviction.
+'''
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from response_cache import ResponseCache, bypasses_cache, get_response_ttl
+
+class ResponseTtlTest(unittest.TestCase):
+  def test_configured_ttl_capped_by_max_age(self):
+    self.assertEqual(get_response_ttl({'ttl': 60}, {}), 60)
+    self.assertEqual(get_response_ttl({'ttl': 60}, {'Cache-Control': 'public, max-age=10'}), 10)
+    self.assertEqual(get_response_ttl({'ttl': 60}, {'cache-control': 's-maxage=300'}), 60)
+
+  def test_uncacheable_responses(self):
+    for cache_control in ('no-store', 'private', 'max-age=oops'):
+      self.assertEqual(get_response_ttl({'ttl': 60}, {'Cache-Control': cache_control}), 0)
+
+  def test_bypass(self):
+    self.assertTrue(bypasses_cache({'cache-control': 'no-cache'}))
+    self.assertTrue(bypasses_cache({'cache-control': 'max-age=0'}))
+    self.assertFalse(bypasses_cache({}))
+
+class ResponseCacheTest(unittest.TestCase):
+  def test_expiry(self):
+    cache = ResponseCache()
+    cache.put('a', 'GET /a', 200, {}, b'body', 0.05)
+    cache.put('b', 'GET /b', 200, {}, b'body', 0)
+
+    self.assertEqual(cache.get('a').body, b'body')
+    self.assertIsNone(cache.get('b'))
+    time.sleep(0.1)
+    self.assertIsNone(cache.get('a'))
+    self.assertEqual(cache.stats()['size'], 0)
+
+  def test_least_recently_used_evicted(self):
+    cache = ResponseCache()
+    cache.put('a', 'GET /a', 200, {}, b'x' * 100, 60)
+    cache.max_size = cache.size * 2
+    cache.put('b', 'GET /b', 200, {}, b'x' * 100, 60)
+    cache.get('a')
+    cache.put('c', 'GET /c', 200, {}, b'x' * 100, 60)
+
+    self.assertIsNone(cache.get('b'))
+    self.assertIsNotNone(cache.get('a'))
+    self.assertEqual(cache.stats()['evictions'], 1)
+
+  def test_invalidate(self):
+    cache = ResponseCache()
+    cache.put('a', 'GET /a', 200, {}, b'', 60)
+    cache.put('b', 'GET /b', 200, {}, b'', 60)
+
+    cache.invalidate(['GET /a'])
+    self.assertIsNone(cache.get('a'))
+    self.assertIsNotNone(cache.get('b'))
+
+if __name__ == '__main__':
+  unittest.main()
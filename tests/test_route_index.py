@@ -0,0 +1,51 @@
+'''
+Tests of route_index.RouteIndex's matching, which follows AWS HTTP API route precedence.
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from route_index import RouteIndex
+
+class RouteIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.index = RouteIndex({
+      'GET /users/me': 'me',
+      'GET /users/{id}': 'user',
+      'ANY /users/{id}': 'any user',
+      'GET /users/{proxy+}': 'users proxy',
+      'ANY /{proxy+}': 'proxy',
+      '$default': 'default'
+    })
+
+  def match(self, method, path):
+    match = self.index.match(method, path)
+    return match.value, match.path_parameters
+
+  def test_precedence(self):
+    self.assertEqual(self.match('GET', '/users/me'), ('me', None))
+    self.assertEqual(self.match('GET', '/users/42'), ('user', {'id': '42'}))
+    self.assertEqual(self.match('delete', '/users/42'), ('any user', {'id': '42'}))
+    self.assertEqual(self.match('GET', '/users/42/posts'), ('users proxy', {'proxy': '42/posts'}))
+    self.assertEqual(self.match('POST', '/orders/1'), ('proxy', {'proxy': 'orders/1'}))
+
+  def test_default_route(self):
+    index = RouteIndex({'GET /users': 'users', '$default': 'default'})
+    self.assertEqual(index.match('GET', '/users/').route_key, 'GET /users')
+    self.assertEqual(index.match('POST', '/users').route_key, '$default')
+    self.assertIsNone(RouteIndex({'GET /users': 'users'}).match('GET', '/orders'))
+
+  def test_invalid_routes(self):
+    for routes in (
+      {'GET /a': 1, 'get /a': 2},
+      {'GET /{proxy+}/a': 1},
+      {'GET /{id}': 1, 'POST /{name}': 2}
+    ):
+      with self.assertRaises(ValueError):
+        RouteIndex(routes)
+
+if __name__ == '__main__':
+  unittest.main()
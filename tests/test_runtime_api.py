@@ -0,0 +1,95 @@
+'''
+Tests of runtime_api.RuntimeApi's handling of runtime workers that exit or time out, running
+workers on the stand-in Docker daemon (see fake_docker_daemon.py).
+'''
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from docker_client import DockerClient
+from fake_docker_daemon import FakeDockerDaemon
+from runtime_api import RuntimeApi
+
+class RuntimeApiWorkerTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.api_config = {
+      'function': 'echo',
+      'filepath': os.path.join(self.temp_dir.name, 'app.py'),
+      'handler': 'handler',
+      'runtime': 'python3.8',
+      'timeout': 5
+    }
+    self.started = []
+    self.release = threading.Event()
+    socket_path = os.path.join(self.temp_dir.name, 'docker.sock')
+    self.daemon = FakeDockerDaemon(socket_path, runner=self.run_worker).start()
+    self.api = RuntimeApi(host='127.0.0.1', client=DockerClient(socket_path), workers=1)
+
+  def tearDown(self):
+    self.release.set()
+    self.api.shutdown()
+    self.daemon.stop()
+    self.temp_dir.cleanup()
+
+  def run_worker(self, config, stdin):
+    '''
+    Emulates a runtime: echoes events, exits on {"exit": true} and hangs on {"hang": true}.
+    '''
+    worker = len(self.started)
+    self.started.append(worker)
+    env = dict(variable.split('=', 1) for variable in config['Env'])
+    url = 'http://{}/2018-06-01/runtime/invocation/'.format(
+      env['AWS_LAMBDA_RUNTIME_API'].replace('host.docker.internal', '127.0.0.1')
+    )
+    while not self.release.is_set():
+      with urllib.request.urlopen(url + 'next', timeout=10) as response:
+        request_id = response.headers['Lambda-Runtime-Aws-Request-Id']
+        event = json.loads(response.read())
+      if event.get('exit'):
+        return 1, b'', b'exiting\n'
+      if event.get('hang'):
+        self.release.wait(10)
+        return 0, b'', b''
+      body = json.dumps({'worker': worker, 'event': event}).encode('utf-8')
+      urllib.request.urlopen(url + request_id + '/response', data=body, timeout=10).close()
+    return 0, b'', b''
+
+  def test_worker_exit_fails_its_invocation(self):
+    self.assertEqual(self.api.invoke(self.api_config, {})['return_value']['worker'], 0)
+
+    start = time.perf_counter()
+    response = self.api.invoke(self.api_config, {'exit': True})
+    self.assertLess(time.perf_counter() - start, 2)
+    self.assertEqual(response['exit_status'], 1)
+    self.assertEqual(response['return_value']['errorType'], 'Runtime.ExitError')
+
+    # the worker gets replaced
+    response = self.api.invoke(self.api_config, {'n': 1})
+    self.assertEqual(response['return_value'], {'worker': 1, 'event': {'n': 1}})
+    self.assertTrue(response['cold_start'])
+
+  def test_timeout_only_replaces_timed_out_worker(self):
+    self.api_config['timeout'] = 1
+    self.api.workers = 2
+    self.api.invoke(self.api_config, {})
+
+    response = self.api.invoke(self.api_config, {'hang': True})
+    self.assertEqual(response['return_value']['errorType'], 'TimeoutError')
+
+    # the other worker keeps serving while the timed out one is replaced
+    for _ in range(3):
+      self.assertEqual(self.api.invoke(self.api_config, {})['exit_status'], 0)
+    time.sleep(1.5)
+    self.assertEqual(len(self.started), 3)
+
+if __name__ == '__main__':
+  unittest.main()
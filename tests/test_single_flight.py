@@ -0,0 +1,94 @@
+'''
+Tests of single_flight.SingleFlight's sharing of concurrent calls.
+'''
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from single_flight import ALONE, LEADER, SHARED, SingleFlight
+
+class SingleFlightTest(unittest.TestCase):
+  def setUp(self):
+    self.single_flight = SingleFlight()
+
+  def wait_for(self, key, max_waiters=100, timeout=5):
+    '''
+    Calls begin for key on a thread, returning a list set to its role and result once it returns.
+    '''
+    outcome = []
+
+    def run():
+      try:
+        outcome.extend(self.single_flight.begin(key, max_waiters, timeout))
+      except Exception as error:
+        outcome.append(error)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+  def wait_registered(self, key, waiters):
+    '''
+    Waits until the call in progress for key has a number of waiters.
+    '''
+    call = self.single_flight._SingleFlight__calls[key]
+    while call.waiters < waiters:
+      time.sleep(0.01)
+
+  def test_waiters_share_leader_result(self):
+    role, token = self.single_flight.begin('k')
+    self.assertEqual(role, LEADER)
+    waiters = [self.wait_for('k') for _ in range(3)]
+    self.wait_registered('k', 3)
+
+    self.single_flight.finish('k', token, 'result')
+    for thread, outcome in waiters:
+      thread.join()
+      self.assertEqual(outcome, [SHARED, 'result'])
+    self.assertEqual(self.single_flight.stats(), {'in_flight': 0, 'saved': 3})
+
+  def test_leader_error_raised_to_waiters(self):
+    _, token = self.single_flight.begin('k')
+    thread, outcome = self.wait_for('k')
+    self.wait_registered('k', 1)
+
+    error = ValueError('failed')
+    self.single_flight.finish('k', token, error=error)
+    thread.join()
+    self.assertEqual(outcome, [error])
+
+  def test_max_waiters(self):
+    _, token = self.single_flight.begin('k')
+    self.assertEqual(self.single_flight.begin('k', max_waiters=0), (ALONE, None))
+    self.single_flight.finish('k', token, 'result')
+    self.assertEqual(self.single_flight.stats(), {'in_flight': 0, 'saved': 0})
+
+  def test_abandoned_call_not_completed_by_late_leader(self):
+    _, old_token = self.single_flight.begin('k')
+    self.assertEqual(self.single_flight.begin('k', timeout=0.05), (ALONE, None))
+
+    # the timed out waiter abandoned the call: the next caller leads a new one
+    role, new_token = self.single_flight.begin('k')
+    self.assertEqual(role, LEADER)
+    thread, outcome = self.wait_for('k')
+    self.wait_registered('k', 1)
+
+    self.single_flight.finish('k', old_token, 'stale')
+    self.assertEqual(self.single_flight.stats()['in_flight'], 1)
+    self.single_flight.finish('k', new_token, 'fresh')
+    thread.join()
+    self.assertEqual(outcome, [SHARED, 'fresh'])
+
+  def test_do(self):
+    self.assertEqual(self.single_flight.do('k', lambda: 1), (1, False))
+    with self.assertRaises(KeyError):
+      self.single_flight.do('k', lambda: {}['missing'])
+    self.assertEqual(self.single_flight.stats()['in_flight'], 0)
+
+if __name__ == '__main__':
+  unittest.main()
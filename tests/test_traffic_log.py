@@ -0,0 +1,119 @@
+'''
+Tests of traffic_log's recording and reading of traffic logs.
+'''
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from traffic_log import BodyCapture, RECORD_HEADER, TrafficLog, TrafficRecorder
+
+def record(recorder, arrival_time, path, body=b'', response_body=b'ok'):
+  recorder.record(
+    arrival_time,
+    {'method': 'POST', 'path': path, 'headers': [['content-type', 'text/plain']], 'body': body},
+    {'rawPath': path},
+    {'status': 200, 'headers': [['content-length', str(len(response_body))]], 'body': response_body},
+    0.01
+  )
+
+class TrafficLogTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.temp_dir.name, 'traffic.log')
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+
+  def check_round_trip(self, compress):
+    recorder = TrafficRecorder(self.path, compress=compress)
+    # records are appended as responses complete, not in arrival order
+    record(recorder, 2.0, '/second', b'\x00\xff')
+    record(recorder, 1.0, '/first?a=1', response_body=b'')
+    recorder.close()
+    self.assertEqual(recorder.records, 2)
+
+    with TrafficLog(self.path) as log:
+      self.assertEqual(len(log), 2)
+      first, second = list(log)
+    self.assertEqual(first['time'], 1.0)
+    self.assertEqual(first['request']['path'], '/first?a=1')
+    self.assertEqual(first['request']['body'], b'')
+    self.assertEqual(first['event'], {'rawPath': '/first?a=1'})
+    self.assertEqual(first['response']['body'], b'')
+    self.assertEqual(second['request']['headers'], [['content-type', 'text/plain']])
+    self.assertEqual(second['request']['body'], b'\x00\xff')
+    self.assertEqual(second['response'], {'status': 200, 'headers': [['content-length', '2']], 'body': b'ok'})
+    self.assertEqual(second['duration'], 0.01)
+
+  def test_round_trip(self):
+    self.check_round_trip(False)
+
+  def test_compressed_round_trip(self):
+    self.check_round_trip(True)
+
+  def test_bodies_over_max_size_dropped(self):
+    recorder = TrafficRecorder(self.path, max_body_size=4)
+    recorder.record(1.0, {'method': 'GET', 'path': '/', 'headers': [], 'body': None}, None, {'status': 200, 'headers': [], 'body': None}, 0)
+    recorder.close()
+
+    with TrafficLog(self.path) as log:
+      entry = log.read(0)
+    self.assertIsNone(entry['request']['body'])
+    self.assertIsNone(entry['response']['body'])
+    self.assertIsNone(entry['event'])
+
+  def test_reopened_log_appended_to(self):
+    recorder = TrafficRecorder(self.path)
+    record(recorder, 1.0, '/a')
+    recorder.close()
+    # a record cut short by the gateway being killed
+    with open(self.path, 'ab') as f:
+      f.write(RECORD_HEADER.pack(100, 2.0) + b'{"req')
+
+    with TrafficLog(self.path) as log:
+      self.assertEqual(len(log), 1)
+
+    with redirect_stderr(io.StringIO()) as stderr:
+      recorder = TrafficRecorder(self.path)
+    self.assertIn('cut short', stderr.getvalue())
+    record(recorder, 3.0, '/b')
+    recorder.close()
+
+    with TrafficLog(self.path) as log:
+      self.assertEqual([entry['request']['path'] for entry in log], ['/a', '/b'])
+
+  def test_compression_mismatch(self):
+    TrafficRecorder(self.path).close()
+    with self.assertRaises(ValueError):
+      TrafficRecorder(self.path, compress=True)
+
+  def test_not_a_log(self):
+    with open(self.path, 'wb') as f:
+      f.write(b'not a traffic log')
+    with self.assertRaises(ValueError):
+      TrafficLog(self.path)
+
+class BodyCaptureTest(unittest.TestCase):
+  def test_body_read_by_app(self):
+    capture = BodyCapture(io.BytesIO(b'hello world'), max_size=20)
+    self.assertEqual(capture.read(5), b'hello')
+    self.assertEqual(capture.read(), b' world')
+    self.assertEqual(capture.body(), b'hello world')
+
+  def test_unread_body_drained(self):
+    capture = BodyCapture(io.BytesIO(b'hello world'), max_size=20)
+    self.assertEqual(capture.body(), b'hello world')
+
+  def test_body_over_max_size(self):
+    capture = BodyCapture(io.BytesIO(b'hello world'), max_size=5)
+    self.assertEqual(capture.read(), b'hello world')
+    self.assertIsNone(capture.body())
+
+if __name__ == '__main__':
+  unittest.main()